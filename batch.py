@@ -0,0 +1,223 @@
+import hashlib
+import logging
+import os
+from os import path as osp
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+from data.datasets import ImportsCollector, HTTPLocationDatasetSpec, HTTPLocationListDatasetSpec
+from data.peers import SourceIndex
+from data.throttling import Throttle
+from data.transfer import MirrorDownloader, TRANSFER_ERRORS
+from tools import FilenameOps, HeadRequest, child_thread_name, is_dict_like
+
+LISTS_DIR = osp.join('.dld', 'lists')
+
+
+def batch_working_dirs(config_files):
+    """
+    :return: list of the working dirs for the configuration files: 'wd-' and the configuration name, prefixed with
+             the names of as many parent directories as needed to tell apart configurations with the same name
+             (e.g. wd-de-dld and wd-en-dld for de/dld.yml and en/dld.yml)
+    :raise RuntimeError: for configuration files that would share a working dir
+    """
+    paths = [osp.abspath(config_file) for config_file in config_files]
+    depths = [0] * len(paths)
+
+    def working_dir(path, depth):
+        parts = path.split(os.sep)
+        return 'wd-' + '-'.join(parts[len(parts) - 1 - depth:-1] + [FilenameOps.strip_config_suffixes(parts[-1])])
+
+    while True:
+        names = [working_dir(path, depth) for path, depth in zip(paths, depths)]
+        colliding = [idx for idx, name in enumerate(names) if names.count(name) > 1]
+        if not colliding:
+            return names
+        growing = [idx for idx in colliding if depths[idx] < len(paths[idx].split(os.sep)) - 2]
+        if not growing:
+            raise RuntimeError("the configuration files {c} would share a working dir".format(
+                c=", ".join(sorted(set(config_files[idx] for idx in colliding)))))
+        for idx in growing:
+            depths[idx] += 1
+
+
+class SharedSource(object):
+    """
+    A remote dataset source needed by one or several deployments, downloaded once into the shared directory.
+    """
+    log = logging.getLogger('dld.SharedSource')
+
+    def __init__(self, locations, basename, shared_dir, download_settings=None, throttle=None, peer_sources=None):
+        """
+        :param locations: mirror URLs of the source
+        :param basename: file name the source is stored with
+        :param shared_dir: directory shared by all deployments of a batch
+        :param download_settings: keyword arguments for the MirrorDownloader
+        :param throttle: data.throttling.Throttle limiting the download
+        :param peer_sources: data.peers.PeerSources to try before the mirrors (or None)
+        """
+        self.locations = list(locations)
+        self.basename = basename
+        self.shared_dir = shared_dir
+        self.download_settings = download_settings or dict()
+        self.throttle = throttle or Throttle()
+        self.peer_sources = peer_sources
+        # sources with equal basenames from different places must not overwrite each other
+        source_key = hashlib.sha1(self.locations[0].encode('utf-8')).hexdigest()[:16]
+        self.path = osp.join(shared_dir, source_key, basename)
+        self.error = None
+        self.downloaded = False
+
+    def _remote_size(self):
+        for location in self.locations:
+            try:
+                with urlopen(HeadRequest(location), timeout=60) as response:
+                    length_str = response.headers.get('content-length')
+                    return (length_str is not None) and int(length_str) or None
+            except TRANSFER_ERRORS as ex:
+                self.log.debug("error getting HEAD for {u}: {ex}".format(u=location, ex=ex))
+        return None
+
+    def fetch(self):
+        try:
+            if osp.isfile(self.path) and self._remote_size() == osp.getsize(self.path):
+                self.log.info("{p} is a complete download of {u} -- skipping".format(p=self.path, u=self.locations[0]))
+                SourceIndex(self.shared_dir).record(self.locations, self.path)
+                return
+            if not osp.isdir(osp.dirname(self.path)):
+                os.makedirs(osp.dirname(self.path))
+            self.log.info("starting download: {u}".format(u=self.locations[0]))
+            with self.throttle.transfer_context():
+                validators = None
+                if self.peer_sources is not None:
+                    validators = self.peer_sources.fetch(self.locations, self.path, None, self.throttle or None)
+                if validators is None:
+                    downloader = MirrorDownloader(self.locations, chunk_filter=self.throttle or None,
+                                                  **self.download_settings)
+                    downloader.download(self.path)
+                    validators = downloader.validators
+            self.downloaded = True
+            SourceIndex(self.shared_dir).record(self.locations, self.path, validators)
+            self.log.info("download finished: {u}".format(u=self.locations[0]))
+        except (IOError, OSError) as ex:
+            self.error = ex
+
+
+class Deployment(object):
+    """
+    A DLD setup prepared as part of a batch: its configuration file, parsed configuration and DLDConfig.
+    """
+
+    def __init__(self, config_file, yaml_config, dld_config):
+        self.config_file = config_file
+        self.yaml_config = yaml_config
+        self.dld_config = dld_config
+        self.sources = list()
+        self.error = None
+        self.files_added = 0
+        self.files_retained = 0
+        self.import_bytes = 0
+
+    @property
+    def status(self):
+        if self.error is not None:
+            return "FAILED"
+        return "ok"
+
+
+class BatchPlan(object):
+    """
+    Collects the remote sources of all deployments of a batch, so that each of them is downloaded only once
+    (with bounded concurrency) into a shared directory. The dataset configurations of the deployments are then
+    rewritten to use the shared copies as local sources.
+    """
+    log = logging.getLogger('dld.BatchPlan')
+
+    def __init__(self, deployments, shared_dir, max_downloads=4):
+        """
+        :param deployments: list of Deployment instances
+        :param shared_dir: directory for the downloads shared by the deployments
+        :param max_downloads: maximal number of concurrent downloads
+        """
+        self.deployments = deployments
+        self.shared_dir = osp.abspath(shared_dir)
+        self.max_downloads = max_downloads
+        self.sources = dict()
+
+    def _shared_source(self, spec):
+        key = spec.source_location
+        if key not in self.sources:
+            # the download settings and transfer limits of the first deployment needing the source apply
+            self.sources[key] = SharedSource(spec.source_locations, spec.basename, self.shared_dir,
+                                             spec.config.download_settings, spec.throttle, spec.config.peer_sources)
+        return self.sources[key]
+
+    def collect(self):
+        """
+        :return: dict of the unique remote sources by their (primary) URL
+        """
+        for deployment in self.deployments:
+            if deployment.error is None:
+                try:
+                    self._collect_deployment(deployment)
+                except RuntimeError as ex:
+                    deployment.error = ex
+        return self.sources
+
+    def _collect_deployment(self, deployment):
+        collector = ImportsCollector(deployment.dld_config)
+        for dataset_name, dataset_config in list(deployment.yaml_config['datasets'].items()):
+            if not is_dict_like(dataset_config) or not any(k in dataset_config for k in ('location', 'location_list')):
+                continue
+            dataset_spec = collector.create_dataset_spec(dataset_config)
+            atomic_specs = [s for s in dataset_spec.atomic_specs() if isinstance(s, HTTPLocationDatasetSpec)]
+            if any(s.basename is None for s in atomic_specs):
+                continue  # leave invalid locations to the regular preparation to report
+            shared = [self._shared_source(s) for s in atomic_specs]
+            deployment.sources.extend(shared)
+            self._rewrite_dataset(deployment, dataset_name, dataset_config, dataset_spec, shared)
+
+    @staticmethod
+    def _rewrite_dataset(deployment, dataset_name, dataset_config, dataset_spec, shared_sources):
+        rewritten = dict((k, v) for k, v in dataset_config.items() if k not in ('location', 'location_list'))
+        if isinstance(dataset_spec, HTTPLocationListDatasetSpec):
+            lists_dir = osp.join(deployment.dld_config.working_dir, LISTS_DIR)
+            if not osp.isdir(lists_dir):
+                os.makedirs(lists_dir)
+            list_path = osp.abspath(osp.join(lists_dir, dataset_name + '.list'))
+            with open(list_path, 'w') as list_fd:
+                list_fd.write("".join(source.path + "\n" for source in shared_sources))
+            rewritten['file_list'] = list_path
+        else:
+            rewritten['file'] = shared_sources[0].path
+        deployment.yaml_config['datasets'][dataset_name] = rewritten
+
+    def fetch(self):
+        """
+        Downloads all collected sources, the deployments needing a source that failed are marked as failed.
+        """
+        sources = sorted(self.sources.values(), key=lambda source: source.path)
+        if sources:
+            with ThreadPoolExecutor(max_workers=min(self.max_downloads, len(sources)),
+                                    thread_name_prefix=child_thread_name('dld-batch-download')) as executor:
+                for future in [executor.submit(source.fetch) for source in sources]:
+                    future.result()
+        for deployment in self.deployments:
+            failed = [source for source in deployment.sources if source.error is not None]
+            if failed and deployment.error is None:
+                deployment.error = RuntimeError("unable to download: {u}".format(
+                    u=", ".join("{l} ({e})".format(l=s.locations[0], e=s.error) for s in failed)))
+
+
+def format_batch_summary(deployments, sources):
+    downloaded = [source for source in sources.values() if source.downloaded]
+    lines = ["batch summary: {d} deployments, {s} unique remote sources ({n} downloaded)"
+             .format(d=len(deployments), s=len(sources), n=len(downloaded))]
+    for deployment in deployments:
+        lines.append("  {st:<7}{cf} -> {wd}: {a} import files added, {r} retained, {mb:.1f} MiB"
+                     .format(st=deployment.status, cf=deployment.config_file,
+                             wd=osp.realpath(deployment.dld_config.working_dir), a=deployment.files_added,
+                             r=deployment.files_retained, mb=deployment.import_bytes / (1024.0 * 1024)))
+        if deployment.error is not None:
+            lines.append("         {e}".format(e=deployment.error))
+    return "\n".join(lines)
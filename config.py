@@ -15,6 +15,29 @@ class DLDConfig(object):
     def __init__(self):
         self.__models_dir = None
         self.default_graph_name = None
+        # signal each dataset that is ready for import with a marker file (for loaders started before preparation ends)
+        self.ready_markers = False
+        # write a consolidated index mapping all import files to their target graphs
+        self.graph_index = False
+        # keyword arguments for the MirrorDownloader (max_attempts, stall_timeout, min_speed)
+        self.download_settings = dict()
+        # sample declaration applying to all datasets without one of their own (see data.sampling.SampleSpec)
+        self.sample_settings = None
+        # conversion of non line based RDF serialisations to N-Triples (see data.normalization.NormalizeSpec)
+        self.normalize_settings = None
+        # write changesets for changed N-Triples import files (see data.changesets.ChangesetSpec)
+        self.changeset_settings = None
+        # global limits for the transfers of the dataset preparation (data.throttling.TransferLimits or None)
+        self.transfer_limits = None
+        # data.transfer.SourceMetadataCache shared by the preparations of a long-running process (or None)
+        self.source_metadata_cache = None
+        # other DLD hosts to download dataset sources from before their origin (data.peers.PeerSources or None)
+        self.peer_sources = None
+        # hard link local dataset sources into the models dir instead of copying them (where possible)
+        self.link_local_sources = False
+        # directory to keep snapshots of the store data in, to skip the load services for identical imports
+        self.snapshot_cache_dir = None
+        self.snapshot_cache_max_bytes = None
 
     # we allow the models dir to be specified explicitly, if it is not, we derive it
     @property
@@ -27,6 +50,16 @@ class DLDConfig(object):
             else:
                 raise RuntimeError("working directory not set")
 
+    @property
+    def partitions_dir(self):
+        """
+        parent directory for the per-service import partitions when several load services are configured
+        """
+        if self.working_dir:
+            return osp.join(self.working_dir, 'partitions')
+        else:
+            raise RuntimeError("working directory not set")
+
     @property
     def additional_volumes_from(self):
         env_value = env.get(ADDITIONAL_VOLUMES_FROM_ENV_VAR, '')
@@ -55,6 +88,14 @@ class DLDConfig(object):
     def docker_engine_version(self):
         return DLDConfig.__docker_engine_version
 
+    @property
+    def docker_host_cpus(self):
+        """
+        number of CPUs of the Docker host (divided among the store replicas)
+        """
+        with dockerutil.docker_client() as dc:
+            return dc.info()['NCPU']
+
     @property
     def selinux_volumes_tweaks_supported(self):
         return SELINUX_VOLUME_ADJUSTMENT_DOCKER_VERSIONS_PATTERN.match(self.docker_engine_version) is not None
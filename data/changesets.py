@@ -0,0 +1,419 @@
+import gzip
+import heapq
+import json
+import logging
+import os
+from os import path as osp
+import shutil
+import tempfile
+import time
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from data.sampling import open_source, syntax_extension
+from tools import FilenameOps, is_dict_like
+
+CHANGESETS_DIR = 'changesets'
+BASELINES_DIR = osp.join('.dld', 'baselines')
+BASELINE_SUFFIX = '.sorted.gz'
+MANIFEST_FILE = 'changeset.json'
+APPLIED_MARKER = 'applied'
+ADDED_FILE = 'added.nt.gz'
+REMOVED_FILE = 'removed.nt.gz'
+# removed statements with blank nodes, which DELETE DATA does not allow (and could not match)
+BLANK_NODE_REMOVALS_FILE = 'removed-blank-nodes.nt.gz'
+UPDATE_FILE_TEMPLATE = 'update-{n:05d}.ru'
+
+
+class ChangesetSpec(object):
+    """
+    How to compute changesets: the number of statements sorted in memory per run of the external sort, the number
+    of runs merged at once and the number of statements per SPARQL UPDATE request.
+    """
+
+    def __init__(self, run_statements=1000000, fan_in=64, batch_statements=10000):
+        for name, value in [('run_statements', run_statements), ('fan_in', fan_in),
+                            ('batch_statements', batch_statements)]:
+            if not isinstance(value, int) or value < (name == 'fan_in' and 2 or 1):
+                raise RuntimeError("changesets {n} must be a positive integer, got: {v}".format(n=name, v=value))
+        self.run_statements = run_statements
+        self.fan_in = fan_in
+        self.batch_statements = batch_statements
+
+    @classmethod
+    def from_config(cls, changesets_config):
+        """
+        :param changesets_config: True (defaults), a dict with 'run_statements', 'fan_in' and 'batch_statements'
+                                  entries or a false value (no changesets)
+        :return: ChangesetSpec or None
+        """
+        if not changesets_config:
+            return None
+        if changesets_config is True:
+            return cls()
+        if not is_dict_like(changesets_config):
+            raise RuntimeError("unexpected changesets declaration: {c}".format(c=changesets_config))
+        unknown = set(changesets_config.keys()) - set(['run_statements', 'fan_in', 'batch_statements'])
+        if unknown:
+            raise RuntimeError("unknown changesets settings: {k}".format(k=", ".join(sorted(unknown))))
+        return cls(**changesets_config)
+
+
+def canonical_statement(line):
+    """
+    :return: the N-Triples statement of the line with the whitespace around it normalized (None for comments and
+             blank lines)
+    """
+    statement = line.strip()
+    if not statement or statement.startswith(b'#'):
+        return None
+    if statement.endswith(b'.'):
+        statement = statement[:-1].rstrip()
+    return statement + b' .\n'
+
+
+def has_blank_node(statement):
+    """
+    :return: whether the canonical statement has a blank node as subject or object
+    """
+    return statement.startswith(b'_:') or b' _:' in statement
+
+
+def read_sorted(filepath):
+    with gzip.open(filepath, 'rb') as sorted_fd:
+        for line in sorted_fd:
+            yield line
+
+
+def merge_unique(iterables):
+    """
+    :return: generator over the lines of the sorted iterables, merged and without duplicates
+    """
+    previous = None
+    for line in heapq.merge(*iterables):
+        if line != previous:
+            yield line
+            previous = line
+
+
+def _write_sorted(lines, target_path):
+    count = 0
+    with gzip.open(target_path, 'wb', compresslevel=1) as target_fd:
+        for line in lines:
+            target_fd.write(line)
+            count += 1
+    return count
+
+
+def external_sort(lines, target_path, spec, tmp_dir):
+    """
+    Sorts the canonical statements of the lines into a gzipped file without duplicates, holding at most
+    spec.run_statements statements in memory: sorted runs are written to temporary files and merged, at most
+    spec.fan_in at once.
+
+    :return: number of distinct statements
+    """
+    runs = list()
+    run_dir = tempfile.mkdtemp(prefix='.sort-', dir=tmp_dir)
+    try:
+        statements = set()
+        for line in lines:
+            statement = canonical_statement(line)
+            if statement is not None:
+                statements.add(statement)
+                if len(statements) >= spec.run_statements:
+                    runs.append(osp.join(run_dir, "run-{n}.gz".format(n=len(runs))))
+                    _write_sorted(sorted(statements), runs[-1])
+                    statements = set()
+        if not runs:
+            return _write_sorted(sorted(statements), target_path)
+        if statements:
+            runs.append(osp.join(run_dir, "run-{n}.gz".format(n=len(runs))))
+            _write_sorted(sorted(statements), runs[-1])
+        merge_count = 0
+        while len(runs) > spec.fan_in:
+            merged = list()
+            for start in range(0, len(runs), spec.fan_in):
+                merge_count += 1
+                merged.append(osp.join(run_dir, "merged-{n}.gz".format(n=merge_count)))
+                _write_sorted(merge_unique([read_sorted(run) for run in runs[start:start + spec.fan_in]]),
+                              merged[-1])
+                for run in runs[start:start + spec.fan_in]:
+                    os.remove(run)
+            runs = merged
+        return _write_sorted(merge_unique([read_sorted(run) for run in runs]), target_path)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def diff_sorted(old_lines, new_lines):
+    """
+    :return: generator over pairs ('-' or '+', line) for the lines only in the old or only in the new sorted
+             (duplicate free) sequence, in sorted order
+    """
+    old_iter, new_iter = iter(old_lines), iter(new_lines)
+    old, new = next(old_iter, None), next(new_iter, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old < new):
+            yield '-', old
+            old = next(old_iter, None)
+        elif old is None or new < old:
+            yield '+', new
+            new = next(new_iter, None)
+        else:
+            old, new = next(old_iter, None), next(new_iter, None)
+
+
+def subtract_sorted(lines, excluded_lines):
+    """
+    :return: generator over the sorted lines that are not in the sorted excluded lines
+    """
+    excluded_iter = iter(excluded_lines)
+    excluded = next(excluded_iter, None)
+    for line in lines:
+        while excluded is not None and excluded < line:
+            excluded = next(excluded_iter, None)
+        if line != excluded:
+            yield line
+
+
+class ChangesetWriter(object):
+    """
+    Writes the statements removed from and added to a graph as N-Triples delta files (e.g. for a bulk loader)
+    and as numbered SPARQL UPDATE requests of up to batch_statements statements each, deletions first. Removed
+    statements with blank nodes are kept out of both and written to a file of their own instead, as DELETE DATA
+    does not allow blank nodes.
+    """
+
+    def __init__(self, directory, graph_name, previous_graph_name, batch_statements):
+        self.directory = directory
+        self.graph_name = graph_name
+        self.previous_graph_name = previous_graph_name
+        self.batch_statements = batch_statements
+        self.counts = {'-': 0, '+': 0}
+        self.blank_node_removals = 0
+        self.update_files = 0
+        os.makedirs(directory)
+        self._delta_files = {'-': gzip.open(osp.join(directory, REMOVED_FILE), 'wb', compresslevel=1),
+                             '+': gzip.open(osp.join(directory, ADDED_FILE), 'wb', compresslevel=1)}
+        self._blank_node_removals_file = None
+        self._batch = list()
+        self._batch_sign = None
+
+    def write(self, sign, statement):
+        if sign == '-' and has_blank_node(statement):
+            if self._blank_node_removals_file is None:
+                self._blank_node_removals_file = gzip.open(osp.join(self.directory, BLANK_NODE_REMOVALS_FILE), 'wb',
+                                                           compresslevel=1)
+            self._blank_node_removals_file.write(statement)
+            self.blank_node_removals += 1
+            return
+        self._delta_files[sign].write(statement)
+        self.counts[sign] += 1
+        if sign != self._batch_sign or len(self._batch) >= self.batch_statements:
+            self._flush()
+            self._batch_sign = sign
+        self._batch.append(statement)
+
+    def _flush(self):
+        if not self._batch:
+            return
+        operation, graph_name = self._batch_sign == '-' and ('DELETE', self.previous_graph_name) or \
+            ('INSERT', self.graph_name)
+        self.update_files += 1
+        with open(osp.join(self.directory, UPDATE_FILE_TEMPLATE.format(n=self.update_files)), 'wb') as update_fd:
+            update_fd.write("{op} DATA {{ GRAPH <{g}> {{\n".format(op=operation, g=graph_name).encode('utf-8'))
+            update_fd.writelines(self._batch)
+            update_fd.write(b'} }\n')
+        self._batch = list()
+
+    def close(self, manifest):
+        """
+        :param manifest: dict describing the changeset, completed with the statement counts and written along
+        """
+        self._flush()
+        for delta_file in self._delta_files.values():
+            delta_file.close()
+        if self._blank_node_removals_file is not None:
+            self._blank_node_removals_file.close()
+        manifest = dict(manifest, graph=self.graph_name, previous_graph=self.previous_graph_name,
+                        removed=self.counts['-'], added=self.counts['+'],
+                        blank_node_removals=self.blank_node_removals, update_files=self.update_files)
+        if self.blank_node_removals:
+            manifest['blank_node_removals_file'] = BLANK_NODE_REMOVALS_FILE
+        with open(osp.join(self.directory, MANIFEST_FILE), 'w') as manifest_fd:
+            json.dump(manifest, manifest_fd, indent=2, sort_keys=True)
+        return manifest
+
+
+class ChangesetTracker(object):
+    """
+    Keeps a sorted, duplicate free copy (baseline) of every N-Triples import file in the working dir. When an
+    import file changed since its baseline was taken (or was removed), the statements removed from and added to
+    its target graph are written as a changeset to the changesets dir, so that a running store can be updated
+    instead of importing everything again. Statements removed from a file that are still contained in another
+    import file for the same graph are not removed. Import files without a baseline get a changeset adding all
+    their statements, except on the first run (without any baselines), which is a complete import.
+    """
+    log = logging.getLogger('dld.ChangesetTracker')
+
+    def __init__(self, working_dir, changeset_spec):
+        self.working_dir = working_dir
+        self.spec = changeset_spec
+        self.baselines_dir = osp.join(working_dir, BASELINES_DIR)
+        self.changesets_dir = osp.join(working_dir, CHANGESETS_DIR)
+
+    def _baseline_path(self, basename):
+        return osp.join(self.baselines_dir, basename + BASELINE_SUFFIX)
+
+    def _read_baseline_info(self, basename):
+        try:
+            with open(self._baseline_path(basename) + '.json') as info_fd:
+                return json.load(info_fd)
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def _signature(filepath):
+        stat = os.stat(filepath)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def update(self, graphs_by_file, models_dir):
+        """
+        :param graphs_by_file: dict mapping the basenames of all import files to their target graphs
+        :param models_dir: directory holding the import files
+        :return: list of the manifests of the changesets written
+        """
+        first_run = not osp.isdir(self.baselines_dir)
+        if first_run:
+            os.makedirs(self.baselines_dir)
+        tmp_dir = tempfile.mkdtemp(prefix='.update-', dir=self.baselines_dir)
+        try:
+            changes = list()  # (basename, previous info or None, new baseline path or None, new info or None)
+            current_paths = dict()
+            for basename, graph_name in sorted(graphs_by_file.items()):
+                if syntax_extension(basename) != '.nt':
+                    self.log.warning("changesets are computed for N-Triples only, not for {bn}".format(bn=basename))
+                    continue
+                filepath = osp.join(models_dir, basename)
+                info = self._read_baseline_info(basename)
+                signature = self._signature(filepath)
+                if info is not None and info['signature'] == signature and info['graph'] == graph_name:
+                    current_paths[basename] = self._baseline_path(basename)
+                    continue
+                new_path = osp.join(tmp_dir, basename + BASELINE_SUFFIX)
+                self.log.info("sorting the statements of {bn}".format(bn=basename))
+                source_stream, raw_stream = open_source(filepath)
+                try:
+                    external_sort(source_stream, new_path, self.spec, tmp_dir)
+                finally:
+                    source_stream.close()
+                    raw_stream.close()
+                current_paths[basename] = new_path
+                changes.append((basename, info, new_path, {'signature': signature, 'graph': graph_name}))
+            for baseline_name in sorted(os.listdir(self.baselines_dir)):
+                basename = baseline_name[:-len(BASELINE_SUFFIX)]
+                if baseline_name.endswith(BASELINE_SUFFIX) and basename not in current_paths:
+                    changes.append((basename, self._read_baseline_info(basename), None, None))
+
+            manifests = list()
+            for basename, info, new_path, new_info in changes:
+                if not first_run and (info is not None or new_info is not None):
+                    manifests.append(self._write_changeset(basename, info, new_path, new_info, graphs_by_file,
+                                                           current_paths))
+            for basename, info, new_path, new_info in changes:
+                self._replace_baseline(basename, new_path, new_info)
+            return manifests
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _write_changeset(self, basename, info, new_path, new_info, graphs_by_file, current_paths):
+        def old_lines():
+            return read_sorted(self._baseline_path(basename))
+
+        def new_lines():
+            return new_path is not None and read_sorted(new_path) or iter(())
+
+        graph_name = new_info is not None and new_info['graph'] or info['graph']
+        if info is None:
+            # a file added since the baselines were taken
+            info = {'graph': graph_name}
+            removed_lines, added_lines = iter(()), new_lines()
+        elif graph_name != info['graph']:
+            # moved to another graph: everything is removed from the old one and added to the new one
+            removed_lines, added_lines = old_lines(), new_lines()
+        else:
+            removed_lines = (line for sign, line in diff_sorted(old_lines(), new_lines()) if sign == '-')
+            added_lines = (line for sign, line in diff_sorted(old_lines(), new_lines()) if sign == '+')
+        # statements of the old version still contained in other import files for its graph need to stay
+        others = [read_sorted(path) for other, path in sorted(current_paths.items())
+                  if other != basename and graphs_by_file.get(other) == info['graph']]
+        directory = osp.join(self.changesets_dir, "{n:05d}-{sb}".format(
+            n=self._next_sequence_number(), sb=FilenameOps.strip_ld_and_compession_extensions(basename)))
+        writer = ChangesetWriter(directory, graph_name, info['graph'], self.spec.batch_statements)
+        try:
+            for line in subtract_sorted(removed_lines, merge_unique(others)):
+                writer.write('-', line)
+            for line in added_lines:
+                writer.write('+', line)
+        except:
+            writer.close(dict())
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        manifest = writer.close({'file': basename, 'created': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        self.log.info("changeset {d}: {r} statements removed, {a} added".format(
+            d=osp.basename(directory), r=manifest['removed'], a=manifest['added']))
+        if manifest['blank_node_removals']:
+            self.log.warning("changeset {d} does not remove {n} statements with blank nodes (listed in {f}), which "
+                             "DELETE DATA does not allow, consider a full import instead"
+                             .format(d=osp.basename(directory), n=manifest['blank_node_removals'],
+                                     f=BLANK_NODE_REMOVALS_FILE))
+        return manifest
+
+    def _next_sequence_number(self):
+        if not osp.isdir(self.changesets_dir):
+            return 1
+        numbers = [int(name.split('-', 1)[0]) for name in os.listdir(self.changesets_dir)
+                   if name.split('-', 1)[0].isdigit()]
+        return max(numbers or [0]) + 1
+
+    def _replace_baseline(self, basename, new_path, new_info):
+        baseline_path = self._baseline_path(basename)
+        if new_path is None:
+            for path in [baseline_path, baseline_path + '.json']:
+                if osp.isfile(path):
+                    os.remove(path)
+            return
+        os.replace(new_path, baseline_path)
+        with open(baseline_path + '.json', 'w') as info_fd:
+            json.dump(new_info, info_fd)
+
+
+def pending_changesets(working_dir):
+    """
+    :return: sorted list of the directories of the changesets not applied yet
+    """
+    changesets_dir = osp.join(working_dir, CHANGESETS_DIR)
+    if not osp.isdir(changesets_dir):
+        return []
+    return [osp.join(changesets_dir, name) for name in sorted(os.listdir(changesets_dir))
+            if osp.isfile(osp.join(changesets_dir, name, MANIFEST_FILE)) and
+            not osp.isfile(osp.join(changesets_dir, name, APPLIED_MARKER))]
+
+
+def apply_changeset(directory, update_endpoint, timeout=600):
+    """
+    Sends the SPARQL UPDATE requests of the changeset in order and marks it as applied afterwards. A changeset
+    interrupted on the way can be applied again, as deleting absent and inserting present statements does not
+    change a graph.
+    """
+    update_names = sorted(name for name in os.listdir(directory) if name.startswith('update-'))
+    for update_name in update_names:
+        with open(osp.join(directory, update_name), 'rb') as update_fd:
+            update = update_fd.read().decode('utf-8')
+        request = Request(update_endpoint, data=urlencode({'update': update}).encode('utf-8'),
+                          headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        with urlopen(request, timeout=timeout) as response:
+            response.read()
+    open(osp.join(directory, APPLIED_MARKER), 'w').close()
+    return len(update_names)
@@ -3,11 +3,47 @@ import os
 from os import path as osp
 import shutil
 import threading
-from urllib.request import urlretrieve, urlopen
+from urllib.request import urlopen
 import urllib
-from glob import glob
+from glob import glob, escape as glob_escape
+
+from data.changesets import ChangesetSpec, ChangesetTracker
+from data.normalization import NormalizeSpec, Normalizer, RAW_COPIES_DIR, needs_normalization
+from data.peers import SourceIndex
+from data.sampling import SampleSpec, SampleCache, FULL_COPIES_DIR, can_sample, is_sample_file
+from data.throttling import copy_file, create_throttle
+from data.transfer import MirrorDownloader
+from tools import FilenameOps, HeadRequest, write_if_changed, is_list_like
+
+READY_MARKER_SUFFIX = '.ready'
+PREPARATION_DONE_MARKER = 'dld-preparation.done'
+GRAPH_INDEX_FILE = 'dld-graphs.index'
+GLOBAL_GRAPH_FILE = 'global.graph'
+# files in the models dir that describe the import data instead of being import data
+BOOKKEEPING_FILES = frozenset([PREPARATION_DONE_MARKER, GRAPH_INDEX_FILE])
+# dataset configuration entries handed to the dataset specs as settings (taking precedence over global settings)
+DATASET_SETTING_KEYS = ('sample', 'normalize', 'throttle', 'sha256')
+
+
+def format_graph_index(graphs_by_file):
+    """
+    :param graphs_by_file: dict mapping import file basenames to their target graph IRIs
+    :return: the graph index content: one tab separated line with file name and graph IRI per import file
+    """
+    return "".join("{f}\t{g}\n".format(f=f, g=g) for f, g in sorted(graphs_by_file.items()))
+
+
+def link_or_copy(source_path, target_path):
+    try:
+        os.link(source_path, target_path)
+    except OSError:  # e.g. source and target on different file systems
+        shutil.copyfile(source_path, target_path)
+
+
+def read_graph_index(filepath):
+    with open(filepath) as index_fd:
+        return dict(line.rstrip('\n').split('\t', 1) for line in index_fd if line.strip())
 
-from tools import adjusted_socket_timeout, FilenameOps, HeadRequest
 
 class ImportsCollector(object):
     log = logging.getLogger('dld.DatasetImportCollector')
@@ -18,34 +54,115 @@ class ImportsCollector(object):
         """
         self.memory = DatasetMemory()
         self.dld_config = dld_config
+        # stripped basenames of the import files by name of the dataset they were collected for
+        self.dataset_files = dict()
 
     def prepare(self, datasets_config_fragment):
+        self._remove_preparation_done_marker()
         self._write_default_graph_name()
         for dataset_name, dataset_config in datasets_config_fragment.items():
-            keys = frozenset(dataset_config.keys())
-            source_spec_keywords = keys.intersection(DATASET_SPEC_FACTORY_BY_KEYWORD.keys())
-            if len(source_spec_keywords) is not 1:
-                msg_tmpl = "None or several data source specifications ({opts} keys) defined for dataset:\n{ds}"
-                raise RuntimeError(msg_tmpl.format(ds=dataset_config,
-                                                   opts=" or ".join(DATASET_SPEC_FACTORY_BY_KEYWORD.keys())))
-
-            spec_keyword = next(iter(source_spec_keywords))
-            graph_name = dataset_config.get('graph_name')  # might be None
-            factory = DATASET_SPEC_FACTORY_BY_KEYWORD[spec_keyword]
-            source_spec = dataset_config[spec_keyword]
-            dataset_spec = factory(source_spec, self.dld_config, self.memory, graph_name)
-            dataset_spec.add_to_import_data()
+            self.prepare_dataset(dataset_name, dataset_config)
         self._prune_target_directory()
+        self._write_graph_index()
+        self._update_changesets()
+        self._write_preparation_done_marker()
+
+    def update(self, datasets_config_fragment, dataset_names):
+        """
+        Prepares the named datasets again (e.g. after their configuration or sources changed), keeping the
+        import files collected for all other datasets. Named datasets no longer in the configuration
+        fragment are forgotten and their import files pruned.
+        """
+        self._remove_preparation_done_marker()
+        self._write_default_graph_name()
+        for dataset_name in dataset_names:
+            if dataset_name in datasets_config_fragment:
+                self.prepare_dataset(dataset_name, datasets_config_fragment[dataset_name])
+            else:
+                self.forget_dataset(dataset_name)
+        self._prune_target_directory()
+        self._write_graph_index()
+        self._update_changesets()
+        self._write_preparation_done_marker()
+
+    def create_dataset_spec(self, dataset_config):
+        """
+        :return: the dataset spec instance for the source declared in the dataset configuration
+        """
+        keys = frozenset(dataset_config.keys())
+        source_spec_keywords = keys.intersection(DATASET_SPEC_FACTORY_BY_KEYWORD.keys())
+        if len(source_spec_keywords) is not 1:
+            msg_tmpl = "None or several data source specifications ({opts} keys) defined for dataset:\n{ds}"
+            raise RuntimeError(msg_tmpl.format(ds=dataset_config,
+                                               opts=" or ".join(DATASET_SPEC_FACTORY_BY_KEYWORD.keys())))
+
+        spec_keyword = next(iter(source_spec_keywords))
+        graph_name = dataset_config.get('graph_name')  # might be None
+        factory = DATASET_SPEC_FACTORY_BY_KEYWORD[spec_keyword]
+        source_spec = dataset_config[spec_keyword]
+        settings = dict((key, dataset_config[key]) for key in DATASET_SETTING_KEYS if key in dataset_config)
+        return factory(source_spec, self.dld_config, self.memory, graph_name, settings)
+
+    def prepare_dataset(self, dataset_name, dataset_config):
+        dataset_spec = self.create_dataset_spec(dataset_config)
+        self.forget_dataset(dataset_name)
+        known_before = self.memory.added_or_retained()
+        dataset_spec.add_to_import_data()
+        self.dataset_files[dataset_name] = self.memory.added_or_retained() - known_before
+
+    def forget_dataset(self, dataset_name):
+        for stripped_basename in self.dataset_files.pop(dataset_name, set()):
+            self.memory.forget_file(stripped_basename)
+
+    @property
+    def _preparation_done_marker_path(self):
+        return osp.join(self.dld_config.models_dir, PREPARATION_DONE_MARKER)
+
+    def _remove_preparation_done_marker(self):
+        if osp.isfile(self._preparation_done_marker_path):
+            os.remove(self._preparation_done_marker_path)
+
+    def _write_preparation_done_marker(self):
+        if self.dld_config.ready_markers:
+            open(self._preparation_done_marker_path, 'w').close()
 
     def _write_default_graph_name(self):
         if self.dld_config.default_graph_name:
-            with open(osp.join(self.dld_config.models_dir, "global.graph"), "w") as graph_file:
-                graph_file.write(self.dld_config.default_graph_name + "\n")
+            write_if_changed(osp.join(self.dld_config.models_dir, GLOBAL_GRAPH_FILE),
+                             self.dld_config.default_graph_name + "\n")
+
+    def _write_graph_index(self):
+        """
+        Writes the consolidated mapping of all import files to their target graphs (if enabled),
+        replacing the index atomically and only if the mapping changed.
+        """
+        index_path = osp.join(self.dld_config.models_dir, GRAPH_INDEX_FILE)
+        if self.dld_config.graph_index:
+            if write_if_changed(index_path, format_graph_index(self.memory.graph_mapping()), atomic=True):
+                self.log.debug("updated graph index: {f}".format(f=index_path))
+        elif osp.isfile(index_path):
+            os.remove(index_path)
+
+    def _update_changesets(self):
+        """
+        Writes changesets for the import files that changed since the last preparation (if enabled).
+        """
+        changeset_spec = ChangesetSpec.from_config(self.dld_config.changeset_settings)
+        if changeset_spec is not None:
+            ChangesetTracker(self.dld_config.working_dir, changeset_spec).update(self.memory.graph_mapping(),
+                                                                                 self.dld_config.models_dir)
 
     def _prune_target_directory(self):
         for dircontent in glob(osp.join(self.dld_config.models_dir, '*')):
             if osp.isdir(dircontent):  # dld.py does not create subdirectories of the models directory
                 os.removedirs(dircontent)
+            elif FilenameOps.basename(dircontent) in BOOKKEEPING_FILES:
+                continue
+            elif osp.isfile(dircontent) and dircontent.endswith(READY_MARKER_SUFFIX):
+                marked_basename = FilenameOps.basename(dircontent)[:-len(READY_MARKER_SUFFIX)]
+                stripped_ds_basename = FilenameOps.strip_ld_and_compession_extensions(marked_basename)
+                if not (self.dld_config.ready_markers and self.memory.was_added_or_retained(stripped_ds_basename)):
+                    os.remove(dircontent)
             elif osp.isfile(dircontent) and not dircontent.endswith('.graph'):
                 basename = FilenameOps.basename(dircontent)
                 stripped_ds_basename = FilenameOps.strip_ld_and_compession_extensions(basename)
@@ -70,6 +187,7 @@ class DatasetMemory(object):
         self._added = set()
         self._retained = set()
         self._adding = set()
+        self._graphs = dict()
 
     def added_file(self, stripped_basename):
         with self._lock:
@@ -91,6 +209,35 @@ class DatasetMemory(object):
         with self._lock:
             return any((stripped_basename in s) for s in (self._added, self._retained))
 
+    def added(self):
+        with self._lock:
+            return set(self._added)
+
+    def retained(self):
+        with self._lock:
+            return set(self._retained)
+
+    def added_or_retained(self):
+        with self._lock:
+            return self._added | self._retained
+
+    def forget_file(self, stripped_basename):
+        with self._lock:
+            self._added.discard(stripped_basename)
+            self._retained.discard(stripped_basename)
+            self._graphs.pop(stripped_basename, None)
+
+    def mapped_graph(self, stripped_basename, basename, graph_name):
+        with self._lock:
+            self._graphs[stripped_basename] = (basename, graph_name)
+
+    def graph_mapping(self):
+        """
+        :return: dict mapping the basenames of all added or retained import files to their target graphs
+        """
+        with self._lock:
+            return dict(self._graphs[sb] for sb in self._added | self._retained if sb in self._graphs)
+
     def adding_token(self, stripped_basename):
         """
         Creates a context object, trying to obtain a lock for adding the named dataset.
@@ -121,13 +268,14 @@ class DatasetAlreadyBeingAddedError(RuntimeError):
 
 
 class AbstractDatasetSpec(object):
-    def __init__(self, source, dld_config, dataset_memory, graph_name=None):
+    def __init__(self, source, dld_config, dataset_memory, graph_name=None, settings=None):
         """
         ""
         :param source: string describing the source
         :param dld_config: a DLDConfig instance
         :param dataset_memory: the DatasetMemory used by DatasetImportPreparator
         :param graph_name: target named graph
+        :param settings: dict of dataset specific settings (see DATASET_SETTING_KEYS)
         :return:
         """
 
@@ -135,6 +283,8 @@ class AbstractDatasetSpec(object):
         self.config = dld_config
         self.memory = dataset_memory
         self.graph_name = graph_name
+        self.settings = settings or dict()
+        self._throttle = None
         self.skip = False
         self.log = logging.getLogger('dld.' + self.__class__.__name__)
 
@@ -151,8 +301,14 @@ class AbstractDatasetSpec(object):
         return osp.join(self.config.models_dir, self.basename)
 
     @property
-    def graph_file_path(self):
-        return osp.join(self.config.models_dir, FilenameOps.graph_file_name(self.basename))
+    def import_basenames(self):
+        """
+        :return: basenames of the files in the models dir the dataset is imported from
+        """
+        normalize_spec = self.normalize_spec
+        if normalize_spec is not None:
+            return normalize_spec.output_basenames(self.stripped_basename)
+        return [self.basename]
 
     def add_to_import_data(self):
         def duplicate_error():
@@ -168,26 +324,181 @@ class AbstractDatasetSpec(object):
             try:
                 with self.memory.adding_token(self.stripped_basename):
                     # TODO: catch errors and delete dataset and target graph files on error to clean up
-                    self._ensure_copy()
-                    self._ensure_graph_file()
+                    self._remove_ready_markers()
+                    with self.throttle.transfer_context():
+                        self._ensure_import_file()
+                    self._ensure_normalized()
+                    self._ensure_graph_files()
+                    self._write_ready_markers()
 
             except DatasetAlreadyBeingAddedError as dabae:
                 self.log.error(dabae)
                 self._set_skip()
 
-    def _ensure_graph_file(self):
+    def _ensure_graph_files(self):
         if not any((self.graph_name, self.config.default_graph_name)):
             raise RuntimeError("No destination graph name defined for {bn}".format(bn=self.basename))
 
-        # write a graph file if destination graph name differs from default destination graph name
-        if self.graph_name and (self.graph_name != self.config.default_graph_name):
-            with open(self.graph_file_path, "w") as graph_fd:
-                graph_fd.write(self.graph_name + "\n")
+        for basename in self.import_basenames:
+            self.memory.mapped_graph(FilenameOps.strip_ld_and_compession_extensions(basename), basename,
+                                     self.graph_name or self.config.default_graph_name)
+            graph_file_path = osp.join(self.config.models_dir, FilenameOps.graph_file_name(basename))
+
+            # write a graph file if destination graph name differs from default destination graph name
+            if self.graph_name and (self.graph_name != self.config.default_graph_name):
+                write_if_changed(graph_file_path, self.graph_name + "\n")
+
+            # check if a previously written graph file is outdated or no longer required
+            if ((not self.graph_name) or (self.graph_name == self.config.default_graph_name)) and \
+                    osp.isfile(graph_file_path):
+                os.remove(graph_file_path)
 
-        # check if a previously written graph file is outdated or no longer required
-        if ((not self.graph_name) or (self.graph_name == self.config.default_graph_name)) and \
-                osp.isfile(self.graph_file_path):
-            os.remove(self.graph_file_path)
+    def _ready_marker_paths(self):
+        return [osp.join(self.config.models_dir, basename) + READY_MARKER_SUFFIX for basename in self.import_basenames]
+
+    def _remove_ready_markers(self):
+        for marker_path in self._ready_marker_paths():
+            if osp.isfile(marker_path):
+                os.remove(marker_path)
+
+    def _write_ready_markers(self):
+        # the graph files are already in place when a marker appears, a loader can import the file right away
+        if self.config.ready_markers:
+            for marker_path in self._ready_marker_paths():
+                open(marker_path, 'w').close()
+
+    def atomic_specs(self):
+        """
+        :return: list of the specs for the single files this spec adds to the import data
+        """
+        return [self]
+
+    @property
+    def throttle(self):
+        """
+        :return: Throttle for the transfers of the dataset (global and dataset specific limits)
+        """
+        if self._throttle is None:
+            self._throttle = create_throttle(self.config.transfer_limits, self.settings.get('throttle'))
+        return self._throttle
+
+    @property
+    def sample_spec(self):
+        """
+        :return: SampleSpec for the dataset (from the dataset or the global settings) or None
+        """
+        return SampleSpec.from_config(self.settings.get('sample', self.config.sample_settings))
+
+    @property
+    def sample_source(self):
+        return self.source
+
+    @property
+    def normalize_spec(self):
+        """
+        :return: NormalizeSpec for the dataset (from the dataset or the global settings) or None, if the dataset
+                 is not to be converted to N-Triples
+        """
+        if not needs_normalization(self.basename):
+            return None
+        return NormalizeSpec.from_config(self.settings.get('normalize', self.config.normalize_settings))
+
+    @property
+    def raw_copy_path(self):
+        return osp.join(self.config.working_dir, RAW_COPIES_DIR, self.basename)
+
+    @property
+    def copy_path(self):
+        """
+        :return: path of the local copy of the source: the import file itself or the raw copy to be normalized
+        """
+        return self.normalize_spec is not None and self.raw_copy_path or self.target_path
+
+    @property
+    def full_copy_path(self):
+        return osp.join(self.config.working_dir, FULL_COPIES_DIR, self.basename)
+
+    def _ensure_import_file(self):
+        self._move_previous_copy()
+        sample_spec = self.sample_spec
+        if sample_spec is not None and can_sample(self.basename):
+            self._ensure_sample(sample_spec)
+        else:
+            if sample_spec is not None:
+                self.log.warning("unable to sample {bn}, using the complete dataset".format(bn=self.basename))
+            self._restore_full_copy()
+            self._ensure_copy()
+
+    def _move_previous_copy(self):
+        """
+        Moves the copy of the source made when normalization was (not) enabled to where it is needed now.
+        """
+        previous_path = self.copy_path == self.raw_copy_path and self.target_path or self.raw_copy_path
+        if osp.isfile(previous_path) and not osp.isfile(self.copy_path):
+            os.replace(previous_path, self.copy_path)
+        if not osp.isdir(osp.dirname(self.copy_path)):
+            os.makedirs(osp.dirname(self.copy_path))
+
+    def _ensure_sample(self, sample_spec):
+        sample_cache = SampleCache(self.config.working_dir, sample_spec, self.config.source_metadata_cache)
+        sample_path = sample_cache.ensure_sample(self.basename, self.sample_source, self.throttle or None)
+        if osp.isfile(self.copy_path):
+            if osp.samefile(self.copy_path, sample_path):
+                self.memory.retained_file(self.stripped_basename)
+                return
+            if is_sample_file(self.config.working_dir, self.copy_path):
+                os.remove(self.copy_path)
+            else:
+                # keep the complete copy aside to switch back without copying or downloading it again
+                if not osp.isdir(osp.dirname(self.full_copy_path)):
+                    os.makedirs(osp.dirname(self.full_copy_path))
+                os.replace(self.copy_path, self.full_copy_path)
+        link_or_copy(sample_path, self.copy_path)
+        self.log.info("using sample ({k}) of {src}".format(k=sample_spec.key, src=self.sample_source))
+        self.memory.added_file(self.stripped_basename)
+
+    def _restore_full_copy(self):
+        if osp.isfile(self.copy_path) and is_sample_file(self.config.working_dir, self.copy_path):
+            os.remove(self.copy_path)
+        if osp.isfile(self.full_copy_path):
+            if osp.isfile(self.copy_path):
+                os.remove(self.full_copy_path)
+            else:
+                os.replace(self.full_copy_path, self.copy_path)
+
+    def _ensure_normalized(self):
+        """
+        Converts the copy of the source to N-Triples (if enabled) and links the conversion into the models dir,
+        files imported from the same source before are removed.
+        """
+        normalize_spec = self.normalize_spec
+        if normalize_spec is not None:
+            converted_paths = Normalizer(self.config.working_dir, normalize_spec).ensure_normalized(self.copy_path)
+            for converted_path, basename in zip(converted_paths, self.import_basenames):
+                target_path = osp.join(self.config.models_dir, basename)
+                stripped_basename = FilenameOps.strip_ld_and_compession_extensions(basename)
+                if osp.isfile(target_path) and osp.samefile(target_path, converted_path):
+                    self.memory.retained_file(stripped_basename)
+                    continue
+                if osp.isfile(target_path):
+                    os.remove(target_path)
+                link_or_copy(converted_path, target_path)
+                self.memory.added_file(stripped_basename)
+        self._remove_superseded_files()
+
+    def _remove_superseded_files(self):
+        import_basenames = set(self.import_basenames)
+        for filepath in glob(osp.join(self.config.models_dir, glob_escape(self.stripped_basename) + '.*')):
+            basename = FilenameOps.basename(filepath)
+            if basename in import_basenames or not osp.isfile(filepath) or \
+                    FilenameOps.strip_ld_and_compession_extensions(basename) != self.stripped_basename:
+                continue
+            self.log.debug("removing superseded import data file: {f}".format(f=filepath))
+            os.remove(filepath)
+            for companion_path in [osp.join(self.config.models_dir, FilenameOps.graph_file_name(basename)),
+                                   filepath + READY_MARKER_SUFFIX]:
+                if osp.isfile(companion_path):
+                    os.remove(companion_path)
 
     def _ensure_copy(self):
         pass
@@ -202,68 +513,115 @@ class AbstractDatasetSpec(object):
 
 
 class FileDatasetSpec(AbstractDatasetSpec):
-    def __init__(self, source_path, dld_config, dataset_memory, graph_name=None):
-        AbstractDatasetSpec.__init__(self, source_path, dld_config, dataset_memory, graph_name)
+    def __init__(self, source_path, dld_config, dataset_memory, graph_name=None, settings=None):
+        AbstractDatasetSpec.__init__(self, source_path, dld_config, dataset_memory, graph_name, settings)
 
     @property
     def source_path(self):
         return self.source
 
+    def copy_is_current(self):
+        return osp.isfile(self.copy_path) and osp.getsize(self.source_path) == osp.getsize(self.copy_path) and \
+            osp.getmtime(self.source_path) <= osp.getmtime(self.copy_path)
+
     def _ensure_copy(self):
-        if osp.isfile(self.target_path) and osp.getsize(self.source_path) == osp.getsize(self.target_path):
-            self.log.info("{tp} appears to be identical to {sp} - skipping copy"
-                          .format(sp=self.source_path, tp=self.target_path))
+        if self.copy_is_current():
+            self.log.info("{cp} appears to be identical to {sp} - skipping copy"
+                          .format(sp=self.source_path, cp=self.copy_path))
             self.memory.retained_file(self.stripped_basename)
         else:
-            self.log.debug("starting copying for: {src}".format(src=self.source_path))
-            shutil.copyfile(self.source_path, self.target_path)
-            self.log.debug("finished copying for: {src}".format(src=self.source_path))
+            # never write through a hard link of a previous run into its source
+            if osp.isfile(self.copy_path):
+                os.remove(self.copy_path)
+            if self.config.link_local_sources and self._try_link():
+                self.log.debug("linked {cp} to {sp}".format(sp=self.source_path, cp=self.copy_path))
+            else:
+                self.log.debug("starting copying for: {src}".format(src=self.source_path))
+                copy_file(self.source_path, self.copy_path, self.throttle)
+                self.log.debug("finished copying for: {src}".format(src=self.source_path))
             self.memory.added_file(self.stripped_basename)
 
+    def _try_link(self):
+        try:
+            os.link(self.source_path, self.copy_path)
+            return True
+        except OSError:  # e.g. source and target on different file systems
+            return False
+
     def _extract_basename(self):
         return FilenameOps.basename(self.source)
 
 
 class HTTPLocationDatasetSpec(AbstractDatasetSpec):
-    def __init__(self, source_location, dld_config, dataset_memory, graph_name=None):
-        AbstractDatasetSpec.__init__(self, source_location, dld_config, dataset_memory, graph_name)
+    def __init__(self, source_location, dld_config, dataset_memory, graph_name=None, settings=None):
+        """
+        :param source_location: URL of the dataset or a list of mirror URLs for the same dataset
+        """
+        AbstractDatasetSpec.__init__(self, source_location, dld_config, dataset_memory, graph_name, settings)
+
+    @property
+    def source_locations(self):
+        return is_list_like(self.source) and list(self.source) or [self.source]
 
     @property
     def source_location(self):
-        return self.source
+        return self.source_locations[0]
+
+    @property
+    def sample_source(self):
+        return self.source_location
 
     def _ensure_copy(self):
+        def head_content_length(location):
+            response = urlopen(HeadRequest(location), timeout=60)
+            length_str = response.headers.get('content-length')
+            return (length_str is not None) and int(length_str) or None
+
         def get_content_size():
-            try:
-                response = urllib.request.urlopen(HeadRequest(self.source_location), timeout=60)
-                length_str = response.headers.getheader('content-length')
-                return (length_str is not None) and int(length_str) or None
-            except:
-                self.log.exception("error getting HEAD for {u}".format(u=self.source_location))
-                return None
+            metadata_cache = self.config.source_metadata_cache
+            for location in self.source_locations:
+                try:
+                    if metadata_cache is not None:
+                        return metadata_cache.content_length(location, head_content_length)
+                    return head_content_length(location)
+                except Exception:
+                    self.log.exception("error getting HEAD for {u}".format(u=location))
+            return None
 
         skip_download = False
-        if osp.isfile(self.target_path):
-            if get_content_size() == osp.getsize(self.target_path):
-                self.log.info("{tp} seems to be complete download of {u} -- skipping (re-)download"
-                              .format(tp=self.target_path, u=self.source_location))
+        if osp.isfile(self.copy_path):
+            if get_content_size() == osp.getsize(self.copy_path):
+                self.log.info("{cp} seems to be complete download of {u} -- skipping (re-)download"
+                              .format(cp=self.copy_path, u=self.source_location))
                 skip_download = True
 
+        peer_sources = self.config.peer_sources
+        validators = None
         if skip_download:
             self.memory.retained_file(self.stripped_basename)
-        else:
+        elif peer_sources is not None:
+            validators = peer_sources.fetch(self.source_locations, self.copy_path, self.settings.get('sha256'),
+                                            self.throttle or None)
+        if validators is not None:
+            self.memory.added_file(self.stripped_basename)
+            self.log.info("download finished from peers: {u}".format(u=self.source_location))
+        elif not skip_download:
             self.memory.added_file(self.stripped_basename)
-            # this (hopefully) sets a sensible 1 minute default for connection inactivity
-            with adjusted_socket_timeout(60):
-                self.log.info("starting download: {u}".format(u=self.source_location))
-                urlretrieve(self.source_location, self.target_path)
-                self.log.info("download finished: {u}".format(u=self.source_location))
+            self.log.info("starting download: {u}".format(u=self.source_location))
+            downloader = MirrorDownloader(self.source_locations, chunk_filter=self.throttle or None,
+                                          **self.config.download_settings)
+            used_location = downloader.download(self.copy_path)
+            validators = downloader.validators
+            self.log.info("download finished: {u}".format(u=used_location))
+        # offer the copy to other hosts (see data.peers.PeerShareServer)
+        SourceIndex(self.config.working_dir).record(self.source_locations, self.copy_path, validators)
 
     def _extract_basename(self):
-        parsed_url = urllib.parse.urlparse(self.source)
+        parsed_url = urllib.parse.urlparse(self.source_location)
         if parsed_url.scheme not in ['http', 'https']:
             self.skip = True
-            error = RuntimeError("location does not appear to be a http(s)-URL:\n{loc}".format(loc=self.source))
+            error = RuntimeError("location does not appear to be a http(s)-URL:\n{loc}"
+                                 .format(loc=self.source_location))
             self.log.error(error)
             self._set_skip()
             return
@@ -273,41 +631,48 @@ class HTTPLocationDatasetSpec(AbstractDatasetSpec):
 
 class SourceListMixin(object):
     def handle_list(self):
-        """
-        :param handler: callable with (basename, graph_name) parameters
-        """
+        for atomic_spec in self.atomic_specs():
+            atomic_spec.add_to_import_data()
+
+    def atomic_specs(self):
         try:
             with open(self.source) as src:
-                for line in src:
-                    line.strip() and self.atomic_spec_factory(line.strip()).add_to_import_data()
+                atomic_specs = [self.atomic_spec_factory(line.strip()) for line in src if line.strip()]
         except IOError as ex:
             raise RuntimeError('Unable to open source specification list at {p} due to: {ex}' \
                                .format(p=self.source, ex=ex))
+        # the files of a list share the rate limit declared for the dataset
+        for atomic_spec in atomic_specs:
+            atomic_spec._throttle = self.throttle
+        return atomic_specs
 
     def atomic_spec_factory(self, source_description):
         return None
 
 
-class FileListDatasetSpec(AbstractDatasetSpec, SourceListMixin):
-    def __init__(self, source, dld_config, dataset_memory, graph_name=None):
-        AbstractDatasetSpec.__init__(self, source, dld_config, dataset_memory, graph_name)
+class FileListDatasetSpec(SourceListMixin, AbstractDatasetSpec):
+    def __init__(self, source, dld_config, dataset_memory, graph_name=None, settings=None):
+        AbstractDatasetSpec.__init__(self, source, dld_config, dataset_memory, graph_name, settings)
 
     def add_to_import_data(self):
         self.handle_list()
 
     def atomic_spec_factory(self, source_description):
-        return FileDatasetSpec(source_description, self.config, self.memory, self.graph_name)
+        return FileDatasetSpec(source_description, self.config, self.memory, self.graph_name, self.settings)
 
 
-class HTTPLocationListDatasetSpec(AbstractDatasetSpec, SourceListMixin):
-    def __init__(self,  source, dld_config, dataset_memory, graph_name=None):
-        AbstractDatasetSpec.__init__(self, source, dld_config, dataset_memory, graph_name)
+class HTTPLocationListDatasetSpec(SourceListMixin, AbstractDatasetSpec):
+    def __init__(self,  source, dld_config, dataset_memory, graph_name=None, settings=None):
+        AbstractDatasetSpec.__init__(self, source, dld_config, dataset_memory, graph_name, settings)
 
     def add_to_import_data(self):
         self.handle_list()
 
     def atomic_spec_factory(self, source_description):
-        return HTTPLocationDatasetSpec(source_description, self.config, self.memory, self.graph_name)
+        # a line might list several whitespace separated mirror URLs of the same dataset
+        mirrors = source_description.split()
+        source = len(mirrors) > 1 and mirrors or mirrors[0]
+        return HTTPLocationDatasetSpec(source, self.config, self.memory, self.graph_name, self.settings)
 
 DATASET_SPEC_FACTORY_BY_KEYWORD = {
     'file': FileDatasetSpec,
@@ -0,0 +1,264 @@
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from os import path as osp
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import rdflib
+except ImportError:
+    rdflib = None
+
+from data.sampling import LINE_BASED_SYNTAXES, TURTLE_SYNTAXES, syntax_extension, open_source, turtle_statements
+from tools import is_dict_like
+
+NORMALIZED_DIR = osp.join('.dld', 'normalized')
+RAW_COPIES_DIR = osp.join('.dld', 'raw')
+DIGEST_SUFFIX = '.digest'
+CHUNK_SIZE = 1024 * 1024
+
+RDFLIB_FORMAT_BY_EXTENSION = {
+    '.ttl': 'turtle',
+    '.rdf': 'xml',
+    '.owl': 'xml',
+    '.xml': 'xml',
+    '.jsonld': 'json-ld',
+    '.json': 'json-ld',
+}
+
+
+class NormalizeSpec(object):
+    """
+    How to convert datasets to N-Triples: the number of shards to write, whether to gzip them, the number of
+    worker processes and the number of Turtle statements converted per work unit.
+    """
+
+    def __init__(self, shards=1, gzip=True, workers=None, chunk_statements=20000):
+        if not isinstance(shards, int) or shards < 1:
+            raise RuntimeError("normalize shards must be a positive integer, got: {s}".format(s=shards))
+        if workers is not None and (not isinstance(workers, int) or workers < 1):
+            raise RuntimeError("normalize workers must be a positive integer, got: {w}".format(w=workers))
+        self.shards = shards
+        self.gzip = bool(gzip)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_statements = chunk_statements
+
+    @classmethod
+    def from_config(cls, normalize_config):
+        """
+        :param normalize_config: True (defaults), a dict with 'shards', 'gzip', 'workers' and 'chunk_statements'
+                                 entries or a false value (no normalization)
+        :return: NormalizeSpec or None
+        """
+        if not normalize_config:
+            return None
+        if normalize_config is True:
+            return cls()
+        if not is_dict_like(normalize_config):
+            raise RuntimeError("unexpected normalize declaration: {n}".format(n=normalize_config))
+        unknown = set(normalize_config.keys()) - set(['shards', 'gzip', 'workers', 'chunk_statements'])
+        if unknown:
+            raise RuntimeError("unknown normalize settings: {k}".format(k=", ".join(sorted(unknown))))
+        return cls(**normalize_config)
+
+    @property
+    def extension(self):
+        return self.gzip and '.nt.gz' or '.nt'
+
+    @property
+    def key(self):
+        """
+        distinguishes the cached conversions of the same source with different output layouts
+        """
+        return "s{n}{gz}".format(n=self.shards, gz=self.gzip and '-gz' or '')
+
+    def output_basenames(self, stripped_basename):
+        if self.shards == 1:
+            return [stripped_basename + self.extension]
+        return ["{sb}-{i:03d}{ext}".format(sb=stripped_basename, i=idx, ext=self.extension)
+                for idx in range(self.shards)]
+
+
+def needs_normalization(basename):
+    """
+    :return: True for RDF serialisations that are not line based (and can be converted)
+    """
+    extension = syntax_extension(basename)
+    return extension not in LINE_BASED_SYNTAXES and extension in RDFLIB_FORMAT_BY_EXTENSION
+
+
+def raw_digest(filepath):
+    """
+    :return: SHA-256 hex digest of the file, remembered next to it by size and modification time
+    """
+    stat = os.stat(filepath)
+    stat_key = [stat.st_size, stat.st_mtime_ns]
+    try:
+        with open(filepath + DIGEST_SUFFIX) as digest_fd:
+            cached = json.load(digest_fd)
+        if cached[:2] == stat_key:
+            return cached[2]
+    except (IOError, ValueError):
+        pass
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as data_fd:
+        for chunk in iter(lambda: data_fd.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    with open(filepath + DIGEST_SUFFIX, 'w') as digest_fd:
+        json.dump(stat_key + [sha.hexdigest()], digest_fd)
+    return sha.hexdigest()
+
+
+def _convert_chunk(data, rdf_format):
+    graph = rdflib.Graph()
+    graph.parse(data=data, format=rdf_format)
+    return graph.serialize(format='nt', encoding='utf-8')
+
+
+def _convert_document(source_path, rdf_format):
+    source_stream, raw_stream = open_source(source_path)
+    try:
+        graph = rdflib.Graph()
+        graph.parse(source=source_stream, format=rdf_format)
+    finally:
+        source_stream.close()
+        raw_stream.close()
+    return graph.serialize(format='nt', encoding='utf-8')
+
+
+def has_labeled_blank_nodes(source_path):
+    """
+    Labeled blank nodes must be parsed within the same document to keep their identity, this errs on the
+    side of caution (e.g. '_:' within literals counts as well).
+    """
+    source_stream, raw_stream = open_source(source_path)
+    try:
+        return any(b'_:' in line for line in source_stream)
+    finally:
+        source_stream.close()
+        raw_stream.close()
+
+
+def turtle_chunks(lines, chunk_statements):
+    """
+    :return: generator over self-contained Turtle documents with up to chunk_statements statements each,
+             all directives seen so far preceding the statements
+    """
+    directives = list()
+    statements = list()
+    for is_directive, text in turtle_statements(lines):
+        if is_directive:
+            directives.append(text)
+            continue
+        statements.append(text)
+        if len(statements) >= chunk_statements:
+            yield b''.join(directives) + b'\n' + b''.join(statements)
+            statements = list()
+    if statements:
+        yield b''.join(directives) + b'\n' + b''.join(statements)
+
+
+class ShardWriter(object):
+    """
+    Distributes blocks of N-Triples over the shard files round robin.
+    """
+
+    def __init__(self, paths, compress):
+        self.files = [compress and gzip.open(p, 'wb', compresslevel=1) or open(p, 'wb') for p in paths]
+        self.next_shard = 0
+
+    def write(self, ntriples):
+        if ntriples:
+            self.files[self.next_shard].write(ntriples)
+            self.next_shard = (self.next_shard + 1) % len(self.files)
+
+    def write_lines(self, ntriples, block_lines):
+        lines = ntriples.splitlines(True)
+        for start in range(0, len(lines), block_lines):
+            self.write(b''.join(lines[start:start + block_lines]))
+
+    def close(self):
+        for shard_file in self.files:
+            shard_file.close()
+
+
+class Normalizer(object):
+    """
+    Converts RDF documents to N-Triples in a process pool and caches the results by source digest in the
+    working dir. Turtle is streamed and converted in chunks of statements in parallel (unless the document
+    uses labeled blank nodes), other serialisations are parsed as complete documents by a worker process.
+    """
+    log = logging.getLogger('dld.Normalizer')
+
+    def __init__(self, working_dir, normalize_spec):
+        """
+        :param working_dir: working directory, holding the cached conversions
+        :param normalize_spec: NormalizeSpec instance
+        """
+        self.cache_root = osp.join(working_dir, NORMALIZED_DIR)
+        self.spec = normalize_spec
+
+    def ensure_normalized(self, source_path):
+        """
+        :param source_path: local (raw) copy of the dataset
+        :return: list of the paths of the (cached) N-Triples shards converted from the source
+        """
+        if rdflib is None:
+            raise RuntimeError("normalization of {s} requires the rdflib package".format(s=source_path))
+        entry_dir = osp.join(self.cache_root, "{d}-{k}".format(d=raw_digest(source_path), k=self.spec.key))
+        output_paths = [osp.join(entry_dir, name) for name in self.spec.output_basenames('part')]
+        if all(osp.isfile(p) for p in output_paths):
+            self.log.info("using cached conversion of {s}".format(s=source_path))
+            return output_paths
+        if not osp.isdir(self.cache_root):
+            os.makedirs(self.cache_root)
+        tmp_dir = tempfile.mkdtemp(prefix='.' + osp.basename(entry_dir), dir=self.cache_root)
+        try:
+            self.log.info("converting {s} to N-Triples".format(s=source_path))
+            writer = ShardWriter([osp.join(tmp_dir, osp.basename(p)) for p in output_paths], self.spec.gzip)
+            try:
+                self._convert(source_path, writer)
+            finally:
+                writer.close()
+            if osp.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.rename(tmp_dir, entry_dir)
+        except:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return output_paths
+
+    def _convert(self, source_path, writer):
+        rdf_format = RDFLIB_FORMAT_BY_EXTENSION[syntax_extension(source_path)]
+        # forking from one of several threads (e.g. the pipelined preparation or a job of the service) could leave
+        # the workers with locks held by other threads, forkserver starts them from a single threaded process
+        with ProcessPoolExecutor(max_workers=self.spec.workers,
+                                 mp_context=multiprocessing.get_context('forkserver')) as executor:
+            if syntax_extension(source_path) in TURTLE_SYNTAXES and not has_labeled_blank_nodes(source_path):
+                self._convert_chunked(source_path, rdf_format, executor, writer)
+            else:
+                converted = executor.submit(_convert_document, source_path, rdf_format).result()
+                writer.write_lines(converted, self.spec.chunk_statements)
+
+    def _convert_chunked(self, source_path, rdf_format, executor, writer):
+        # bounded number of pending chunks, results are written in document order
+        pending = collections.deque()
+        source_stream, raw_stream = open_source(source_path)
+        try:
+            for chunk in turtle_chunks(source_stream, self.spec.chunk_statements):
+                pending.append(executor.submit(_convert_chunk, chunk, rdf_format))
+                if len(pending) >= 2 * self.spec.workers:
+                    writer.write(pending.popleft().result())
+            while pending:
+                writer.write(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+            source_stream.close()
+            raw_stream.close()
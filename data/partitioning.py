@@ -0,0 +1,123 @@
+import heapq
+import logging
+import os
+from os import path as osp
+import shutil
+from glob import glob
+
+from data.datasets import READY_MARKER_SUFFIX, PREPARATION_DONE_MARKER, GRAPH_INDEX_FILE, GLOBAL_GRAPH_FILE, \
+    BOOKKEEPING_FILES, format_graph_index, read_graph_index
+from tools import FilenameOps, write_if_changed
+
+
+class LoadPartitioner(object):
+    """
+    Distributes the import data collected in the models dir onto disjoint partition directories,
+    one per load service, so that several loaders can work in parallel.
+    Partitions are balanced by byte size and populated with hard links (falling back to copies
+    when the partitions dir resides on another file system).
+    """
+    log = logging.getLogger('dld.LoadPartitioner')
+
+    def __init__(self, dld_config):
+        """
+        :param dld_config: DLDConfig instance
+        """
+        self.dld_config = dld_config
+
+    def partition(self, partition_names):
+        """
+        :param partition_names: names of the partitions to create (the load service names), the directories of
+                                other partitions (e.g. of load services configured before) are removed
+        :return: dict mapping each partition name to the list of data file basenames assigned to it
+        """
+        self._remove_stale_partitions(partition_names)
+        assignment = self.balance(self._sized_import_files(), partition_names)
+        for name in partition_names:
+            self._populate(name, assignment[name])
+        return assignment
+
+    @staticmethod
+    def balance(sized_files, partition_names):
+        """
+        Assigns files to partitions greedily, always putting the largest remaining file into the
+        partition with the smallest byte total so far.
+
+        :param sized_files: iterable of (basename, size) pairs
+        :param partition_names: names of the partitions to fill
+        :return: dict mapping each partition name to a list of basenames
+        """
+        assignment = dict((name, list()) for name in partition_names)
+        # the index keeps the order among equally loaded partitions deterministic
+        loads = [(0, idx, name) for idx, name in enumerate(partition_names)]
+        heapq.heapify(loads)
+        for basename, size in sorted(sized_files, key=lambda bs: (-bs[1], bs[0])):
+            total, idx, name = heapq.heappop(loads)
+            assignment[name].append(basename)
+            heapq.heappush(loads, (total + size, idx, name))
+        return assignment
+
+    def _remove_stale_partitions(self, partition_names):
+        partitions_dir = self.dld_config.partitions_dir
+        if not osp.isdir(partitions_dir):
+            return
+        for existing in sorted(os.listdir(partitions_dir)):
+            if existing not in partition_names and osp.isdir(osp.join(partitions_dir, existing)):
+                self.log.info("removing partition {p} of a load service no longer configured".format(p=existing))
+                shutil.rmtree(osp.join(partitions_dir, existing))
+
+    def _sized_import_files(self):
+        sized_files = list()
+        for filepath in glob(osp.join(self.dld_config.models_dir, '*')):
+            if osp.isfile(filepath) and not self._is_bookkeeping_file(filepath):
+                sized_files.append((FilenameOps.basename(filepath), osp.getsize(filepath)))
+        return sized_files
+
+    @staticmethod
+    def _is_bookkeeping_file(filepath):
+        return filepath.endswith('.graph') or filepath.endswith(READY_MARKER_SUFFIX) or \
+               FilenameOps.basename(filepath) in BOOKKEEPING_FILES
+
+    def _populate(self, partition_name, basenames):
+        models_dir = self.dld_config.models_dir
+        partition_dir = osp.join(self.dld_config.partitions_dir, partition_name)
+        if not osp.isdir(partition_dir):
+            os.makedirs(partition_dir)
+
+        wanted = set()
+        for basename in basenames:
+            wanted.add(basename)
+            for companion in (FilenameOps.graph_file_name(basename), basename + READY_MARKER_SUFFIX):
+                if osp.isfile(osp.join(models_dir, companion)):
+                    wanted.add(companion)
+        for shared in (GLOBAL_GRAPH_FILE, PREPARATION_DONE_MARKER):
+            if osp.isfile(osp.join(models_dir, shared)):
+                wanted.add(shared)
+
+        index_path = osp.join(models_dir, GRAPH_INDEX_FILE)
+        if osp.isfile(index_path):
+            # each loader gets the part of the graph index covering its files
+            graphs_by_file = read_graph_index(index_path)
+            partition_graphs = dict((f, graphs_by_file[f]) for f in basenames if f in graphs_by_file)
+            write_if_changed(osp.join(partition_dir, GRAPH_INDEX_FILE), format_graph_index(partition_graphs),
+                             atomic=True)
+
+        for existing in os.listdir(partition_dir):
+            if existing not in wanted and not (existing == GRAPH_INDEX_FILE and osp.isfile(index_path)):
+                self.log.debug("removing {f} from partition {p}".format(f=existing, p=partition_name))
+                os.remove(osp.join(partition_dir, existing))
+
+        for filename in sorted(wanted):
+            self._link_or_copy(osp.join(models_dir, filename), osp.join(partition_dir, filename))
+        self.log.info("partition {p}: {n} data files".format(p=partition_name, n=len(basenames)))
+
+    def _link_or_copy(self, source, target):
+        if osp.isfile(target):
+            if osp.samefile(source, target):
+                return
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            self.log.debug("unable to hard link {s}, copying instead".format(s=source))
+            shutil.copyfile(source, target)
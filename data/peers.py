@@ -0,0 +1,531 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+from os import path as osp
+import re
+import threading
+from collections import Counter, deque
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.request import Request, urlopen
+
+from data.transfer import CHUNK_SIZE, TRANSFER_ERRORS, if_range_value, response_validators
+from tools import HeadRequest, byte_size, child_thread_name, is_dict_like, is_list_like
+
+SOURCES_INDEX_FILE = osp.join('.dld', 'sources.json')
+PEER_PARTIAL_SUFFIX = '.peer-part'
+DEFAULT_PEER_PORT = 8900
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+PEER_SETTINGS_KEYS = ['urls', 'connections', 'segment_size', 'timeout', 'max_attempts']
+# validators of the origin version recorded for a download and offered along with it
+RECORDED_VALIDATOR_KEYS = ['etag', 'last_modified']
+
+_index_lock = threading.Lock()
+
+
+def sha256_digest(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as data_fd:
+        for chunk in iter(lambda: data_fd.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def announced_digest(headers):
+    """
+    :return: SHA-256 hex digest announced in a Repr-Digest or Digest response header, None if there is none
+    """
+    for name in ['repr-digest', 'digest']:
+        for item in (headers.get(name) or '').split(','):
+            algorithm, _, value = item.strip().partition('=')
+            if algorithm.lower() != 'sha-256':
+                continue
+            try:
+                return binascii.hexlify(base64.b64decode(value.strip(':'), validate=True)).decode('ascii')
+            except (ValueError, binascii.Error):
+                continue
+    return None
+
+
+def is_trusted_offer(source, expected):
+    """
+    :param source: source offered by a peer (see PeerCatalog.refresh)
+    :param expected: dict describing the expected version: a 'sha256' digest, or 'etag', 'last_modified' and
+                     'length' reported by the origin
+    :return: whether the offered source is known to be the expected version
+    """
+    if expected.get('sha256'):
+        return source['sha256'] == expected['sha256']
+    if expected.get('length') is not None and source['size'] != expected['length']:
+        return False
+    etag = expected.get('etag')
+    if etag and not etag.startswith('W/') and source.get('etag'):
+        return source['etag'] == etag
+    return expected.get('last_modified') is not None and source.get('last_modified') == expected['last_modified']
+
+
+class SourceIndex(object):
+    """
+    Records which origin URLs the downloaded files in a directory (a working dir or the shared dir of a batch)
+    were fetched from, so that they can be offered to peers (see PeerShareServer).
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.filepath = osp.join(base_dir, SOURCES_INDEX_FILE)
+
+    def _load(self):
+        try:
+            with open(self.filepath) as index_fd:
+                return json.load(index_fd)
+        except (IOError, ValueError):
+            return dict()
+
+    def record(self, locations, filepath, validators=None):
+        """
+        :param locations: origin URLs (mirrors) of the file
+        :param filepath: path of the downloaded file within the base dir
+        :param validators: dict with the ETag and Last-Modified of the origin version, the ones recorded before are
+                           kept if None
+        """
+        with _index_lock:
+            entries = self._load()
+            relpath = osp.relpath(filepath, self.base_dir)
+            if validators is None:
+                validators = entries.get(relpath, dict())
+            entry = {'urls': list(locations)}
+            for key in RECORDED_VALIDATOR_KEYS:
+                if validators.get(key) is not None:
+                    entry[key] = validators[key]
+            entries[relpath] = entry
+            if not osp.isdir(osp.dirname(self.filepath)):
+                os.makedirs(osp.dirname(self.filepath))
+            with open(self.filepath + '.tmp', 'w') as index_fd:
+                json.dump(entries, index_fd, indent=2, sort_keys=True)
+            os.replace(self.filepath + '.tmp', self.filepath)
+
+    def entries(self):
+        """
+        :return: list of pairs of the absolute path and the entry (the origin 'urls' and the recorded validators) of
+                 the recorded files still present
+        """
+        entries = list()
+        for relpath, entry in sorted(self._load().items()):
+            filepath = osp.join(self.base_dir, relpath)
+            if osp.isfile(filepath):
+                entries.append((filepath, entry))
+        return entries
+
+
+class PeerCatalog(object):
+    """
+    The files offered by a host: the recorded downloads of the given directories, identified by their SHA-256
+    digest. Digests are remembered by path, size and modification time.
+    """
+    log = logging.getLogger('dld.PeerCatalog')
+
+    def __init__(self, directories):
+        self.directories = [osp.abspath(directory) for directory in directories]
+        self._digests = dict()
+        self._files_by_digest = dict()
+        self._lock = threading.Lock()
+
+    def _digest(self, filepath):
+        stat = os.stat(filepath)
+        key = (filepath, stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            self.log.info("computing digest of {f}".format(f=filepath))
+            self._digests[key] = sha256_digest(filepath)
+        return self._digests[key]
+
+    def refresh(self):
+        """
+        :return: list of the offered sources as dicts with the origin 'urls', 'sha256', 'size' and the 'etag' and
+                 'last_modified' of the origin version (None if unknown)
+        """
+        with self._lock:
+            offers = list()
+            files_by_digest = dict()
+            for directory in self.directories:
+                for filepath, entry in SourceIndex(directory).entries():
+                    digest = self._digest(filepath)
+                    files_by_digest[digest] = filepath
+                    offer = {'urls': entry['urls'], 'sha256': digest, 'size': osp.getsize(filepath)}
+                    offer.update((key, entry.get(key)) for key in RECORDED_VALIDATOR_KEYS)
+                    offers.append(offer)
+            self._files_by_digest = files_by_digest
+            return offers
+
+    def file(self, digest):
+        with self._lock:
+            filepath = self._files_by_digest.get(digest)
+        if filepath is None or not osp.isfile(filepath):
+            return None
+        return filepath
+
+
+def parse_range(range_header, size):
+    """
+    :return: inclusive (first, last) byte positions of a single range request, None for the complete content
+    :raise ValueError: for unsatisfiable or unsupported ranges
+    """
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None or match.groups() == ('', ''):
+        raise ValueError("unsupported range: {r}".format(r=range_header))
+    first, last = match.groups()
+    if first == '':
+        first, last = max(0, size - int(last)), size - 1
+    else:
+        first, last = int(first), min(size - 1, int(last or size - 1))
+    if first > last or first >= size:
+        raise ValueError("unsatisfiable range: {r}".format(r=range_header))
+    return first, last
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PeerShareHandler(BaseHTTPRequestHandler):
+    """
+        GET /index             the offered sources (JSON)
+        GET /files/<sha256>    the content of an offered file, single byte ranges are supported
+    """
+    server_version = 'dld-share'
+
+    def log_message(self, msg_format, *args):
+        PeerShareServer.log.debug("{c}: {m}".format(c=self.client_address[0], m=msg_format % args))
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        catalog = self.server.catalog
+        if self.path == '/index':
+            body = json.dumps({'sources': catalog.refresh()}, sort_keys=True).encode('utf-8')
+            self._send_headers(200, len(body), {'Content-Type': 'application/json'})
+            if send_body:
+                self.wfile.write(body)
+            return
+        digest = self.path.startswith('/files/') and self.path[len('/files/'):] or ''
+        filepath = DIGEST_PATTERN.match(digest) and catalog.file(digest) or None
+        if filepath is None:
+            self.send_error(404)
+            return
+        size = osp.getsize(filepath)
+        try:
+            byte_range = parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            self._send_headers(416, 0, {'Content-Range': 'bytes */{s}'.format(s=size)})
+            return
+        first, last = byte_range or (0, size - 1)
+        headers = {'Content-Type': 'application/octet-stream', 'Accept-Ranges': 'bytes',
+                   'ETag': '"{d}"'.format(d=digest)}
+        if byte_range is not None:
+            headers['Content-Range'] = 'bytes {f}-{l}/{s}'.format(f=first, l=last, s=size)
+        self._send_headers(byte_range is not None and 206 or 200, last - first + 1, headers)
+        if not send_body:
+            return
+        try:
+            with open(filepath, 'rb') as data_fd:
+                data_fd.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    chunk = data_fd.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            PeerShareServer.log.debug("{c} closed the connection".format(c=self.client_address[0]))
+
+    def _send_headers(self, status, length, headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+
+class PeerShareServer(object):
+    """
+    Offers the downloaded dataset sources of the given directories to other DLD hosts over HTTP.
+    """
+    log = logging.getLogger('dld.PeerShareServer')
+
+    def __init__(self, directories, host='0.0.0.0', port=DEFAULT_PEER_PORT):
+        self.catalog = PeerCatalog(directories)
+        self.server = ThreadingHTTPServer((host, port), PeerShareHandler)
+        self.server.catalog = self.catalog
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{h}:{p}".format(h=host == '0.0.0.0' and '127.0.0.1' or host, p=port)
+
+    def serve_forever(self):
+        offers = self.catalog.refresh()
+        self.log.info("offering {n} sources at {u}".format(n=len(offers), u=self.url))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def start(self):
+        self.catalog.refresh()
+        threading.Thread(target=self.server.serve_forever, name='dld-share', daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SegmentedDownloader(object):
+    """
+    Downloads a file offered by several peers in segments (Range requests), pulling from all peers at once.
+    Segments failing at one peer are retried at the others, peers failing repeatedly are dropped. The result
+    is only kept when its digest matches.
+    """
+    log = logging.getLogger('dld.SegmentedDownloader')
+
+    def __init__(self, urls, size, digest, segment_size=DEFAULT_SEGMENT_SIZE, connections=1, timeout=60,
+                 max_attempts=3, chunk_filter=None):
+        """
+        :param urls: URLs of the file at the peers
+        :param size: size of the file in bytes
+        :param digest: expected SHA-256 hex digest
+        :param connections: number of concurrent connections per peer
+        :param max_attempts: number of failed segments after which a peer is dropped
+        :param chunk_filter: optional callable invoked with the size of each received chunk (e.g. for rate limiting)
+        """
+        self.urls = list(urls)
+        self.size = size
+        self.digest = digest
+        self.segment_size = segment_size
+        self.connections = connections
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.chunk_filter = chunk_filter
+        self._segments = deque((first, min(first + segment_size, size) - 1)
+                               for first in range(0, size, segment_size))
+        self._lock = threading.Condition()
+        self._in_flight = 0
+        self._failures = Counter()
+        self._received_by_url = Counter()
+
+    def download(self, target_path):
+        """
+        :return: dict with the number of bytes received per peer URL
+        """
+        partial_path = target_path + PEER_PARTIAL_SUFFIX
+        with open(partial_path, 'wb') as target_fd:
+            target_fd.truncate(self.size)
+        try:
+            workers = [threading.Thread(target=self._worker, args=(url, partial_path), daemon=True,
+                                        name=child_thread_name('dld-peer-download'))
+                       for url in self.urls for _ in range(self.connections)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            if self._segments:
+                raise IOError("{n} segments could not be downloaded from any peer".format(n=len(self._segments)))
+            actual_digest = sha256_digest(partial_path)
+            if actual_digest != self.digest:
+                raise IOError("digest mismatch: expected {e}, got {a}".format(e=self.digest, a=actual_digest))
+            os.replace(partial_path, target_path)
+        finally:
+            if osp.isfile(partial_path):
+                os.remove(partial_path)
+        return dict(self._received_by_url)
+
+    def _next_segment(self, url):
+        """
+        :return: the next segment to transfer from the peer, None when done (waits while segments in transfer by
+                 other workers might still fail)
+        """
+        with self._lock:
+            while not self._segments and self._in_flight and self._failures[url] < self.max_attempts:
+                self._lock.wait()
+            if self._failures[url] >= self.max_attempts or not self._segments:
+                return None
+            self._in_flight += 1
+            return self._segments.popleft()
+
+    def _worker(self, url, partial_path):
+        with open(partial_path, 'r+b') as target_fd:
+            while True:
+                segment = self._next_segment(url)
+                if segment is None:
+                    return
+                try:
+                    self._transfer(url, segment, target_fd)
+                    failure = None
+                except TRANSFER_ERRORS + (IOError,) as ex:
+                    failure = ex
+                with self._lock:
+                    self._in_flight -= 1
+                    if failure is not None:
+                        self._segments.append(segment)
+                        self._failures[url] += 1
+                    self._lock.notify_all()
+                if failure is not None:
+                    self.log.warning("segment {f}-{l} from {u} failed: {ex}{d}".format(
+                        f=segment[0], l=segment[1], u=url, ex=failure,
+                        d=self._failures[url] >= self.max_attempts and ", dropping the peer" or ""))
+
+    def _transfer(self, url, segment, target_fd):
+        first, last = segment
+        request = Request(url, headers={'Range': 'bytes={f}-{l}'.format(f=first, l=last)})
+        with urlopen(request, timeout=self.timeout) as response:
+            if response.status != 206:
+                raise IOError("peer does not support ranges (status {s})".format(s=response.status))
+            position = first
+            while position <= last:
+                chunk = response.read(min(CHUNK_SIZE, last - position + 1))
+                if not chunk:
+                    raise IOError("segment ended after {n} of {t} bytes".format(n=position - first,
+                                                                              t=last - first + 1))
+                os.pwrite(target_fd.fileno(), chunk, position)
+                position += len(chunk)
+                if callable(self.chunk_filter):
+                    self.chunk_filter(len(chunk))
+        with self._lock:
+            self._received_by_url[url] += last - first + 1
+
+
+class PeerSources(object):
+    """
+    Other DLD hosts (running 'dld.py share') preferred over the origin of a dataset source, declared as below.
+    Peers are only used for the version expected from the origin: a 'sha256' declared for the dataset, a digest
+    announced by the origin or the ETag resp. Last-Modified the origin reports for it.
+
+        settings:
+          peers:
+            urls: [http://dld-host-a:8900, http://dld-host-b:8900]
+            connections: 2        # concurrent connections per peer (default: 1)
+            segment_size: 16M     # size of the ranges requested (default: 8M)
+    """
+    log = logging.getLogger('dld.PeerSources')
+
+    def __init__(self, peer_urls, connections=1, segment_size=DEFAULT_SEGMENT_SIZE, timeout=10, max_attempts=3):
+        self.peer_urls = [url.rstrip('/') for url in peer_urls]
+        self.connections = connections
+        self.segment_size = segment_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self._indexes = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, peers_config):
+        """
+        :return: PeerSources instance or None for a false value
+        """
+        if not peers_config:
+            return None
+        if is_list_like(peers_config) or isinstance(peers_config, str):
+            peers_config = {'urls': peers_config}
+        if not is_dict_like(peers_config):
+            raise RuntimeError("unexpected peers declaration: {p}".format(p=peers_config))
+        unknown = set(peers_config.keys()) - set(PEER_SETTINGS_KEYS)
+        if unknown:
+            raise RuntimeError("unknown peers settings: {k}".format(k=", ".join(sorted(unknown))))
+        settings = dict(peers_config)
+        urls = settings.pop('urls', None)
+        urls = isinstance(urls, str) and [urls] or urls
+        if not urls:
+            raise RuntimeError("the peers declaration lacks the peer urls")
+        if isinstance(settings.get('segment_size'), str):
+            settings['segment_size'] = byte_size(settings['segment_size'])
+        return cls(urls, **settings)
+
+    def _fetch_indexes(self):
+        with self._lock:
+            if self._indexes is None:
+                self._indexes = dict()
+                for peer_url in self.peer_urls:
+                    try:
+                        with urlopen(peer_url + '/index', timeout=self.timeout) as response:
+                            self._indexes[peer_url] = json.loads(response.read().decode('utf-8'))['sources']
+                    except (TRANSFER_ERRORS + (ValueError, KeyError)) as ex:
+                        self.log.warning("peer {p} is not available: {ex}".format(p=peer_url, ex=ex))
+            return self._indexes
+
+    def origin_version(self, locations):
+        """
+        :param locations: origin URLs of a source
+        :return: dict describing the version at the first responding origin (see is_trusted_offer), None if no
+                 origin responds
+        """
+        for location in locations:
+            try:
+                with urlopen(HeadRequest(location), timeout=self.timeout) as response:
+                    version = response_validators(response)
+                    version['sha256'] = announced_digest(response.headers)
+                    return version
+            except TRANSFER_ERRORS as ex:
+                self.log.debug("error getting HEAD for {u}: {ex}".format(u=location, ex=ex))
+        return None
+
+    def offer(self, locations, expected=None):
+        """
+        :param locations: origin URLs of a source
+        :param expected: dict describing the expected version (see is_trusted_offer), other versions are ignored
+        :return: triple of the SHA-256 digest, the size and the peer URLs of the version of the source offered
+                 by most peers, None if no peer offers it
+        """
+        peers_by_version = dict()
+        for peer_url, sources in sorted(self._fetch_indexes().items()):
+            for source in sources:
+                if set(source['urls']) & set(locations) and (expected is None or is_trusted_offer(source, expected)):
+                    version = (source['sha256'], source['size'])
+                    peers_by_version.setdefault(version, list()).append(
+                        "{p}/files/{d}".format(p=peer_url, d=source['sha256']))
+                    break
+        if not peers_by_version:
+            return None
+        if len(peers_by_version) > 1:
+            self.log.warning("peers offer different versions of {u}, using the most common one".format(
+                u=locations[0]))
+        (digest, size), urls = max(peers_by_version.items(), key=lambda item: len(item[1]))
+        return digest, size, urls
+
+    def fetch(self, locations, target_path, declared_digest=None, chunk_filter=None):
+        """
+        Downloads a source from the peers offering the version expected from the origin.
+
+        :param declared_digest: SHA-256 hex digest declared for the source, the origin is asked for the version
+                                to expect otherwise
+        :return: the validators of the fetched version to record (see SourceIndex.record) if the source was fetched
+                 from peers, None if it needs to be downloaded from the origin
+        """
+        expected = declared_digest and {'sha256': declared_digest.lower()} or self.origin_version(locations)
+        if expected is None or not (expected.get('sha256') or if_range_value(expected)):
+            self.log.info("the version of {u} at the origin is unknown -- not using peers".format(u=locations[0]))
+            return None
+        offer = self.offer(locations, expected)
+        if offer is None:
+            return None
+        digest, size, urls = offer
+        self.log.info("downloading {u} from {n} peers".format(u=locations[0], n=len(urls)))
+        try:
+            received = SegmentedDownloader(urls, size, digest, self.segment_size, self.connections,
+                                           max(self.timeout, 60), self.max_attempts, chunk_filter).download(target_path)
+        except (IOError, OSError) as ex:
+            self.log.warning("download of {u} from peers failed, falling back to the origin: {ex}".format(
+                u=locations[0], ex=ex))
+            return None
+        self.log.debug("received from peers: {r}".format(r=received))
+        return dict((key, expected.get(key)) for key in RECORDED_VALIDATOR_KEYS)
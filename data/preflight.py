@@ -0,0 +1,230 @@
+import logging
+import os
+from os import path as osp
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+from data.datasets import FileDatasetSpec, HTTPLocationDatasetSpec
+from data.transfer import TRANSFER_ERRORS, PARTIAL_DOWNLOAD_SUFFIX
+from tools import HeadRequest, child_thread_name
+
+
+class PreflightError(RuntimeError):
+    pass
+
+
+def _human_size(num_bytes):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(num_bytes) < 1024:
+            return "{n:.1f} {u}".format(n=num_bytes, u=unit)
+        num_bytes /= 1024.0
+    return "{n:.1f} TiB".format(n=num_bytes)
+
+
+def _existing_ancestor(dirpath):
+    dirpath = osp.abspath(dirpath)
+    while not osp.exists(dirpath):
+        dirpath = osp.dirname(dirpath)
+    return dirpath
+
+
+class PreflightEntry(object):
+    """
+    Outcome of checking a single import file source.
+    """
+
+    def __init__(self, dataset_name, source, basename=None):
+        self.dataset_name = dataset_name
+        self.source = source
+        self.basename = basename
+        self.size = None
+        self.transfer_bytes = 0
+        self.retained = False
+        self.error = None
+        self.warning = None
+
+
+class PreflightReport(object):
+    def __init__(self, entries, space_by_dir):
+        """
+        :param entries: list of PreflightEntry instances
+        :param space_by_dir: dict mapping target directories to pairs of (needed bytes, free bytes)
+        """
+        self.entries = entries
+        self.space_by_dir = space_by_dir
+
+    @property
+    def failed_entries(self):
+        return [entry for entry in self.entries if entry.error is not None]
+
+    @property
+    def short_dirs(self):
+        return sorted(d for d, (needed, free) in self.space_by_dir.items() if needed > free)
+
+    @property
+    def ok(self):
+        return not (self.failed_entries or self.short_dirs)
+
+    @property
+    def transfer_bytes(self):
+        return sum(entry.transfer_bytes for entry in self.entries)
+
+    def format(self):
+        transferred = [e for e in self.entries if e.error is None and not e.retained]
+        lines = ["preflight: {n} import files, {t} to transfer ({b}), {r} retained"
+                 .format(n=len(self.entries), t=len(transferred), b=_human_size(self.transfer_bytes),
+                         r=len([e for e in self.entries if e.retained]))]
+        for dirpath, (needed, free) in sorted(self.space_by_dir.items()):
+            lines.append("  {d}: needs {n}, {f} free{s}".format(d=dirpath, n=_human_size(needed), f=_human_size(free),
+                                                               s=(needed > free) and " -- NOT ENOUGH SPACE" or ""))
+        for entry in self.entries:
+            if entry.error is not None:
+                lines.append("  ERROR   [{ds}] {src}: {e}"
+                             .format(ds=entry.dataset_name, src=entry.source, e=entry.error))
+        for entry in self.entries:
+            if entry.warning is not None:
+                lines.append("  WARNING [{ds}] {src}: {w}".format(ds=entry.dataset_name, src=entry.source,
+                                                                  w=entry.warning))
+        return "\n".join(lines)
+
+    def raise_on_failure(self):
+        if not self.ok:
+            raise PreflightError(self.format())
+
+
+class Preflight(object):
+    """
+    Checks all dataset sources before any data is transferred: local sources are stat'ed and remote ones
+    probed with HEAD requests concurrently. Sums up the bytes that need to be copied or downloaded (leaving
+    out files already complete in the models dir) and compares them with the free space of the target
+    file systems.
+    """
+    log = logging.getLogger('dld.Preflight')
+
+    def __init__(self, collector, extra_target_dirs=(), max_workers=16, head_timeout=30):
+        """
+        :param collector: ImportsCollector creating the dataset specs
+        :param extra_target_dirs: further directories receiving a copy of the import data (e.g. the partitions dir
+                                  when it cannot be populated with hard links)
+        :param max_workers: maximal number of concurrent stat calls and HEAD requests
+        :param head_timeout: timeout (in seconds) for each HEAD request
+        """
+        self.collector = collector
+        self.extra_target_dirs = list(extra_target_dirs)
+        self.max_workers = max_workers
+        self.head_timeout = head_timeout
+
+    def run(self, datasets_config_fragment):
+        """
+        :return: PreflightReport (call raise_on_failure() on it to abort when problems were found)
+        """
+        entries = list()
+        work = list()
+        for dataset_name, dataset_config in datasets_config_fragment.items():
+            try:
+                for atomic_spec in self.collector.create_dataset_spec(dataset_config).atomic_specs():
+                    work.append((dataset_name, atomic_spec))
+            except RuntimeError as ex:
+                failed = PreflightEntry(dataset_name, dataset_name)
+                failed.error = ex
+                entries.append(failed)
+
+        if work:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(work)),
+                                    thread_name_prefix=child_thread_name('dld-preflight')) as executor:
+                entries.extend(executor.map(lambda ds_spec: self._check(*ds_spec), work))
+        self._mark_duplicates(entries)
+        report = PreflightReport(entries, self._space_by_dir(entries))
+        self.log.debug(report.format())
+        return report
+
+    def _check(self, dataset_name, spec):
+        if isinstance(spec, HTTPLocationDatasetSpec):
+            return self._check_location(dataset_name, spec)
+        elif isinstance(spec, FileDatasetSpec):
+            return self._check_file(dataset_name, spec)
+        entry = PreflightEntry(dataset_name, spec.source)
+        entry.warning = "unknown source type, not checked"
+        return entry
+
+    @staticmethod
+    def _check_file(dataset_name, spec):
+        entry = PreflightEntry(dataset_name, spec.source_path, spec.basename)
+        try:
+            entry.size = os.stat(spec.source_path).st_size
+            entry.retained = spec.copy_is_current()
+            if not entry.retained:
+                # the target file is truncated before copying, so the space it occupies becomes available
+                existing = osp.isfile(spec.copy_path) and osp.getsize(spec.copy_path) or 0
+                entry.transfer_bytes = max(entry.size - existing, 0)
+        except OSError as ex:
+            entry.error = "cannot access source file ({ex})".format(ex=ex.strerror or ex)
+        return entry
+
+    def _check_location(self, dataset_name, spec):
+        entry = PreflightEntry(dataset_name, spec.source_location)
+        entry.basename = spec.basename
+        if entry.basename is None:
+            entry.error = "not a http(s)-URL"
+            return entry
+        failures = list()
+        for location in spec.source_locations:
+            try:
+                with urlopen(HeadRequest(location), timeout=self.head_timeout) as response:
+                    length_str = response.headers.get('content-length')
+                entry.source = location
+                entry.size = (length_str is not None) and int(length_str) or None
+                break
+            except TRANSFER_ERRORS as ex:
+                failures.append("{u}: {ex}".format(u=location, ex=ex))
+        else:
+            entry.error = "unreachable ({f})".format(f="; ".join(failures))
+            return entry
+
+        if failures:
+            entry.warning = "mirrors unreachable: {f}".format(f="; ".join(failures))
+        if entry.size is None:
+            entry.warning = "size unknown (no Content-Length in HEAD response)"
+        elif osp.isfile(spec.copy_path) and osp.getsize(spec.copy_path) == entry.size:
+            entry.retained = True
+        else:
+            partial_path = spec.copy_path + PARTIAL_DOWNLOAD_SUFFIX
+            resumable = osp.isfile(partial_path) and osp.getsize(partial_path) or 0
+            entry.transfer_bytes = max(entry.size - resumable, 0)
+        return entry
+
+    @staticmethod
+    def _mark_duplicates(entries):
+        seen = set()
+        for entry in entries:
+            if entry.error is not None or entry.basename is None:
+                continue
+            if entry.basename in seen:
+                entry.warning = "duplicate import file name {b}, will be skipped".format(b=entry.basename)
+                entry.transfer_bytes = 0
+            seen.add(entry.basename)
+
+    def _space_by_dir(self, entries):
+        """
+        :return: dict mapping target directories to (needed bytes, free bytes); an extra target dir only needs
+                 space when it resides on another file system than the models dir (as it is populated with
+                 hard links otherwise), it then needs room for all of the import data
+        """
+        models_dir = self.collector.dld_config.models_dir
+        models_device = os.stat(_existing_ancestor(models_dir)).st_dev
+        space_by_dir = dict()
+        dir_by_device = {models_device: models_dir}
+        space_by_dir[models_dir] = [sum(entry.transfer_bytes for entry in entries),
+                                    shutil.disk_usage(_existing_ancestor(models_dir)).free]
+        import_data_bytes = sum(entry.size or 0 for entry in entries if entry.error is None)
+        for dirpath in self.extra_target_dirs:
+            existing = _existing_ancestor(dirpath)
+            device = os.stat(existing).st_dev
+            if device == models_device:
+                continue
+            if device not in dir_by_device:
+                dir_by_device[device] = dirpath
+                space_by_dir[dirpath] = [0, shutil.disk_usage(existing).free]
+            space_by_dir[dir_by_device[device]][0] += import_data_bytes
+        return dict((d, tuple(space)) for d, space in space_by_dir.items())
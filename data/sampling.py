@@ -0,0 +1,263 @@
+import bz2
+import gzip
+import json
+import os
+from os import path as osp
+import random
+import re
+import tempfile
+from urllib.request import urlopen
+
+from data.throttling import throttled_stream
+from data.transfer import TRANSFER_ERRORS, head_validators
+from tools import FilenameOps, is_dict_like
+
+SAMPLES_DIR = osp.join('.dld', 'samples')
+FULL_COPIES_DIR = osp.join('.dld', 'full')
+SOURCE_SIGNATURE_SUFFIX = '.source'
+
+LINE_BASED_SYNTAXES = frozenset(['.nt', '.nq'])
+TURTLE_SYNTAXES = frozenset(['.ttl'])
+TURTLE_DIRECTIVE_PATTERN = re.compile(r'^\s*(@prefix|@base|PREFIX|BASE)\b', re.IGNORECASE)
+
+OPENERS_BY_COMPRESSION = {
+    '.gz': lambda fileobj, mode: gzip.GzipFile(fileobj=fileobj, mode=mode, compresslevel=1),
+    '.bz2': lambda fileobj, mode: bz2.BZ2File(fileobj, mode=mode, compresslevel=1),
+}
+
+
+class SampleSpec(object):
+    """
+    Which statements of a dataset to keep: the first N ('triples') or a random fraction (optionally with a seed
+    for reproducible samples, and a limit of 'triples' statements).
+    """
+
+    def __init__(self, triples=None, fraction=None, seed=0):
+        if triples is not None and (not isinstance(triples, int) or triples < 1):
+            raise RuntimeError("sample triples must be a positive integer, got: {t}".format(t=triples))
+        if fraction is not None and not (isinstance(fraction, (int, float)) and 0 < fraction <= 1):
+            raise RuntimeError("sample fraction must be a number in (0, 1], got: {f}".format(f=fraction))
+        if triples is None and fraction is None:
+            raise RuntimeError("a sample needs a 'triples' or 'fraction' declaration")
+        self.triples = triples
+        self.fraction = fraction
+        self.seed = seed
+
+    @classmethod
+    def from_config(cls, sample_config):
+        """
+        :param sample_config: dict with 'triples', 'fraction' and 'seed' entries or a false value (no sampling)
+        :return: SampleSpec or None
+        """
+        if not sample_config:
+            return None
+        if not is_dict_like(sample_config):
+            raise RuntimeError("unexpected sample declaration: {s}".format(s=sample_config))
+        unknown = set(sample_config.keys()) - set(['triples', 'fraction', 'seed'])
+        if unknown:
+            raise RuntimeError("unknown sample settings: {k}".format(k=", ".join(sorted(unknown))))
+        return cls(sample_config.get('triples'), sample_config.get('fraction'), sample_config.get('seed', 0))
+
+    @property
+    def head_only(self):
+        return self.fraction is None
+
+    @property
+    def key(self):
+        """
+        directory name for the samples taken this way
+        """
+        parts = []
+        if self.triples is not None:
+            parts.append("t{n}".format(n=self.triples))
+        if self.fraction is not None:
+            parts.append("f{f}-s{s}".format(f=self.fraction, s=self.seed))
+        return "-".join(parts)
+
+
+def syntax_extension(basename):
+    """
+    :return: the RDF serialisation extension of a (possibly compressed) file name, e.g. '.nt' for 'a.nt.bz2'
+    """
+    return osp.splitext(FilenameOps.strip_compression_extensions(basename))[1].lower()
+
+
+def compression_extension(basename):
+    extension = osp.splitext(basename)[1].lower()
+    return extension in OPENERS_BY_COMPRESSION and extension or None
+
+
+def can_sample(basename):
+    extension = syntax_extension(basename)
+    return extension in LINE_BASED_SYNTAXES or extension in TURTLE_SYNTAXES
+
+
+def line_statements(lines):
+    """
+    :return: generator over pairs (is_directive, text) for the statements of N-Triples/N-Quads lines
+    """
+    for line in lines:
+        stripped = line.strip()
+        if stripped and not stripped.startswith(b'#'):
+            yield False, line
+
+
+def turtle_statements(lines):
+    """
+    Splits Turtle into directives and statements (including their ';' and ',' continuations) with a heuristic:
+    a statement ends with a line ending in '.', unless a long string literal is still open.
+    """
+    block = []
+    in_long_string = False
+    for line in lines:
+        if not block and not line.strip():
+            continue
+        if not block and TURTLE_DIRECTIVE_PATTERN.match(line.decode('utf-8', 'replace')):
+            yield True, line
+            continue
+        block.append(line)
+        if (line.count(b'"""') + line.count(b"'''")) % 2 == 1:
+            in_long_string = not in_long_string
+        if not in_long_string and line.rstrip().endswith(b'.'):
+            yield False, b''.join(block)
+            block = []
+    if block:
+        yield False, b''.join(block)
+
+
+def open_source(source, chunk_filter=None):
+    """
+    :param source: local file path or http(s) URL
+    :param chunk_filter: optional callable invoked with the size of each chunk read from the source (e.g. Throttle)
+    :return: pair of a binary file-like object over the (decompressed) content of the source and the underlying
+             raw stream (both need to be closed)
+    """
+    if re.match('^https?://', source):
+        raw = throttled_stream(urlopen(source, timeout=60), chunk_filter)
+    else:
+        raw = throttled_stream(open(source, 'rb'), chunk_filter)
+    compression = compression_extension(source.split('?')[0])
+    if compression is None:
+        return raw, raw
+    return OPENERS_BY_COMPRESSION[compression](raw, 'rb'), raw
+
+
+def write_sample(source, target_path, sample_spec, chunk_filter=None):
+    """
+    Streams the source and writes the statements selected by the sample spec to the target path (compressed like
+    the target file name suggests). Turtle directives are always kept. Reading stops as soon as the sample
+    is complete, i.e. head-only samples of remote sources are not downloaded completely.
+
+    :param chunk_filter: optional callable invoked with the size of each chunk read from the source (e.g. Throttle)
+
+    :return: number of statements written
+    """
+    extension = syntax_extension(target_path)
+    splitter = extension in TURTLE_SYNTAXES and turtle_statements or line_statements
+    rng = random.Random(sample_spec.seed)
+    written = 0
+    tmp_fd, tmp_path = tempfile.mkstemp(prefix='.' + osp.basename(target_path), dir=osp.dirname(target_path))
+    try:
+        with os.fdopen(tmp_fd, 'wb') as tmp_raw:
+            compression = compression_extension(target_path)
+            target = compression and OPENERS_BY_COMPRESSION[compression](tmp_raw, 'wb') or tmp_raw
+            source_stream, raw_stream = open_source(source, chunk_filter)
+            try:
+                for is_directive, statement in splitter(source_stream):
+                    if is_directive:
+                        target.write(statement)
+                    elif sample_spec.fraction is None or rng.random() < sample_spec.fraction:
+                        target.write(statement)
+                        written += 1
+                        if sample_spec.triples is not None and written >= sample_spec.triples:
+                            break
+            finally:
+                source_stream.close()
+                raw_stream.close()
+            if target is not tmp_raw:
+                target.close()
+        os.replace(tmp_path, target_path)
+    except:
+        if osp.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+
+def source_signature(source, metadata_cache=None):
+    """
+    :param metadata_cache: data.transfer.SourceMetadataCache to take the validators of a remote source from (or None)
+    :return: JSON serialisable description of the state of a source, changing when a local source changes or a
+             remote one announces another ETag, Last-Modified or Content-Length
+    """
+    if osp.isfile(source):
+        stat = os.stat(source)
+        return [osp.abspath(source), stat.st_size, stat.st_mtime_ns]
+    try:
+        if metadata_cache is not None:
+            validators = metadata_cache.validators(source, head_validators)
+        else:
+            validators = head_validators(source)
+    except TRANSFER_ERRORS:
+        return [source]  # the version is unknown, does not match a recorded signature
+    return [source, validators['etag'], validators['last_modified'], validators['length']]
+
+
+class SampleCache(object):
+    """
+    Keeps samples by sample spec and file name in the working dir, together with the signature of the source
+    they were taken from, so that samples are only taken again when the source changed.
+    """
+
+    def __init__(self, working_dir, sample_spec, metadata_cache=None):
+        """
+        :param metadata_cache: data.transfer.SourceMetadataCache for the signatures of remote sources (or None)
+        """
+        self.sample_dir = osp.join(working_dir, SAMPLES_DIR, sample_spec.key)
+        self.sample_spec = sample_spec
+        self.metadata_cache = metadata_cache
+
+    def sample_path(self, basename):
+        return osp.join(self.sample_dir, basename)
+
+    def is_current(self, basename, source, signature=None):
+        """
+        :param signature: the current source_signature of the source, determined if None
+        """
+        if signature is None:
+            signature = source_signature(source, self.metadata_cache)
+        try:
+            with open(self.sample_path(basename) + SOURCE_SIGNATURE_SUFFIX) as signature_fd:
+                return json.load(signature_fd) == signature and osp.isfile(self.sample_path(basename))
+        except (IOError, ValueError):
+            return False
+
+    def ensure_sample(self, basename, source, chunk_filter=None):
+        """
+        :param chunk_filter: optional callable invoked with the size of each chunk read from the source
+        :return: path of the current sample for the source
+        """
+        sample_path = self.sample_path(basename)
+        signature = source_signature(source, self.metadata_cache)
+        if not self.is_current(basename, source, signature):
+            if not osp.isdir(self.sample_dir):
+                os.makedirs(self.sample_dir)
+            write_sample(source, sample_path, self.sample_spec, chunk_filter)
+            with open(sample_path + SOURCE_SIGNATURE_SUFFIX, 'w') as signature_fd:
+                json.dump(signature, signature_fd)
+        return sample_path
+
+
+def is_sample_file(working_dir, filepath):
+    """
+    :return: True if the file is a (hard link of a) sample kept in the working dir
+    """
+    basename = FilenameOps.basename(filepath)
+    samples_root = osp.join(working_dir, SAMPLES_DIR)
+    if not osp.isdir(samples_root):
+        return False
+    for key in os.listdir(samples_root):
+        sample_path = osp.join(samples_root, key, basename)
+        if osp.isfile(sample_path) and osp.samefile(sample_path, filepath):
+            return True
+    return False
@@ -0,0 +1,308 @@
+import contextlib
+import ctypes
+import io
+import logging
+import platform
+import shutil
+import threading
+import time
+from urllib.request import urlopen
+
+from tools import byte_size, child_thread_name, is_dict_like
+
+CHUNK_SIZE = 1024 * 1024
+
+# Linux I/O scheduling classes (see ioprio_set(2)), the idle class only gets disk time no one else asks for
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_SYSCALLS_BY_MACHINE = {  # (ioprio_set, ioprio_get)
+    'x86_64': (251, 252),
+    'aarch64': (30, 31),
+    'i386': (289, 290),
+    'i686': (289, 290),
+}
+
+LOG = logging.getLogger('dld.throttling')
+
+
+def _rate(value):
+    return isinstance(value, str) and byte_size(value) or value
+
+
+class TokenBucket(object):
+    """
+    Limits the throughput of all transfers sharing the bucket to a rate of bytes per second, allowing bursts
+    up to the bucket size. Transfers going beyond the available tokens wait for the deficit to be refilled.
+    The rate can be scaled down temporarily with rate_factor (see LatencyProbe).
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: bytes per second
+        :param burst: bucket size in bytes (defaults to one second worth of transfer)
+        """
+        if not rate or rate <= 0:
+            raise RuntimeError("a rate limit needs to be a positive number of bytes per second, got: {r}"
+                               .format(r=rate))
+        self.rate = rate
+        self.burst = burst or rate
+        self.rate_factor = 1.0
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = self.clock()
+            effective_rate = self.rate * self.rate_factor
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * effective_rate)
+            self._last_refill = now
+            # the deficit is reserved right away, so that concurrent transfers queue up behind each other
+            self._tokens -= amount
+            wait = self._tokens < 0 and -self._tokens / effective_rate or 0
+        if wait > 0:
+            self.sleep(wait)
+
+
+class Throttle(object):
+    """
+    Chunk filter (see MirrorDownloader) consuming the transferred bytes from a set of token buckets,
+    e.g. a global one and one for the dataset.
+    """
+
+    def __init__(self, buckets=(), idle_io=False):
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+        self.idle_io = idle_io
+
+    def __call__(self, amount):
+        for bucket in self.buckets:
+            bucket.consume(amount)
+
+    def __bool__(self):
+        return bool(self.buckets)
+
+    def transfer_context(self):
+        """
+        :return: context for running the transfers of the calling thread in (at idle I/O priority if requested)
+        """
+        return self.idle_io and idle_io_priority() or contextlib.suppress()
+
+
+class ThrottledReader(io.RawIOBase):
+    """
+    Binary stream passing the size of each read chunk of the wrapped stream to the chunk filter.
+    """
+
+    def __init__(self, raw, chunk_filter):
+        self.raw = raw
+        self.chunk_filter = chunk_filter
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.raw.readinto(buffer)
+        if count:
+            self.chunk_filter(count)
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        io.RawIOBase.close(self)
+
+
+def throttled_stream(raw, chunk_filter=None):
+    """
+    :return: buffered binary stream over the raw stream, reading through the chunk filter if there is one
+    """
+    if not chunk_filter:
+        return raw
+    return io.BufferedReader(ThrottledReader(raw, chunk_filter), CHUNK_SIZE)
+
+
+def copy_file(source_path, target_path, chunk_filter=None):
+    """
+    Copies like shutil.copyfile, passing the size of each copied chunk to the chunk filter.
+    """
+    if not chunk_filter:
+        shutil.copyfile(source_path, target_path)
+        return
+    with open(source_path, 'rb') as source_fd, open(target_path, 'wb') as target_fd:
+        for chunk in iter(lambda: source_fd.read(CHUNK_SIZE), b''):
+            target_fd.write(chunk)
+            chunk_filter(len(chunk))
+
+
+def _ioprio_syscalls():
+    syscalls = IOPRIO_SYSCALLS_BY_MACHINE.get(platform.machine())
+    if platform.system() != 'Linux' or syscalls is None:
+        return None
+    try:
+        return ctypes.CDLL(None, use_errno=True).syscall, syscalls
+    except (OSError, AttributeError):
+        return None
+
+
+@contextlib.contextmanager
+def idle_io_priority():
+    """
+    Puts the calling thread into the idle I/O scheduling class for the duration of the context (Linux only,
+    effective with I/O schedulers supporting priorities such as BFQ and CFQ).
+    """
+    ioprio = _ioprio_syscalls()
+    previous = None
+    if ioprio is None:
+        LOG.debug("idle I/O priority is not supported on this platform")
+    else:
+        syscall, (ioprio_set, ioprio_get) = ioprio
+        # 'who' 0 refers to the calling thread
+        previous = syscall(ioprio_get, IOPRIO_WHO_PROCESS, 0)
+        if previous < 0 or syscall(ioprio_set, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) < 0:
+            LOG.warning("unable to set idle I/O priority (errno {e})".format(e=ctypes.get_errno()))
+            previous = None
+    try:
+        yield
+    finally:
+        if previous is not None:
+            syscall(ioprio_set, IOPRIO_WHO_PROCESS, 0, previous)
+
+
+class LatencyProbe(object):
+    """
+    Requests a URL (e.g. a cheap query against a live SPARQL endpoint) periodically and scales the rate of
+    the given token buckets down while the response time is degraded: halving it on each degraded
+    measurement and restoring it gradually once the latency recovered.
+    """
+    log = logging.getLogger('dld.LatencyProbe')
+
+    def __init__(self, url, buckets, interval=5.0, max_latency=None, degradation=3.0, timeout=10,
+                 min_factor=0.05, recovery_step=0.1):
+        """
+        :param url: URL to request
+        :param buckets: the TokenBucket instances to adjust
+        :param interval: seconds between two requests
+        :param max_latency: seconds above which the latency counts as degraded
+        :param degradation: latency counts as degraded as well when exceeding the lowest latency seen this often
+        """
+        self.url = url
+        self.buckets = buckets
+        self.interval = interval
+        self.max_latency = max_latency
+        self.degradation = degradation
+        self.timeout = timeout
+        self.min_factor = min_factor
+        self.recovery_step = recovery_step
+        self.baseline = None
+        self.rate_factor = 1.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def measure(self):
+        """
+        :return: seconds until the response was read, None if the request failed
+        """
+        start = time.monotonic()
+        try:
+            with urlopen(self.url, timeout=self.timeout) as response:
+                response.read()
+            return time.monotonic() - start
+        except Exception as ex:
+            self.log.debug("latency probe of {u} failed: {ex}".format(u=self.url, ex=ex))
+            return None
+
+    def adjust(self, latency):
+        degraded = latency is None or (self.max_latency is not None and latency > self.max_latency) or \
+            (self.baseline is not None and latency > self.baseline * self.degradation)
+        if latency is not None:
+            self.baseline = self.baseline is None and latency or min(self.baseline, latency)
+        if degraded:
+            self.rate_factor = max(self.min_factor, self.rate_factor / 2)
+        else:
+            self.rate_factor = min(1.0, self.rate_factor + self.recovery_step)
+        for bucket in self.buckets:
+            bucket.rate_factor = self.rate_factor
+        if degraded:
+            self.log.info("latency of {u} degraded ({l}), limiting transfers to {p:.0%} of their rate"
+                          .format(u=self.url, l=latency is None and "failed" or "{s:.3f} s".format(s=latency),
+                                  p=self.rate_factor))
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.adjust(self.measure())
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=child_thread_name('dld-latency-probe'), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class TransferLimits(object):
+    """
+    The global transfer limits declared under 'settings: throttle:' (rate and burst in bytes per second, with
+    optional unit suffixes, idle_io and a latency probe), creating the throttles for the single datasets,
+    which may declare a rate, burst and idle_io of their own.
+    """
+
+    def __init__(self, bucket=None, idle_io=False, probe=None):
+        self.bucket = bucket
+        self.idle_io = idle_io
+        self.probe = probe
+
+    @classmethod
+    def from_config(cls, throttle_config):
+        """
+        :return: TransferLimits instance or None for a false value
+        """
+        if not throttle_config:
+            return None
+        cls._check_keys(throttle_config, ['rate', 'burst', 'idle_io', 'probe'])
+        bucket = throttle_config.get('rate') and \
+            TokenBucket(_rate(throttle_config['rate']), _rate(throttle_config.get('burst'))) or None
+        probe = None
+        probe_config = throttle_config.get('probe')
+        if probe_config:
+            if bucket is None:
+                raise RuntimeError("a latency probe requires a global rate limit to adjust")
+            probe_config = isinstance(probe_config, str) and {'url': probe_config} or probe_config
+            cls._check_keys(probe_config, ['url', 'interval', 'max_latency', 'degradation', 'timeout'])
+            probe_config = dict(probe_config)
+            probe = LatencyProbe(probe_config.pop('url'), [bucket], **probe_config)
+        return cls(bucket, bool(throttle_config.get('idle_io')), probe)
+
+    @staticmethod
+    def _check_keys(config, known_keys):
+        if not is_dict_like(config):
+            raise RuntimeError("unexpected throttle declaration: {t}".format(t=config))
+        unknown = set(config.keys()) - set(known_keys)
+        if unknown:
+            raise RuntimeError("unknown throttle settings: {k}".format(k=", ".join(sorted(unknown))))
+
+    def close(self):
+        if self.probe is not None:
+            self.probe.stop()
+
+
+def create_throttle(transfer_limits, dataset_throttle_config=None):
+    """
+    :param transfer_limits: global TransferLimits (or None)
+    :param dataset_throttle_config: the throttle declaration of a dataset (or None)
+    :return: Throttle instance for the transfers of the dataset
+    """
+    if transfer_limits is not None and transfer_limits.probe is not None:
+        transfer_limits.probe.start()
+    buckets = [transfer_limits and transfer_limits.bucket or None]
+    idle_io = bool(transfer_limits and transfer_limits.idle_io)
+    if dataset_throttle_config:
+        TransferLimits._check_keys(dataset_throttle_config, ['rate', 'burst', 'idle_io'])
+        if dataset_throttle_config.get('rate'):
+            buckets.append(TokenBucket(_rate(dataset_throttle_config['rate']),
+                                       _rate(dataset_throttle_config.get('burst'))))
+        idle_io = idle_io or bool(dataset_throttle_config.get('idle_io'))
+    return Throttle(buckets, idle_io)
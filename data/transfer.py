@@ -0,0 +1,349 @@
+import json
+import logging
+import os
+from os import path as osp
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from urllib.error import URLError, HTTPError
+from urllib.request import Request, urlopen
+
+from tools import HeadRequest, child_thread_name
+
+CHUNK_SIZE = 64 * 1024
+PROBE_BYTES = 64 * 1024
+# amount of data the mirror ranking estimates the transfer time for
+RANKING_REFERENCE_BYTES = 8 * 1024 * 1024
+PARTIAL_DOWNLOAD_SUFFIX = '.part'
+# next to a partial download, records the validators of the resource version it holds a prefix of
+PARTIAL_VALIDATORS_SUFFIX = '.validators'
+
+TRANSFER_ERRORS = (URLError, HTTPException, socket.timeout, ConnectionError)
+
+
+class StalledTransferError(IOError):
+    pass
+
+
+class ChangedResourceError(IOError):
+    pass
+
+
+def response_validators(response):
+    """
+    :return: dict with the ETag, Last-Modified and total length identifying the version of the resource sent in the
+             response (values may be None)
+    """
+    length = None
+    content_range = response.headers.get('content-range')
+    if content_range and '/' in content_range:
+        total = content_range.rpartition('/')[2].strip()
+        if total.isdigit():
+            length = int(total)
+    elif response.status == 200 and response.headers.get('content-length') is not None:
+        length = int(response.headers['content-length'])
+    return {'etag': response.headers.get('etag'), 'last_modified': response.headers.get('last-modified'),
+            'length': length}
+
+
+def head_validators(location, timeout=60):
+    """
+    :return: dict with the ETag, Last-Modified and length of the current version of a location (see
+             response_validators), from a HEAD request
+    """
+    with urlopen(HeadRequest(location), timeout=timeout) as response:
+        return response_validators(response)
+
+
+def same_version(recorded, received):
+    """
+    :return: whether no validator known on both sides differs
+    """
+    for name in ['etag', 'last_modified', 'length']:
+        if recorded.get(name) is not None and received.get(name) is not None and recorded[name] != received[name]:
+            return False
+    return True
+
+
+def if_range_value(validators):
+    """
+    :return: the validator to send with If-Range (a strong ETag or else Last-Modified), None if there is none
+    """
+    etag = validators.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return validators.get('last_modified')
+
+
+def cross_mirror_validators(validators):
+    """
+    :return: the validators that identify a version on another mirror than the one they were received from: ETags
+             are assigned by each server, so only Last-Modified together with the total length is kept (an empty
+             dict if one of them is unknown)
+    """
+    if validators.get('last_modified') is None or validators.get('length') is None:
+        return dict()
+    return {'etag': None, 'last_modified': validators['last_modified'], 'length': validators['length']}
+
+
+class ExponentialBackoff(object):
+    """
+    Delays for retry attempts, growing exponentially up to a maximum, with random jitter to keep
+    concurrent clients from retrying in lockstep.
+    """
+
+    def __init__(self, base_delay=1.0, factor=2.0, max_delay=60.0, jitter=0.5, rng=random):
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.rng = rng
+
+    def delay(self, attempt):
+        """
+        :param attempt: number of failed attempts so far, starting with 0 for the first failure
+        """
+        capped = min(self.max_delay, self.base_delay * (self.factor ** attempt))
+        return capped * (1 - self.jitter * self.rng.random())
+
+
+class MirrorProbe(object):
+    def __init__(self, url, latency=None, throughput=None, error=None):
+        self.url = url
+        self.latency = latency
+        self.throughput = throughput
+        self.error = error
+
+    @property
+    def estimated_duration(self):
+        if self.error is not None:
+            return float('inf')
+        return self.latency + RANKING_REFERENCE_BYTES / max(self.throughput, 1.0)
+
+
+def probe_mirror(url, timeout=10):
+    """
+    Requests the first bytes of a resource to measure the latency (time to first byte) and the throughput.
+
+    :return: MirrorProbe instance (with error set if the mirror failed)
+    """
+    start = time.time()
+    try:
+        request = Request(url, headers={'Range': 'bytes=0-{e}'.format(e=PROBE_BYTES - 1)})
+        with urlopen(request, timeout=timeout) as response:
+            first_chunk = response.read(1)
+            first_byte = time.time()
+            received = len(first_chunk) + len(response.read(PROBE_BYTES - 1))
+        finished = time.time()
+        return MirrorProbe(url, latency=first_byte - start,
+                           throughput=received / max(finished - first_byte, 1e-6))
+    except TRANSFER_ERRORS as ex:
+        return MirrorProbe(url, error=ex)
+
+
+def rank_mirrors(urls, timeout=10):
+    """
+    Probes all mirrors concurrently.
+
+    :return: list of MirrorProbe instances, the mirror expected to be fastest first, failed mirrors last
+    """
+    if len(urls) == 1:
+        return [MirrorProbe(urls[0], latency=0.0, throughput=1.0)]
+    with ThreadPoolExecutor(max_workers=min(8, len(urls)),
+                            thread_name_prefix=child_thread_name('dld-probe')) as executor:
+        probes = list(executor.map(lambda u: probe_mirror(u, timeout), urls))
+    return sorted(probes, key=lambda probe: probe.estimated_duration)
+
+
+class SourceMetadataCache(object):
+    """
+    Remembers the content lengths and validators of remote sources for a while, so that consecutive preparations
+    in the same process (see service.py) do not request them again.
+    """
+
+    def __init__(self, ttl=300, clock=time.monotonic):
+        """
+        :param ttl: seconds a content length or the validators are remembered
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def content_length(self, location, fetch):
+        """
+        :param fetch: function returning the content length of a location, called if there is no current entry
+        """
+        return self._cached('content_length', location, fetch)
+
+    def validators(self, location, fetch=head_validators):
+        """
+        :param fetch: function returning the validators of a location (see head_validators), called if there is no
+                      current entry
+        """
+        return self._cached('validators', location, fetch)
+
+    def _cached(self, kind, location, fetch):
+        with self._lock:
+            entry = self._entries.get((kind, location))
+            if entry is not None and self.clock() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = fetch(location)
+        with self._lock:
+            self._entries[(kind, location)] = (self.clock(), value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class MirrorDownloader(object):
+    """
+    Downloads a resource available from one or several mirrors. Failed or stalled transfers are retried
+    with exponential backoff, switching to the next mirror and resuming the transfer with a Range
+    request where the mirror supports that. A transfer is only resumed with an If-Range validator recorded
+    for the partial download, so that a changed resource is not spliced from two versions. On another mirror
+    than the one the validators were received from, the transfer is resumed by Last-Modified and total length.
+    """
+    log = logging.getLogger('dld.MirrorDownloader')
+
+    def __init__(self, urls, max_attempts=5, stall_timeout=60, min_speed=0, backoff=None, probe_timeout=10,
+                 chunk_filter=None):
+        """
+        :param urls: list of mirror URLs for the same resource
+        :param max_attempts: number of failed transfer attempts after which to give up
+        :param stall_timeout: seconds without progress (resp. below min_speed) after which a transfer counts as stalled
+        :param min_speed: minimal bytes/s to maintain over stall_timeout windows (0 to only detect halted transfers)
+        :param backoff: ExponentialBackoff instance for the delays between attempts
+        :param chunk_filter: optional callable invoked with the size of each received chunk (e.g. for rate limiting)
+        """
+        self.urls = list(urls)
+        self.max_attempts = max_attempts
+        self.stall_timeout = stall_timeout
+        self.min_speed = min_speed
+        self.backoff = backoff or ExponentialBackoff()
+        self.probe_timeout = probe_timeout
+        self.chunk_filter = chunk_filter
+        # validators of the downloaded version (see response_validators) and the 'url' of the mirror they were
+        # received from, known after a download
+        self.validators = None
+
+    def download(self, target_path):
+        partial_path = target_path + PARTIAL_DOWNLOAD_SUFFIX
+        probes = rank_mirrors(self.urls, self.probe_timeout)
+        mirrors = [probe.url for probe in probes if probe.error is None] + \
+                  [probe.url for probe in probes if probe.error is not None]
+        self.log.debug("mirror ranking: {m}".format(m=", ".join(mirrors)))
+        failed_attempts = 0
+        mirror_idx = 0
+        while True:
+            url = mirrors[mirror_idx % len(mirrors)]
+            try:
+                self._transfer(url, partial_path)
+                os.replace(partial_path, target_path)
+                self.validators = self._read_validators(partial_path)
+                self._remove_validators(partial_path)
+                return url
+            except (TRANSFER_ERRORS + (StalledTransferError, ChangedResourceError)) as ex:
+                failed_attempts += 1
+                if isinstance(ex, HTTPError) and 400 <= ex.code < 500 and ex.code not in (408, 416, 429):
+                    mirrors.remove(url)  # the mirror lacks the resource, no point in asking it again
+                else:
+                    mirror_idx += 1
+                if failed_attempts >= self.max_attempts or not mirrors:
+                    raise IOError("giving up downloading from {u} after {n} failed attempts, last error: {ex}"
+                                  .format(u=", ".join(self.urls), n=failed_attempts, ex=ex))
+                delay = self.backoff.delay(failed_attempts - 1)
+                self.log.warning("transfer from {u} failed ({ex}), retrying in {d:.1f} s"
+                                 .format(u=url, ex=ex, d=delay))
+                time.sleep(delay)
+
+    @staticmethod
+    def _read_validators(partial_path):
+        try:
+            with open(partial_path + PARTIAL_VALIDATORS_SUFFIX) as validators_fd:
+                return json.load(validators_fd)
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_validators(partial_path, validators):
+        with open(partial_path + PARTIAL_VALIDATORS_SUFFIX, 'w') as validators_fd:
+            json.dump(validators, validators_fd)
+
+    @staticmethod
+    def _remove_validators(partial_path):
+        if osp.isfile(partial_path + PARTIAL_VALIDATORS_SUFFIX):
+            os.remove(partial_path + PARTIAL_VALIDATORS_SUFFIX)
+
+    def _discard(self, partial_path):
+        if osp.isfile(partial_path):
+            os.remove(partial_path)
+        self._remove_validators(partial_path)
+
+    def _transfer(self, url, partial_path):
+        offset = osp.isfile(partial_path) and osp.getsize(partial_path) or 0
+        validators = self._read_validators(partial_path) or dict()
+        if offset and validators.get('url') not in (None, url):
+            validators = cross_mirror_validators(validators)
+        if offset and if_range_value(validators) is None:
+            self.log.info("no validators recorded for {p}, restarting transfer".format(p=partial_path))
+            offset = 0
+        headers = dict()
+        if offset:
+            headers = {'Range': 'bytes={o}-'.format(o=offset), 'If-Range': if_range_value(validators)}
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=self.stall_timeout)
+        except HTTPError as http_error:
+            if http_error.code == 416 and offset and offset == validators.get('length'):
+                # the partial download is complete already, only the rename is missing
+                self.log.info("{p} is complete, finishing transfer".format(p=partial_path))
+                return
+            if http_error.code == 416:
+                self._discard(partial_path)
+            raise
+        with response:
+            received_validators = response_validators(response)
+            if offset and response.status != 206:
+                self.log.info("{u} does not support resuming or the resource changed, restarting transfer"
+                              .format(u=url))
+                offset = 0
+            elif offset and not same_version(validators, received_validators):
+                self._discard(partial_path)
+                raise ChangedResourceError("{u} serves another version than the partial download".format(u=url))
+            elif offset:
+                self.log.info("resuming transfer from {u} at byte {o}".format(u=url, o=offset))
+            if not offset:
+                received_validators['url'] = url
+                self._write_validators(partial_path, received_validators)
+            expected_length = response.headers.get('content-length')
+            expected_length = (expected_length is not None) and int(expected_length) + offset or None
+            received = offset
+            with open(partial_path, offset and 'ab' or 'wb') as target_fd:
+                window_start, window_received = time.time(), 0
+                while True:
+                    chunk = response.read1(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target_fd.write(chunk)
+                    received += len(chunk)
+                    window_received += len(chunk)
+                    if callable(self.chunk_filter):
+                        filter_start = time.time()
+                        self.chunk_filter(len(chunk))
+                        # time spent waiting in the filter (e.g. for a rate limit) does not count as stalling
+                        window_start += time.time() - filter_start
+                    if time.time() - window_start >= self.stall_timeout:
+                        if window_received < self.min_speed * self.stall_timeout:
+                            raise StalledTransferError("transfer below {s} bytes/s".format(s=self.min_speed))
+                        window_start, window_received = time.time(), 0
+        if expected_length is not None and received != expected_length:
+            raise StalledTransferError("transfer ended after {r} of {e} bytes".format(r=received, e=expected_length))
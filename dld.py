@@ -3,28 +3,53 @@ import sys
 import os
 from os import path as osp
 import argparse as ap
+import json
 import re
 import logging
 import logging.config
 from collections import defaultdict
 from textwrap import dedent
 import tempfile
+import threading
 
 import yaml
 import httplib2
-from docker import Client
 
-from data.datasets import ImportsCollector
-from tools import http_url, is_dict_like, is_list_like
+from data.changesets import MANIFEST_FILE, apply_changeset, pending_changesets
+from data.datasets import ImportsCollector, READY_MARKER_SUFFIX, PREPARATION_DONE_MARKER, GRAPH_INDEX_FILE
+from data.partitioning import LoadPartitioner
+from data.peers import DEFAULT_PEER_PORT, PeerShareServer, PeerSources
+from data.preflight import Preflight
+from data.throttling import TransferLimits
+from data.transfer import SourceMetadataCache
+from orchestration.images import ImagePuller
+from orchestration.engine import EngineOrchestrator, compose_project_name, container_id, container_name, \
+    outdated_image_services
+from orchestration.plan import ComposePlan, normalize_compose_config, read_compose_file
+from orchestration.volumes import ImportVolumeUploader, import_volume_name
+from orchestration.snapshots import SnapshotCache, StoreSnapshots, DigestCache, DIGEST_CACHE_FILE, import_fingerprint
+from sparql.cache import CachingProxyServer, DEFAULT_CACHE_MAX_BYTES, DEFAULT_CACHE_MAX_ENTRIES, \
+    DEFAULT_CACHE_PORT, DEFAULT_CACHE_TTL, LoadWatcher, QueryCache
+from sparql.loadgen import LoadGenerator, Workload
+from sparql.verify import CountCache, CountVerifier, VERIFY_CACHE_FILE, endpoint_from_compose, \
+    format_verification, parse_expected_counts
+from service import DLDService, ServiceClient
+from watch import WatchSession
+from batch import BatchPlan, Deployment, batch_working_dirs, format_batch_summary
+from yamlconfig import load_dld_config
+from tools import http_url, byte_size, is_dict_like, is_list_like, parse_cpuset, partition_cpuset, write_if_changed
 
 #non-dererred import when this is not run as main script (e.g. through nosetests)
 if __name__ != '__main__':
     from dldbase import DEV_MODE
     from config import DLDConfig
 
-from tools import FilenameOps, ComposeConfigDefaultDict, HeadRequest, alpha_gen
+from tools import FilenameOps, ComposeConfigDefaultDict, HeadRequest, alpha_gen, child_thread_name
 
 LAST_WORD_PATTERN = re.compile('[a-zA-Z0-9]+$')
+# image built from the Dockerfile of this repository, runs the caching SPARQL proxy ('dld.py cache')
+DLD_IMAGE = 'aksw/dld'
+DOCKER_SOCKET = '/var/run/docker.sock'
 
 PROJECT_DIR = osp.dirname(osp.realpath(__file__))
 DLD_LOG = logging.getLogger('dld')
@@ -53,18 +78,35 @@ class ComposeConfigGenerator(object):
         self.log = logging.getLogger('dld.' + self.__class__.__name__)
         self.compose_config = ComposeConfigDefaultDict()
         self._steps_done = defaultdict(lambda: False)
+        self.compose_plan = None
+        # leave out the load services (e.g. when the store data is restored from a snapshot)
+        self.skip_load = False
+        self.collector = ImportsCollector(self.dld_config)
         self.log.debug("init - passed configuration:\n{}".format(self.yaml_config))
 
-    def run(self):
-        # self.pull_images(self.configuration) #not using image metadata yet
+    def run(self, pull_images=False):
         self.create_compose_config()
-        self.prepare_import_data(self.yaml_config["datasets"])
+        self.run_preparation(pull_images)
+
+    def run_preparation(self, pull_images=False):
+        """
+        Prepares the import data (self#create_compose_config must have been run before).
 
-    def pull_images(self, config):
-        docker = Client()
-        images = docker.images(filters={"label": "org.aksw.dld"})
+        :param pull_images: whether to pull the component images meanwhile (when the setup is brought up next)
+        """
+        image_puller = pull_images and self.pull_images() or None
+        try:
+            self.prepare_import_data(self.yaml_config["datasets"])
+        finally:
+            if image_puller is not None:
+                image_puller.wait()
+        self.upload_import_data()
 
-        # docker.inspect_image
+    def pull_images(self):
+        """
+        Starts pulling the images referenced in the compose configuration in the background.
+        """
+        return ImagePuller(self.compose_config).start()
 
     def _add_global_settings(self, component_settings):
         global_settings = self.yaml_config.get('settings', dict())
@@ -120,22 +162,51 @@ class ComposeConfigGenerator(object):
         if callable(additional_config_thunk):
             additional_config_thunk(compose_container_spec)
         if self.dld_config.additional_volumes_from:
-            self.log.info("adding volumes from meta-container: {l}".format(l=self.dld_config.additional_volumes_from))
-            compose_container_spec['volumes_from'] += self.dld_config.additional_volumes_from
+            self.log.info("adding volumes from meta-container: {l}"
+                          .format(l=self.dld_config.additional_volumes_from))
+            compose_container_spec['volumes_from'] += [
+                container for container in self.dld_config.additional_volumes_from
+                if container not in compose_container_spec['volumes_from']]
 
-    def create_compose_config(self):
+    @property
+    def compose_file_path(self):
+        return osp.join(self.dld_config.working_dir, 'docker-compose.yml')
+
+    def plan_compose_config(self):
+        """
+        Generates the compose configuration and compares it with the previously written compose file.
+
+        :return: pair of the normalized compose configuration and the ComposePlan
+        """
         self.configure_compose()
         # transformation back to standard dict required to keep pyyaml from serialising class metadata
-        docker_compose_config = ddict2dict(self.compose_config)
-        DLD_LOG.debug("\n" + yaml.safe_dump(docker_compose_config))
+        docker_compose_config = normalize_compose_config(ddict2dict(self.compose_config))
+        previous_config = read_compose_file(self.compose_file_path)
+        outdated_images = list()
+        if previous_config:  # containers of the setup might exist already
+            try:
+                outdated_images = outdated_image_services(docker_compose_config,
+                                                          compose_project_name(self.dld_config.working_dir))
+            except Exception as ex:
+                self.log.debug("unable to compare the images of the existing containers: {ex}".format(ex=ex))
+        return docker_compose_config, ComposePlan(previous_config, docker_compose_config, outdated_images)
+
+    def create_compose_config(self):
+        docker_compose_config, self.compose_plan = self.plan_compose_config()
+        compose_yaml = yaml.safe_dump(docker_compose_config)
+        DLD_LOG.debug("\n" + compose_yaml)
         ensure_dir_exists(self.dld_config.working_dir, self.log, warn_exists=False)
-        with open(osp.join(self.dld_config.working_dir, 'docker-compose.yml'), mode='w') as compose_fd:
-            yaml.safe_dump(docker_compose_config, compose_fd)
+        # an untouched compose file keeps docker-compose from reconsidering the services without need
+        if write_if_changed(self.compose_file_path, compose_yaml, atomic=True):
+            self.log.debug("services changed in the compose configuration: {s}"
+                           .format(s=", ".join(self.compose_plan.changed_services)))
 
     def configure_compose(self):
         self.configure_store()
         self.configure_load()
         self.configure_present()
+        self.configure_cache()
+        self._distribute_present_links()
 
     @property
     def wd_ready_message(self):
@@ -157,26 +228,121 @@ class ComposeConfigGenerator(object):
             return msg_tmpl.format(wd=abs_wd)
 
     def configure_store(self):
-        if not self._steps_done['store']:
-            self._configure_singleton_component('store')
-            self._steps_done['store'] = True
+        """
+        Configures the store service and, when several replicas are requested, the services 'store2' to 'storeN'
+        that receive a copy of its data once it was loaded (see replicate_store). The CPUs (the declared cpuset
+        or else all CPUs of the Docker host) are divided among the replicas, ports are only published for the
+        primary store.
+        """
+        def additional_config_for(cpuset, replica):
+            def additional_config(store_spec):
+                if cpuset is not None:
+                    store_spec['cpuset'] = cpuset
+                if replica:  # the replicas are reached through the links of the other services only
+                    store_spec.pop('ports', None)
+
+            return additional_config
+
+        if ('store' not in self.yaml_config['components']) or self._steps_done['store']:
+            return
+        replicas, component_config = self._extract_replicas(self.yaml_config['components']['store'])
+        cpusets = [None] * replicas
+        if replicas > 1:
+            declared_cpuset = is_dict_like(component_config) and component_config.get('cpuset') or None
+            cpus = declared_cpuset is not None and parse_cpuset(declared_cpuset) or \
+                list(range(self.dld_config.docker_host_cpus))
+            cpusets = partition_cpuset(cpus, replicas)
+        for store_service_name, cpuset in zip(self.store_service_names, cpusets):
+            self._update_container_config(component_config, self.compose_config[store_service_name],
+                                          additional_config_thunk=additional_config_for(cpuset,
+                                                                                        store_service_name != 'store'))
+        self._steps_done['store'] = True
+
+    @property
+    def store_service_names(self):
+        """
+        names of the compose services for the store component: the (primary) 'store' service that is loaded and,
+        when several replicas are requested, 'store2' to 'storeN' (copies of the loaded primary)
+        """
+        if 'store' not in self.yaml_config['components']:
+            return []
+        replicas, _ = self._extract_replicas(self.yaml_config['components']['store'])
+        return ['store'] + ['store{n}'.format(n=n) for n in range(2, replicas + 1)]
+
+    @property
+    def load_service_names(self):
+        """
+        names of the compose services for the load component: a single 'load' service or, when
+        several replicas are requested, 'load1' to 'loadN' (each working on its own import partition)
+        """
+        if 'load' not in self.yaml_config['components']:
+            return []
+        replicas, _ = self._extract_replicas(self.yaml_config['components']['load'])
+        if replicas == 1:
+            return ['load']
+        return ['load{n}'.format(n=n) for n in range(1, replicas + 1)]
+
+    @staticmethod
+    def _extract_replicas(component_config):
+        """
+        :return: pair of the requested replica count and the component config without the replicas declaration
+        """
+        if not is_dict_like(component_config) or 'replicas' not in component_config:
+            return 1, component_config
+        component_config = component_config.copy()  # copy to keep input config unaltered
+        replicas = component_config.pop('replicas')
+        if not isinstance(replicas, int) or replicas < 1:
+            raise RuntimeError("replicas must be a positive integer, got: {r}".format(r=replicas))
+        return replicas, component_config
+
+    @property
+    def early_service_names(self):
+        """
+        names of the services that can be started while the import data is still being prepared:
+        all services except the load services, unless those are fed incrementally through ready markers
+        """
+        if self.dld_config.ready_markers and len(self.load_service_names) == 1:
+            return sorted(self.compose_config.keys())
+        return sorted(name for name in self.compose_config.keys() if name not in self.load_service_names)
+
+    def _import_source_dir(self, load_service_name):
+        if len(self.load_service_names) > 1:
+            return osp.join(self.dld_config.partitions_dir, load_service_name)
+        return self.dld_config.models_dir
 
     def configure_load(self):
-        def additional_config(load_component_spec):
-            load_component_spec['links'].append('store')
-            # TODO This might also be done by reading the labels of the load container resp. for the other categories.
-            # A stub for loading the images and reading the labels is in pull_images
-            load_component_spec['volumes_from'].append('store')
-            import_vol_dest = self.dld_config.import_volume_destination
-            load_component_spec['environment']['IMPORT_SRC'] = import_vol_dest
-            if not self.dld_config.internal_import_volume:
-                if self.dld_config.selinux_volumes_tweaks_supported:
-                    import_vol_dest += ':z'
-                load_component_spec['volumes'] = [osp.abspath(self.dld_config.models_dir) + ":" + import_vol_dest]
-
-        if not self._steps_done['load']:
-            self._configure_singleton_component('load', additional_config_thunk=additional_config)
-            self._steps_done['load'] = True
+        def additional_config_for(load_service_name):
+            def additional_config(load_component_spec):
+                load_component_spec['links'].append('store')
+                # TODO This might also be done by reading the labels of the load container resp. for the other
+                # categories.
+                load_component_spec['volumes_from'].append('store')
+                import_vol_dest = self.dld_config.import_volume_destination
+                load_component_spec['environment']['IMPORT_SRC'] = import_vol_dest
+                if self.dld_config.ready_markers:
+                    load_component_spec['environment']['IMPORT_READY_MARKER_SUFFIX'] = READY_MARKER_SUFFIX
+                    load_component_spec['environment']['IMPORT_DONE_MARKER'] = PREPARATION_DONE_MARKER
+                if self.dld_config.graph_index:
+                    load_component_spec['environment']['IMPORT_GRAPH_INDEX'] = GRAPH_INDEX_FILE
+                if self.dld_config.internal_import_volume:
+                    volume_name = import_volume_name(compose_project_name(self.dld_config.working_dir),
+                                                     load_service_name)
+                    load_component_spec['volumes'] = [volume_name + ":" + import_vol_dest]
+                else:
+                    if self.dld_config.selinux_volumes_tweaks_supported:
+                        import_vol_dest += ':z'
+                    import_src_dir = self._import_source_dir(load_service_name)
+                    load_component_spec['volumes'] = [osp.abspath(import_src_dir) + ":" + import_vol_dest]
+
+            return additional_config
+
+        if ('load' not in self.yaml_config['components']) or self._steps_done['load'] or self.skip_load:
+            return
+        _, component_config = self._extract_replicas(self.yaml_config['components']['load'])
+        for load_service_name in self.load_service_names:
+            self._update_container_config(component_config, self.compose_config[load_service_name],
+                                          additional_config_thunk=additional_config_for(load_service_name))
+        self._steps_done['load'] = True
 
     def _extract_last_word(string, fallback=None):
         try:
@@ -229,6 +395,69 @@ class ComposeConfigGenerator(object):
                                               additional_config_thunk=additional_config)
         self._steps_done['present'] = True
 
+    def configure_cache(self):
+        """
+        Puts a caching SPARQL proxy between the present components and the store: the 'cache' service is linked
+        to the store and the present services reach it under the hostname of the store. As long as the load
+        services run, the proxy passes the queries through and only starts caching once they finished (it
+        watches them through the Docker socket). Queries are balanced over the replicas of the store.
+        """
+        def settings_handler(cache_settings, cache_spec):
+            if 'command' in cache_spec:
+                return
+            max_size = cache_settings.get('max_size', DEFAULT_CACHE_MAX_BYTES)
+            upstreams = ['http://{s}:{p}'.format(s=store_service_name, p=DEFAULT_CACHE_PORT)
+                         for store_service_name in self.store_service_names]
+            cache_spec['command'] = ['cache', '--upstream'] + upstreams + [
+                '--ttl', str(cache_settings.get('ttl', DEFAULT_CACHE_TTL)),
+                '--max-entries', str(cache_settings.get('max_entries', DEFAULT_CACHE_MAX_ENTRIES)),
+                '--max-size', str(max_size)]
+            load_services = not self.skip_load and self.load_service_names or []
+            if load_services:
+                project_name = compose_project_name(self.dld_config.working_dir)
+                cache_spec['command'] += ['--await'] + [container_name(project_name, load_service)
+                                                        for load_service in load_services]
+                if len(self.store_service_names) > 1:
+                    cache_spec['command'] += ['--await-replicas'] + [
+                        container_name(project_name, replica) for replica in self.store_service_names[1:]]
+                cache_spec['volumes'].append(DOCKER_SOCKET + ':' + DOCKER_SOCKET)
+
+        def additional_config(cache_spec):
+            cache_spec['links'] += self.store_service_names
+
+        components = self.yaml_config['components']
+        if 'cache' not in components or self._steps_done['cache']:
+            return
+        if 'store' not in components:
+            raise RuntimeError("the cache component requires a store component")
+        component_config = components['cache']
+        if component_config is None or component_config is True:
+            component_config = DLD_IMAGE
+        elif is_dict_like(component_config) and 'image' not in component_config:
+            component_config = dict(component_config, image=DLD_IMAGE)
+        self._update_container_config(component_config, self.compose_config['cache'], settings_handler,
+                                      additional_config)
+        for service_name, service_spec in self.compose_config.items():
+            if service_name.startswith('present'):
+                service_spec['links'] = [link == 'store' and 'cache:store' or link for link in service_spec['links']]
+        self._steps_done['cache'] = True
+
+    def _distribute_present_links(self):
+        """
+        Links the present services to the store replicas in turn (they reach their replica under the hostname
+        of the store). With a cache component, the cache balances the queries instead.
+        """
+        store_service_names = self.store_service_names
+        if len(store_service_names) < 2 or 'cache' in self.compose_config:
+            return
+        present_service_names = sorted(name for name in self.compose_config.keys() if name.startswith('present'))
+        for idx, service_name in enumerate(present_service_names):
+            store_service_name = store_service_names[idx % len(store_service_names)]
+            if store_service_name != 'store':
+                service_spec = self.compose_config[service_name]
+                service_spec['links'] = [link == 'store' and (store_service_name + ':store') or link
+                                         for link in service_spec['links']]
+
     @classmethod
     def _http_client(cls, **kwargs):
         # TODO: set up proper HTTP-caching directory and test caching facilities
@@ -240,21 +469,99 @@ class ComposeConfigGenerator(object):
         if not self._steps_done['store']:
             raise RuntimeError('[internal] cannot prepare import data before store configuration')
 
+        self.check_import_data(datasets_fragment).raise_on_failure()
         ensure_dir_exists(self.dld_config.models_dir, self.log)
-        collector = ImportsCollector(self.dld_config)
-        collector.prepare(datasets_fragment)
+        self.collector.prepare(datasets_fragment)
+        self._partition_import_data()
+
+    def check_import_data(self, datasets_fragment):
+        """
+        Checks the reachability and sizes of all dataset sources and the free space for the import data
+        without transferring anything.
+
+        :return: PreflightReport
+        """
+        extra_target_dirs = len(self.load_service_names) > 1 and [self.dld_config.partitions_dir] or []
+        report = Preflight(self.collector, extra_target_dirs).run(datasets_fragment)
+        self.log.info(report.format())
+        return report
+
+    def update_import_data(self, dataset_names):
+        """
+        Prepares the import data for the named datasets again, keeping the data collected for the other datasets.
+        """
+        ensure_dir_exists(self.dld_config.models_dir, self.log, warn_exists=False)
+        self.collector.update(self.yaml_config["datasets"], dataset_names)
+        self._partition_import_data()
+        self.upload_import_data()
+
+    def upload_import_data(self):
+        """
+        Streams the prepared import data into the import volumes of the load services through the Docker API,
+        when the internal import volume is used instead of bind mounts (the load images must be available).
+        """
+        if not self.dld_config.internal_import_volume:
+            return
+        project_name = compose_project_name(self.dld_config.working_dir)
+        for load_service_name in self.load_service_names:
+            if load_service_name in self.compose_config:
+                ImportVolumeUploader(self._import_source_dir(load_service_name),
+                                     import_volume_name(project_name, load_service_name),
+                                     self.compose_config[load_service_name]['image'],
+                                     self.dld_config.working_dir).upload()
+
+    def _partition_import_data(self):
+        if len(self.load_service_names) > 1:
+            LoadPartitioner(self.dld_config).partition(self.load_service_names)
+
+    def reconfigure(self, yaml_config):
+        """
+        Generates and writes the compose configuration for a changed DLD configuration.
+
+        :return: sorted names of the services added, changed or removed in comparison to the previous configuration
+        """
+        self.yaml_config = yaml_config
+        self.compose_config = ComposeConfigDefaultDict()
+        self._steps_done.clear()
+        self.create_compose_config()
+        return self.compose_plan.changed_services
 
 
 def build_argument_parser():
     helptexts = {
         'app_descr': "DLD command line tool to orchestrate Linked Data tools.",
-        'app_epilog': "See http://dld.aksw.org/ for further explanation and instructions.",
+        'app_epilog': "Further subcommands (see their --help): 'dld.py batch' prepares several setups at once, " +
+                      "'dld.py verify' checks the triple counts of a running setup, 'dld.py loadtest' measures " +
+                      "its query performance, 'dld.py changesets' updates it with the changes of new " +
+                      "dataset versions, 'dld.py serve' keeps running to prepare setups submitted with " +
+                      "'dld.py submit', 'dld.py share' offers the downloaded dataset sources to other hosts and " +
+                      "'dld.py cache' runs the caching SPARQL proxy of the 'cache' component. " +
+                      "See http://dld.aksw.org/ for further explanation and instructions.",
         'config-file': "the *-dld.yml file specifying the desired LD tool orchestration (defaults to 'dld.yml')",
         'working-dir': "target directory for compose configuration and collected LD dumps for import",
         'target-named-graph': "named graph as destination for LD to import specified with the -f or -l option",
         'dump-file': "LD dump file to import into RDF storage solution",
         'dump-location': "location (as URL) of dump file to download and import into RDF storage solution",
         'do-up' : "let this script run 'docker-compose up' after successful preperation of the DLD setup",
+        'pipelined': "like --do-up, but start the store and present components already while the import data " +
+                     "is being prepared, the load component is started when the preparation is completed",
+        'ready-markers': "like --pipelined, but also start the load component early and signal each dataset " +
+                         "ready for import with a '" + READY_MARKER_SUFFIX + "' marker file " +
+                         "(requires a load image supporting incremental imports)",
+        'backend': "how to bring the setup up: 'compose' runs docker-compose on the written compose file, " +
+                   "'engine' creates and starts the containers directly through the Docker Engine API " +
+                   "(in parallel where the dependencies allow it)",
+        'watch': "after preparing the setup, keep watching the config file, list files and local dataset sources " +
+                 "and prepare the affected datasets and compose services again on changes",
+        'plan': "only show which compose services would be created, recreated or removed in comparison " +
+                "to the compose file in the working directory (nothing is written or prepared)",
+        'check': "only check that all dataset sources are reachable and that there is enough disk space for " +
+                 "the data to transfer, exits with status 1 when problems were found",
+        'snapshot-cache': "directory for snapshots of the store data: after the load services finished, the store " +
+                          "data is saved there, later runs with identical datasets and images restore it instead " +
+                          "of running the load services again (implies --do-up, starting the containers detached)",
+        'snapshot-cache-size': "size limit for the snapshot cache (e.g. 50G), least recently used snapshots " +
+                               "are removed to stay within it",
         'help': "print this usage/help info"
     }
 
@@ -276,7 +583,23 @@ def build_argument_parser():
                         help=helptexts['dump-location'])
     parser.add_argument("-u", "--do-up", action='store_true',
                         help=helptexts['do-up'])
-    parser.set_defaults(do_up=False)
+    parser.add_argument("-p", "--pipelined", action='store_true',
+                        help=helptexts['pipelined'])
+    parser.add_argument("--ready-markers", action='store_true',
+                        help=helptexts['ready-markers'])
+    parser.add_argument("--backend", choices=BRING_UP_BACKENDS, default='compose',
+                        help=helptexts['backend'])
+    parser.add_argument("--watch", action='store_true',
+                        help=helptexts['watch'])
+    parser.add_argument("--plan", action='store_true',
+                        help=helptexts['plan'])
+    parser.add_argument("--check", action='store_true',
+                        help=helptexts['check'])
+    parser.add_argument("--snapshot-cache", default=None,
+                        help=helptexts['snapshot-cache'])
+    parser.add_argument("--snapshot-cache-size", type=byte_size, default=None,
+                        help=helptexts['snapshot-cache-size'])
+    parser.set_defaults(do_up=False, pipelined=False, ready_markers=False, watch=False, plan=False, check=False)
 
 
     return parser
@@ -291,21 +614,127 @@ def run_compose(*cli_args):
         sys.argv = prev_argv
 
 
-def main(args=sys.argv[1:]):
-    argparser = build_argument_parser()
-    args_ns = argparser.parse_args(args)
+BRING_UP_BACKENDS = ('compose', 'engine')
 
-    #deferring DLDConfig import until here to allow getting CLI --help also when the Docker deamon is not accessible
-    from config import DLDConfig
-    dld_config = DLDConfig()
-    dld_config.working_dir = args_ns.working_dir
 
-    if not dld_config.working_dir:
-        dld_config.working_dir = 'wd-' + FilenameOps.strip_config_suffixes(
-            osp.basename(args_ns.config_file))
+def bring_up(configurator, dld_config, backend, service_names=None, detach=False):
+    """
+    Starts the given services (defaults to all) of the configured setup with the chosen backend.
+    The engine backend always starts the containers detached.
+    """
+    if backend == 'engine':
+        project_name = compose_project_name(dld_config.working_dir)
+        EngineOrchestrator(configurator.compose_config, project_name).up(service_names)
+    else:
+        run_compose("-f", configurator.compose_file_path, "up",
+                    *((detach and ["-d"] or []) + list(service_names or [])))
+
+
+class BackgroundCall(threading.Thread):
+    """
+    Runs a callable in a separate thread and hands over its result (or exception) on join.
+    """
+
+    def __init__(self, target, *args, **kwargs):
+        threading.Thread.__init__(self, name=child_thread_name('dld-' + getattr(target, '__name__', 'background')))
+        self.daemon = True
+        self._call = lambda: target(*args, **kwargs)
+        self._result = None
+        self._exception = None
+
+    def run(self):
+        try:
+            self._result = self._call()
+        except BaseException as ex:
+            self._exception = ex
+
+    def join(self, timeout=None):
+        threading.Thread.join(self, timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+def replicate_store(configurator, dld_config):
+    """
+    Copies the data of the store into its replicas once the load services finished (without replicas, nothing
+    is done). The setup needs to be up (detached).
+    """
+    replica_services = configurator.store_service_names[1:]
+    if not replica_services:
+        return
+    load_services = not configurator.skip_load and configurator.load_service_names or []
+    snapshots = StoreSnapshots(None, compose_project_name(dld_config.working_dir), dld_config.import_volume_destination)
+    DLD_LOG.info("waiting for the load services to finish to copy the store data to {r}..."
+                 .format(r=", ".join(replica_services)))
+    if snapshots.replicate(configurator.compose_config['store']['image'], load_services, replica_services):
+        DLD_LOG.info("copied the store data to {r}".format(r=", ".join(replica_services)))
+
+
+def run_pipelined(configurator, dld_config, backend):
+    """
+    Brings the setup up while its import data is prepared: the early services are started as soon as the
+    compose configuration is written, the remaining ones after the preparation completed.
+    """
+    configurator.create_compose_config()
+    # create the import directory before the docker engine does so on behalf of an early started loader
+    ensure_dir_exists(dld_config.models_dir, DLD_LOG, warn_exists=False)
+    # the working directory is not entered, as relative dataset paths are resolved during the preparation
+    preparation = BackgroundCall(configurator.run_preparation, pull_images=True)
+    preparation.start()
+    early_services = configurator.early_service_names
+    DLD_LOG.info("starting services while preparing import data: {s}".format(s=", ".join(early_services)))
+    bring_up(configurator, dld_config, backend, early_services, detach=True)
+    preparation.join()
+    DLD_LOG.info("Finished preparing import data, bringing up all services...")
+    replicated = len(configurator.store_service_names) > 1
+    bring_up(configurator, dld_config, backend, detach=replicated)
+    replicate_store(configurator, dld_config)
+
+
+def run_with_snapshot_cache(configurator, dld_config, backend):
+    """
+    Brings the setup up (detached). When the same import data was loaded with the same store and load images
+    before, the store data is restored from the snapshot cache and the load services are left out. Otherwise
+    a snapshot of the store data is taken after the load services finished.
+    """
+    configurator.run(pull_images=True)
+    if 'store' not in configurator.compose_config:
+        raise RuntimeError("a store component is required to use the snapshot cache")
+    snapshot_cache = SnapshotCache(dld_config.snapshot_cache_dir, dld_config.snapshot_cache_max_bytes)
+    snapshots = StoreSnapshots(snapshot_cache, compose_project_name(dld_config.working_dir),
+                               dld_config.import_volume_destination)
+    load_services = configurator.load_service_names
+    digest_cache = DigestCache(osp.join(dld_config.working_dir, DIGEST_CACHE_FILE))
+    fingerprint = import_fingerprint(dld_config.models_dir, configurator.collector.memory.graph_mapping(),
+                                     dld_config.default_graph_name,
+                                     snapshots.image_ids(configurator.compose_config, ['store'] + load_services),
+                                     digest_cache)
+    digest_cache.save()
+
+    if snapshot_cache.has(fingerprint):
+        DLD_LOG.info("restoring the store data from snapshot {f}, skipping the load services".format(f=fingerprint))
+        configurator.skip_load = True
+        configurator.reconfigure(configurator.yaml_config)
+        bring_up(configurator, dld_config, backend, configurator.store_service_names, detach=True)
+        snapshots.restore(fingerprint)
+        # the replicas are filled before the other services (e.g. a cache) start to query them
+        replicate_store(configurator, dld_config)
+        bring_up(configurator, dld_config, backend, detach=True)
+    else:
+        bring_up(configurator, dld_config, backend, detach=True)
+        DLD_LOG.info("waiting for the load services to finish to take a snapshot of the store data...")
+        if snapshots.export(fingerprint, configurator.compose_config['store']['image'], load_services):
+            DLD_LOG.info("saved snapshot {f} of the store data".format(f=fingerprint))
+        replicate_store(configurator, dld_config)
 
-    with open(args_ns.config_file, 'r') as config_fd:
-        yaml_config = yaml.load(config_fd)
+
+def load_yaml_config(argparser, args_ns):
+    """
+    Reads the configuration file and adds the dataset given by command line arguments.
+    Exits when the resulting configuration lacks datasets or components.
+    """
+    yaml_config = load_dld_config(args_ns.config_file)
 
     # Add command line arguments to configuration
     if any((args_ns.target_named_graph, args_ns.dump_file, args_ns.dump_location)):
@@ -329,27 +758,554 @@ def main(args=sys.argv[1:]):
             argparser.print_usage()
             sys.exit(2)
 
-    if is_dict_like(yaml_config.get("settings")):
-        dld_config.default_graph_name = yaml_config["settings"].get("default_graph")
-    if args_ns.target_named_graph:
-        dld_config.default_graph_name = args_ns.target_named_graph
-
     if "datasets" not in yaml_config or "components" not in yaml_config:
         DLD_LOG.error("dataset and component configuration is needed")
         argparser.print_usage()
         sys.exit(2)
 
-    dld_config.ensure_required_settings()
-    # start dld process
-    configurator = ComposeConfigGenerator(yaml_config, dld_config)
-    configurator.run()
-    if args_ns.do_up:
-        msg_templ = "Finished preparing compose setup. Changing to '{wd}' and performing 'docker-compose up'..."
-        DLD_LOG.info(msg_templ.format(wd = dld_config.working_dir))
-        os.chdir(dld_config.working_dir)
-        run_compose("up")
+    return yaml_config
+
+
+def close_transfer_limits(dld_config):
+    """
+    Stops the latency probe of the global transfer limits of the configuration (if there is one).
+    """
+    if dld_config.transfer_limits is not None:
+        dld_config.transfer_limits.close()
+    dld_config.transfer_limits = None
+
+
+def apply_yaml_settings(dld_config, yaml_config, target_named_graph=None):
+    dld_config.default_graph_name = None
+    dld_config.graph_index = False
+    dld_config.download_settings = dict()
+    dld_config.sample_settings = None
+    dld_config.normalize_settings = None
+    dld_config.changeset_settings = None
+    dld_config.peer_sources = None
+    close_transfer_limits(dld_config)
+    if is_dict_like(yaml_config.get("settings")):
+        dld_config.default_graph_name = yaml_config["settings"].get("default_graph")
+        dld_config.graph_index = bool(yaml_config["settings"].get("graph_index"))
+        dld_config.download_settings = dict(yaml_config["settings"].get("download") or dict())
+        dld_config.sample_settings = yaml_config["settings"].get("sample")
+        dld_config.normalize_settings = yaml_config["settings"].get("normalize")
+        dld_config.changeset_settings = yaml_config["settings"].get("changesets")
+        dld_config.peer_sources = PeerSources.from_config(yaml_config["settings"].get("peers"))
+        dld_config.transfer_limits = TransferLimits.from_config(yaml_config["settings"].get("throttle"))
+    if target_named_graph:
+        dld_config.default_graph_name = target_named_graph
+
+
+def build_batch_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py batch',
+                               description="Prepares the setups for several DLD configuration files at once, " +
+                                           "downloading the remote sources they have in common only once.")
+    parser.add_argument("config_files", nargs='+', metavar='CONFIG_FILE',
+                        help="DLD configuration files, each set up in its own working directory " +
+                             "(wd-<config file name>, prefixed with parent directory names for equal names)")
+    parser.add_argument("--shared-dir", default='dld-shared',
+                        help="directory for the downloads shared by the setups (default: dld-shared)")
+    parser.add_argument("--max-downloads", type=int, default=4,
+                        help="maximal number of concurrent downloads (default: 4)")
+    return parser
+
+
+def main_batch(args):
+    """
+    Prepares the setups of several configuration files: the remote sources of all setups are downloaded once
+    into a shared directory and linked into the models dirs, then the compose configuration is written per setup.
+
+    :return: exit status (1 if any setup failed)
+    """
+    args_ns = build_batch_argument_parser().parse_args(args)
+    from config import DLDConfig
+
+    try:
+        working_dirs = batch_working_dirs(args_ns.config_files)
+    except RuntimeError as ex:
+        DLD_LOG.error(ex)
+        return 1
+    deployments = list()
+    for config_file, working_dir in zip(args_ns.config_files, working_dirs):
+        dld_config = DLDConfig()
+        dld_config.working_dir = working_dir
+        dld_config.link_local_sources = True
+        deployment = Deployment(config_file, dict(), dld_config)
+        try:
+            deployment.yaml_config = load_dld_config(config_file)
+            if "datasets" not in deployment.yaml_config or "components" not in deployment.yaml_config:
+                raise RuntimeError("dataset and component configuration is needed")
+            apply_yaml_settings(dld_config, deployment.yaml_config)
+        except (RuntimeError, IOError, yaml.YAMLError) as ex:
+            deployment.error = ex
+        deployments.append(deployment)
+
+    try:
+        batch_plan = BatchPlan(deployments, args_ns.shared_dir, args_ns.max_downloads)
+        sources = batch_plan.collect()
+        DLD_LOG.info("fetching {n} unique remote sources for {d} setups".format(n=len(sources), d=len(deployments)))
+        batch_plan.fetch()
+
+        for deployment in deployments:
+            if deployment.error is not None:
+                continue
+            try:
+                configurator = ComposeConfigGenerator(deployment.yaml_config, deployment.dld_config)
+                configurator.run()
+                memory = configurator.collector.memory
+                deployment.files_added = len(memory.added())
+                deployment.files_retained = len(memory.retained())
+                deployment.import_bytes = sum(osp.getsize(osp.join(deployment.dld_config.models_dir, basename))
+                                              for basename in memory.graph_mapping())
+            except Exception as ex:
+                DLD_LOG.exception("preparing the setup for {c} failed".format(c=deployment.config_file))
+                deployment.error = ex
+    finally:
+        for deployment in deployments:
+            close_transfer_limits(deployment.dld_config)
+
+    DLD_LOG.info(format_batch_summary(deployments, sources))
+    return any(deployment.error is not None for deployment in deployments) and 1 or 0
+
+
+def _subcommand_settings(config_file, settings_key):
+    """
+    :return: the 'settings: <settings_key>:' declaration of the configuration file (empty if there is none)
+    """
+    if not osp.isfile(config_file):
+        return dict()
+    settings = load_dld_config(config_file).get("settings")
+    return is_dict_like(settings) and settings.get(settings_key) or dict()
+
+
+def _store_endpoint(argparser, endpoint, working_dir):
+    """
+    :return: the given endpoint or else the one of the store published by the setup in the working dir
+    """
+    endpoint = endpoint or endpoint_from_compose(read_compose_file(osp.join(working_dir, 'docker-compose.yml')))
+    if not endpoint:
+        argparser.error("unable to determine the SPARQL endpoint of the store, please use --endpoint")
+    return endpoint
+
+
+def build_verify_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py verify',
+                               description="Compares the triple counts of the named graphs in the store of a " +
+                                           "running setup with expected counts and reports the differences.")
+    parser.add_argument("-c", "--config-file", default='dld.yml',
+                        help="DLD configuration file, expected counts are read from its 'settings: verify:' " +
+                             "declaration (default: dld.yml)")
+    parser.add_argument("-w", "--working-dir",
+                        help="working directory of the setup (default: wd-<config file name>)")
+    parser.add_argument("-e", "--expected", metavar='FILE',
+                        help="YAML file mapping graph names to expected counts (or [min, max] ranges), " +
+                             "instead of the counts declared in the configuration file")
+    parser.add_argument("--endpoint",
+                        help="URL of the SPARQL endpoint (default: the published port of the store service)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="maximal number of concurrent COUNT queries (default: 4)")
+    parser.add_argument("--timeout", type=int, default=300,
+                        help="seconds to wait for the result of a COUNT query (default: 300)")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="number of retries of a failed COUNT query (default: 2)")
+    parser.add_argument("--refresh", action='store_true',
+                        help="count again also the graphs counted before in the same store container")
+    return parser
+
+
+def main_verify(args):
+    """
+    Counts the triples of each graph with expected counts in the store of a running setup.
+
+    :return: exit status (1 if any count diverges or could not be determined)
+    """
+    argparser = build_verify_argument_parser()
+    args_ns = argparser.parse_args(args)
+    working_dir = args_ns.working_dir or \
+        'wd-' + FilenameOps.strip_config_suffixes(osp.basename(args_ns.config_file))
+
+    verify_config = _subcommand_settings(args_ns.config_file, "verify")
+    if args_ns.expected:
+        with open(args_ns.expected) as expected_fd:
+            expected_config = yaml.safe_load(expected_fd)
+    else:
+        expected_config = verify_config.get("expected")
+    if not expected_config:
+        argparser.error("no expected counts given (--expected or 'settings: verify: expected:')")
+    expected_counts = parse_expected_counts(expected_config)
+
+    endpoint = _store_endpoint(argparser, args_ns.endpoint or verify_config.get("endpoint"), working_dir)
+
+    store_id = None
+    try:
+        store_id = container_id(compose_project_name(working_dir), 'store')
+    except Exception as ex:
+        DLD_LOG.warning("unable to inspect the store container, not caching counts: {ex}".format(ex=ex))
+    cache = CountCache(osp.join(working_dir, VERIFY_CACHE_FILE), store_id, args_ns.refresh)
+
+    verifier = CountVerifier(endpoint, args_ns.concurrency, args_ns.timeout, args_ns.retries, cache)
+    results = verifier.verify(expected_counts)
+    DLD_LOG.info(format_verification(results))
+    return any(not result.ok for result in results) and 1 or 0
+
+
+def build_loadtest_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py loadtest',
+                               description="Sends a query workload (query templates and/or a query log) to the " +
+                                           "store of a running setup and reports throughput, latency " +
+                                           "percentiles and error rates per query template.")
+    parser.add_argument("-c", "--config-file", default='dld.yml',
+                        help="DLD configuration file, the workload is read from its 'settings: loadtest:' " +
+                             "declaration (default: dld.yml)")
+    parser.add_argument("-w", "--working-dir",
+                        help="working directory of the setup (default: wd-<config file name>)")
+    parser.add_argument("--workload", metavar='FILE',
+                        help="YAML file declaring the workload, instead of the declaration in the configuration " +
+                             "file (see sparql/loadgen.py for the format)")
+    parser.add_argument("--endpoint",
+                        help="URL of the SPARQL endpoint (default: the published port of the store service)")
+    parser.add_argument("--rate", type=float,
+                        help="queries per second to send (open loop), overriding the workload")
+    parser.add_argument("--concurrency", type=int,
+                        help="number of concurrent queries, overriding the workload")
+    parser.add_argument("--duration", type=float,
+                        help="seconds to measure, overriding the workload")
+    parser.add_argument("--warmup", type=float,
+                        help="seconds to run the workload before measuring, overriding the workload")
+    parser.add_argument("-o", "--output", metavar='FILE',
+                        help="write the report as JSON to this file")
+    return parser
+
+
+def main_loadtest(args):
+    """
+    Runs a query workload against the store of a running setup.
+
+    :return: exit status (1 if no query succeeded)
+    """
+    argparser = build_loadtest_argument_parser()
+    args_ns = argparser.parse_args(args)
+    working_dir = args_ns.working_dir or \
+        'wd-' + FilenameOps.strip_config_suffixes(osp.basename(args_ns.config_file))
+
+    if args_ns.workload:
+        with open(args_ns.workload) as workload_fd:
+            workload_config = yaml.safe_load(workload_fd) or dict()
+        base_dir = osp.dirname(args_ns.workload)
     else:
-        DLD_LOG.info(configurator.wd_ready_message)
+        workload_config = dict(_subcommand_settings(args_ns.config_file, "loadtest"))
+        base_dir = osp.dirname(args_ns.config_file)
+    endpoint = _store_endpoint(argparser, args_ns.endpoint or workload_config.pop("endpoint", None), working_dir)
+    for key in ['rate', 'concurrency', 'duration', 'warmup']:
+        if getattr(args_ns, key) is not None:
+            workload_config[key] = getattr(args_ns, key)
+    if not workload_config.get("templates") and not workload_config.get("query_log"):
+        argparser.error("no workload given (--workload or 'settings: loadtest:')")
+    workload = Workload.from_config(workload_config, base_dir)
+
+    report = LoadGenerator(endpoint, workload).run()
+    DLD_LOG.info(report.format())
+    if args_ns.output:
+        with open(args_ns.output, 'w') as output_fd:
+            json.dump(report.as_dict(), output_fd, indent=2, sort_keys=True)
+    return not report.total.latencies and 1 or 0
+
+
+def build_changesets_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py changesets',
+                               description="Lists the changesets written for changed import files (with " +
+                                           "'settings: changesets:' enabled) that were not applied yet and " +
+                                           "applies them in order to the store of a running setup.")
+    parser.add_argument("-c", "--config-file", default='dld.yml',
+                        help="DLD configuration file (default: dld.yml)")
+    parser.add_argument("-w", "--working-dir",
+                        help="working directory of the setup (default: wd-<config file name>)")
+    parser.add_argument("--apply", action='store_true',
+                        help="send the SPARQL UPDATE requests of the pending changesets to the store")
+    parser.add_argument("--endpoint",
+                        help="URL of the SPARQL UPDATE endpoint (default: the published port of the store service)")
+    parser.add_argument("--timeout", type=int, default=600,
+                        help="seconds to wait for a single update request (default: 600)")
+    return parser
+
+
+def main_changesets(args):
+    """
+    :return: exit status (1 if applying a changeset failed)
+    """
+    argparser = build_changesets_argument_parser()
+    args_ns = argparser.parse_args(args)
+    working_dir = args_ns.working_dir or \
+        'wd-' + FilenameOps.strip_config_suffixes(osp.basename(args_ns.config_file))
+
+    pending = pending_changesets(working_dir)
+    for directory in pending:
+        with open(osp.join(directory, MANIFEST_FILE)) as manifest_fd:
+            manifest = json.load(manifest_fd)
+        DLD_LOG.info("{d}: {r} removed from <{pg}>, {a} added to <{g}>".format(
+            d=osp.basename(directory), r=manifest['removed'], pg=manifest['previous_graph'], a=manifest['added'],
+            g=manifest['graph']))
+    if not pending:
+        DLD_LOG.info("no pending changesets in '{wd}'".format(wd=working_dir))
+    if not args_ns.apply:
+        return 0
+
+    endpoint = _store_endpoint(argparser, args_ns.endpoint, working_dir)
+    for directory in pending:
+        try:
+            requests = apply_changeset(directory, endpoint, args_ns.timeout)
+        except IOError as ex:
+            DLD_LOG.error("applying {d} failed, it can be applied again: {ex}".format(d=osp.basename(directory),
+                                                                                       ex=ex))
+            return 1
+        DLD_LOG.info("applied {d} ({n} update requests)".format(d=osp.basename(directory), n=requests))
+    return 0
+
+
+def default_service_socket():
+    return osp.join(tempfile.gettempdir(), 'dld-{u}.sock'.format(u=os.getuid()))
+
+
+def build_serve_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py serve',
+                               description="Keeps running and prepares the setups submitted with 'dld.py submit' " +
+                                           "(or through its HTTP API), reusing the Docker engine information, " +
+                                           "parsed configuration files and source metadata between runs. Runs " +
+                                           "on the same working directory are done one after the other.")
+    parser.add_argument("--socket", default=default_service_socket(),
+                        help="Unix socket to listen on (default: {s})".format(s=default_service_socket()))
+    parser.add_argument("--port", type=int,
+                        help="listen on this port of the loopback interface instead of a Unix socket")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="maximal number of setups prepared at once (default: 2)")
+    parser.add_argument("--metadata-ttl", type=int, default=300,
+                        help="seconds the sizes of remote sources are remembered (default: 300)")
+    return parser
+
+
+def validate_service_job(args):
+    """
+    Raises ValueError for dld.py arguments that cannot be run as a job of the service: subcommands other than the
+    plain preparation, watching and bringing the setup up with docker-compose (which replaces the process-wide
+    command line arguments and stays attached).
+    """
+    if args and args[0] in ('batch', 'verify', 'loadtest', 'changesets', 'serve', 'submit', 'share',
+                            'cache'):
+        raise ValueError("the subcommand '{c}' cannot be run by the service".format(c=args[0]))
+    argparser = build_argument_parser()
+    try:
+        args_ns = argparser.parse_args(args)
+    except SystemExit:
+        raise ValueError("invalid arguments: {a}".format(a=" ".join(args)))
+    if args_ns.watch:
+        raise ValueError("--watch cannot be run by the service")
+    brings_up = any((args_ns.do_up, args_ns.pipelined, args_ns.ready_markers, args_ns.snapshot_cache))
+    if brings_up and args_ns.backend != 'engine':
+        raise ValueError("the service brings setups up only with --backend engine")
+
+
+def main_serve(args):
+    args_ns = build_serve_argument_parser().parse_args(args)
+    metadata_cache = SourceMetadataCache(args_ns.metadata_ttl)
+    service = DLDService(lambda job_args: main(job_args, metadata_cache), args_ns.workers, validate_service_job,
+                         lambda: {'source_metadata': metadata_cache.stats()})
+    address = service.bind(None if args_ns.port else args_ns.socket, args_ns.port)
+    DLD_LOG.info("serving on {a} with {w} workers (relative paths of jobs are resolved against '{d}')".format(
+        a=address, w=args_ns.workers, d=os.getcwd()))
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        DLD_LOG.info("stopping the service")
+    return 0
+
+
+def build_submit_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py submit',
+                               description="Submits dld.py arguments as a job to a running 'dld.py serve' and " +
+                                           "prints its log messages until it is done.")
+    parser.add_argument("--socket", default=default_service_socket(),
+                        help="Unix socket of the service (default: {s})".format(s=default_service_socket()))
+    parser.add_argument("--port", type=int,
+                        help="port of the service on the loopback interface instead of a Unix socket")
+    parser.add_argument("--no-follow", action='store_true',
+                        help="only submit the job, do not wait for it")
+    parser.add_argument("dld_args", nargs=ap.REMAINDER, metavar='...',
+                        help="dld.py arguments of the job (e.g. -c dld.yml -w wd-dld)")
+    return parser
+
+
+def main_submit(args):
+    """
+    :return: exit status of the job (or 0 with --no-follow)
+    """
+    args_ns = build_submit_argument_parser().parse_args(args)
+    client = ServiceClient(('127.0.0.1', args_ns.port) if args_ns.port else args_ns.socket)
+    job = client.submit(args_ns.dld_args)
+    DLD_LOG.info("submitted job {j} for '{wd}'".format(j=job['id'], wd=job['working_dir']))
+    if args_ns.no_follow:
+        return 0
+    for event in client.events(job['id']):
+        if event['type'] == 'log':
+            DLD_LOG.log(logging.getLevelName(event['level']), event['message'])
+        elif event['type'] == 'state':
+            DLD_LOG.info("job {j} is {s}".format(j=job['id'], s=event['state']))
+    return client.job(job['id'])['exit_status'] or 0
+
+
+def build_share_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py share',
+                               description="Offers the dataset sources downloaded into the given working " +
+                                           "directories (or shared directories of batches) to other DLD hosts, " +
+                                           "which list this host in their 'settings: peers:' declaration.")
+    parser.add_argument("directories", nargs='+', metavar='DIR',
+                        help="working directories or shared directories whose downloads to offer")
+    parser.add_argument("--host", default='0.0.0.0',
+                        help="address to listen on (default: all interfaces)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PEER_PORT,
+                        help="port to listen on (default: {p})".format(p=DEFAULT_PEER_PORT))
+    return parser
+
+
+def main_share(args):
+    args_ns = build_share_argument_parser().parse_args(args)
+    server = PeerShareServer(args_ns.directories, args_ns.host, args_ns.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        DLD_LOG.info("stopping to share")
+    return 0
+
+
+def build_cache_argument_parser():
+    parser = ap.ArgumentParser(prog='dld.py cache',
+                               description="Runs a caching SPARQL proxy in front of a store (the 'cache' component " +
+                                           "of a setup runs this in a container of the DLD image).")
+    parser.add_argument("--upstream", dest='upstreams', nargs='+', metavar='URL',
+                        default=['http://store:{p}'.format(p=DEFAULT_CACHE_PORT)],
+                        help="base URLs of the store and its replicas (queries are balanced over them), request " +
+                             "paths are kept (default: http://store:{p})".format(p=DEFAULT_CACHE_PORT))
+    parser.add_argument("--host", default='0.0.0.0',
+                        help="address to listen on (default: all interfaces)")
+    parser.add_argument("--port", type=int, default=DEFAULT_CACHE_PORT,
+                        help="port to listen on (default: {p})".format(p=DEFAULT_CACHE_PORT))
+    parser.add_argument("--ttl", type=float, default=DEFAULT_CACHE_TTL,
+                        help="seconds a query result is served from the cache (default: {t})"
+                             .format(t=DEFAULT_CACHE_TTL))
+    parser.add_argument("--max-entries", type=int, default=DEFAULT_CACHE_MAX_ENTRIES,
+                        help="maximal number of cached results (default: {m})".format(m=DEFAULT_CACHE_MAX_ENTRIES))
+    parser.add_argument("--max-size", type=byte_size, default=DEFAULT_CACHE_MAX_BYTES,
+                        help="maximal total size of the cached results, e.g. 512M (default: 64M)")
+    parser.add_argument("--await", dest='await_containers', nargs='+', metavar='CONTAINER', default=[],
+                        help="load containers to wait for (through the Docker socket) before caching results")
+    parser.add_argument("--await-replicas", dest='await_replicas', nargs='+', metavar='CONTAINER', default=[],
+                        help="store replica containers to wait for to receive the loaded data before caching " +
+                             "results and balancing queries over them")
+    return parser
+
+
+def main_cache(args):
+    args_ns = build_cache_argument_parser().parse_args(args)
+    cache = QueryCache(args_ns.ttl, args_ns.max_entries, args_ns.max_size, enabled=not args_ns.await_containers)
+    if args_ns.await_containers:
+        LoadWatcher(cache, args_ns.await_containers, args_ns.await_replicas).start()
+    server = CachingProxyServer(args_ns.upstreams, cache, args_ns.host, args_ns.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        DLD_LOG.info("stopping the cache")
+    return 0
+
+
+def main(args=sys.argv[1:], metadata_cache=None):
+    if args and args[0] == 'batch':
+        sys.exit(main_batch(args[1:]))
+    if args and args[0] == 'verify':
+        sys.exit(main_verify(args[1:]))
+    if args and args[0] == 'loadtest':
+        sys.exit(main_loadtest(args[1:]))
+    if args and args[0] == 'changesets':
+        sys.exit(main_changesets(args[1:]))
+    if args and args[0] == 'serve':
+        sys.exit(main_serve(args[1:]))
+    if args and args[0] == 'submit':
+        sys.exit(main_submit(args[1:]))
+    if args and args[0] == 'share':
+        sys.exit(main_share(args[1:]))
+    if args and args[0] == 'cache':
+        sys.exit(main_cache(args[1:]))
+    argparser = build_argument_parser()
+    args_ns = argparser.parse_args(args)
+
+    #deferring DLDConfig import until here to allow getting CLI --help also when the Docker deamon is not accessible
+    from config import DLDConfig
+    dld_config = DLDConfig()
+    dld_config.working_dir = args_ns.working_dir
+
+    if not dld_config.working_dir:
+        dld_config.working_dir = 'wd-' + FilenameOps.strip_config_suffixes(
+            osp.basename(args_ns.config_file))
+
+    if args_ns.watch and any((args_ns.do_up, args_ns.pipelined, args_ns.ready_markers)):
+        argparser.error("--watch cannot be combined with bringing the setup up")
+    if args_ns.snapshot_cache and any((args_ns.watch, args_ns.pipelined, args_ns.ready_markers)):
+        argparser.error("--snapshot-cache cannot be combined with --watch, --pipelined or --ready-markers")
+
+    try:
+        yaml_config = load_yaml_config(argparser, args_ns)
+        apply_yaml_settings(dld_config, yaml_config, args_ns.target_named_graph)
+
+        dld_config.ready_markers = args_ns.ready_markers
+        dld_config.snapshot_cache_dir = args_ns.snapshot_cache
+        dld_config.snapshot_cache_max_bytes = args_ns.snapshot_cache_size
+        dld_config.source_metadata_cache = metadata_cache
+
+        dld_config.ensure_required_settings()
+        # start dld process
+        configurator = ComposeConfigGenerator(yaml_config, dld_config)
+        if args_ns.plan:
+            _, compose_plan = configurator.plan_compose_config()
+            DLD_LOG.info(compose_plan.report())
+            return
+        if args_ns.check:
+            report = configurator.check_import_data(yaml_config["datasets"])
+            sys.exit(not report.ok and 1 or 0)
+        if args_ns.snapshot_cache:
+            run_with_snapshot_cache(configurator, dld_config, args_ns.backend)
+            DLD_LOG.info("The setup at '{wd}' is up, `docker-compose ps` in that directory lists its containers."
+                         .format(wd=osp.realpath(dld_config.working_dir)))
+            return
+        if args_ns.pipelined or args_ns.ready_markers:
+            run_pipelined(configurator, dld_config, args_ns.backend)
+            return
+        configurator.run(pull_images=args_ns.do_up)
+        if args_ns.watch:
+            DLD_LOG.info(configurator.wd_ready_message)
+            def reload_config():
+                reloaded_config = load_yaml_config(argparser, args_ns)
+                apply_yaml_settings(dld_config, reloaded_config, args_ns.target_named_graph)
+                return reloaded_config
+
+            WatchSession(configurator, args_ns.config_file, reload_config).run()
+        elif args_ns.do_up and (args_ns.backend == 'engine' or len(configurator.store_service_names) > 1):
+            DLD_LOG.info("Finished preparing compose setup. Starting the containers...")
+            bring_up(configurator, dld_config, args_ns.backend, detach=True)
+            replicate_store(configurator, dld_config)
+            DLD_LOG.info("The setup at '{wd}' is up, `docker-compose ps` in that directory lists its containers."
+                         .format(wd=osp.realpath(dld_config.working_dir)))
+        elif args_ns.do_up:
+            msg_templ = "Finished preparing compose setup. Changing to '{wd}' and performing 'docker-compose up'..."
+            DLD_LOG.info(msg_templ.format(wd = dld_config.working_dir))
+            os.chdir(dld_config.working_dir)
+            run_compose("up")
+        else:
+            DLD_LOG.info(configurator.wd_ready_message)
+            if len(configurator.store_service_names) > 1:
+                DLD_LOG.warning("the store replicas only receive the loaded data when the setup is brought up by " +
+                                "dld.py (-u, --pipelined or --snapshot-cache)")
+
+    finally:
+        close_transfer_limits(dld_config)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+def docker_client():
+    """
+    :return: context manager for a docker client (dldbase is imported on use, since dld.py only puts it onto the
+             path when run as main script)
+    """
+    from dldbase import dockerutil
+    return dockerutil.docker_client()
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import logging
+import os
+from os import path as osp
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from docker.errors import APIError
+
+from orchestration import docker_client
+from orchestration.plan import normalize_service_config, service_dependencies
+from tools import child_thread_name
+
+PROJECT_NAME_ENV_VAR = 'COMPOSE_PROJECT_NAME'
+CONFIG_HASH_LABEL = 'org.aksw.dld.config-hash'
+COMPOSE_PROJECT_LABEL = 'com.docker.compose.project'
+COMPOSE_SERVICE_LABEL = 'com.docker.compose.service'
+COMPOSE_NUMBER_LABEL = 'com.docker.compose.container-number'
+COMPOSE_ONEOFF_LABEL = 'com.docker.compose.oneoff'
+# logged by the load components when the import completed, they keep running (idle) afterwards
+LOAD_COMPLETED_MESSAGE = 'done loading graphs (start hanging around idle)'
+# seconds to wait for a load component to complete the import at most
+LOAD_COMPLETION_TIMEOUT = 24 * 60 * 60
+LOG_TIMESTAMP_PATTERN = re.compile(r'^(\d{4}-\d\d-\d\dT\S+)\s')
+
+# service settings passed through to create_container as they are
+PASSTHROUGH_CREATE_KEYS = frozenset(['command', 'entrypoint', 'hostname', 'user', 'working_dir', 'domainname',
+                                     'stdin_open', 'tty', 'mac_address'])
+HOST_CONFIG_KEYS = frozenset(['mem_limit', 'privileged', 'dns', 'restart', 'extra_hosts', 'cap_add', 'cap_drop'])
+HANDLED_KEYS = frozenset(['image', 'environment', 'ports', 'volumes', 'volumes_from', 'links', 'labels', 'cpuset'])
+
+
+def compose_project_name(working_dir):
+    """
+    :return: the project name docker-compose would derive for a compose file in the given directory
+    """
+    name = os.environ.get(PROJECT_NAME_ENV_VAR) or osp.basename(osp.realpath(working_dir))
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def container_name(project_name, service_name):
+    return "{p}_{s}_1".format(p=project_name, s=service_name)
+
+
+def container_id(project_name, service_name, client_factory=docker_client):
+    """
+    :return: ID of the container of the service, None if there is no such container
+    """
+    with client_factory() as dc:
+        container_info = EngineOrchestrator._inspect_if_exists(dc, container_name(project_name, service_name))
+    return container_info and container_info['Id'] or None
+
+
+def wait_for_load_completion(docker_client, name, timeout=LOAD_COMPLETION_TIMEOUT, poll_interval=5):
+    """
+    Waits for a load container to complete the import. The load components do not exit when they are done,
+    so the log of the container is watched for their completion message instead.
+
+    :param docker_client: docker client to use
+    :param name: name (or id) of the load container
+    :param timeout: seconds to wait at most
+    :param poll_interval: seconds between two looks at the log
+    :return: engine timestamp of the completion message (None if the engine did not report one)
+    :raise RuntimeError: when the container stopped before completing the import or the timeout expired
+    """
+    deadline = time.time() + timeout
+    while True:
+        # the state is taken before the log, so that the log of a stopped container is complete
+        state = docker_client.inspect_container(name)['State']
+        log = docker_client.logs(name, stdout=True, stderr=True, timestamps=True)
+        if isinstance(log, bytes):
+            log = log.decode('utf-8', 'replace')
+        for line in log.splitlines():
+            if LOAD_COMPLETED_MESSAGE in line:
+                timestamp_match = LOG_TIMESTAMP_PATTERN.match(line)
+                return timestamp_match and timestamp_match.group(1) or None
+        if not state.get('Running'):
+            raise RuntimeError("{c} stopped with exit code {e} before completing the import"
+                               .format(c=name, e=state.get('ExitCode')))
+        if time.time() >= deadline:
+            raise RuntimeError("{c} did not complete the import within {t} s".format(c=name, t=timeout))
+        time.sleep(poll_interval)
+
+
+def outdated_image_services(compose_config, project_name, client_factory=docker_client):
+    """
+    :return: sorted names of the services whose existing container runs another image than the one their image
+             reference resolves to now (e.g. after a newer image was pulled), docker-compose recreates those
+    """
+    outdated = list()
+    with client_factory() as dc:
+        for service_name, service_spec in sorted(compose_config.items()):
+            container_info = EngineOrchestrator._inspect_if_exists(dc, container_name(project_name, service_name))
+            if container_info is None or not service_spec.get('image'):
+                continue
+            try:
+                image_id = dc.inspect_image(service_spec['image'])['Id']
+            except APIError as api_error:
+                response = getattr(api_error, 'response', None)
+                if response is not None and response.status_code == 404:  # to be pulled, not known yet
+                    continue
+                raise
+            if container_info['Image'] != image_id:
+                outdated.append(service_name)
+    return outdated
+
+
+def service_config_hash(service_spec):
+    normalized_spec = normalize_service_config(service_spec)
+    return hashlib.sha256(json.dumps(normalized_spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _split_reference(entry):
+    """
+    :return: pair of the referenced service (or container) and the remainder after the first colon (might be None)
+    """
+    name, _, remainder = entry.partition(':')
+    return name, (remainder or None)
+
+
+def dependency_levels(compose_config, service_names=None):
+    """
+    Orders services (and the services they transitively depend on) into levels, so that each service
+    only depends on services of lower levels. The services of one level are independent of each other.
+
+    :param compose_config: dict of compose service configurations
+    :param service_names: services to start with (defaults to all services)
+    :return: list of sorted lists of service names
+    """
+    pending = list(service_names or compose_config.keys())
+    requested = set()
+    while pending:
+        name = pending.pop()
+        if name not in compose_config:
+            raise RuntimeError("no such service: {s}".format(s=name))
+        if name not in requested:
+            requested.add(name)
+            pending.extend(service_dependencies(compose_config, name))
+
+    remaining = dict((name, service_dependencies(compose_config, name)) for name in requested)
+    levels = list()
+    while remaining:
+        level = sorted(name for name, deps in remaining.items() if not deps)
+        if not level:
+            raise RuntimeError("circular dependencies among services: {s}".format(s=", ".join(sorted(remaining))))
+        levels.append(level)
+        for name in level:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return levels
+
+
+class EngineOrchestrator(object):
+    """
+    Brings up the services of a compose configuration directly through the Docker Engine API.
+    Services independent of each other (along the dependency graph spanned by 'links' and
+    'volumes_from') are created and started in parallel. Containers are named and labeled like
+    docker-compose would do, so that 'docker-compose ps/logs/stop' keep working for the setup.
+    Existing containers are only recreated when their service configuration changed or when a service
+    they depend on was recreated (as links and volumes_from refer to the replaced container).
+    """
+    log = logging.getLogger('dld.EngineOrchestrator')
+
+    def __init__(self, compose_config, project_name, client_factory=docker_client, max_workers=4):
+        """
+        :param compose_config: dict of compose service configurations
+        :param project_name: compose project name used as container name prefix
+        :param client_factory: callable returning a context manager for a docker client
+        :param max_workers: maximal number of services set up concurrently
+        """
+        self.compose_config = compose_config
+        self.project_name = project_name
+        self.client_factory = client_factory
+        self.max_workers = max_workers
+
+    def up(self, service_names=None):
+        """
+        Creates (when needed) and starts the given services and the services they depend on.
+
+        :return: dict mapping the service names to the ids of their containers
+        """
+        container_ids = dict()
+        recreated = set()
+        for level in dependency_levels(self.compose_config, service_names):
+            self.log.debug("bringing up services: {s}".format(s=", ".join(level)))
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(level)),
+                                    thread_name_prefix=child_thread_name('dld-engine')) as executor:
+                futures = dict()
+                for name in level:
+                    # containers linked to a recreated one would still refer to the removed container
+                    force_recreate = bool(service_dependencies(self.compose_config, name) & recreated)
+                    futures[name] = executor.submit(self._ensure_service, name, force_recreate)
+            for name, future in futures.items():
+                container_ids[name], created = future.result()
+                if created:
+                    recreated.add(name)
+        return container_ids
+
+    def _ensure_service(self, service_name, force_recreate=False):
+        """
+        :param force_recreate: whether to recreate an existing container even if its configuration is unchanged
+        :return: pair of the container id and whether the container was (re-)created
+        """
+        service_spec = self.compose_config[service_name]
+        name = container_name(self.project_name, service_name)
+        config_hash = service_config_hash(service_spec)
+        with self.client_factory() as dc:
+            existing = self._inspect_if_exists(dc, name)
+            if existing is not None:
+                unchanged = (existing['Config'].get('Labels') or dict()).get(CONFIG_HASH_LABEL) == config_hash
+                if unchanged and not force_recreate:
+                    if not existing['State'].get('Running'):
+                        dc.start(existing['Id'])
+                        self.log.info("started existing container {c}".format(c=name))
+                    return existing['Id'], False
+                self.log.info("recreating container {c} for changed {r}".format(
+                    c=name, r=unchanged and 'dependencies' or 'configuration'))
+                dc.remove_container(existing['Id'], force=True)
+            container_id = self._create_container(dc, service_name, name, config_hash)['Id']
+            dc.start(container_id)
+            self.log.info("started container {c}".format(c=name))
+            return container_id, True
+
+    @staticmethod
+    def _inspect_if_exists(docker_client, name):
+        try:
+            return docker_client.inspect_container(name)
+        except APIError as api_error:
+            response = getattr(api_error, 'response', None)
+            if response is not None and response.status_code == 404:
+                return None
+            raise
+
+    def _container_reference(self, entry):
+        name, remainder = _split_reference(entry)
+        if name in self.compose_config:
+            name = container_name(self.project_name, name)
+        return name, remainder
+
+    def _create_container(self, docker_client, service_name, name, config_hash):
+        service_spec = self.compose_config[service_name]
+        unsupported = set(service_spec.keys()) - HANDLED_KEYS - PASSTHROUGH_CREATE_KEYS - HOST_CONFIG_KEYS
+        if unsupported:
+            self.log.warning("ignoring unsupported settings for service {s}: {k}"
+                             .format(s=service_name, k=", ".join(sorted(unsupported))))
+
+        ports, port_bindings = self._port_specs(service_spec.get('ports', []))
+        # 'host:container[:mode]' entries are bind mounts, entries without a host path are anonymous volumes
+        volume_entries = list(service_spec.get('volumes', []))
+        binds = [entry for entry in volume_entries if ':' in entry]
+        volumes = [entry.split(':')[1] if ':' in entry else entry for entry in volume_entries]
+        links = list()
+        for entry in service_spec.get('links', []):
+            target, alias = self._container_reference(entry)
+            links.append((target, alias or _split_reference(entry)[0]))
+        volumes_from = list()
+        for entry in service_spec.get('volumes_from', []):
+            target, mode = self._container_reference(entry)
+            volumes_from.append(target + (mode and (':' + mode) or ''))
+
+        host_config_args = dict((k, v) for k, v in service_spec.items() if k in HOST_CONFIG_KEYS)
+        if 'cpuset' in service_spec:
+            host_config_args['cpuset_cpus'] = service_spec['cpuset']
+        host_config = docker_client.create_host_config(binds=binds, port_bindings=port_bindings, links=links,
+                                                       volumes_from=volumes_from, **host_config_args)
+
+        labels = dict(service_spec.get('labels') or dict())
+        labels.update({COMPOSE_PROJECT_LABEL: self.project_name, COMPOSE_SERVICE_LABEL: service_name,
+                       COMPOSE_NUMBER_LABEL: '1', COMPOSE_ONEOFF_LABEL: 'False', CONFIG_HASH_LABEL: config_hash})
+        create_args = dict((k, v) for k, v in service_spec.items() if k in PASSTHROUGH_CREATE_KEYS)
+        return docker_client.create_container(
+            service_spec['image'], name=name, environment=dict(service_spec.get('environment') or dict()),
+            ports=ports, volumes=volumes,
+            labels=labels, host_config=host_config, **create_args)
+
+    @staticmethod
+    def _port_specs(port_entries):
+        """
+        :param port_entries: compose port declarations ('container', 'host:container' or 'ip:host:container')
+        :return: pair of the container ports and the port bindings as understood by docker-py
+        """
+        ports = list()
+        port_bindings = dict()
+        for entry in port_entries:
+            parts = str(entry).split(':')
+            container_port = parts[-1]
+            port, _, protocol = container_port.partition('/')
+            ports.append((int(port), protocol) if protocol else int(port))
+            if len(parts) == 2:
+                port_bindings[container_port] = parts[0]
+            elif len(parts) == 3:
+                port_bindings[container_port] = (parts[0], parts[1]) if parts[1] else (parts[0],)
+        return ports, port_bindings
@@ -0,0 +1,140 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from docker.errors import APIError
+
+from orchestration import docker_client
+from tools import child_thread_name
+
+DLD_LABEL_PREFIX = 'org.aksw.dld'
+
+# DLD labels by image id, shared by all users of the process, since image ids are content addressed
+_LABEL_CACHE = dict()
+_LABEL_CACHE_LOCK = threading.Lock()
+
+
+def split_image_reference(image):
+    """
+    :return: triple of repository, tag and digest of an image reference (tag and digest might be None)
+    """
+    if '@' in image:
+        repository, digest = image.split('@', 1)
+        return repository, None, digest
+    last_colon = image.rfind(':')
+    if last_colon > image.rfind('/'):  # do not mistake a registry port for a tag
+        return image[:last_colon], image[last_colon + 1:], None
+    return image, None, None
+
+
+def cached_image_labels(image_id):
+    """
+    :return: dict of the DLD labels of the image with the id, None if the image was not inspected yet
+    """
+    with _LABEL_CACHE_LOCK:
+        return _LABEL_CACHE.get(image_id)
+
+
+def dld_labels(image_info):
+    labels = (image_info.get('Config') or dict()).get('Labels') or dict()
+    return dict((k, v) for k, v in labels.items() if k.startswith(DLD_LABEL_PREFIX))
+
+
+def remember_image_labels(image_info):
+    """
+    Caches the DLD labels of an inspected image by its id.
+
+    :return: dict of the DLD labels of the image
+    """
+    labels = dld_labels(image_info)
+    with _LABEL_CACHE_LOCK:
+        _LABEL_CACHE[image_info['Id']] = labels
+    return labels
+
+
+def _is_not_found(api_error):
+    response = getattr(api_error, 'response', None)
+    return response is not None and response.status_code == 404
+
+
+class ImagePuller(object):
+    """
+    Pulls the images referenced in a compose configuration concurrently in the background and
+    caches their DLD labels (see cached_image_labels). Images already present locally (resp. with a
+    matching repo digest, if the reference pins one) are not pulled again.
+    """
+    log = logging.getLogger('dld.ImagePuller')
+
+    def __init__(self, compose_config, max_workers=4, client_factory=docker_client):
+        """
+        :param compose_config: dict of compose service configurations
+        :param max_workers: maximal number of concurrent pulls
+        :param client_factory: callable returning a context manager for a docker client
+        """
+        images = set(spec['image'] for spec in compose_config.values() if spec.get('image'))
+        self.images = sorted(images)
+        self.max_workers = max_workers
+        self.client_factory = client_factory
+        self._executor = None
+        self._futures = dict()
+
+    def start(self):
+        if self._executor is None and self.images:
+            self._executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.images)),
+                                                thread_name_prefix=child_thread_name('dld-image-pull'))
+            for image in self.images:
+                self._futures[image] = self._executor.submit(self._ensure_image, image)
+            self._executor.shutdown(wait=False)
+        return self
+
+    def wait(self):
+        """
+        Waits for all pulls to finish. Failed pulls are logged, since docker-compose will attempt
+        to pull missing images again anyway.
+
+        :return: sorted list of the image references that are available
+        """
+        available = list()
+        for image, future in sorted(self._futures.items()):
+            try:
+                future.result()
+                available.append(image)
+            except Exception as ex:
+                self.log.error("unable to provide image {i}: {ex}".format(i=image, ex=ex))
+        return available
+
+    def _ensure_image(self, image):
+        with self.client_factory() as dc:
+            image_info = self._inspect_if_present(dc, image)
+            if image_info is None:
+                self._pull(dc, image)
+                image_info = dc.inspect_image(image)
+            else:
+                self.log.debug("image {i} already present - skipping pull".format(i=image))
+        remember_image_labels(image_info)
+
+    @staticmethod
+    def _inspect_if_present(docker_client, image):
+        try:
+            image_info = docker_client.inspect_image(image)
+        except APIError as api_error:
+            if _is_not_found(api_error):
+                return None
+            raise
+        repository, _, digest = split_image_reference(image)
+        if digest and (repository + '@' + digest) not in (image_info.get('RepoDigests') or []):
+            return None
+        return image_info
+
+    def _pull(self, docker_client, image):
+        repository, tag, digest = split_image_reference(image)
+        self.log.info("pulling image: {i}".format(i=image))
+        for line in docker_client.pull(repository, tag=digest or tag or 'latest', stream=True):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            for chunk in line.splitlines():
+                progress = chunk.strip() and json.loads(chunk)
+                if progress and 'error' in progress:
+                    raise RuntimeError(progress['error'])
+        self.log.info("finished pulling image: {i}".format(i=image))
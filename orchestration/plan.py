@@ -0,0 +1,117 @@
+from os import path as osp
+
+import yaml
+
+from tools import is_dict_like
+
+# lists whose order has no meaning for docker-compose, they are sorted to keep the generated file stable
+UNORDERED_LIST_KEYS = frozenset(['links', 'volumes_from', 'ports', 'dns', 'cap_add', 'cap_drop', 'external_links'])
+ORDERED_LIST_KEYS = frozenset(['volumes'])
+
+
+def unique(entries):
+    """
+    :return: list of the entries without duplicates, keeping the first occurrences in order
+    """
+    seen = set()
+    result = list()
+    for entry in entries:
+        key = str(entry)
+        if key not in seen:
+            seen.add(key)
+            result.append(entry)
+    return result
+
+
+def normalize_service_config(service_spec):
+    """
+    :return: plain dict copy of a compose service configuration with deduplicated and, where the order has no
+             meaning, sorted list entries
+    """
+    normalized = dict()
+    for key, value in service_spec.items():
+        if key in UNORDERED_LIST_KEYS and isinstance(value, (list, tuple)):
+            normalized[key] = sorted(unique(value), key=str)
+        elif key in ORDERED_LIST_KEYS and isinstance(value, (list, tuple)):
+            normalized[key] = unique(value)
+        elif is_dict_like(value):
+            normalized[key] = dict(value)
+        else:
+            normalized[key] = value
+    return normalized
+
+
+def service_dependencies(compose_config, service_name):
+    """
+    :return: set of the services the named service depends on through 'links' or 'volumes_from'
+    """
+    service_spec = compose_config[service_name]
+    # the entries name the service, optionally followed by an alias (links) resp. an access mode (volumes_from)
+    referenced = [str(entry).partition(':')[0] for entry in
+                  list(service_spec.get('links', [])) + list(service_spec.get('volumes_from', []))]
+    return set(name for name in referenced if name in compose_config and name != service_name)
+
+
+def normalize_compose_config(compose_config):
+    return dict((name, normalize_service_config(spec)) for name, spec in compose_config.items())
+
+
+def read_compose_file(filepath):
+    """
+    :return: the normalized service configurations of an existing compose file (empty if there is none)
+    """
+    if not osp.isfile(filepath):
+        return dict()
+    with open(filepath) as compose_fd:
+        return normalize_compose_config(yaml.safe_load(compose_fd) or dict())
+
+
+class ComposePlan(object):
+    """
+    Compares the service configurations of a previously written compose file with newly generated ones,
+    telling which services docker-compose will create, recreate or leave untouched. Like docker-compose,
+    services are also recreated when their image changed or when a service they depend on is recreated.
+    """
+
+    def __init__(self, previous_config, current_config, outdated_images=()):
+        """
+        :param previous_config: normalized service configurations of the previous compose file
+        :param current_config: normalized service configurations about to be written
+        :param outdated_images: names of the services whose containers run another image than the one their
+                                image reference resolves to now (see orchestration.engine.outdated_image_services)
+        """
+        self.created = sorted(set(current_config) - set(previous_config))
+        self.removed = sorted(set(previous_config) - set(current_config))
+        common = set(current_config) & set(previous_config)
+        # reason for recreating each service
+        self.reasons = dict()
+        for name in common:
+            if current_config[name] != previous_config[name]:
+                self.reasons[name] = 'configuration changed'
+            elif name in outdated_images:
+                self.reasons[name] = 'image changed'
+        propagating = True
+        while propagating:
+            propagating = False
+            for name in sorted(common - set(self.reasons)):
+                recreated_dependencies = service_dependencies(current_config, name) & set(self.reasons)
+                if recreated_dependencies:
+                    self.reasons[name] = 'depends on ' + ", ".join(sorted(recreated_dependencies))
+                    propagating = True
+        self.recreated = sorted(self.reasons)
+        self.unchanged = sorted(common - set(self.recreated))
+
+    @property
+    def changed_services(self):
+        return sorted(self.created + self.recreated + self.removed)
+
+    def report(self):
+        lines = ["compose plan:"]
+        for label, names in [("create", self.created), ("recreate", self.recreated),
+                             ("remove", self.removed), ("keep", self.unchanged)]:
+            for name in names:
+                reason = self.reasons.get(name)
+                lines.append("  {l:<9}{n}{r}".format(l=label, n=name, r=reason and " (" + reason + ")" or ""))
+        if not self.changed_services:
+            lines.append("  (no changes to the compose services)")
+        return "\n".join(lines)
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import logging
+import os
+from os import path as osp
+import shutil
+import tempfile
+import time
+
+from orchestration import docker_client
+from orchestration.engine import LOAD_COMPLETION_TIMEOUT, container_name, wait_for_load_completion
+from orchestration.images import cached_image_labels, remember_image_labels
+
+SNAPSHOT_PATHS_LABEL = 'org.aksw.dld.snapshot-paths'
+SNAPSHOT_MANIFEST = 'snapshot.json'
+DIGEST_CACHE_FILE = osp.join('.dld', 'digests.json')
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as data_fd:
+        for chunk in iter(lambda: data_fd.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class DigestCache(object):
+    """
+    Remembers the content digests of the import files by name, size and modification time, so that
+    unchanged files are not hashed again on later runs.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        try:
+            with open(filepath) as cache_fd:
+                self._digests = json.load(cache_fd)
+        except (IOError, ValueError):
+            self._digests = dict()
+
+    def digest(self, filepath):
+        stat = os.stat(filepath)
+        stat_key = [stat.st_size, stat.st_mtime_ns]
+        cached = self._digests.get(filepath)
+        if cached is not None and cached[:2] == stat_key:
+            return cached[2]
+        digest = file_digest(filepath)
+        self._digests[filepath] = stat_key + [digest]
+        return digest
+
+    def save(self):
+        if not osp.isdir(osp.dirname(self.filepath)):
+            os.makedirs(osp.dirname(self.filepath))
+        with open(self.filepath, 'w') as cache_fd:
+            json.dump(self._digests, cache_fd, sort_keys=True)
+
+
+def import_fingerprint(models_dir, graph_mapping, default_graph_name, image_ids, digest_cache):
+    """
+    :param models_dir: directory holding the prepared import files
+    :param graph_mapping: dict mapping import file basenames to their target graphs
+    :param default_graph_name: graph for import files without an explicit graph (might be None)
+    :param image_ids: dict mapping the store and load service names to the ids of their images
+    :param digest_cache: DigestCache for the import files
+    :return: hex digest identifying the state of the store after importing the given files with the given images
+    """
+    inputs = {
+        'datasets': dict((basename, digest_cache.digest(osp.join(models_dir, basename)))
+                         for basename in graph_mapping),
+        'graphs': graph_mapping,
+        'default_graph': default_graph_name,
+        'images': image_ids,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class SnapshotCache(object):
+    """
+    Directory of store snapshots by fingerprint: one subdirectory per snapshot, containing a tar archive
+    for each data path of the store container and a manifest. When the cache grows beyond its size limit,
+    the least recently used snapshots are evicted.
+    """
+    log = logging.getLogger('dld.SnapshotCache')
+
+    def __init__(self, cache_dir, max_bytes=None):
+        """
+        :param cache_dir: directory to keep the snapshots in
+        :param max_bytes: size limit for all snapshots together (None for no limit)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _entry_dir(self, fingerprint):
+        return osp.join(self.cache_dir, fingerprint)
+
+    def has(self, fingerprint):
+        return osp.isfile(osp.join(self._entry_dir(fingerprint), SNAPSHOT_MANIFEST))
+
+    def archives(self, fingerprint):
+        """
+        :return: list of pairs of a data path in the store container and the tar archive file restoring it,
+                 marking the snapshot as recently used
+        """
+        entry_dir = self._entry_dir(fingerprint)
+        with open(osp.join(entry_dir, SNAPSHOT_MANIFEST)) as manifest_fd:
+            manifest = json.load(manifest_fd)
+        os.utime(osp.join(entry_dir, SNAPSHOT_MANIFEST))
+        return [(data_path, osp.join(entry_dir, archive)) for data_path, archive in manifest['archives']]
+
+    def add(self, fingerprint, archive_streams):
+        """
+        :param archive_streams: list of pairs of a data path and an iterable over the chunks of its tar archive
+        """
+        if not osp.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_dir = tempfile.mkdtemp(prefix='.' + fingerprint, dir=self.cache_dir)
+        try:
+            archives = list()
+            for idx, (data_path, chunks) in enumerate(archive_streams):
+                archive = "{i}.tar".format(i=idx)
+                with open(osp.join(tmp_dir, archive), 'wb') as archive_fd:
+                    for chunk in chunks:
+                        archive_fd.write(chunk)
+                archives.append((data_path, archive))
+            with open(osp.join(tmp_dir, SNAPSHOT_MANIFEST), 'w') as manifest_fd:
+                json.dump({'archives': archives, 'created': time.time()}, manifest_fd)
+            if osp.isdir(self._entry_dir(fingerprint)):
+                shutil.rmtree(self._entry_dir(fingerprint))
+            os.rename(tmp_dir, self._entry_dir(fingerprint))
+        except:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.evict(keep=fingerprint)
+
+    @staticmethod
+    def _dir_size(dirpath):
+        return sum(osp.getsize(osp.join(dirpath, name)) for name in os.listdir(dirpath))
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used snapshots until the cache is within its size limit again.
+
+        :param keep: fingerprint of a snapshot not to remove (the one just added)
+        """
+        if self.max_bytes is None or not osp.isdir(self.cache_dir):
+            return
+        entries = list()
+        for fingerprint in os.listdir(self.cache_dir):
+            if self.has(fingerprint):
+                entry_dir = self._entry_dir(fingerprint)
+                last_used = osp.getmtime(osp.join(entry_dir, SNAPSHOT_MANIFEST))
+                entries.append((last_used, fingerprint, self._dir_size(entry_dir)))
+        total = sum(size for _, _, size in entries)
+        for _, fingerprint, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if fingerprint == keep:
+                continue
+            self.log.info("evicting store snapshot {f}".format(f=fingerprint))
+            shutil.rmtree(self._entry_dir(fingerprint), ignore_errors=True)
+            total -= size
+
+
+class StoreSnapshots(object):
+    """
+    Exports the data of the store container into a SnapshotCache after the load services completed and
+    restores it into a fresh store container, so that identical imports do not need to be run again.
+    The data can also be copied into the replicas of the store right away.
+    The data paths are taken from the 'org.aksw.dld.snapshot-paths' label of the store image (comma separated),
+    or else from the volumes the image declares (except for the import volume).
+    """
+    log = logging.getLogger('dld.StoreSnapshots')
+
+    def __init__(self, cache, project_name, import_volume_destination, client_factory=docker_client,
+                 load_timeout=LOAD_COMPLETION_TIMEOUT, poll_interval=5):
+        """
+        :param cache: SnapshotCache instance (not needed for replicating the store)
+        :param project_name: compose project name of the setup
+        :param import_volume_destination: mount point of the import data (never part of a snapshot)
+        :param client_factory: callable returning a context manager for a docker client
+        :param load_timeout: seconds to wait for each load service to complete the import at most
+        :param poll_interval: seconds between two looks at the logs of the load services
+        """
+        self.cache = cache
+        self.project_name = project_name
+        self.import_volume_destination = import_volume_destination
+        self.client_factory = client_factory
+        self.load_timeout = load_timeout
+        self.poll_interval = poll_interval
+        # ids of the images inspected by image_ids, by image reference
+        self._image_ids = dict()
+
+    def image_ids(self, compose_config, service_names):
+        ids = dict()
+        with self.client_factory() as dc:
+            for name in service_names:
+                image = compose_config[name]['image']
+                image_info = dc.inspect_image(image)
+                remember_image_labels(image_info)
+                self._image_ids[image] = ids[name] = image_info['Id']
+        return ids
+
+    def data_paths(self, store_image):
+        # the cached labels of an image inspected before (see orchestration.images.cached_image_labels) spare
+        # inspecting it again
+        labels = (store_image in self._image_ids) and cached_image_labels(self._image_ids[store_image]) or dict()
+        labeled = labels.get(SNAPSHOT_PATHS_LABEL)
+        image_config = dict()
+        if not labeled:
+            with self.client_factory() as dc:
+                image_info = dc.inspect_image(store_image)
+            image_config = image_info.get('Config') or dict()
+            labeled = remember_image_labels(image_info).get(SNAPSHOT_PATHS_LABEL)
+        if labeled:
+            return [data_path.strip() for data_path in labeled.split(',') if data_path.strip()]
+        return sorted(data_path for data_path in (image_config.get('Volumes') or dict())
+                      if data_path.rstrip('/') != self.import_volume_destination.rstrip('/'))
+
+    def restore(self, fingerprint, store_service='store'):
+        """
+        Replaces the data of the (already created) store container with the snapshot.
+        The store is stopped for that and started again afterwards.
+        """
+        store_container = container_name(self.project_name, store_service)
+        archives = self.cache.archives(fingerprint)
+        with self.client_factory() as dc:
+            dc.stop(store_container)
+            self._clear_data_paths(dc, store_container, [data_path for data_path, _ in archives])
+            for data_path, archive_path in archives:
+                self.log.info("restoring {p} of {c} from snapshot".format(p=data_path, c=store_container))
+                with open(archive_path, 'rb') as archive_fd:
+                    dc.put_archive(store_container, osp.dirname(data_path.rstrip('/')) or '/', archive_fd)
+            dc.start(store_container)
+
+    @staticmethod
+    def _clear_data_paths(docker_client, container, data_paths):
+        """
+        Empties the data paths of the (stopped) container, so that no files the extracted archives do not
+        contain are left over. A helper container of the same image sharing its volumes deletes the files.
+        """
+        image = docker_client.inspect_container(container)['Config']['Image']
+        helper_id = docker_client.create_container(
+            image, entrypoint=['find'], command=list(data_paths) + ['-mindepth', '1', '-delete'],
+            host_config=docker_client.create_host_config(volumes_from=[container]))['Id']
+        try:
+            docker_client.start(helper_id)
+            exit_code = docker_client.wait(helper_id)
+            if isinstance(exit_code, dict):  # newer API versions report a status object
+                exit_code = exit_code.get('StatusCode')
+            if exit_code != 0:
+                raise RuntimeError("unable to clear {p} of {c} (exit code {e})"
+                                   .format(p=", ".join(data_paths), c=container, e=exit_code))
+        finally:
+            docker_client.remove_container(helper_id, force=True)
+
+    def _wait_for_loads(self, docker_client, load_services, consequence):
+        """
+        :return: True if all load services completed the import
+        """
+        for load_service in load_services:
+            try:
+                wait_for_load_completion(docker_client, container_name(self.project_name, load_service),
+                                         self.load_timeout, self.poll_interval)
+            except RuntimeError as error:
+                self.log.warning("{e}, {n}".format(e=error, n=consequence))
+                return False
+        return True
+
+    def export(self, fingerprint, store_image, load_services, store_service='store'):
+        """
+        Waits for the load services to complete the import and adds the data of the store container to the cache.
+        The store is paused during the export to get a consistent copy of its files.
+
+        :return: True if a snapshot was taken (False when a load service failed)
+        """
+        store_container = container_name(self.project_name, store_service)
+        data_paths = self.data_paths(store_image)
+        if not data_paths:
+            self.log.warning("no data paths known for image {i}, not taking a snapshot".format(i=store_image))
+            return False
+        with self.client_factory() as dc:
+            if not self._wait_for_loads(dc, load_services, "not taking a snapshot"):
+                return False
+            self.log.info("taking snapshot of {c}: {p}".format(c=store_container, p=", ".join(data_paths)))
+            dc.pause(store_container)
+            try:
+                self.cache.add(fingerprint, [(data_path, self._archive_chunks(dc, store_container, data_path))
+                                             for data_path in data_paths])
+            finally:
+                dc.unpause(store_container)
+        return True
+
+    def replicate(self, store_image, load_services, replica_services, store_service='store'):
+        """
+        Waits for the load services to complete the import and copies the data of the store container into the
+        (already created) replica containers. The store is only paused while its data is read into temporary
+        files, the replicas are stopped while their data is replaced and started again afterwards.
+
+        :return: True if the data was copied (False when a load service failed)
+        """
+        store_container = container_name(self.project_name, store_service)
+        data_paths = self.data_paths(store_image)
+        if not data_paths:
+            self.log.warning("no data paths known for image {i}, not replicating the store".format(i=store_image))
+            return False
+        archives = list()
+        with self.client_factory() as dc:
+            if not self._wait_for_loads(dc, load_services, "not replicating the store"):
+                return False
+            try:
+                dc.pause(store_container)
+                try:
+                    for data_path in data_paths:
+                        archive_fd = tempfile.TemporaryFile()
+                        archives.append((data_path, archive_fd))
+                        for chunk in self._archive_chunks(dc, store_container, data_path):
+                            archive_fd.write(chunk)
+                finally:
+                    dc.unpause(store_container)
+                for replica_service in replica_services:
+                    replica_container = container_name(self.project_name, replica_service)
+                    self.log.info("copying {p} of {s} to {r}".format(p=", ".join(data_paths), s=store_container,
+                                                                    r=replica_container))
+                    dc.stop(replica_container)
+                    self._clear_data_paths(dc, replica_container, data_paths)
+                    for data_path, archive_fd in archives:
+                        archive_fd.seek(0)
+                        dc.put_archive(replica_container, osp.dirname(data_path.rstrip('/')) or '/', archive_fd)
+                    dc.start(replica_container)
+            finally:
+                for _, archive_fd in archives:
+                    archive_fd.close()
+        return True
+
+    @staticmethod
+    def _archive_chunks(docker_client, container, data_path):
+        response, _ = docker_client.get_archive(container, data_path)
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            yield chunk
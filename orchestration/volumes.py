@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+from os import path as osp
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from docker.errors import APIError
+
+from data.datasets import READY_MARKER_SUFFIX, PREPARATION_DONE_MARKER
+from data.partitioning import LoadPartitioner
+from orchestration import docker_client
+from tools import child_thread_name
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_DIR = '.dld'
+# mount point of the import volume in the helper container receiving the uploads
+HELPER_MOUNT = '/import'
+
+
+def import_volume_name(project_name, load_service_name):
+    return "{p}_{s}_import".format(p=project_name, s=load_service_name)
+
+
+def _is_marker(basename):
+    return basename.endswith(READY_MARKER_SUFFIX) or basename == PREPARATION_DONE_MARKER
+
+
+def tar_stream(source_dir, basenames, chunk_size=CHUNK_SIZE):
+    """
+    Generates a tar archive of the named files on the fly, without staging it in memory or on disk:
+    a thread writes the archive into a pipe, the generator yields the chunks read from it.
+
+    :return: generator over the chunks (bytes) of the archive
+    """
+    read_fd, write_fd = os.pipe()
+    errors = list()
+
+    def write_archive():
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe_out:
+                with tarfile.open(fileobj=pipe_out, mode='w|', bufsize=chunk_size) as archive:
+                    for basename in basenames:
+                        archive.add(osp.join(source_dir, basename), arcname=basename, recursive=False)
+        except Exception as ex:
+            errors.append(ex)
+
+    writer = threading.Thread(target=write_archive, name=child_thread_name('dld-tar-writer'), daemon=True)
+    writer.start()
+    with os.fdopen(read_fd, 'rb') as pipe_in:
+        for chunk in iter(lambda: pipe_in.read(chunk_size), b''):
+            yield chunk
+    writer.join()
+    if errors:
+        raise errors[0]
+
+
+class ImportVolumeUploader(object):
+    """
+    Transfers the prepared import files into a named Docker volume through the archive upload endpoint of
+    the Docker API, so that the import data reaches the load containers without bind mounts (e.g. when the
+    Docker engine runs on a remote host). Only files changed since the previous upload (according to a
+    manifest kept in the working dir) are sent, large file sets as several parallel uploads. Files no longer
+    present are removed from the volume. Ready markers and the preparation done marker are sent last.
+    """
+    log = logging.getLogger('dld.ImportVolumeUploader')
+
+    def __init__(self, source_dir, volume_name, helper_image, working_dir, client_factory=docker_client,
+                 max_workers=4):
+        """
+        :param source_dir: directory with the prepared import files (the models dir or a partition dir)
+        :param volume_name: name of the Docker volume to fill
+        :param helper_image: (locally available) image for the helper containers, e.g. the load image
+        :param working_dir: working directory, holding the upload manifest
+        :param client_factory: callable returning a context manager for a docker client
+        :param max_workers: maximal number of parallel uploads
+        """
+        self.source_dir = source_dir
+        self.volume_name = volume_name
+        self.helper_image = helper_image
+        self.manifest_path = osp.join(working_dir, MANIFEST_DIR, volume_name + '.json')
+        self.client_factory = client_factory
+        self.max_workers = max_workers
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as manifest_fd:
+                return json.load(manifest_fd)
+        except (IOError, ValueError):
+            return dict()
+
+    def _write_manifest(self, manifest):
+        if not osp.isdir(osp.dirname(self.manifest_path)):
+            os.makedirs(osp.dirname(self.manifest_path))
+        with open(self.manifest_path, 'w') as manifest_fd:
+            json.dump(manifest, manifest_fd, sort_keys=True)
+
+    def _current_files(self):
+        files = dict()
+        for basename in os.listdir(self.source_dir):
+            filepath = osp.join(self.source_dir, basename)
+            if osp.isfile(filepath):
+                stat = os.stat(filepath)
+                files[basename] = [stat.st_size, stat.st_mtime_ns]
+        return files
+
+    def upload(self):
+        """
+        :return: pair of the lists of uploaded and removed file basenames
+        """
+        current = self._current_files()
+        with self.client_factory() as dc:
+            if self._ensure_volume(dc):
+                previous = dict()
+            else:
+                previous = self._read_manifest().get('files', dict())
+            changed = sorted(name for name, stat in current.items() if previous.get(name) != stat)
+            removed = sorted(set(previous) - set(current))
+            if not (changed or removed):
+                self.log.info("import volume {v} is up to date".format(v=self.volume_name))
+                return [], []
+
+            helper = self._create_helper(dc)
+            try:
+                if removed:
+                    self._remove_files(dc, removed)
+                data_files = [name for name in changed if not _is_marker(name)]
+                self._upload_in_groups(helper, [(name, current[name][0]) for name in data_files])
+                markers = [name for name in changed if _is_marker(name)]
+                if markers:
+                    dc.put_archive(helper, HELPER_MOUNT, tar_stream(self.source_dir, markers))
+            finally:
+                dc.remove_container(helper, force=True)
+        self._write_manifest({'volume': self.volume_name, 'files': current})
+        self.log.info("uploaded {c} files to import volume {v}, removed {r}"
+                      .format(c=len(changed), v=self.volume_name, r=len(removed)))
+        return changed, removed
+
+    def _ensure_volume(self, docker_client):
+        """
+        :return: True if the volume was created (i.e. it is empty)
+        """
+        try:
+            docker_client.inspect_volume(self.volume_name)
+            return False
+        except APIError as api_error:
+            response = getattr(api_error, 'response', None)
+            if response is None or response.status_code != 404:
+                raise
+        self.log.info("creating import volume {v}".format(v=self.volume_name))
+        docker_client.create_volume(self.volume_name)
+        return True
+
+    def _create_helper(self, docker_client, entrypoint=('true',), command=None):
+        host_config = docker_client.create_host_config(binds=[self.volume_name + ':' + HELPER_MOUNT])
+        return docker_client.create_container(self.helper_image, entrypoint=list(entrypoint), command=command,
+                                              volumes=[HELPER_MOUNT], host_config=host_config)['Id']
+
+    def _upload_in_groups(self, helper, sized_files):
+        if not sized_files:
+            return
+        group_names = [str(idx) for idx in range(min(self.max_workers, len(sized_files)))]
+        groups = [files for files in LoadPartitioner.balance(sized_files, group_names).values() if files]
+
+        def upload_group(basenames):
+            with self.client_factory() as group_client:
+                group_client.put_archive(helper, HELPER_MOUNT, tar_stream(self.source_dir, basenames))
+
+        with ThreadPoolExecutor(max_workers=len(groups),
+                                thread_name_prefix=child_thread_name('dld-upload')) as executor:
+            for future in [executor.submit(upload_group, group) for group in groups]:
+                future.result()
+
+    def _remove_files(self, docker_client, basenames):
+        remover = self._create_helper(docker_client, ['rm', '-f'], [HELPER_MOUNT + '/' + name for name in basenames])
+        try:
+            docker_client.start(remover)
+            docker_client.wait(remover)
+        finally:
+            docker_client.remove_container(remover, force=True)
@@ -0,0 +1,450 @@
+import argparse as ap
+import http.client
+import itertools
+import json
+import logging
+import os
+from os import path as osp
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from tools import THREAD_NAME_SEPARATOR, FilenameOps
+
+FINISHED_STATES = frozenset(['succeeded', 'failed'])
+NDJSON = 'application/x-ndjson'
+
+LOG = logging.getLogger('dld.service')
+
+
+def job_working_dir(args):
+    """
+    :param args: dld.py command line arguments of a job
+    :return: real path of the working directory the job operates on (derived like dld.py does)
+    """
+    parser = ap.ArgumentParser(add_help=False)
+    parser.add_argument('-c', '--config-file', default='dld.yml')
+    parser.add_argument('-w', '--working-dir')
+    args_ns, _ = parser.parse_known_args(args)
+    return osp.realpath(args_ns.working_dir or
+                        'wd-' + FilenameOps.strip_config_suffixes(osp.basename(args_ns.config_file)))
+
+
+class Job(object):
+    """
+    A dld.py invocation run by the service, collecting the events describing its progress.
+    """
+
+    def __init__(self, job_id, args, working_dir):
+        self.id = job_id
+        self.args = list(args)
+        self.working_dir = working_dir
+        self.state = None
+        self.exit_status = None
+        self.error = None
+        self.events = list()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._changed = threading.Condition()
+
+    def emit(self, event_type, **fields):
+        with self._changed:
+            self.events.append(dict(fields, type=event_type, time=round(time.time(), 3)))
+            self._changed.notify_all()
+
+    def set_state(self, state):
+        with self._changed:
+            self.state = state
+        self.emit('state', state=state, exit_status=self.exit_status, error=self.error)
+
+    @property
+    def done(self):
+        return self.state in FINISHED_STATES
+
+    def wait_events(self, start, timeout=None):
+        """
+        :return: pair of the events from index start on (waiting up to timeout for new ones) and whether the job
+                 is done
+        """
+        with self._changed:
+            if len(self.events) <= start and not self.done:
+                self._changed.wait(timeout)
+            return self.events[start:], self.done
+
+    def describe(self):
+        return {
+            'id': self.id,
+            'args': self.args,
+            'working_dir': self.working_dir,
+            'state': self.state,
+            'exit_status': self.exit_status,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobLogHandler(logging.Handler):
+    """
+    Passes the log records emitted by the threads running jobs on to these jobs as events. The thread running a job
+    is named after it, the threads it starts (named with tools.child_thread_name) inherit that name as prefix, so
+    that their log records reach the job as well.
+    """
+
+    def __init__(self, level=logging.INFO):
+        logging.Handler.__init__(self, level)
+        self._jobs_by_thread_name = dict()
+
+    def attach(self, job):
+        thread = threading.current_thread()
+        thread_name = 'dld-job-' + job.id
+        self._jobs_by_thread_name[thread_name] = (job, thread.name)
+        thread.name = thread_name
+
+    def detach(self):
+        thread = threading.current_thread()
+        job, original_name = self._jobs_by_thread_name.pop(thread.name, (None, thread.name))
+        thread.name = original_name
+
+    def emit(self, record):
+        job, _ = self._jobs_by_thread_name.get(record.threadName.split(THREAD_NAME_SEPARATOR, 1)[0], (None, None))
+        if job is not None:
+            job.emit('log', level=record.levelname, logger=record.name, message=record.getMessage())
+
+
+class JobScheduler(object):
+    """
+    Runs jobs on a bounded pool of worker threads. Jobs for the same working directory run one after the other in
+    the order they were submitted, so that they do not race on the same models dir; waiting jobs do not occupy a
+    worker.
+    """
+    log = logging.getLogger('dld.JobScheduler')
+
+    def __init__(self, runner, max_workers=2, max_finished=100, log_handler=None):
+        """
+        :param runner: function running the dld.py command line arguments of a job, returning an exit status
+        :param max_workers: maximal number of jobs running at once
+        :param max_finished: number of finished jobs to keep for inspection
+        """
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.log_handler = log_handler
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._waiting_by_dir = dict()
+
+    def submit(self, args):
+        """
+        :return: the queued Job
+        """
+        job = Job(str(next(self._ids)), args, job_working_dir(args))
+        job.set_state('queued')
+        with self._lock:
+            self._jobs[job.id] = job
+            if job.working_dir in self._waiting_by_dir:
+                self.log.info("job {j} waits for the jobs on {wd}".format(j=job.id, wd=job.working_dir))
+                self._waiting_by_dir[job.working_dir].append(job)
+                return job
+            self._waiting_by_dir[job.working_dir] = deque()
+        self._executor.submit(self._run, job)
+        return job
+
+    def job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _run(self, job):
+        job.started = time.time()
+        job.set_state('running')
+        if self.log_handler is not None:
+            self.log_handler.attach(job)
+        try:
+            exit_status = self.runner(job.args)
+        except SystemExit as exit_ex:
+            exit_status = exit_ex.code if isinstance(exit_ex.code, int) or exit_ex.code is None else 1
+        except Exception as ex:
+            self.log.exception("job {j} failed".format(j=job.id))
+            job.error = "{t}: {ex}".format(t=type(ex).__name__, ex=ex)
+            exit_status = 1
+        finally:
+            if self.log_handler is not None:
+                self.log_handler.detach()
+        job.exit_status = exit_status or 0
+        job.finished = time.time()
+        job.set_state(job.exit_status == 0 and 'succeeded' or 'failed')
+        self._start_next(job.working_dir)
+        self._forget_finished()
+
+    def _start_next(self, working_dir):
+        with self._lock:
+            waiting = self._waiting_by_dir[working_dir]
+            if not waiting:
+                del self._waiting_by_dir[working_dir]
+                return
+            next_job = waiting.popleft()
+        self._executor.submit(self._run, next_job)
+
+    def _forget_finished(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.done]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return dict((state, states.count(state)) for state in set(states))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    The service API:
+        POST /jobs              submits a job, the body being a JSON object with the dld.py arguments ('args')
+        GET  /jobs              lists the jobs
+        GET  /jobs/<id>         describes a job
+        GET  /jobs/<id>/events  streams the events of a job (newline delimited JSON) until it is done
+        GET  /status            job counts and cache statistics
+    """
+    server_version = 'dld-service'
+
+    def log_message(self, msg_format, *args):
+        LOG.debug("{r}: {m}".format(r=self.requestline, m=msg_format % args))
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def _send_json(self, status, content):
+        body = json.dumps(content, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path_parts(self):
+        return [part for part in urlparse(self.path).path.split('/') if part]
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ['status']:
+            self._send_json(200, self.service.status())
+        elif parts == ['jobs']:
+            self._send_json(200, [job.describe() for job in self.service.scheduler.jobs()])
+        elif len(parts) in (2, 3) and parts[0] == 'jobs' and parts[2:] in ([], ['events']):
+            job = self.service.scheduler.job(parts[1])
+            if job is None:
+                self._send_json(404, {'error': "unknown job {j}".format(j=parts[1])})
+            elif len(parts) == 2:
+                self._send_json(200, job.describe())
+            else:
+                self._stream_events(job)
+        else:
+            self._send_json(404, {'error': "unknown resource {p}".format(p=self.path)})
+
+    def do_POST(self):
+        if self._path_parts() != ['jobs']:
+            self._send_json(404, {'error': "unknown resource {p}".format(p=self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            args = request['args']
+            if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                raise ValueError("'args' needs to be a list of strings")
+            if self.service.validate is not None:
+                self.service.validate(args)
+        except (ValueError, KeyError, TypeError) as ex:
+            self._send_json(400, {'error': str(ex)})
+            return
+        self._send_json(202, self.service.scheduler.submit(args).describe())
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header('Content-Type', NDJSON)
+        self.end_headers()
+        position = 0
+        try:
+            while True:
+                events, done = job.wait_events(position, timeout=1.0)
+                for event in events:
+                    self.wfile.write(json.dumps(event, sort_keys=True).encode('utf-8') + b'\n')
+                self.wfile.flush()
+                position += len(events)
+                if done and not events:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            LOG.debug("client stopped following the events of job {j}".format(j=job.id))
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class LocalHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class DLDService(object):
+    """
+    Long-running process accepting dld.py invocations as jobs through a local HTTP API (on a Unix socket or a
+    port of the loopback interface). Caches of the process (the parsed configuration files, the Docker engine
+    version and the source metadata handed to the runner) stay warm between jobs.
+    """
+    log = logging.getLogger('dld.DLDService')
+
+    def __init__(self, runner, max_workers=2, validate=None, cache_stats=None):
+        """
+        :param runner: function running the dld.py command line arguments of a job, returning an exit status
+        :param validate: function raising ValueError for arguments the service does not accept (or None)
+        :param cache_stats: function returning statistics of the caches for the status resource (or None)
+        """
+        self.log_handler = JobLogHandler()
+        self.scheduler = JobScheduler(runner, max_workers, log_handler=self.log_handler)
+        self.validate = validate
+        self.cache_stats = cache_stats
+        self.server = None
+        self._thread = None
+
+    def status(self):
+        return {'jobs': self.scheduler.stats(), 'workers': self.scheduler.max_workers,
+                'caches': self.cache_stats() if self.cache_stats is not None else dict()}
+
+    def bind(self, socket_path=None, port=None):
+        """
+        :return: the address clients connect to: the socket path or a (host, port) pair
+        """
+        if socket_path is not None:
+            if osp.exists(socket_path):
+                if _is_listening(socket_path):
+                    raise RuntimeError("another service is listening on {s}".format(s=socket_path))
+                os.remove(socket_path)
+            self.server = UnixHTTPServer(socket_path, ServiceRequestHandler)
+            os.chmod(socket_path, 0o600)
+        else:
+            self.server = LocalHTTPServer(('127.0.0.1', port or 0), ServiceRequestHandler)
+        self.server.service = self
+        logging.getLogger('dld').addHandler(self.log_handler)
+        return self.server.server_address
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def start(self):
+        """
+        Serves in a background thread.
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name='dld-service', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        logging.getLogger('dld').removeHandler(self.log_handler)
+        self.scheduler.shutdown()
+        if self.server is not None:
+            if self._thread is not None:
+                self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.server, UnixHTTPServer) and osp.exists(self.server.server_address):
+                os.remove(self.server.server_address)
+
+
+def _is_listening(socket_path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+        return True
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    finally:
+        probe.close()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient(object):
+    """
+    Submits jobs to a DLDService and follows their events.
+    """
+
+    def __init__(self, address):
+        """
+        :param address: socket path or (host, port) pair of the service
+        """
+        self.address = address
+
+    def _connection(self):
+        if isinstance(self.address, str):
+            return UnixHTTPConnection(self.address)
+        return http.client.HTTPConnection(*self.address)
+
+    def _request(self, method, path, content=None):
+        connection = self._connection()
+        try:
+            body = content is not None and json.dumps(content).encode('utf-8') or None
+            connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            result = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise RuntimeError("service refused {m} {p}: {e}".format(m=method, p=path, e=result.get('error')))
+        return result
+
+    def submit(self, args):
+        """
+        :return: description of the submitted job
+        """
+        return self._request('POST', '/jobs', {'args': list(args)})
+
+    def job(self, job_id):
+        return self._request('GET', '/jobs/' + job_id)
+
+    def jobs(self):
+        return self._request('GET', '/jobs')
+
+    def status(self):
+        return self._request('GET', '/status')
+
+    def events(self, job_id):
+        """
+        :return: generator over the events of the job, ending when the job is done
+        """
+        connection = self._connection()
+        try:
+            connection.request('GET', '/jobs/{j}/events'.format(j=job_id))
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RuntimeError("unable to follow job {j}: {s}".format(j=job_id, s=response.status))
+            for line in response:
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+        finally:
+            connection.close()
@@ -0,0 +1,327 @@
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlsplit
+from urllib.request import Request, urlopen
+
+from data.transfer import TRANSFER_ERRORS
+from orchestration import docker_client
+from orchestration.engine import wait_for_load_completion
+
+DEFAULT_CACHE_PORT = 8890
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_MAX_ENTRIES = 1000
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_SETTINGS_KEYS = ['ttl', 'max_entries', 'max_size']
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+QUERY_CONTENT_TYPE = 'application/sparql-query'
+UPDATE_CONTENT_TYPE = 'application/sparql-update'
+# request parameters that do not change the result of a query
+IGNORED_PARAMETERS = frozenset(['query', '_'])
+RELAYED_HEADERS = ('Content-Type', 'Content-Encoding')
+# literals and IRIs are kept as they are, comments and runs of whitespace are collapsed to a single blank
+QUERY_TOKEN_PATTERN = re.compile(r'"""(?:[^"\\]|\\.|"(?!""))*"""|' + r"'''(?:[^'\\]|\\.|'(?!''))*'''|" +
+                                 r'"(?:[^"\\\n]|\\.)*"|' + r"'(?:[^'\\\n]|\\.)*'|" +
+                                 r'<[^<>"{}|^`\\\s]*>|#[^\n]*|\s+|[^\s"\'<#]+|.', re.DOTALL)
+
+
+def normalize_query(query):
+    """
+    :return: the query with comments removed and whitespace outside of literals and IRIs collapsed
+    """
+    tokens = list()
+    for token in QUERY_TOKEN_PATTERN.findall(query):
+        if token.startswith('#') or token.isspace():
+            if tokens and tokens[-1] != ' ':
+                tokens.append(' ')
+        else:
+            tokens.append(token)
+    return ''.join(tokens).strip()
+
+
+def normalize_accept(accept):
+    return ','.join(part.strip().replace(' ', '') for part in (accept or '*/*').lower().split(','))
+
+
+def cache_key(query, parameters, accept):
+    """
+    :param parameters: list of the (name, value) request parameters, 'query' is left out
+    :return: key of a query result that identical queries (up to normalization) asked for the same format share
+    """
+    relevant = tuple(sorted((name, value) for name, value in parameters if name not in IGNORED_PARAMETERS))
+    return normalize_query(query), relevant, normalize_accept(accept)
+
+
+class QueryCache(object):
+    """
+    LRU cache of query results bounded by the number of entries and their total size. Entries expire after
+    ttl seconds. While disabled (e.g. as long as the store is being loaded) nothing is looked up or added.
+    """
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+                 max_bytes=DEFAULT_CACHE_MAX_BYTES, enabled=True, clock=time.time):
+        """
+        :param ttl: seconds a result is served from the cache
+        :param max_entries: maximal number of cached results
+        :param max_bytes: maximal total size of the cached results (larger results are not cached)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counters = dict((name, 0) for name in ('hits', 'misses', 'bypassed', 'evictions', 'invalidations'))
+
+    def _remove(self, key):
+        _, _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def get(self, key):
+        """
+        :return: pair of the headers and the body of the cached result, None if there is none
+        """
+        with self._lock:
+            if not self.enabled:
+                self._counters['bypassed'] += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1], entry[2]
+
+    def put(self, key, headers, body):
+        with self._lock:
+            if not self.enabled or len(body) > self.max_bytes or self.max_entries < 1:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + self.ttl, headers, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def invalidate(self, enable=True):
+        """
+        Drops all cached results (e.g. after the store was loaded or updated).
+
+        :param enable: whether to (re-)enable caching
+        :return: number of dropped results
+        """
+        with self._lock:
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self._counters['invalidations'] += 1
+            self.enabled = enable
+            return dropped
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), bytes=self._bytes, enabled=self.enabled)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = lookups and round(float(stats['hits']) / lookups, 4) or 0.0
+        return stats
+
+
+class LoadWatcher(threading.Thread):
+    """
+    Waits for the load containers to complete the import and then invalidates (and enables) the cache, so that
+    no results of the partially loaded store are served afterwards. Containers not created yet (e.g. when the load
+    services are only started after the import data was prepared) are waited for as well. Replicas of the store are
+    waited for until they were started again after the load finished (i.e. after the data was copied to them).
+    """
+    log = logging.getLogger('dld.LoadWatcher')
+
+    def __init__(self, cache, container_names, replica_names=(), client_factory=docker_client, poll_interval=5):
+        threading.Thread.__init__(self, name='dld-load-watcher', daemon=True)
+        self.cache = cache
+        self.container_names = list(container_names)
+        self.replica_names = list(replica_names)
+        self.client_factory = client_factory
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def _is_not_found(api_error):
+        response = getattr(api_error, 'response', None)
+        return response is not None and response.status_code == 404
+
+    def _wait(self, docker_client, name):
+        self.log.info("waiting for {c} to finish loading".format(c=name))
+        while True:
+            try:
+                completed = wait_for_load_completion(docker_client, name, poll_interval=self.poll_interval)
+                # timestamps are compared with a precision of seconds (the precision of the fractions varies)
+                return (completed or time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()))[:19]
+            except Exception as ex:
+                if not self._is_not_found(ex):
+                    raise
+            time.sleep(self.poll_interval)
+
+    def _wait_for_restart(self, docker_client, name, finished):
+        self.log.info("waiting for {c} to receive the loaded data".format(c=name))
+        while docker_client.inspect_container(name)['State']['StartedAt'][:19] <= finished:
+            time.sleep(self.poll_interval)
+
+    def run(self):
+        try:
+            with self.client_factory() as dc:
+                finished = max([self._wait(dc, name) for name in self.container_names] or [''])
+                for name in self.replica_names:
+                    self._wait_for_restart(dc, name, finished)
+        except Exception as ex:
+            self.log.warning("unable to wait for the load containers ({ex}), relying on the TTL".format(ex=ex))
+        dropped = self.cache.invalidate()
+        self.log.info("load finished, caching query results (dropped {n})".format(n=dropped))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CachingProxyHandler(BaseHTTPRequestHandler):
+    """
+        GET  /cache/metrics      hit/miss counters of the cache (JSON)
+        POST /cache/invalidate   drops all cached results
+        any other request is forwarded to the store, query results are served from the cache when possible
+        and updates drop the cached results
+    """
+    server_version = 'dld-cache'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, msg_format, *args):
+        CachingProxyServer.log.debug("{c}: {m}".format(c=self.client_address[0], m=msg_format % args))
+
+    def do_GET(self):
+        if self.path == '/cache/metrics':
+            self._send(200, {'Content-Type': 'application/json'},
+                       json.dumps(self.server.cache.stats(), sort_keys=True).encode('utf-8'))
+            return
+        parameters = parse_qsl(urlsplit(self.path).query, keep_blank_values=True)
+        self._proxy(None, parameters, dict(parameters).get('query'))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path == '/cache/invalidate':
+            dropped = self.server.cache.invalidate()
+            self._send(200, {'Content-Type': 'application/json'}, json.dumps({'dropped': dropped}).encode('utf-8'))
+            return
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        parameters = parse_qsl(urlsplit(self.path).query, keep_blank_values=True)
+        query = None
+        if content_type == FORM_CONTENT_TYPE:
+            parameters += parse_qsl(body.decode('utf-8'), keep_blank_values=True)
+            query = dict(parameters).get('query')
+        elif content_type == QUERY_CONTENT_TYPE:
+            query = body.decode('utf-8')
+        updates = content_type == UPDATE_CONTENT_TYPE or 'update' in dict(parameters)
+        self._proxy(body, parameters, query, updates)
+
+    def _proxy(self, body, parameters, query, updates=False):
+        cache = self.server.cache
+        key = query is not None and not updates and cache_key(query, parameters, self.headers.get('Accept')) or None
+        cached = key is not None and cache.get(key) or None
+        if cached is not None:
+            self._send(200, dict(cached[0], **{'X-Cache': 'HIT'}), cached[1])
+            return
+        headers = dict((name, self.headers[name]) for name in ('Accept', 'Content-Type') if self.headers.get(name))
+        # updates are only sent to the first store (the primary), queries are spread over the stores
+        upstreams = updates and self.server.upstreams[:1] or self.server.next_upstreams()
+        for upstream in upstreams:
+            request = Request(upstream + self.path, data=body, headers=headers, method=self.command)
+            try:
+                with urlopen(request, timeout=self.server.upstream_timeout) as response:
+                    status, response_headers, content = response.status, response.headers, response.read()
+                break
+            except HTTPError as ex:
+                status, response_headers, content = ex.code, ex.headers, ex.read()
+                break
+            except TRANSFER_ERRORS as ex:
+                CachingProxyServer.log.warning("store {u} unavailable: {ex}".format(u=upstream, ex=ex))
+        else:
+            self._send(502, {'Content-Type': 'text/plain'}, b"store unavailable")
+            return
+        relayed = dict((name, response_headers[name]) for name in RELAYED_HEADERS if response_headers.get(name))
+        if status == 200 and key is not None:
+            cache.put(key, relayed, content)
+        if status < 300 and updates:
+            cache.invalidate(enable=cache.enabled)
+        self._send(status, dict(relayed, **{'X-Cache': key is not None and 'MISS' or 'PASS'}), content)
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            CachingProxyServer.log.debug("{c} closed the connection".format(c=self.client_address[0]))
+
+
+class CachingProxyServer(object):
+    """
+    SPARQL proxy in front of the store that answers repeated queries from a QueryCache. With several upstreams
+    (store replicas) it balances the queries over them, skipping unavailable ones.
+    """
+    log = logging.getLogger('dld.CachingProxyServer')
+
+    def __init__(self, upstreams, cache, host='0.0.0.0', port=DEFAULT_CACHE_PORT, timeout=300):
+        """
+        :param upstreams: base URLs of the store and its replicas (the request paths are kept),
+                          e.g. http://store:8890, queries are sent to them in turn
+        """
+        self.server = ThreadingHTTPServer((host, port), CachingProxyHandler)
+        self.server.upstreams = [upstream.rstrip('/') for upstream in
+                                 (isinstance(upstreams, str) and [upstreams] or upstreams)]
+        self.server.next_upstreams = self._next_upstreams
+        self.server.cache = cache
+        self.server.upstream_timeout = timeout
+        self._turn = itertools.count()
+
+    def _next_upstreams(self):
+        """
+        :return: the upstreams in the order to try them for the next query (round-robin)
+        """
+        upstreams = self.server.upstreams
+        if not self.server.cache.enabled:  # the replicas are not filled before the load finished
+            return upstreams[:1]
+        first = next(self._turn) % len(upstreams)
+        return upstreams[first:] + upstreams[:first]
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{h}:{p}".format(h=host == '0.0.0.0' and '127.0.0.1' or host, p=port)
+
+    def serve_forever(self):
+        self.log.info("caching queries to {u} at {p}".format(u=", ".join(self.server.upstreams), p=self.url))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='dld-cache', daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
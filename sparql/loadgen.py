@@ -0,0 +1,323 @@
+import logging
+import math
+from os import path as osp
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, urlencode
+from urllib.request import Request, urlopen
+
+from tools import child_thread_name, is_dict_like, is_list_like
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+ACCEPT_RESULTS = 'application/sparql-results+json, application/n-triples;q=0.9, */*;q=0.1'
+CHUNK_SIZE = 64 * 1024
+PERCENTILES = (0.5, 0.95, 0.99)
+WORKLOAD_KEYS = ['templates', 'query_log', 'rate', 'concurrency', 'duration', 'warmup', 'timeout', 'seed']
+
+
+class QueryTemplate(object):
+    """
+    A query with {{name}} placeholders, each replaced by a random choice of the values given for it.
+    """
+
+    def __init__(self, name, query, params=None, weight=1):
+        self.name = name
+        self.query = query
+        self.params = dict(params or dict())
+        self.weight = weight
+        for placeholder in PLACEHOLDER_PATTERN.findall(query):
+            if not is_list_like(self.params.get(placeholder)) or not self.params[placeholder]:
+                raise RuntimeError("query template {n} lacks values for the placeholder '{p}'"
+                                   .format(n=name, p=placeholder))
+
+    def render(self, rng):
+        return PLACEHOLDER_PATTERN.sub(lambda match: str(rng.choice(self.params[match.group(1)])), self.query)
+
+
+class QueryLogTemplate(object):
+    """
+    Replays the queries of a query log in their order (starting over at the end).
+    """
+
+    def __init__(self, name, queries, weight=1):
+        if not queries:
+            raise RuntimeError("query log {n} contains no queries".format(n=name))
+        self.name = name
+        self.queries = queries
+        self.weight = weight
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def render(self, rng):
+        with self._lock:
+            query = self.queries[self._next]
+            self._next = (self._next + 1) % len(self.queries)
+        return query
+
+
+def read_query_log(filepath):
+    """
+    :param filepath: file with one query per line, either plain or as (part of) an URL-encoded request
+                     with a query parameter as found in endpoint access logs
+    :return: list of the queries
+    """
+    queries = list()
+    with open(filepath) as log_fd:
+        for line in log_fd:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if 'query=' in line:
+                query_values = parse_qs(line.split('?', 1)[-1].split()[0]).get('query')
+                if query_values:
+                    queries.append(query_values[0])
+            else:
+                queries.append(line)
+    return queries
+
+
+class Workload(object):
+    """
+    The queries to send and how to drive them, declared as:
+
+        templates:
+          label_lookup:
+            query: SELECT ?s WHERE { ?s rdfs:label "{{label}}"@en } LIMIT 10
+            params:
+              label: [Leipzig, Dresden]
+            weight: 3              # relative frequency (default: 1)
+        query_log: queries.log     # replayed in order, reported as one template named after the file
+        rate: 20                   # queries per second (open loop), or without a rate ...
+        concurrency: 8             # ... the number of clients sending queries back to back
+        duration: 60               # seconds to measure
+        warmup: 30                 # seconds to run the workload unmeasured before, to warm the store buffers
+    """
+
+    def __init__(self, templates, rate=None, concurrency=4, duration=60, warmup=0, timeout=60, seed=0):
+        if not templates:
+            raise RuntimeError("a workload needs query templates or a query log")
+        if rate is not None and rate <= 0:
+            raise RuntimeError("the query rate needs to be a positive number, got: {r}".format(r=rate))
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise RuntimeError("the concurrency needs to be a positive integer, got: {c}".format(c=concurrency))
+        self.templates = templates
+        self.rate = rate
+        self.concurrency = concurrency
+        self.duration = duration
+        self.warmup = warmup
+        self.timeout = timeout
+        self.seed = seed
+        self._weights = [template.weight for template in templates]
+
+    @classmethod
+    def from_config(cls, workload_config, base_dir='.'):
+        """
+        :param workload_config: workload declaration (see class documentation)
+        :param base_dir: directory relative query log paths are resolved against
+        """
+        if not is_dict_like(workload_config):
+            raise RuntimeError("unexpected workload declaration: {w}".format(w=workload_config))
+        unknown = set(workload_config.keys()) - set(WORKLOAD_KEYS)
+        if unknown:
+            raise RuntimeError("unknown workload settings: {k}".format(k=", ".join(sorted(unknown))))
+        templates = list()
+        for name, template_config in sorted((workload_config.get('templates') or dict()).items()):
+            if isinstance(template_config, str):
+                template_config = {'query': template_config}
+            templates.append(QueryTemplate(name, template_config['query'], template_config.get('params'),
+                                           template_config.get('weight', 1)))
+        if workload_config.get('query_log'):
+            log_path = osp.join(base_dir, workload_config['query_log'])
+            templates.append(QueryLogTemplate(osp.basename(log_path), read_query_log(log_path)))
+        settings = dict((key, workload_config[key]) for key in WORKLOAD_KEYS[2:] if key in workload_config)
+        return cls(templates, **settings)
+
+    def next_query(self, rng):
+        """
+        :return: pair of the template name and a query rendered from it
+        """
+        template = rng.choices(self.templates, weights=self._weights)[0]
+        return template.name, template.render(rng)
+
+
+def execute_query(endpoint, query, timeout=60):
+    """
+    Sends the query (as POSTed form, so that long queries do not exceed URL length limits) and reads the complete
+    result, discarding it.
+
+    :return: number of result bytes received
+    """
+    request = Request(endpoint, data=urlencode({'query': query}).encode('utf-8'),
+                      headers={'Accept': ACCEPT_RESULTS, 'Content-Type': 'application/x-www-form-urlencoded'})
+    received = 0
+    with urlopen(request, timeout=timeout) as response:
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            received += len(chunk)
+    return received
+
+
+def error_kind(ex):
+    if isinstance(ex, HTTPError):
+        return "HTTP {c}".format(c=ex.code)
+    if isinstance(ex, socket.timeout) or isinstance(getattr(ex, 'reason', None), socket.timeout):
+        return "timeout"
+    if isinstance(ex, URLError):
+        return "connection: {r}".format(r=ex.reason)
+    return type(ex).__name__
+
+
+def percentile(sorted_values, fraction):
+    """
+    :return: the nearest-rank percentile of the sorted values (None if there are none)
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, int(math.ceil(fraction * len(sorted_values))) - 1)]
+
+
+class TemplateStats(object):
+    def __init__(self):
+        self.latencies = list()
+        self.errors = Counter()
+        self.result_bytes = 0
+
+    @property
+    def count(self):
+        return len(self.latencies) + sum(self.errors.values())
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        summary = {
+            'queries': self.count,
+            'errors': sum(self.errors.values()),
+            'error_rate': round(sum(self.errors.values()) / self.count, 4) if self.count else 0.0,
+            'error_kinds': dict(self.errors),
+            'throughput': round(len(latencies) / max(elapsed, 0.001), 2),
+            'result_bytes': self.result_bytes,
+            'mean_seconds': round(sum(latencies) / len(latencies), 4) if latencies else None,
+            'max_seconds': round(latencies[-1], 4) if latencies else None,
+        }
+        for fraction in PERCENTILES:
+            value = percentile(latencies, fraction)
+            summary['p{p}_seconds'.format(p=int(fraction * 100))] = round(value, 4) if value is not None else None
+        return summary
+
+
+class LoadReport(object):
+    def __init__(self, stats_by_template, elapsed):
+        self.stats_by_template = stats_by_template
+        self.elapsed = elapsed
+
+    @property
+    def total(self):
+        total = TemplateStats()
+        for stats in self.stats_by_template.values():
+            total.latencies.extend(stats.latencies)
+            total.errors.update(stats.errors)
+            total.result_bytes += stats.result_bytes
+        return total
+
+    def as_dict(self):
+        return {
+            'elapsed_seconds': round(self.elapsed, 2),
+            'total': self.total.summary(self.elapsed),
+            'templates': dict((name, stats.summary(self.elapsed))
+                              for name, stats in sorted(self.stats_by_template.items())),
+        }
+
+    def format(self):
+        def ms(value):
+            return value is None and '-' or "{v:.1f}".format(v=value * 1000)
+
+        lines = ["{t:<24} {n:>8} {q:>8} {e:>7} {p50:>9} {p95:>9} {p99:>9}".format(
+            t='template', n='queries', q='q/s', e='errors', p50='p50 ms', p95='p95 ms', p99='p99 ms')]
+        rows = sorted(self.stats_by_template.items()) + [('total', self.total)]
+        for name, stats in rows:
+            summary = stats.summary(self.elapsed)
+            lines.append("{t:<24} {n:>8} {q:>8.1f} {e:>6.1%} {p50:>9} {p95:>9} {p99:>9}".format(
+                t=name[:24], n=summary['queries'], q=summary['throughput'], e=summary['error_rate'],
+                p50=ms(summary['p50_seconds']), p95=ms(summary['p95_seconds']), p99=ms(summary['p99_seconds'])))
+            for kind, count in sorted(summary['error_kinds'].items()):
+                lines.append("    {n} x {k}".format(n=count, k=kind))
+        return "\n".join(lines)
+
+
+class LoadGenerator(object):
+    """
+    Drives a workload against a SPARQL endpoint, either open loop at a target rate (latencies are measured from
+    the time a query was due, so that a store falling behind shows in the latencies instead of slowing down the
+    load) or closed loop with a number of clients sending queries back to back.
+    """
+    log = logging.getLogger('dld.LoadGenerator')
+
+    def __init__(self, endpoint, workload, clock=time.monotonic):
+        self.endpoint = endpoint
+        self.workload = workload
+        self.clock = clock
+
+    def run(self):
+        """
+        :return: LoadReport for the measured period (after the warmup)
+        """
+        if self.workload.warmup:
+            self.log.info("warming up for {s} s".format(s=self.workload.warmup))
+            self._drive(self.workload.warmup, None)
+        stats_by_template = dict((template.name, TemplateStats()) for template in self.workload.templates)
+        self.log.info("measuring for {s} s".format(s=self.workload.duration))
+        start = self.clock()
+        self._drive(self.workload.duration, stats_by_template)
+        return LoadReport(stats_by_template, self.clock() - start)
+
+    def _drive(self, seconds, stats_by_template):
+        lock = threading.Lock()
+
+        def timed_query(name, query, due):
+            try:
+                received = execute_query(self.endpoint, query, self.workload.timeout)
+                latency = self.clock() - due
+                if stats_by_template is not None:
+                    with lock:
+                        stats_by_template[name].latencies.append(latency)
+                        stats_by_template[name].result_bytes += received
+            except (IOError, OSError, ValueError) as ex:
+                self.log.debug("query of template {n} failed: {ex}".format(n=name, ex=ex))
+                if stats_by_template is not None:
+                    with lock:
+                        stats_by_template[name].errors[error_kind(ex)] += 1
+
+        end = self.clock() + seconds
+        if self.workload.rate:
+            self._open_loop(timed_query, end)
+        else:
+            self._closed_loop(timed_query, end)
+
+    def _open_loop(self, timed_query, end):
+        rng = random.Random(self.workload.seed)
+        interval = 1.0 / self.workload.rate
+        with ThreadPoolExecutor(max_workers=self.workload.concurrency,
+                                thread_name_prefix=child_thread_name('dld-loadgen')) as executor:
+            due = self.clock()
+            while due < end:
+                wait = due - self.clock()
+                if wait > 0:
+                    time.sleep(wait)
+                name, query = self.workload.next_query(rng)
+                executor.submit(timed_query, name, query, due)
+                due += interval
+
+    def _closed_loop(self, timed_query, end):
+        def client(client_idx):
+            rng = random.Random("{s}-{i}".format(s=self.workload.seed, i=client_idx))
+            while self.clock() < end:
+                name, query = self.workload.next_query(rng)
+                timed_query(name, query, self.clock())
+
+        with ThreadPoolExecutor(max_workers=self.workload.concurrency,
+                                thread_name_prefix=child_thread_name('dld-loadgen')) as executor:
+            list(executor.map(client, range(self.workload.concurrency)))
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+from os import path as osp
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from data.transfer import ExponentialBackoff, TRANSFER_ERRORS
+from tools import child_thread_name, is_dict_like, is_list_like
+
+VERIFY_CACHE_FILE = osp.join('.dld', 'verify-cache.json')
+SPARQL_RESULTS_JSON = 'application/sparql-results+json'
+CHUNK_SIZE = 64 * 1024
+# a COUNT result is a single binding, anything much larger is not what was asked for
+MAX_RESULT_BYTES = 1024 * 1024
+
+
+class SparqlQueryError(IOError):
+    pass
+
+
+def count_query(graph_name):
+    return "SELECT (COUNT(*) AS ?count) WHERE {{ GRAPH <{g}> {{ ?s ?p ?o }} }}".format(g=graph_name)
+
+
+def read_json_result(response, max_bytes=MAX_RESULT_BYTES):
+    """
+    Reads a JSON result from the response stream chunk by chunk, refusing results beyond max_bytes.
+    """
+    chunks = list()
+    received = 0
+    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+        received += len(chunk)
+        if received > max_bytes:
+            raise SparqlQueryError("result exceeds {m} bytes".format(m=max_bytes))
+        chunks.append(chunk)
+    try:
+        return json.loads(b''.join(chunks).decode('utf-8'))
+    except ValueError as ex:
+        raise SparqlQueryError("malformed JSON result: {ex}".format(ex=ex))
+
+
+def query_count(endpoint, graph_name, timeout=300):
+    """
+    :return: number of triples in the named graph
+    """
+    request = Request(endpoint + '?' + urlencode({'query': count_query(graph_name)}),
+                      headers={'Accept': SPARQL_RESULTS_JSON})
+    with urlopen(request, timeout=timeout) as response:
+        result = read_json_result(response)
+    try:
+        bindings = result['results']['bindings']
+        return bindings and int(bindings[0]['count']['value']) or 0
+    except (KeyError, TypeError, ValueError) as ex:
+        raise SparqlQueryError("unexpected COUNT result: {ex}".format(ex=ex))
+
+
+def endpoint_from_compose(compose_config, store_service='store'):
+    """
+    :return: URL of the SPARQL endpoint of the store published on the local host (None if no port is published)
+    """
+    for port in (compose_config.get(store_service) or dict()).get('ports') or []:
+        parts = str(port).split(':')
+        if len(parts) >= 2:
+            return "http://localhost:{p}/sparql".format(p=parts[-2])
+    return None
+
+
+class ExpectedCount(object):
+    """
+    Expected number of triples for a graph: an exact count or an inclusive range.
+    """
+
+    def __init__(self, minimum, maximum=None):
+        self.minimum = minimum
+        self.maximum = minimum if maximum is None else maximum
+
+    @classmethod
+    def parse(cls, value):
+        if isinstance(value, int):
+            return cls(value)
+        if (is_list_like(value) or isinstance(value, tuple)) and len(value) == 2:
+            return cls(int(value[0]), int(value[1]))
+        raise RuntimeError("expected count must be an integer or a [min, max] pair, got: {v}".format(v=value))
+
+    def matches(self, count):
+        return self.minimum <= count <= self.maximum
+
+    def __str__(self):
+        if self.minimum == self.maximum:
+            return str(self.minimum)
+        return "{a}..{b}".format(a=self.minimum, b=self.maximum)
+
+
+def parse_expected_counts(counts_config):
+    """
+    :param counts_config: mapping of graph names to integers or [min, max] pairs
+    :return: dict mapping graph names to ExpectedCount instances
+    """
+    if not is_dict_like(counts_config):
+        raise RuntimeError("expected counts need to be a mapping of graph names to counts")
+    return dict((graph_name, ExpectedCount.parse(value)) for graph_name, value in counts_config.items())
+
+
+class CountCache(object):
+    """
+    Remembers the counts per graph for a store container (by container ID), so that verifying the same
+    store again only queries graphs not counted before. Only counts matching the expectation are remembered,
+    as other counts might still change (e.g. while the store is loading).
+    """
+
+    def __init__(self, filepath, container_id, refresh=False):
+        """
+        :param container_id: ID of the store container (None disables caching)
+        :param refresh: ignore the cached counts (still remembering the new ones)
+        """
+        self.filepath = filepath
+        self.container_id = container_id
+        self.refresh = refresh
+        try:
+            with open(filepath) as cache_fd:
+                self._counts = json.load(cache_fd)
+        except (IOError, ValueError):
+            self._counts = dict()
+
+    def get(self, graph_name):
+        if self.container_id is None or self.refresh:
+            return None
+        return self._counts.get(self.container_id, dict()).get(graph_name)
+
+    def put(self, graph_name, count):
+        if self.container_id is not None:
+            # counts for other (replaced) store containers are of no use anymore
+            self._counts = {self.container_id: dict(self._counts.get(self.container_id, dict()),
+                                                    **{graph_name: count})}
+
+    def save(self):
+        if self.container_id is None:
+            return
+        if not osp.isdir(osp.dirname(self.filepath)):
+            os.makedirs(osp.dirname(self.filepath))
+        with open(self.filepath, 'w') as cache_fd:
+            json.dump(self._counts, cache_fd, sort_keys=True)
+
+
+class GraphCountResult(object):
+    def __init__(self, graph_name, expected, count=None, error=None, cached=False):
+        self.graph_name = graph_name
+        self.expected = expected
+        self.count = count
+        self.error = error
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.error is None and self.expected.matches(self.count)
+
+    def format(self):
+        if self.error is not None:
+            return "{g}: expected {e}, query failed ({ex})".format(g=self.graph_name, e=self.expected, ex=self.error)
+        diff = self.expected.matches(self.count) and "ok" or "diff {d:+d}".format(
+            d=self.count - (self.count < self.expected.minimum and self.expected.minimum or self.expected.maximum))
+        return "{g}: expected {e}, found {c} ({d}{cached})".format(g=self.graph_name, e=self.expected, c=self.count,
+                                                                  d=diff, cached=self.cached and ", cached" or "")
+
+
+class CountVerifier(object):
+    """
+    Compares the triple counts of named graphs in a SPARQL endpoint with expected counts, running one COUNT
+    query per graph (with bounded concurrency, a timeout and retries) instead of a single aggregation over
+    the whole store.
+    """
+    log = logging.getLogger('dld.CountVerifier')
+
+    def __init__(self, endpoint, concurrency=4, timeout=300, retries=2, cache=None, backoff=None):
+        """
+        :param endpoint: URL of the SPARQL endpoint
+        :param concurrency: maximal number of concurrent queries
+        :param timeout: seconds to wait for the result of a query
+        :param retries: number of retries of a failed query
+        :param cache: CountCache instance (or None)
+        """
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        self.backoff = backoff or ExponentialBackoff()
+
+    def _count(self, graph_name, expected):
+        cached_count = None
+        if self.cache is not None:
+            cached_count = self.cache.get(graph_name)
+        if cached_count is not None and expected.matches(cached_count):
+            return GraphCountResult(graph_name, expected, cached_count, cached=True)
+        for attempt in range(self.retries + 1):
+            try:
+                start = time.time()
+                count = query_count(self.endpoint, graph_name, self.timeout)
+                self.log.debug("counted {c} triples in {g} in {s:.1f} s".format(c=count, g=graph_name,
+                                                                               s=time.time() - start))
+                return GraphCountResult(graph_name, expected, count)
+            except (TRANSFER_ERRORS + (SparqlQueryError,)) as ex:
+                if attempt >= self.retries:
+                    return GraphCountResult(graph_name, expected, error=ex)
+                delay = self.backoff.delay(attempt)
+                self.log.warning("counting {g} failed ({ex}), retrying in {d:.1f} s"
+                                 .format(g=graph_name, ex=ex, d=delay))
+                time.sleep(delay)
+
+    def verify(self, expected_counts):
+        """
+        :param expected_counts: dict mapping graph names to ExpectedCount instances
+        :return: list of GraphCountResult instances, sorted by graph name
+        """
+        graph_names = sorted(expected_counts)
+        if not graph_names:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(graph_names)),
+                                thread_name_prefix=child_thread_name('dld-verify')) as executor:
+            results = list(executor.map(lambda g: self._count(g, expected_counts[g]), graph_names))
+        if self.cache is not None:
+            for result in results:
+                if result.ok:
+                    self.cache.put(result.graph_name, result.count)
+            self.cache.save()
+        return results
+
+
+def format_verification(results):
+    failed = [result for result in results if not result.ok]
+    lines = ["{n} graphs verified, {f} diverging".format(n=len(results), f=len(failed))]
+    lines.extend(("  " + (result.ok and "  " or "! ") + result.format()) for result in results)
+    return "\n".join(lines)
@@ -0,0 +1,71 @@
+import tempfile
+import shutil
+from os import path as osp
+
+from batch import BatchPlan, Deployment, batch_working_dirs, format_batch_summary
+from tests.support import DLDTestConfig, StandInServer, PAYLOAD
+
+
+def test_shared_sources_are_downloaded_once():
+    """
+        two deployments referencing the same location get rewritten to the same shared local copy
+    """
+    batch_dir = tempfile.mkdtemp('_batch', 'test_shared_sources')
+    try:
+        with StandInServer() as server, StandInServer() as other_server:
+            deployments = [
+                Deployment('a-dld.yml', {'datasets': {'shared': {'location': server.url, 'graph_name': 'http://g'}}},
+                           DLDTestConfig(osp.join(batch_dir, 'wd-a'), link_local_sources=True)),
+                Deployment('b-dld.yml', {'datasets': {'same': {'location': server.url, 'graph_name': 'http://h'},
+                                                      'own': {'location': other_server.url}}},
+                           DLDTestConfig(osp.join(batch_dir, 'wd-b'), link_local_sources=True)),
+            ]
+            batch_plan = BatchPlan(deployments, osp.join(batch_dir, 'shared'))
+            len(batch_plan.collect()).should.equal(2)
+            batch_plan.fetch()
+
+            len(server.requests).should.equal(1)
+        shared_path = deployments[0].yaml_config['datasets']['shared']['file']
+        deployments[1].yaml_config['datasets']['same'].should.equal({'file': shared_path, 'graph_name': 'http://h'})
+        (deployments[1].yaml_config['datasets']['own']['file'] == shared_path).should.be(False)
+        with open(shared_path, 'rb') as shared_file:
+            (shared_file.read() == PAYLOAD).should.be(True)
+        [deployment.status for deployment in deployments].should.equal(['ok', 'ok'])
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+def test_working_dirs_of_configurations_with_the_same_name_differ():
+    batch_working_dirs(['de/dld.yml', 'en/dld.yml', 'other-dld.yml']).should.equal(['wd-de-dld', 'wd-en-dld',
+                                                                                   'wd-other'])
+    batch_working_dirs(['/srv/x/dld.yml', '/srv/a/x/dld.yml']).should.equal(['wd-srv-x-dld', 'wd-a-x-dld'])
+    batch_working_dirs.when.called_with(['de/dld.yml', 'de/dld.yaml']).should.throw(RuntimeError)
+    batch_working_dirs.when.called_with(['dld.yml', './dld.yml']).should.throw(RuntimeError)
+
+
+def test_deployments_with_failing_sources_fail():
+    batch_dir = tempfile.mkdtemp('_batch', 'test_failing_sources')
+    try:
+        with StandInServer() as server, StandInServer(missing=True) as missing_server:
+            deployments = [
+                Deployment('a-dld.yml', {'datasets': {'ok': {'location': server.url}}},
+                           DLDTestConfig(osp.join(batch_dir, 'wd-a'), link_local_sources=True)),
+                Deployment('b-dld.yml', {'datasets': {'ok': {'location': server.url},
+                                                      'missing': {'location': missing_server.url}}},
+                           DLDTestConfig(osp.join(batch_dir, 'wd-b'), link_local_sources=True,
+                                         download_settings={'max_attempts': 1})),
+            ]
+            batch_plan = BatchPlan(deployments, osp.join(batch_dir, 'shared'))
+            sources = batch_plan.collect()
+            batch_plan.fetch()
+        [deployment.status for deployment in deployments].should.equal(['ok', 'FAILED'])
+        str(deployments[1].error).should.contain(missing_server.url)
+        format_batch_summary(deployments, sources).should.contain('FAILED b-dld.yml')
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+for test in [test_shared_sources_are_downloaded_once, test_working_dirs_of_configurations_with_the_same_name_differ,
+             test_deployments_with_failing_sources_fail]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
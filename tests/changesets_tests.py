@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+from os import path as osp
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+from data.changesets import ChangesetSpec, apply_changeset, diff_sorted, external_sort, pending_changesets, \
+    read_sorted, subtract_sorted
+from data.datasets import ImportsCollector
+from tests.support import DLDTestConfig
+
+GRAPH = 'http://dld.aksw.org/data'
+
+
+def _triple(idx):
+    return '<http://dld.aksw.org/s{i}> <http://dld.aksw.org/p> "o{i}" .\n'.format(i=idx)
+
+
+def _write_ntriples(filepath, indices):
+    with open(filepath, 'w') as nt_file:
+        nt_file.write("".join(_triple(idx) for idx in indices))
+
+
+def test_external_sort_and_sorted_diffs():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lines = [('<http://dld.aksw.org/s{i}>  <http://dld.aksw.org/p> "o" .  \n'.format(i=i % 37)).encode('utf-8')
+                 for i in range(200)] + [b'# comment\n', b'\n']
+        sorted_path = osp.join(tmpdir, 'sorted.gz')
+        count = external_sort(lines, sorted_path, ChangesetSpec(run_statements=5, fan_in=2), tmpdir)
+        count.should.equal(37)
+        result = list(read_sorted(sorted_path))
+        result.should.equal(sorted(result))
+        result[0].should.equal(b'<http://dld.aksw.org/s0>  <http://dld.aksw.org/p> "o" .\n')
+        os.listdir(tmpdir).should.equal(['sorted.gz'])
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    list(diff_sorted([b'a', b'b', b'd'], [b'b', b'c', b'd', b'e'])).should.equal(
+        [('-', b'a'), ('+', b'c'), ('+', b'e')])
+    list(subtract_sorted([b'a', b'c', b'e'], [b'b', b'c', b'd'])).should.equal([b'a', b'e'])
+
+
+def test_changed_import_files_produce_changesets():
+    working_dir = tempfile.mkdtemp('_wd', 'test_changesets')
+    try:
+        config = DLDTestConfig(working_dir, changeset_settings={'batch_statements': 2})
+        os.makedirs(config.models_dir)
+        first_path, second_path = osp.join(working_dir, 'first.nt'), osp.join(working_dir, 'second.nt')
+        _write_ntriples(first_path, range(0, 10))
+        _write_ntriples(second_path, range(8, 12))
+        datasets = {'first': {'file': first_path, 'graph_name': GRAPH},
+                    'second': {'file': second_path, 'graph_name': GRAPH}}
+
+        ImportsCollector(config).prepare(datasets)
+        pending_changesets(working_dir).should.equal([])
+
+        # s0 and s9 are removed (s9 is still in second.nt), s20 is added
+        _write_ntriples(first_path, list(range(1, 9)) + [20])
+        ImportsCollector(config).prepare(datasets)
+        ImportsCollector(config).prepare(datasets)
+        pending = pending_changesets(working_dir)
+        [osp.basename(d) for d in pending].should.equal(['00001-first'])
+        with open(osp.join(pending[0], 'changeset.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        (manifest['removed'], manifest['added'], manifest['graph']).should.equal((1, 1, GRAPH))
+        with gzip.open(osp.join(pending[0], 'removed.nt.gz'), 'rb') as removed_file:
+            removed_file.read().decode('utf-8').should.equal(_triple(0))
+        with open(osp.join(pending[0], 'update-00002.ru')) as update_file:
+            update_file.read().should.equal("INSERT DATA {{ GRAPH <{g}> {{\n{t}}} }}\n".format(g=GRAPH, t=_triple(20)))
+
+        ImportsCollector(config).prepare({'first': datasets['first']})
+        [osp.basename(d) for d in pending_changesets(working_dir)].should.equal(['00001-first', '00002-second'])
+        with open(osp.join(pending_changesets(working_dir)[1], 'changeset.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        (manifest['removed'], manifest['added'], manifest['update_files']).should.equal((3, 0, 2))
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_added_import_files_and_blank_node_removals():
+    working_dir = tempfile.mkdtemp('_wd', 'test_changesets_added')
+    try:
+        config = DLDTestConfig(working_dir, changeset_settings=True)
+        os.makedirs(config.models_dir)
+        first_path, second_path = osp.join(working_dir, 'first.nt'), osp.join(working_dir, 'second.nt')
+        with open(first_path, 'w') as nt_file:
+            nt_file.write(_triple(0) + '_:x <http://dld.aksw.org/p> "3" .\n')
+        datasets = {'first': {'file': first_path, 'graph_name': GRAPH}}
+        ImportsCollector(config).prepare(datasets)
+
+        _write_ntriples(second_path, [1, 2])
+        datasets['second'] = {'file': second_path, 'graph_name': GRAPH}
+        ImportsCollector(config).prepare(datasets)
+        [osp.basename(d) for d in pending_changesets(working_dir)].should.equal(['00001-second'])
+        with open(osp.join(pending_changesets(working_dir)[0], 'changeset.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        (manifest['removed'], manifest['added'], manifest['graph']).should.equal((0, 2, GRAPH))
+
+        _write_ntriples(first_path, [0])
+        ImportsCollector(config).prepare(datasets)
+        directory = pending_changesets(working_dir)[1]
+        with open(osp.join(directory, 'changeset.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        (manifest['removed'], manifest['blank_node_removals'], manifest['update_files']).should.equal((0, 1, 0))
+        with gzip.open(osp.join(directory, manifest['blank_node_removals_file']), 'rb') as removals_file:
+            removals_file.read().should.equal(b'_:x <http://dld.aksw.org/p> "3" .\n')
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+class UpdateEndpointHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        self.server.updates.append(parse_qs(body)['update'][0])
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def test_pending_changesets_are_applied_in_order():
+    working_dir = tempfile.mkdtemp('_wd', 'test_changesets_apply')
+    server = HTTPServer(('127.0.0.1', 0), UpdateEndpointHandler)
+    server.updates = list()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        directory = osp.join(working_dir, 'changesets', '00001-first')
+        os.makedirs(directory)
+        for name, content in [('changeset.json', '{}'), ('update-00002.ru', 'INSERT DATA {}'),
+                              ('update-00001.ru', 'DELETE DATA {}')]:
+            with open(osp.join(directory, name), 'w') as changeset_file:
+                changeset_file.write(content)
+
+        apply_changeset(directory, "http://127.0.0.1:{p}/sparql".format(p=server.server_address[1])).should.equal(2)
+        server.updates.should.equal(['DELETE DATA {}', 'INSERT DATA {}'])
+        pending_changesets(working_dir).should.equal([])
+    finally:
+        server.shutdown()
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_external_sort_and_sorted_diffs, test_changed_import_files_produce_changesets,
+             test_added_import_files_and_blank_node_removals, test_pending_changesets_are_applied_in_order]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
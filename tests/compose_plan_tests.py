@@ -0,0 +1,92 @@
+import contextlib
+
+from docker.errors import APIError
+
+from orchestration.engine import outdated_image_services
+from orchestration.plan import ComposePlan, normalize_compose_config, normalize_service_config, service_dependencies
+from tests.support import NotFoundResponse
+
+COMPOSE_CONFIG = normalize_compose_config({
+    'store': {'image': 'aksw/dld-store-virtuoso7', 'ports': ['8891:8890']},
+    'load': {'image': 'aksw/dld-load-virtuoso', 'links': ['store'], 'volumes_from': ['store']},
+    'presentontowiki': {'image': 'aksw/dld-present-ontowiki', 'links': ['store:store'], 'ports': ['8081:80']},
+    'presentyasgui': {'image': 'aksw/dld-present-yasgui', 'links': ['presentontowiki'], 'ports': ['8082:80']},
+})
+
+
+class FakeImageDockerClient(object):
+    """
+    knows the image ids of the existing containers and of the image references
+    """
+
+    def __init__(self, container_images, image_ids):
+        self.container_images = container_images
+        self.image_ids = image_ids
+
+    def inspect_container(self, name):
+        if name not in self.container_images:
+            raise APIError('no such container', NotFoundResponse())
+        return {'Image': self.container_images[name]}
+
+    def inspect_image(self, image):
+        if image not in self.image_ids:
+            raise APIError('no such image', NotFoundResponse())
+        return {'Id': self.image_ids[image]}
+
+
+class ComposeEnvironment(dict):
+    pass
+
+
+def fake_client_factory(fake_client):
+    @contextlib.contextmanager
+    def client_context():
+        yield fake_client
+
+    return client_context
+
+
+def test_service_configs_are_normalized():
+    normalized = normalize_service_config({
+        'links': ['store', 'cache:store', 'store'], 'volumes': ['/b:/b', '/a:/a', '/b:/b'],
+        'ports': [8890, '8891:8890'], 'environment': {'A': '1'}, 'image': 'aksw/dld'})
+    normalized.should.equal({'links': ['cache:store', 'store'], 'volumes': ['/b:/b', '/a:/a'],
+                             'ports': [8890, '8891:8890'], 'environment': {'A': '1'}, 'image': 'aksw/dld'})
+    type(normalize_service_config({'environment': ComposeEnvironment(A='1')})['environment']).should.be(dict)
+    service_dependencies(COMPOSE_CONFIG, 'presentontowiki').should.equal(set(['store']))
+    service_dependencies(COMPOSE_CONFIG, 'store').should.equal(set())
+
+
+def test_plan_recreates_the_dependents_of_changed_services():
+    unchanged = ComposePlan(COMPOSE_CONFIG, COMPOSE_CONFIG)
+    (unchanged.changed_services, unchanged.unchanged).should.equal(([], sorted(COMPOSE_CONFIG)))
+    unchanged.report().should.contain('(no changes to the compose services)')
+
+    changed_config = dict(COMPOSE_CONFIG, store=dict(COMPOSE_CONFIG['store'], ports=['8892:8890']))
+    del changed_config['presentyasgui']
+    changed_config['cache'] = {'image': 'aksw/dld', 'links': ['store']}
+    plan = ComposePlan(COMPOSE_CONFIG, changed_config)
+    (plan.created, plan.removed, plan.unchanged).should.equal((['cache'], ['presentyasgui'], []))
+    plan.recreated.should.equal(['load', 'presentontowiki', 'store'])
+    plan.reasons['load'].should.equal('depends on store')
+    plan.report().should.contain('  recreate store (configuration changed)')
+
+
+def test_plan_recreates_services_with_changed_images():
+    plan = ComposePlan(COMPOSE_CONFIG, COMPOSE_CONFIG, outdated_images=['presentontowiki'])
+    plan.recreated.should.equal(['presentontowiki', 'presentyasgui'])
+    (plan.reasons['presentontowiki'], plan.reasons['presentyasgui']).should.equal(
+        ('image changed', 'depends on presentontowiki'))
+
+    fake_client = FakeImageDockerClient(
+        {'wdplan_store_1': 'sha256:store-old', 'wdplan_load_1': 'sha256:load', 'wdplan_presentyasgui_1': 'sha256:x'},
+        {'aksw/dld-store-virtuoso7': 'sha256:store-new', 'aksw/dld-load-virtuoso': 'sha256:load',
+         'aksw/dld-present-ontowiki': 'sha256:ontowiki'})
+    outdated_image_services(COMPOSE_CONFIG, 'wdplan', fake_client_factory(fake_client)).should.equal(['store'])
+
+
+for test in [test_service_configs_are_normalized,
+             test_plan_recreates_the_dependents_of_changed_services,
+             test_plan_recreates_services_with_changed_images]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
@@ -0,0 +1,119 @@
+import contextlib
+import threading
+
+from docker.errors import APIError
+
+from orchestration.engine import EngineOrchestrator, dependency_levels, CONFIG_HASH_LABEL
+from tests.support import NotFoundResponse
+
+COMPOSE_CONFIG = {
+    'store': {'image': 'aksw/dld-store-virtuoso7', 'ports': ['8891:8890'], 'volumes': ['/var/lib/virtuoso/db']},
+    'load': {'image': 'aksw/dld-load-virtuoso', 'links': ['store'], 'volumes_from': ['store'],
+             'volumes': ['/tmp/models:/import'], 'environment': {'IMPORT_SRC': '/import'}},
+    'presentontowiki': {'image': 'aksw/dld-present-ontowiki', 'links': ['store'], 'ports': ['8081:80']}
+}
+
+
+class FakeDockerClient(object):
+    """
+    records the containers created and started, containers are known by name and id
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.containers = dict()
+        self.started = list()
+        self.removed = list()
+
+    def inspect_container(self, name):
+        with self.lock:
+            if name not in self.containers:
+                raise APIError('no such container', NotFoundResponse())
+            return self.containers[name]
+
+    def create_host_config(self, **kwargs):
+        return kwargs
+
+    def create_container(self, image, name=None, labels=None, host_config=None, **kwargs):
+        with self.lock:
+            self.containers[name] = {'Id': name, 'Config': {'Image': image, 'Labels': labels,
+                                                            'Volumes': kwargs.get('volumes')},
+                                     'HostConfig': host_config, 'State': {'Running': False}}
+            return {'Id': name}
+
+    def start(self, container_id):
+        with self.lock:
+            self.started.append(container_id)
+            self.containers[container_id]['State']['Running'] = True
+
+    def remove_container(self, container_id, force=False):
+        with self.lock:
+            self.removed.append(container_id)
+            del self.containers[container_id]
+
+
+def fake_client_factory(fake_client):
+    @contextlib.contextmanager
+    def client_context():
+        yield fake_client
+
+    return client_context
+
+
+def test_dependency_levels_from_links_and_volumes_from():
+    dependency_levels(COMPOSE_CONFIG).should.equal([['store'], ['load', 'presentontowiki']])
+    dependency_levels(COMPOSE_CONFIG, ['load']).should.equal([['store'], ['load']])
+
+
+def test_engine_up_starts_dependencies_first_and_wires_containers():
+    fake_client = FakeDockerClient()
+    orchestrator = EngineOrchestrator(COMPOSE_CONFIG, 'enginetest', client_factory=fake_client_factory(fake_client))
+    orchestrator.up()
+
+    fake_client.started[0].should.equal('enginetest_store_1')
+    sorted(fake_client.started[1:]).should.equal(['enginetest_load_1', 'enginetest_presentontowiki_1'])
+    load_host_config = fake_client.containers['enginetest_load_1']['HostConfig']
+    load_host_config['links'].should.equal([('enginetest_store_1', 'store')])
+    load_host_config['volumes_from'].should.equal(['enginetest_store_1'])
+    load_host_config['binds'].should.equal(['/tmp/models:/import'])
+    fake_client.containers['enginetest_load_1']['Config']['Volumes'].should.equal(['/import'])
+    fake_client.containers['enginetest_store_1']['HostConfig']['binds'].should.equal([])
+    fake_client.containers['enginetest_store_1']['Config']['Volumes'].should.equal(['/var/lib/virtuoso/db'])
+    fake_client.containers['enginetest_store_1']['HostConfig']['port_bindings'].should.equal({'8890': '8891'})
+
+
+def test_engine_up_recreates_only_changed_services():
+    fake_client = FakeDockerClient()
+    EngineOrchestrator(COMPOSE_CONFIG, 'enginetest', client_factory=fake_client_factory(fake_client)).up()
+    store_hash = fake_client.containers['enginetest_store_1']['Config']['Labels'][CONFIG_HASH_LABEL]
+
+    changed_config = dict(COMPOSE_CONFIG)
+    changed_config['presentontowiki'] = dict(COMPOSE_CONFIG['presentontowiki'], ports=['8082:80'])
+    EngineOrchestrator(changed_config, 'enginetest', client_factory=fake_client_factory(fake_client)).up()
+
+    fake_client.removed.should.equal(['enginetest_presentontowiki_1'])
+    fake_client.containers['enginetest_store_1']['Config']['Labels'][CONFIG_HASH_LABEL].should.equal(store_hash)
+
+
+def test_engine_up_recreates_dependents_of_recreated_services():
+    fake_client = FakeDockerClient()
+    EngineOrchestrator(COMPOSE_CONFIG, 'enginetest', client_factory=fake_client_factory(fake_client)).up()
+
+    changed_config = dict(COMPOSE_CONFIG)
+    changed_config['store'] = dict(COMPOSE_CONFIG['store'], ports=['8892:8890'])
+    EngineOrchestrator(changed_config, 'enginetest', client_factory=fake_client_factory(fake_client)).up()
+
+    fake_client.removed[0].should.equal('enginetest_store_1')
+    sorted(fake_client.removed[1:]).should.equal(['enginetest_load_1', 'enginetest_presentontowiki_1'])
+    fake_client.started[-3].should.equal('enginetest_store_1')
+
+    EngineOrchestrator(changed_config, 'enginetest', client_factory=fake_client_factory(fake_client)).up(['load'])
+    len(fake_client.removed).should.equal(3)
+
+
+for test in [test_dependency_levels_from_links_and_volumes_from,
+             test_engine_up_starts_dependencies_first_and_wires_containers,
+             test_engine_up_recreates_only_changed_services,
+             test_engine_up_recreates_dependents_of_recreated_services]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
@@ -0,0 +1,76 @@
+import os
+import shutil
+import stat
+import tempfile
+from os import path as osp
+
+from data.datasets import ImportsCollector, GRAPH_INDEX_FILE, format_graph_index, read_graph_index
+from tests.support import DLDTestConfig
+from tools import current_umask, write_if_changed
+
+DEFAULT_GRAPH = 'http://dld.aksw.org/default#'
+
+
+def _mode(file_path):
+    return stat.S_IMODE(os.stat(file_path).st_mode)
+
+
+def test_atomic_write_replaces_changed_files_keeping_their_mode():
+    working_dir = tempfile.mkdtemp('_wd', 'test_atomic_write')
+    try:
+        target = osp.join(working_dir, 'index')
+        write_if_changed(target, 'a\n', atomic=True).should.be(True)
+        _mode(target).should.equal(0o666 & ~current_umask())
+        write_if_changed(target, 'a\n', atomic=True).should.be(False)
+
+        os.chmod(target, 0o640)
+        inode = os.stat(target).st_ino
+        write_if_changed(target, 'b\n', atomic=True).should.be(True)
+        (os.stat(target).st_ino != inode).should.be(True)
+        _mode(target).should.equal(0o640)
+        with open(target) as written:
+            written.read().should.equal('b\n')
+        os.listdir(working_dir).should.equal(['index'])
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_graph_index_maps_import_files_to_their_graphs():
+    working_dir = tempfile.mkdtemp('_wd', 'test_graph_index')
+    try:
+        config = DLDTestConfig(working_dir, default_graph_name=DEFAULT_GRAPH, graph_index=True)
+        os.makedirs(config.models_dir)
+        datasets = dict()
+        for name in ['a', 'b']:
+            source_path = osp.join(working_dir, name + '.nt')
+            with open(source_path, 'w') as source_file:
+                source_file.write('<http://dld.aksw.org/{n}> <http://dld.aksw.org/p> "o" .\n'.format(n=name))
+            datasets[name] = {'file': source_path}
+        datasets['b']['graph_name'] = 'http://dld.aksw.org/b'
+
+        ImportsCollector(config).prepare(datasets)
+        index_path = osp.join(config.models_dir, GRAPH_INDEX_FILE)
+        expected = {'a.nt': DEFAULT_GRAPH, 'b.nt': 'http://dld.aksw.org/b'}
+        read_graph_index(index_path).should.equal(expected)
+        with open(index_path) as index_file:
+            index_file.read().should.equal(format_graph_index(expected))
+
+        inode = os.stat(index_path).st_ino
+        ImportsCollector(config).prepare(datasets)
+        os.stat(index_path).st_ino.should.equal(inode)
+
+        del datasets['b']
+        ImportsCollector(config).prepare(datasets)
+        read_graph_index(index_path).should.equal({'a.nt': DEFAULT_GRAPH})
+
+        config.graph_index = False
+        ImportsCollector(config).prepare(datasets)
+        osp.exists(index_path).should.be(False)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_atomic_write_replaces_changed_files_keeping_their_mode,
+             test_graph_index_maps_import_files_to_their_graphs]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
@@ -0,0 +1,843 @@
+"""
+Hermetic backend for the integration tests: a fake Docker engine serving the parts of the Docker Remote API used
+by DLDConfig, docker-compose (run_compose) and the engine backend, whose containers are simulated in-process:
+
+    * store containers answer SPARQL COUNT/ASK queries and INSERT/DELETE DATA updates from an in-memory graph
+      store, published on a free port of the loopback interface (see FakeEngine.published_endpoint)
+    * load containers ingest the N-Triples/Turtle files of the import directory bound to them into the store
+      they are linked to, honouring .graph and global.graph files, and then log the completion message of
+      the Virtuoso loader
+    * all other containers just keep running until they are stopped
+
+Images are treated as present, pulls succeed immediately. Run the integration tests against it with:
+
+    DLD_TEST_BACKEND=hermetic nosetests tests/import_integration_tests.py
+
+As the backend is announced through DOCKER_HOST, tests share one backend per process; use several processes
+(e.g. nosetests --processes=4) to run them in parallel.
+"""
+import base64
+import bz2
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import lzma
+import os
+from os import path as osp
+import re
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse, unquote
+
+from data.datasets import GLOBAL_GRAPH_FILE
+from tests.support import ThreadingHTTPServer
+from tools import FilenameOps
+
+ENGINE_VERSION = '1.12.0'
+API_VERSION = '1.24'
+LOADER_COMPLETED_MESSAGE = 'done loading graphs (start hanging around idle)'
+RDF_EXTENSIONS = ('.nt', '.ttl', '.n3', '.nq')
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+DIRECTIVE_PATTERN = re.compile(r'^(@prefix|@base|prefix|base)\s', re.IGNORECASE)
+GRAPH_BLOCK_PATTERN = re.compile(r'(INSERT|DELETE)\s+DATA\s*\{\s*GRAPH\s*<([^>]+)>\s*\{(.*?)\}\s*\}', re.DOTALL)
+VERSION_PREFIX_PATTERN = re.compile(r'^/v\d+\.\d+')
+XSD_INTEGER = 'http://www.w3.org/2001/XMLSchema#integer'
+STDOUT_STREAM = 1
+
+LOG = logging.getLogger('dld.test.hermetic')
+
+
+def read_statements(filepath):
+    """
+    Reads the statements of an N-Triples or (line oriented) Turtle file, optionally compressed. Directives are
+    skipped, statements spanning several lines are joined and whitespace is normalized.
+
+    :return: generator over the statements (without the terminating ' .')
+    """
+    _, compression = osp.splitext(filepath)
+    opener = OPENERS.get(compression, open)
+    pending = list()
+    with opener(filepath, 'rt', encoding='utf-8') as rdf_file:
+        for line in rdf_file:
+            line = line.strip()
+            if not line or line.startswith('#') or DIRECTIVE_PATTERN.match(line):
+                continue
+            pending.append(line)
+            if line.endswith('.'):
+                yield " ".join(" ".join(pending)[:-1].split())
+                pending = list()
+
+
+class StandInStore(object):
+    """
+    Keeps the statements per graph in memory (as sets, loading a statement twice does not count twice) and
+    answers the queries of sparql.verify over HTTP.
+    """
+
+    def __init__(self):
+        self.graphs = defaultdict(set)
+        self.lock = threading.Lock()
+        self.server = None
+
+    def add(self, graph_name, statements):
+        with self.lock:
+            self.graphs[graph_name].update(statements)
+
+    def remove(self, graph_name, statements):
+        with self.lock:
+            self.graphs[graph_name].difference_update(statements)
+
+    def count(self, graph_name=None):
+        with self.lock:
+            if graph_name is None:
+                return sum(len(statements) for statements in self.graphs.values())
+            return len(self.graphs.get(graph_name, ()))
+
+    def serve(self):
+        """
+        :return: the port the SPARQL endpoint (at any path) listens on
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInStoreHandler)
+        self.server.store = self
+        threading.Thread(target=self.server.serve_forever, name='dld-stand-in-store', daemon=True).start()
+        return self.server.server_address[1]
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def update(self, update):
+        blocks = GRAPH_BLOCK_PATTERN.findall(update)
+        if not blocks:
+            raise ValueError("unsupported update (only INSERT DATA/DELETE DATA with a GRAPH)")
+        for operation, graph_name, body in blocks:
+            statements = [" ".join(line.strip()[:-1].split()) for line in body.splitlines()
+                          if line.strip().endswith('.')]
+            if operation.upper() == 'INSERT':
+                self.add(graph_name, statements)
+            else:
+                self.remove(graph_name, statements)
+
+    def answer(self, query):
+        """
+        :return: SPARQL JSON result of a COUNT or ASK query
+        """
+        if re.search(r'\bCOUNT\s*\(', query, re.IGNORECASE):
+            graph_match = re.search(r'GRAPH\s*<([^>]+)>', query)
+            count = self.count(graph_match and graph_match.group(1) or None)
+            return {'head': {'vars': ['count']},
+                    'results': {'bindings': [{'count': {'type': 'typed-literal', 'datatype': XSD_INTEGER,
+                                                        'value': str(count)}}]}}
+        if re.match(r'\s*ASK\b', query, re.IGNORECASE):
+            return {'head': {}, 'boolean': self.count() > 0}
+        raise ValueError("unsupported query (only COUNT and ASK queries are answered)")
+
+
+class StandInStoreHandler(BaseHTTPRequestHandler):
+    def log_message(self, msg_format, *args):
+        LOG.debug("store: " + msg_format % args)
+
+    def do_GET(self):
+        self._handle(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        params = parse_qs(urlparse(self.path).query)
+        if self.headers.get('Content-Type', '').startswith('application/sparql-update'):
+            params['update'] = [body]
+        elif self.headers.get('Content-Type', '').startswith('application/sparql-query'):
+            params['query'] = [body]
+        else:
+            params.update(parse_qs(body))
+        self._handle(params)
+
+    def _handle(self, params):
+        store = self.server.store
+        try:
+            if 'update' in params:
+                store.update(params['update'][0])
+                result = None
+            elif 'query' in params:
+                result = store.answer(params['query'][0])
+            else:
+                raise ValueError("neither a query nor an update given")
+        except ValueError as ex:
+            self.send_error(400, str(ex))
+            return
+        body = result is not None and json.dumps(result).encode('utf-8') or b''
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def ingest_import_dir(store, import_dir, default_graph=None, log=LOG):
+    """
+    Loads the RDF files of an import directory into the store: into the graph named in the .graph file of a
+    file, else in global.graph, else into the default graph.
+
+    :return: dict with the number of statements read per graph
+    """
+    global_graph_path = osp.join(import_dir, GLOBAL_GRAPH_FILE)
+    if osp.isfile(global_graph_path):
+        with open(global_graph_path) as graph_file:
+            default_graph = graph_file.read().strip() or default_graph
+    read_counts = defaultdict(int)
+    for basename in sorted(os.listdir(import_dir)):
+        filepath = osp.join(import_dir, basename)
+        stripped = FilenameOps.strip_compression_extensions(basename)
+        if not osp.isfile(filepath) or not stripped.endswith(RDF_EXTENSIONS):
+            continue
+        graph_name = default_graph
+        graph_path = osp.join(import_dir, FilenameOps.graph_file_name(basename))
+        if osp.isfile(graph_path):
+            with open(graph_path) as graph_file:
+                graph_name = graph_file.read().strip()
+        if not graph_name:
+            log.warning("no graph for {f}, skipping it".format(f=basename))
+            continue
+        statements = list(read_statements(filepath))
+        store.add(graph_name, statements)
+        read_counts[graph_name] += len(statements)
+        log.info("loaded {n} statements of {f} into <{g}>".format(n=len(statements), f=basename, g=graph_name))
+    return dict(read_counts)
+
+
+class FakeContainer(object):
+    def __init__(self, container_id, name, create_config):
+        self.id = container_id
+        self.name = name
+        self.config = create_config
+        self.host_config = create_config.get('HostConfig') or dict()
+        self.labels = create_config.get('Labels') or dict()
+        self.env = dict(entry.partition('=')[::2] for entry in create_config.get('Env') or [])
+        self.created = time.time()
+        self.running = False
+        self.exit_code = 0
+        self.ports = dict()
+        self.log_lines = list()
+        self.changed = threading.Condition()
+        self.stop_requested = threading.Event()
+        self.store = None
+
+    @property
+    def image(self):
+        return self.config.get('Image')
+
+    @property
+    def service(self):
+        return self.labels.get('com.docker.compose.service') or self.name
+
+    @property
+    def project(self):
+        return self.labels.get('com.docker.compose.project')
+
+    @property
+    def role(self):
+        for role in ('store', 'load'):
+            if self.service.startswith(role) or ('-' + role) in (self.image or ''):
+                return role
+        return 'idle'
+
+    def log(self, message):
+        with self.changed:
+            self.log_lines.append(message + "\n")
+            self.changed.notify_all()
+
+    def set_running(self, running, exit_code=0):
+        with self.changed:
+            self.running = running
+            self.exit_code = exit_code
+            self.changed.notify_all()
+
+    def wait_stopped(self, timeout=None):
+        with self.changed:
+            self.changed.wait_for(lambda: not self.running, timeout)
+            return self.exit_code
+
+    def inspect(self, engine):
+        state = self.running and 'running' or (self.log_lines and 'exited' or 'created')
+        return {
+            'Id': self.id,
+            'Name': '/' + self.name,
+            'Created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.created)),
+            'Image': engine.image_id(self.image),
+            'Config': dict(self.config, Labels=self.labels, Env=self.config.get('Env') or []),
+            'HostConfig': self.host_config,
+            'State': {'Running': self.running, 'Status': state, 'ExitCode': self.exit_code, 'Pid': 0,
+                      'Paused': False, 'Restarting': False, 'OOMKilled': False, 'Dead': False},
+            'NetworkSettings': {'Ports': self.ports, 'IPAddress': '127.0.0.1', 'Networks': dict()},
+            'Mounts': [{'Source': source, 'Destination': destination, 'RW': True}
+                       for source, destination in engine.mounts(self)],
+        }
+
+    def summary(self, engine):
+        return {
+            'Id': self.id,
+            'Names': ['/' + self.name],
+            'Image': self.image,
+            'ImageID': engine.image_id(self.image),
+            'Labels': self.labels,
+            'State': self.running and 'running' or 'exited',
+            'Status': self.running and 'Up' or 'Exited ({c})'.format(c=self.exit_code),
+            'Created': int(self.created),
+            'Ports': [],
+        }
+
+
+class FakeEngine(object):
+    """
+    State of the fake Docker engine and the simulation of its containers.
+    """
+
+    def __init__(self, import_timeout=600):
+        """
+        :param import_timeout: seconds a load container waits for the preparation done marker with ready markers
+        """
+        self.import_timeout = import_timeout
+        self.containers = dict()
+        self.volumes = dict()
+        self.networks = dict()
+        self.pulled = set()
+        self.lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._volumes_dir = tempfile.mkdtemp(prefix='dld-fake-volumes-')
+
+    @staticmethod
+    def image_id(image):
+        return 'sha256:' + hashlib.sha256((image or '').encode('utf-8')).hexdigest()
+
+    def new_id(self):
+        return hashlib.sha256("container-{n}".format(n=next(self._ids)).encode('utf-8')).hexdigest()
+
+    def container(self, reference):
+        """
+        :param reference: ID, ID prefix or name of a container
+        """
+        reference = reference.lstrip('/')
+        with self.lock:
+            for container in self.containers.values():
+                if reference in (container.id, container.name) or \
+                        (len(reference) >= 12 and container.id.startswith(reference)):
+                    return container
+        return None
+
+    def service_container(self, project_name, service_name):
+        with self.lock:
+            for container in self.containers.values():
+                if (container.project, container.service) == (project_name, service_name) or \
+                        container.name == "{p}_{s}_1".format(p=project_name, s=service_name):
+                    return container
+        return None
+
+    def create(self, name, create_config):
+        with self.lock:
+            if name and self.container(name) is not None:
+                raise KeyError(name)
+            container = FakeContainer(self.new_id(), name or self.new_id()[:12], create_config)
+            self.containers[container.id] = container
+        return container
+
+    def remove(self, container):
+        self.stop(container)
+        with self.lock:
+            self.containers.pop(container.id, None)
+
+    def create_volume(self, name):
+        with self.lock:
+            if name not in self.volumes:
+                self.volumes[name] = tempfile.mkdtemp(prefix=name + '-', dir=self._volumes_dir)
+            return self.volumes[name]
+
+    def mounts(self, container):
+        """
+        :return: list of pairs of the host directory and the container path of the binds and volumes of a
+                 container (including those of the containers it has the volumes from)
+        """
+        mounts = list()
+        for bind in container.host_config.get('Binds') or []:
+            parts = bind.split(':')
+            if len(parts) < 2:
+                continue
+            source = parts[0]
+            if not osp.isabs(source):
+                source = self.create_volume(source)
+            mounts.append((source, parts[1]))
+        for reference in container.host_config.get('VolumesFrom') or []:
+            other = self.container(reference.split(':')[0])
+            if other is not None and other is not container:
+                mounts.extend(self.mounts(other))
+        return mounts
+
+    def host_path(self, container, path):
+        for source, destination in self.mounts(container):
+            if path == destination or path.startswith(destination.rstrip('/') + '/'):
+                return osp.join(source, osp.relpath(path, destination))
+        return None
+
+    def start(self, container):
+        if container.running:
+            return
+        container.stop_requested.clear()
+        container.set_running(True)
+        if container.role == 'store':
+            self._start_store(container)
+        elif container.role == 'load':
+            threading.Thread(target=self._run_loader, args=(container,), name='dld-stand-in-load-' +
+                             container.name, daemon=True).start()
+        else:
+            container.log("stand-in for {i} started".format(i=container.image))
+
+    def _start_store(self, container):
+        container.store = container.store or StandInStore()
+        port = container.store.serve()
+        exposed = list((container.host_config.get('PortBindings') or dict()).keys()) or \
+            list((container.config.get('ExposedPorts') or dict()).keys())
+        container.ports = dict((exposed_port, [{'HostIp': '127.0.0.1', 'HostPort': str(port)}])
+                               for exposed_port in exposed[:1])
+        container.log("stand-in store listening on port {p}".format(p=port))
+
+    def linked_store(self, container):
+        for link in container.host_config.get('Links') or []:
+            target, _, alias = link.partition(':')
+            if alias.strip('/').split('/')[-1] == 'store' or target.strip('/').endswith('_store_1'):
+                linked = self.container(target)
+                if linked is not None:
+                    return linked
+        return self.service_container(container.project, 'store')
+
+    def _run_loader(self, container):
+        try:
+            import_src = container.env.get('IMPORT_SRC', '/import')
+            import_dir = self.host_path(container, import_src)
+            if import_dir is None or not osp.isdir(import_dir):
+                raise RuntimeError("no import directory mounted at {p}".format(p=import_src))
+            if container.env.get('IMPORT_DONE_MARKER'):
+                done_marker = osp.join(import_dir, container.env['IMPORT_DONE_MARKER'])
+                deadline = time.time() + self.import_timeout
+                while not osp.exists(done_marker) and time.time() < deadline:
+                    if container.stop_requested.wait(0.05):
+                        return
+            store_container = self.linked_store(container)
+            if store_container is None or store_container.store is None:
+                raise RuntimeError("no running store linked")
+            counts = ingest_import_dir(store_container.store, import_dir, container.env.get('DEFAULT_GRAPH'))
+            for graph_name, count in sorted(counts.items()):
+                container.log("loaded {n} statements into <{g}>".format(n=count, g=graph_name))
+            # like the Virtuoso loader, keep running until stopped
+            container.log(LOADER_COMPLETED_MESSAGE)
+        except Exception as ex:
+            LOG.exception("stand-in loader {n} failed".format(n=container.name))
+            container.log("loading failed: {ex}".format(ex=ex))
+            container.set_running(False, 1)
+
+    def stop(self, container, exit_code=0):
+        container.stop_requested.set()
+        if container.store is not None:
+            container.store.shutdown()
+        if container.running:
+            container.set_running(False, exit_code)
+
+    def stop_all(self):
+        with self.lock:
+            containers = list(self.containers.values())
+        for container in containers:
+            self.stop(container)
+
+    def close(self):
+        self.stop_all()
+        shutil.rmtree(self._volumes_dir, ignore_errors=True)
+
+    def published_endpoint(self, project_name, service_name='store'):
+        """
+        :return: URL of the SPARQL endpoint of the stand-in store of a service (None if it is not running)
+        """
+        container = self.service_container(project_name, service_name)
+        if container is None or container.store is None or container.store.server is None:
+            return None
+        return "http://127.0.0.1:{p}/sparql".format(p=container.store.server.server_address[1])
+
+    def wait_for_log(self, project_name, service_name, pattern, timeout):
+        """
+        :return: True when the container of the service logged a line matching the pattern within the timeout
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            container = self.service_container(project_name, service_name)
+            if container is not None:
+                with container.changed:
+                    if any(pattern.search(line) for line in container.log_lines):
+                        return True
+                    if not container.running and container.log_lines:
+                        return False
+                    container.changed.wait(min(0.5, max(0, deadline - time.time())))
+            else:
+                time.sleep(0.05)
+        return False
+
+
+def _frame(line):
+    data = line.encode('utf-8')
+    return struct.pack('>BxxxL', STDOUT_STREAM, len(data)) + data
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    """
+    Serves the Docker Remote API calls (with or without a version prefix) on the FakeEngine of the server.
+    """
+    server_version = 'dld-fake-engine'
+
+    def log_message(self, msg_format, *args):
+        LOG.debug("engine: " + msg_format % args)
+
+    @property
+    def engine(self):
+        return self.server.engine
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _not_found(self, message):
+        self._send_json(404, {'message': message})
+
+    def _request(self):
+        url = urlparse(self.path)
+        path = VERSION_PREFIX_PATTERN.sub('', unquote(url.path))
+        params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        return path.rstrip('/'), params
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return length and self.rfile.read(length) or b''
+
+    def _json_body(self):
+        body = self._body()
+        return body and json.loads(body.decode('utf-8')) or dict()
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def _dispatch(self, method):
+        path, params = self._request()
+        if path.startswith('/containers/') and path != '/containers/create' and path != '/containers/json':
+            reference, _, action = path[len('/containers/'):].partition('/')
+            container = self.engine.container(reference)
+            if container is None:
+                self._not_found("No such container: {c}".format(c=reference))
+            else:
+                self._container_action(method, container, action, params)
+            return
+        if path.startswith('/images/') and path.endswith('/json') and path != '/images/json':
+            image = path[len('/images/'):-len('/json')]
+            self._send_json(200, {'Id': self.engine.image_id(image), 'RepoTags': [image], 'RepoDigests': [],
+                                  'Config': {'Labels': dict()}, 'ContainerConfig': {'Labels': dict()}})
+            return
+        handler = {
+            ('GET', '/_ping'): self._ping,
+            ('GET', '/version'): self._version,
+            ('GET', '/info'): self._info,
+            ('GET', '/containers/json'): self._list_containers,
+            ('POST', '/containers/create'): self._create_container,
+            ('GET', '/images/json'): self._list_images,
+            ('POST', '/images/create'): self._pull,
+            ('GET', '/volumes'): self._list_volumes,
+            ('POST', '/volumes/create'): self._create_volume,
+            ('GET', '/networks'): self._list_networks,
+            ('POST', '/networks/create'): self._create_network,
+        }.get((method, path))
+        if handler is not None:
+            handler(params)
+        elif path.startswith('/volumes/') and method in ('GET', 'DELETE'):
+            self._volume(method, path[len('/volumes/'):])
+        elif path.startswith('/networks/'):
+            self._network(method, path[len('/networks/'):])
+        else:
+            self._not_found("unsupported by the fake engine: {m} {p}".format(m=method, p=path))
+
+    def _ping(self, params):
+        body = b'OK'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _version(self, params):
+        self._send_json(200, {'Version': ENGINE_VERSION, 'ApiVersion': API_VERSION, 'MinAPIVersion': '1.12',
+                              'Os': 'linux', 'Arch': 'amd64', 'GoVersion': 'go1.6', 'GitCommit': 'hermetic',
+                              'KernelVersion': os.uname().release})
+
+    def _info(self, params):
+        with self.engine.lock:
+            containers = list(self.engine.containers.values())
+        self._send_json(200, {'Name': 'dld-fake-engine', 'ServerVersion': ENGINE_VERSION, 'Driver': 'fake',
+                              'Containers': len(containers),
+                              'ContainersRunning': len([c for c in containers if c.running]),
+                              'Images': len(self.engine.pulled), 'NCPU': os.cpu_count(), 'MemTotal': 0})
+
+    def _list_containers(self, params):
+        filters = json.loads(params.get('filters') or '{}')
+        label_filters = filters.get('label') or []
+        if isinstance(label_filters, dict):
+            label_filters = [label for label, enabled in label_filters.items() if enabled]
+        name_filters = filters.get('name') or []
+        with self.engine.lock:
+            containers = sorted(self.engine.containers.values(), key=lambda c: c.created)
+        listed = list()
+        for container in containers:
+            if not container.running and params.get('all') not in ('1', 'true', 'True'):
+                continue
+            if any(not self._has_label(container, label_filter) for label_filter in label_filters):
+                continue
+            if name_filters and not any(name.lstrip('/') in container.name for name in name_filters):
+                continue
+            listed.append(container.summary(self.engine))
+        self._send_json(200, listed)
+
+    @staticmethod
+    def _has_label(container, label_filter):
+        key, has_value, value = label_filter.partition('=')
+        if not has_value:
+            return key in container.labels
+        return container.labels.get(key) == value
+
+    def _create_container(self, params):
+        try:
+            container = self.engine.create(params.get('name'), self._json_body())
+        except KeyError:
+            self._send_json(409, {'message': "Conflict. The name {n} is already in use.".format(
+                n=params.get('name'))})
+            return
+        self._send_json(201, {'Id': container.id, 'Warnings': None})
+
+    def _container_action(self, method, container, action, params):
+        if method == 'DELETE' and not action:
+            if container.running and params.get('force') not in ('1', 'true', 'True'):
+                self._send_json(409, {'message': "container is running"})
+                return
+            self.engine.remove(container)
+            self._send_empty()
+        elif method == 'GET' and action == 'json':
+            self._send_json(200, container.inspect(self.engine))
+        elif method == 'POST' and action == 'start':
+            if container.running:
+                self._send_empty(304)
+                return
+            self.engine.start(container)
+            self._send_empty()
+        elif method == 'POST' and action in ('stop', 'kill'):
+            self.engine.stop(container, action == 'kill' and 137 or 0)
+            self._send_empty()
+        elif method == 'POST' and action == 'restart':
+            self.engine.stop(container)
+            self.engine.start(container)
+            self._send_empty()
+        elif method == 'POST' and action == 'wait':
+            self._send_json(200, {'StatusCode': container.wait_stopped()})
+        elif method == 'POST' and action == 'rename':
+            container.name = params.get('name', container.name)
+            self._send_empty()
+        elif action in ('logs', 'attach'):
+            self._stream_logs(container, params.get('follow') in ('1', 'true', 'True') or action == 'attach')
+        elif action == 'archive':
+            self._archive(method, container, params.get('path', '/'))
+        else:
+            self._not_found("unsupported by the fake engine: {m} {a}".format(m=method, a=action))
+
+    def _stream_logs(self, container, follow):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.end_headers()
+        position = 0
+        try:
+            while True:
+                with container.changed:
+                    if follow and position == len(container.log_lines) and container.running:
+                        container.changed.wait(0.5)
+                    lines = container.log_lines[position:]
+                    running = container.running
+                for line in lines:
+                    self.wfile.write(_frame(line))
+                self.wfile.flush()
+                position += len(lines)
+                if not follow or (not running and not lines):
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _archive(self, method, container, path):
+        host_path = self.engine.host_path(container, path)
+        if host_path is None:
+            self._not_found("no volume or bind at {p} in the fake engine".format(p=path))
+        elif method == 'PUT':
+            with tarfile.open(fileobj=io.BytesIO(self._body())) as archive:
+                archive.extractall(host_path)
+            self._send_empty(200)
+        elif method in ('GET', 'HEAD'):
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w') as archive:
+                archive.add(host_path, arcname=osp.basename(path.rstrip('/')) or '.')
+            stat = {'name': osp.basename(path), 'size': buffer.tell(), 'mode': 0o40755, 'linkTarget': ''}
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('X-Docker-Container-Path-Stat',
+                             base64.b64encode(json.dumps(stat).encode('utf-8')).decode('ascii'))
+            self.send_header('Content-Length', str(buffer.tell()))
+            self.end_headers()
+            if method == 'GET':
+                self.wfile.write(buffer.getvalue())
+        else:
+            self._not_found("unsupported by the fake engine: {m} archive".format(m=method))
+
+    def _list_images(self, params):
+        self._send_json(200, [{'Id': self.engine.image_id(image), 'RepoTags': [image], 'Labels': dict()}
+                              for image in sorted(self.engine.pulled)])
+
+    def _pull(self, params):
+        image = params.get('fromImage', '')
+        if params.get('tag'):
+            image += (params['tag'].startswith('sha256:') and '@' or ':') + params['tag']
+        self.engine.pulled.add(image)
+        body = "\r\n".join(json.dumps(status) for status in [
+            {'status': "Pulling from {i}".format(i=image), 'id': params.get('tag') or 'latest'},
+            {'status': "Digest: {d}".format(d=self.engine.image_id(image))},
+            {'status': "Status: Image is up to date for {i}".format(i=image)}]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _volume_description(self, name):
+        return {'Name': name, 'Driver': 'local', 'Mountpoint': self.engine.volumes[name], 'Labels': None}
+
+    def _list_volumes(self, params):
+        with self.engine.lock:
+            names = sorted(self.engine.volumes.keys())
+        self._send_json(200, {'Volumes': [self._volume_description(name) for name in names], 'Warnings': None})
+
+    def _create_volume(self, params):
+        name = self._json_body().get('Name') or self.engine.new_id()
+        self.engine.create_volume(name)
+        self._send_json(201, self._volume_description(name))
+
+    def _volume(self, method, name):
+        with self.engine.lock:
+            if name not in self.engine.volumes:
+                self._not_found("no such volume: {v}".format(v=name))
+                return
+            if method == 'DELETE':
+                shutil.rmtree(self.engine.volumes.pop(name), ignore_errors=True)
+                self._send_empty()
+                return
+        self._send_json(200, self._volume_description(name))
+
+    def _list_networks(self, params):
+        with self.engine.lock:
+            networks = list(self.engine.networks.values())
+        self._send_json(200, networks)
+
+    def _create_network(self, params):
+        request = self._json_body()
+        network = {'Name': request.get('Name'), 'Id': self.engine.new_id(), 'Driver': request.get('Driver') or
+                   'bridge', 'Scope': 'local', 'Containers': dict(), 'Labels': request.get('Labels') or dict(),
+                   'Options': request.get('Options') or dict(), 'IPAM': {'Driver': 'default', 'Config': []}}
+        with self.engine.lock:
+            self.engine.networks[network['Id']] = network
+        self._send_json(201, {'Id': network['Id'], 'Warning': ''})
+
+    def _network(self, method, reference):
+        network_ref, _, action = reference.partition('/')
+        with self.engine.lock:
+            network = next((network for network in self.engine.networks.values()
+                            if network_ref in (network['Id'], network['Name'])), None)
+            if network is None:
+                self._not_found("no such network: {n}".format(n=network_ref))
+            elif method == 'DELETE' and not action:
+                del self.engine.networks[network['Id']]
+                self._send_empty()
+            elif method == 'POST' and action in ('connect', 'disconnect'):
+                self._json_body()
+                self._send_empty(200)
+            else:
+                self._send_json(200, network)
+
+
+class HermeticBackend(object):
+    """
+    Serves a FakeEngine on the loopback interface and points DOCKER_HOST to it while started, so that DLDConfig,
+    the engine backend and docker-compose (run_compose) use it.
+    """
+    ENV_VARS = ('DOCKER_HOST', 'DOCKER_TLS_VERIFY', 'DOCKER_CERT_PATH')
+
+    def __init__(self, import_timeout=600):
+        self.engine = FakeEngine(import_timeout)
+        self.server = None
+        self._previous_env = None
+
+    @property
+    def docker_host(self):
+        return "tcp://127.0.0.1:{p}".format(p=self.server.server_address[1])
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeEngineHandler)
+        self.server.engine = self.engine
+        threading.Thread(target=self.server.serve_forever, name='dld-fake-engine', daemon=True).start()
+        self._previous_env = dict((var, os.environ.get(var)) for var in self.ENV_VARS)
+        for var in self.ENV_VARS:
+            os.environ.pop(var, None)
+        os.environ['DOCKER_HOST'] = self.docker_host
+        LOG.info("fake Docker engine listening at {h}".format(h=self.docker_host))
+        return self
+
+    def stop(self):
+        self.engine.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for var, value in (self._previous_env or dict()).items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,118 @@
+import gzip
+import json
+import re
+import shutil
+import struct
+import tempfile
+from http.client import HTTPConnection
+from os import path as osp
+from urllib.parse import quote
+
+from sparql.verify import CountVerifier, ExpectedCount
+from tests.hermetic import HermeticBackend, LOADER_COMPLETED_MESSAGE, StandInStore, ingest_import_dir, \
+    read_statements
+
+GRAPH = 'http://dld.aksw.org/testing#'
+OTHER_GRAPH = 'http://dld.aksw.org/other#'
+
+
+def _write(filepath, content, opener=open):
+    with opener(filepath, 'wt') as target_file:
+        target_file.write(content)
+
+
+def _prepare_import_dir(import_dir):
+    _write(osp.join(import_dir, 'a.nt'), '<http://ex.org/s1> <http://ex.org/p> "o" .\n' * 2 +
+           '<http://ex.org/s2> <http://ex.org/p>  "o" .\n')
+    _write(osp.join(import_dir, 'a.nt.graph'), OTHER_GRAPH + '\n')
+    _write(osp.join(import_dir, 'b.ttl.gz'), '@prefix ex: <http://ex.org/> .\n# comment\nex:s1 ex:p "o" ;\n' +
+           '    ex:q "r" .\n', gzip.open)
+    _write(osp.join(import_dir, 'global.graph'), GRAPH + '\n')
+    _write(osp.join(import_dir, 'dld-preparation.done'), '')
+
+
+def _api(backend, method, path, content=None):
+    connection = HTTPConnection('127.0.0.1', backend.server.server_address[1], timeout=10)
+    try:
+        body = content is not None and json.dumps(content).encode('utf-8') or None
+        connection.request(method, '/v1.21' + path, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+    return response.status, data and response.getheader('Content-Type') == 'application/json' and \
+        json.loads(data.decode('utf-8')) or data
+
+
+def _log_lines(stream):
+    lines = list()
+    while stream:
+        _, size = struct.unpack('>BxxxL', stream[:8])
+        lines.append(stream[8:8 + size].decode('utf-8'))
+        stream = stream[8 + size:]
+    return lines
+
+
+def test_stand_in_store_ingests_import_dirs_honouring_graph_files():
+    import_dir = tempfile.mkdtemp()
+    try:
+        _prepare_import_dir(import_dir)
+        list(read_statements(osp.join(import_dir, 'b.ttl.gz'))).should.equal(['ex:s1 ex:p "o" ; ex:q "r"'])
+        store = StandInStore()
+        ingest_import_dir(store, import_dir).should.equal({OTHER_GRAPH: 3, GRAPH: 1})
+    finally:
+        shutil.rmtree(import_dir, ignore_errors=True)
+    (store.count(OTHER_GRAPH), store.count(GRAPH), store.count()).should.equal((2, 1, 3))
+    store.update('DELETE DATA {{ GRAPH <{g}> {{\n<http://ex.org/s1> <http://ex.org/p> "o" .\n}} }}'
+                 .format(g=OTHER_GRAPH))
+    store.count(OTHER_GRAPH).should.equal(1)
+    store.answer.when.called_with('SELECT * { ?s ?p ?o }').should.throw(ValueError)
+
+
+def test_fake_engine_runs_store_and_loader_containers():
+    import_dir = tempfile.mkdtemp()
+    backend = HermeticBackend(import_timeout=5).start()
+    try:
+        _prepare_import_dir(import_dir)
+        _api(backend, 'GET', '/version')[1]['Version'].should.equal('1.12.0')
+        labels = {'com.docker.compose.project': 'hermetic'}
+        status, store = _api(backend, 'POST', '/containers/create?name=hermetic_store_1', {
+            'Image': 'aksw/dld-store-virtuoso7', 'Labels': dict(labels, **{'com.docker.compose.service': 'store'}),
+            'HostConfig': {'PortBindings': {'8890/tcp': [{'HostPort': '8891'}]}}})
+        status.should.equal(201)
+        _api(backend, 'POST', '/containers/create?name=hermetic_store_1', {'Image': 'x'})[0].should.equal(409)
+        _, load = _api(backend, 'POST', '/containers/create?name=hermetic_load_1', {
+            'Image': 'aksw/dld-load-virtuoso',
+            'Env': ['IMPORT_SRC=/import', 'IMPORT_DONE_MARKER=dld-preparation.done'],
+            'Labels': dict(labels, **{'com.docker.compose.service': 'load'}),
+            'HostConfig': {'Binds': [import_dir + ':/import:z'], 'Links': ['hermetic_store_1:store'],
+                           'VolumesFrom': ['hermetic_store_1']}})
+        for container in (store, load):
+            _api(backend, 'POST', '/containers/{c}/start'.format(c=container['Id']))[0].should.equal(204)
+
+        completed_pattern = re.compile(re.escape(LOADER_COMPLETED_MESSAGE))
+        backend.engine.wait_for_log('hermetic', 'load', completed_pattern, 5).should.be(True)
+        _, listed = _api(backend, 'GET', '/containers/json?all=1&filters=' +
+                         quote(json.dumps({'label': ['com.docker.compose.service=load']})))
+        [c['Names'] for c in listed].should.equal([['/hermetic_load_1']])
+        _, inspected = _api(backend, 'GET', '/containers/hermetic_store_1/json')
+        endpoint = backend.engine.published_endpoint('hermetic')
+        endpoint.should.contain(inspected['NetworkSettings']['Ports']['8890/tcp'][0]['HostPort'])
+        results = CountVerifier(endpoint).verify({GRAPH: ExpectedCount.parse(1), OTHER_GRAPH: ExpectedCount.parse(2)})
+        [result.ok for result in results].should.equal([True, True])
+
+        _, logs = _api(backend, 'GET', '/containers/hermetic_load_1/logs?stdout=1&stderr=1')
+        _log_lines(logs)[-1].should.equal(LOADER_COMPLETED_MESSAGE + '\n')
+        _api(backend, 'POST', '/containers/hermetic_load_1/kill')[0].should.equal(204)
+        _api(backend, 'POST', '/containers/hermetic_load_1/wait')[1].should.equal({'StatusCode': 137})
+        _api(backend, 'DELETE', '/containers/hermetic_load_1')[0].should.equal(204)
+        _api(backend, 'GET', '/containers/hermetic_load_1/json')[0].should.equal(404)
+    finally:
+        backend.stop()
+        shutil.rmtree(import_dir, ignore_errors=True)
+
+
+for test in [test_stand_in_store_ingests_import_dirs_honouring_graph_files,
+             test_fake_engine_runs_store_and_loader_containers]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
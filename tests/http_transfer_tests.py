@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+import shutil
+from os import path as osp
+
+from data.transfer import MirrorDownloader, ExponentialBackoff, rank_mirrors, PARTIAL_DOWNLOAD_SUFFIX, \
+    PARTIAL_VALIDATORS_SUFFIX
+from tests.support import StandInServer, PAYLOAD, LAST_MODIFIED
+
+
+def test_backoff_grows_exponentially_within_bounds():
+    backoff = ExponentialBackoff(base_delay=1.0, factor=2.0, max_delay=5.0, jitter=0.5)
+    for attempt, upper_bound in [(0, 1.0), (1, 2.0), (2, 4.0), (3, 5.0), (10, 5.0)]:
+        delay = backoff.delay(attempt)
+        delay.should.be.within(upper_bound / 2, upper_bound)
+
+
+def test_mirror_ranking_prefers_responsive_mirrors():
+    with StandInServer(failing=True) as failing, StandInServer(delay=0.5) as slow, StandInServer() as fast:
+        ranking = [probe.url for probe in rank_mirrors([failing.url, slow.url, fast.url])]
+        ranking.should.equal([fast.url, slow.url, failing.url])
+
+
+def test_download_retries_and_resumes_stalled_transfer_on_other_mirror():
+    """
+        the fastest mirror stalls mid-transfer, the download continues with a Range request
+        on the other working mirror, the failing mirror is ranked last
+    """
+    target_dir = tempfile.mkdtemp('_dl', 'test_download_retries')
+    try:
+        target_path = osp.join(target_dir, 'dump.nt')
+        with StandInServer(failing=True) as failing, StandInServer(stall_after=100000) as stalling, \
+                StandInServer(delay=0.3) as slow:
+            downloader = MirrorDownloader([failing.url, slow.url, stalling.url], stall_timeout=0.5,
+                                          backoff=ExponentialBackoff(base_delay=0.01))
+            used_url = downloader.download(target_path)
+
+            used_url.should.equal(slow.url)
+            slow.requests[-1].should.equal('bytes=100000-')
+            slow.if_range_headers[-1].should.equal(LAST_MODIFIED)
+        with open(target_path, 'rb') as downloaded:
+            (downloaded.read() == PAYLOAD).should.be(True)
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+
+def test_download_resumes_on_mirror_with_other_etag():
+    """
+        the mirrors assign different ETags to the same version, the transfer is resumed on the other mirror
+        by Last-Modified instead of restarting it
+    """
+    target_dir = tempfile.mkdtemp('_dl', 'test_download_cross_mirror')
+    try:
+        target_path = osp.join(target_dir, 'dump.nt')
+        with StandInServer(stall_after=100000, etag='"mirror-a"') as stalling, \
+                StandInServer(delay=0.3, etag='"mirror-b"') as slow:
+            downloader = MirrorDownloader([slow.url, stalling.url], stall_timeout=0.5,
+                                          backoff=ExponentialBackoff(base_delay=0.01))
+            downloader.download(target_path)
+
+            slow.requests[-1].should.equal('bytes=100000-')
+            slow.if_range_headers[-1].should.equal(LAST_MODIFIED)
+            downloader.validators['etag'].should.equal('"mirror-a"')
+        with open(target_path, 'rb') as downloaded:
+            (downloaded.read() == PAYLOAD).should.be(True)
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+
+def test_download_gives_up_after_max_attempts():
+    target_dir = tempfile.mkdtemp('_dl', 'test_download_gives_up')
+    try:
+        with StandInServer(failing=True) as failing:
+            downloader = MirrorDownloader([failing.url], max_attempts=3,
+                                          backoff=ExponentialBackoff(base_delay=0.01))
+            downloader.download.when.called_with(osp.join(target_dir, 'dump.nt')).should.throw(IOError)
+            len(failing.requests).should.equal(3)
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+
+def _write_partial_download(target_path, content, validators):
+    with open(target_path + PARTIAL_DOWNLOAD_SUFFIX, 'wb') as partial_fd:
+        partial_fd.write(content)
+    if validators is not None:
+        with open(target_path + PARTIAL_DOWNLOAD_SUFFIX + PARTIAL_VALIDATORS_SUFFIX, 'w') as validators_fd:
+            json.dump(validators, validators_fd)
+
+
+def test_download_discards_partial_download_of_changed_resource():
+    target_dir = tempfile.mkdtemp('_dl', 'test_download_changed')
+    try:
+        target_path = osp.join(target_dir, 'dump.nt')
+        for validators in [{'etag': '"payload-0"', 'last_modified': None, 'length': len(PAYLOAD)}, None]:
+            _write_partial_download(target_path, b'x' * 1000, validators)
+            with StandInServer() as server:
+                MirrorDownloader([server.url], backoff=ExponentialBackoff(base_delay=0.01)).download(target_path)
+                server.requests[-1].should.equal(validators and 'bytes=1000-' or None)
+            with open(target_path, 'rb') as downloaded:
+                (downloaded.read() == PAYLOAD).should.be(True)
+            sorted(os.listdir(target_dir)).should.equal(['dump.nt'])
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+
+def test_download_finishes_complete_partial_download():
+    target_dir = tempfile.mkdtemp('_dl', 'test_download_complete')
+    try:
+        target_path = osp.join(target_dir, 'dump.nt')
+        _write_partial_download(target_path, PAYLOAD,
+                                {'etag': '"payload-1"', 'last_modified': None, 'length': len(PAYLOAD)})
+        with StandInServer() as server:
+            MirrorDownloader([server.url], backoff=ExponentialBackoff(base_delay=0.01)).download(target_path)
+            server.requests[-1].should.equal('bytes={o}-'.format(o=len(PAYLOAD)))
+        with open(target_path, 'rb') as downloaded:
+            (downloaded.read() == PAYLOAD).should.be(True)
+        sorted(os.listdir(target_dir)).should.equal(['dump.nt'])
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+
+for test in [test_backoff_grows_exponentially_within_bounds, test_mirror_ranking_prefers_responsive_mirrors,
+             test_download_retries_and_resumes_stalled_transfer_on_other_mirror,
+             test_download_resumes_on_mirror_with_other_etag, test_download_gives_up_after_max_attempts,
+             test_download_discards_partial_download_of_changed_resource,
+             test_download_finishes_complete_partial_download]:
+    test.test_kind = 'unit'
+    test.test_speed = 2
@@ -0,0 +1,110 @@
+import contextlib
+import json
+import threading
+
+from docker.errors import APIError
+
+from dld import ComposeConfigGenerator
+from orchestration.images import ImagePuller, cached_image_labels, split_image_reference
+from tests.support import DLDTestConfig, NotFoundResponse
+
+PINNED_DIGEST = 'sha256:' + '0' * 64
+
+
+class FakeImageDockerClient(object):
+    """
+    knows the images given by reference, records the pulls and knows the pulled images afterwards;
+    pulling a repository named 'broken' fails
+    """
+
+    def __init__(self, images):
+        self.lock = threading.Lock()
+        self.images = dict(images)
+        self.pulls = list()
+
+    def inspect_image(self, image):
+        with self.lock:
+            if image not in self.images:
+                raise APIError('no such image', NotFoundResponse())
+            return self.images[image]
+
+    def pull(self, repository, tag=None, stream=False):
+        with self.lock:
+            self.pulls.append((repository, tag))
+        if repository == 'broken':
+            return [json.dumps({'error': 'pull access denied'}).encode('utf-8')]
+        reference = tag.startswith('sha256:') and repository + '@' + tag or repository + ':' + tag
+        with self.lock:
+            self.images[reference] = {'Id': 'sha256:' + reference, 'RepoDigests': [],
+                                      'Config': {'Labels': {'org.aksw.dld.type': 'present', 'other': 'x'}}}
+        return [json.dumps({'status': 'Pulling'}).encode('utf-8') + b'\r\n' +
+                json.dumps({'status': 'Downloaded newer image'}).encode('utf-8')]
+
+
+def fake_client_factory(fake_client):
+    @contextlib.contextmanager
+    def client_context():
+        yield fake_client
+
+    return client_context
+
+
+def test_split_image_reference():
+    split_image_reference('aksw/dld-store-virtuoso7').should.equal(('aksw/dld-store-virtuoso7', None, None))
+    split_image_reference('aksw/dld-store-virtuoso7:1.0').should.equal(('aksw/dld-store-virtuoso7', '1.0', None))
+    split_image_reference('registry:5000/dld-store').should.equal(('registry:5000/dld-store', None, None))
+    split_image_reference('registry:5000/dld-store:v2').should.equal(('registry:5000/dld-store', 'v2', None))
+    split_image_reference('aksw/dld@' + PINNED_DIGEST).should.equal(('aksw/dld', None, PINNED_DIGEST))
+
+
+def test_puller_pulls_only_missing_images_and_reports_failures():
+    fake_client = FakeImageDockerClient({
+        'aksw/dld-store-virtuoso7': {'Id': 'sha256:store', 'RepoDigests': [],
+                                     'Config': {'Labels': {'org.aksw.dld.snapshot-paths': '/var/lib/virtuoso/db'}}},
+        'aksw/dld-load-virtuoso@' + PINNED_DIGEST: {'Id': 'sha256:outdated',
+                                                    'RepoDigests': ['aksw/dld-load-virtuoso@sha256:other']},
+    })
+    compose_config = {
+        'store': {'image': 'aksw/dld-store-virtuoso7'},
+        'load': {'image': 'aksw/dld-load-virtuoso@' + PINNED_DIGEST},
+        'presentontowiki': {'image': 'aksw/dld-present-ontowiki:1.0'},
+        'presentbroken': {'image': 'broken'},
+        'other': {'build': '.'},
+    }
+    puller = ImagePuller(compose_config, client_factory=fake_client_factory(fake_client))
+    puller.images.should.equal(['aksw/dld-load-virtuoso@' + PINNED_DIGEST, 'aksw/dld-present-ontowiki:1.0',
+                                'aksw/dld-store-virtuoso7', 'broken'])
+    available = puller.start().wait()
+
+    available.should.equal(['aksw/dld-load-virtuoso@' + PINNED_DIGEST, 'aksw/dld-present-ontowiki:1.0',
+                            'aksw/dld-store-virtuoso7'])
+    sorted(fake_client.pulls).should.equal([('aksw/dld-load-virtuoso', PINNED_DIGEST),
+                                            ('aksw/dld-present-ontowiki', '1.0'), ('broken', 'latest')])
+    cached_image_labels('sha256:store').should.equal({'org.aksw.dld.snapshot-paths': '/var/lib/virtuoso/db'})
+    cached_image_labels('sha256:aksw/dld-present-ontowiki:1.0').should.equal({'org.aksw.dld.type': 'present'})
+    cached_image_labels('sha256:aksw/dld-load-virtuoso@' + PINNED_DIGEST).should.equal({'org.aksw.dld.type': 'present'})
+
+
+def test_images_are_only_pulled_when_requested():
+    class RecordingPuller(object):
+        waited = list()
+
+        def wait(self):
+            self.waited.append(True)
+            return []
+
+    configurator = ComposeConfigGenerator({'datasets': {}}, DLDTestConfig('wd-pull'))
+    configurator.pull_images = RecordingPuller
+    configurator.prepare_import_data = lambda datasets: None
+    configurator.upload_import_data = lambda: None
+    configurator.run_preparation()
+    RecordingPuller.waited.should.equal([])
+    configurator.run_preparation(pull_images=True)
+    RecordingPuller.waited.should.equal([True])
+
+
+for test in [test_split_image_reference,
+             test_puller_pulls_only_missing_images_and_reports_failures,
+             test_images_are_only_pulled_when_requested]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
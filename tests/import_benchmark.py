@@ -0,0 +1,364 @@
+"""
+Import throughput benchmarks for combinations of DLD configurations, generated dataset sizes and file layouts,
+and component settings (e.g. image versions, cpuset or mem_limit of the store).
+
+A matrix file lists the values to combine, every combination is prepared with dld.main, brought up with
+docker-compose and timed until the load component reports the import as completed:
+
+    configs: [tests/simple-dld.yml]
+    dataset_triples: [100000, 1000000]
+    layouts: [{files: 1}, {files: 4, gzip: true}]
+    components:
+      - {}
+      - {store: {cpuset: '0,1', mem_limit: 4g}}
+    import_timeout: 1800
+
+    python -m tests.import_benchmark matrix.yml -o results.json [-b baseline.json] [-t 0.1]
+
+The results (import duration, triples/s, time to first query, peak memory and CPU of the store and load
+containers from the Docker stats API) are stored as JSON keyed by combination, so that results of different
+runs can be compared. With a baseline, the run fails when a metric got worse by more than the threshold.
+"""
+import argparse as ap
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+from os import path as osp
+import platform
+import sys
+import threading
+import time
+
+import yaml
+
+from dldbase import dockerutil
+from tests.import_integration_tests import ImportIntegrationTest
+from yamlconfig import load_dld_config
+
+BENCHMARK_GRAPH = 'http://dld.aksw.org/benchmark#'
+RESULTS_FORMAT = 1
+DEFAULT_THRESHOLD = 0.1
+# metrics compared against a baseline and whether higher values are better
+REGRESSION_METRICS = [
+    ('triples_per_second', True),
+    ('time_to_first_query_seconds', False),
+    ('containers.store.peak_memory_bytes', False),
+]
+LOG = logging.getLogger('dld.test.benchmark')
+
+
+class BenchmarkCase(object):
+    """
+    One combination of a benchmark matrix.
+    """
+
+    def __init__(self, config_file, triples, layout=None, components=None):
+        """
+        :param config_file: DLD configuration to take the components and settings from
+        :param triples: number of triples to generate for the import
+        :param layout: dict with the number of 'files' to spread the triples over and whether to 'gzip' them
+        :param components: dict of compose settings to merge into the component configurations by component name
+        """
+        self.config_file = config_file
+        self.triples = triples
+        self.layout = dict({'files': 1, 'gzip': False}, **(layout or dict()))
+        self.components = components or dict()
+
+    def describe(self):
+        return {
+            'config': osp.basename(self.config_file),
+            'triples': self.triples,
+            'layout': self.layout,
+            'components': self.components,
+        }
+
+    @property
+    def key(self):
+        """
+        stable identifier of the combination, to find the results of the same case in other runs
+        """
+        return json.dumps(self.describe(), sort_keys=True)
+
+    @property
+    def name(self):
+        return 'dldbench' + hashlib.sha1(self.key.encode('utf-8')).hexdigest()[:10]
+
+
+def expand_matrix(matrix):
+    """
+    :param matrix: dict with lists of 'configs', 'dataset_triples', 'layouts' and 'components' settings
+    :return: list of BenchmarkCase instances for all combinations
+    """
+    if not matrix.get('configs') or not matrix.get('dataset_triples'):
+        raise RuntimeError("a benchmark matrix needs 'configs' and 'dataset_triples'")
+    return [BenchmarkCase(config_file, triples, layout, components) for config_file, triples, layout, components
+            in itertools.product(matrix['configs'], matrix['dataset_triples'],
+                                 matrix.get('layouts') or [None], matrix.get('components') or [None])]
+
+
+def generate_dataset(target_dir, triples, files=1, gzip_files=False):
+    """
+    Writes synthetic N-Triples, spread evenly over the given number of files.
+
+    :return: list of the paths of the written files
+    """
+    paths = list()
+    per_file = -(-triples // files)
+    for file_idx in range(files):
+        filepath = osp.join(target_dir, "bench-{i:03d}.nt{gz}".format(i=file_idx, gz=gzip_files and '.gz' or ''))
+        opener = gzip_files and gzip.open or open
+        with opener(filepath, 'wt') as data_file:
+            for idx in range(file_idx * per_file, min(triples, (file_idx + 1) * per_file)):
+                data_file.write('<http://dld.aksw.org/bench/s{s}> <http://dld.aksw.org/bench/p{p}> "{i}" .\n'
+                                .format(s=idx // 10, p=idx % 10, i=idx))
+        paths.append(filepath)
+    return paths
+
+
+def benchmark_config(case, base_config, dataset_paths):
+    """
+    :return: the DLD configuration for the case: components and settings of the base configuration with the
+             component settings of the case merged in, importing the generated dataset files
+    """
+    components = dict()
+    for component_name, component_config in base_config['components'].items():
+        if isinstance(component_config, str):
+            component_config = {'image': component_config}
+        components[component_name] = dict(component_config, **case.components.get(component_name, dict()))
+    datasets = dict(("bench{i}".format(i=idx), {'file': path, 'graph_name': BENCHMARK_GRAPH})
+                    for idx, path in enumerate(dataset_paths))
+    return {'components': components, 'datasets': datasets, 'settings': dict(base_config.get('settings') or dict())}
+
+
+class ContainerUsage(object):
+    """
+    Peak memory, peak CPU load and CPU time of a container, from the samples of the Docker stats API.
+    """
+
+    def __init__(self):
+        self.peak_memory_bytes = 0
+        self.peak_cpu_percent = 0.0
+        self._first_cpu_total = None
+        self._last_cpu_total = None
+
+    @staticmethod
+    def cpu_percent(stats):
+        cpu_stats = stats.get('cpu_stats') or dict()
+        precpu_stats = stats.get('precpu_stats') or dict()
+        cpu_delta = cpu_stats.get('cpu_usage', dict()).get('total_usage', 0) - \
+            precpu_stats.get('cpu_usage', dict()).get('total_usage', 0)
+        system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+        if cpu_delta <= 0 or system_delta <= 0:
+            return 0.0
+        online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats['cpu_usage'].get('percpu_usage') or [None])
+        return 100.0 * cpu_delta / system_delta * online_cpus
+
+    def add_sample(self, stats):
+        memory_stats = stats.get('memory_stats') or dict()
+        self.peak_memory_bytes = max(self.peak_memory_bytes, memory_stats.get('max_usage', 0),
+                                     memory_stats.get('usage', 0))
+        self.peak_cpu_percent = max(self.peak_cpu_percent, self.cpu_percent(stats))
+        cpu_total = (stats.get('cpu_stats') or dict()).get('cpu_usage', dict()).get('total_usage')
+        if cpu_total is not None:
+            if self._first_cpu_total is None:
+                self._first_cpu_total = cpu_total
+            self._last_cpu_total = cpu_total
+
+    def as_dict(self):
+        cpu_seconds = (self._first_cpu_total is not None) and \
+            (self._last_cpu_total - self._first_cpu_total) / 1e9 or 0.0
+        return {
+            'peak_memory_bytes': self.peak_memory_bytes,
+            'peak_cpu_percent': round(self.peak_cpu_percent, 1),
+            'cpu_seconds': round(cpu_seconds, 2),
+        }
+
+
+class StatsSampler(object):
+    """
+    Follows the stats streams of a set of containers in background threads.
+    """
+
+    def __init__(self, containers, client_factory=dockerutil.docker_client):
+        """
+        :param containers: dict mapping names to report the usage under to container names
+        """
+        self.containers = containers
+        self.client_factory = client_factory
+        self.usage = dict((name, ContainerUsage()) for name in containers)
+        self._stopped = threading.Event()
+        self._threads = list()
+
+    def _follow(self, name, container):
+        try:
+            with self.client_factory() as dc:
+                for stats in dc.stats(container, decode=True):
+                    if self._stopped.is_set():
+                        return
+                    self.usage[name].add_sample(stats)
+        except Exception as ex:
+            LOG.warning("stats of {c} not available: {ex}".format(c=container, ex=ex))
+
+    def start(self):
+        for name, container in self.containers.items():
+            thread = threading.Thread(target=self._follow, args=(name, container), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(5)  # a stats stream delivers a sample every second
+        return dict((name, usage.as_dict()) for name, usage in self.usage.items())
+
+
+class ImportBenchmark(ImportIntegrationTest):
+    """
+    Runs a BenchmarkCase: generates the dataset and configuration, prepares the setup with dld.main, brings
+    it up and measures the import until the load component reports completion.
+    """
+
+    def __init__(self, case, import_timeout=1800, store_port=8891, keep_tmpdir=False):
+        ImportIntegrationTest.__init__(self, case.name, [], import_timeout=import_timeout, store_port=store_port,
+                                       expected_triple_counts={BENCHMARK_GRAPH: case.triples},
+                                       keep_tmpdir=keep_tmpdir)
+        self.case = case
+        self.first_query_at = None
+
+    def _wait_for_first_query(self, stopped):
+        from SPARQLWrapper import SPARQLWrapper, JSON
+
+        sparql = SPARQLWrapper(self._endpooint_url(), returnFormat=JSON)
+        sparql.setQuery('ASK { ?s ?p ?o }')
+        while not stopped.is_set():
+            try:
+                sparql.queryAndConvert()
+                self.first_query_at = time.time()
+                return
+            except Exception:
+                stopped.wait(0.5)
+
+    def run(self):
+        dataset_paths = generate_dataset(self.tmpdir, self.case.triples, self.case.layout['files'],
+                                         self.case.layout['gzip'])
+        config_path = osp.join(self.tmpdir, 'benchmark-dld.yml')
+        with open(config_path, 'w') as config_file:
+            yaml.safe_dump(benchmark_config(self.case, load_dld_config(self.case.config_file), dataset_paths),
+                           config_file, default_flow_style=False)
+        self.dld_args = ['-c', config_path, '-w', self.tmpdir]
+
+        started = time.time()
+        self.run_dld()
+        prepared = time.time()
+        self.run_compose_up()
+        up = time.time()
+        sampler = StatsSampler(dict((service, "{p}_{s}_1".format(p=self.compose_name, s=service))
+                                    for service in ('store', 'load'))).start()
+        stopped = threading.Event()
+        first_query_waiter = threading.Thread(target=self._wait_for_first_query, args=(stopped,), daemon=True)
+        first_query_waiter.start()
+        try:
+            self.wait_for_completed_import()
+        finally:
+            imported = time.time()
+            stopped.set()
+            first_query_waiter.join()
+            containers = sampler.stop()
+        self.verify_imported_triple_counts()
+
+        import_seconds = imported - up
+        return {
+            'case': self.case.describe(),
+            'prepare_seconds': round(prepared - started, 2),
+            'import_seconds': round(import_seconds, 2),
+            'triples_per_second': round(self.case.triples / max(import_seconds, 0.001), 1),
+            'time_to_first_query_seconds': self.first_query_at and round(self.first_query_at - up, 2),
+            'containers': containers,
+        }
+
+
+def _metric(result, path):
+    value = result
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    :param baseline: results document of an earlier run
+    :param current: results document of this run
+    :param threshold: tolerated relative change for the worse (e.g. 0.1 for 10%)
+    :return: list of messages describing the regressions of cases present in both documents
+    """
+    regressions = list()
+    for case_key, result in sorted(current['results'].items()):
+        base_result = baseline['results'].get(case_key)
+        if base_result is None or 'error' in base_result:
+            continue
+        if 'error' in result:
+            regressions.append("{k}: failed ({e})".format(k=case_key, e=result['error']))
+            continue
+        for metric, higher_is_better in REGRESSION_METRICS:
+            base_value, value = _metric(base_result, metric), _metric(result, metric)
+            if not base_value or value is None:
+                continue
+            change = (value - base_value) / float(base_value)
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append("{k}: {m} changed from {b} to {v} ({c:+.1%})"
+                                   .format(k=case_key, m=metric, b=base_value, v=value, c=change))
+    return regressions
+
+
+def write_results(filepath, results):
+    with open(filepath, 'w') as results_fd:
+        json.dump({'format': RESULTS_FORMAT, 'host': platform.node(), 'created': time.time(), 'results': results},
+                  results_fd, indent=2, sort_keys=True)
+
+
+def build_argument_parser():
+    parser = ap.ArgumentParser(prog='import_benchmark.py', description="DLD import throughput benchmarks")
+    parser.add_argument("matrix_file", help="YAML file with the benchmark matrix")
+    parser.add_argument("-o", "--output", default='dld-benchmark.json', help="file to write the results to")
+    parser.add_argument("-b", "--baseline", default=None, help="results of an earlier run to compare with")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="tolerated relative change for the worse of the compared metrics")
+    parser.add_argument("--keep-tmpdir", action='store_true', help="keep the working directories of the cases")
+    return parser
+
+
+def main(args=sys.argv[1:]):
+    args_ns = build_argument_parser().parse_args(args)
+    with open(args_ns.matrix_file) as matrix_fd:
+        matrix = yaml.safe_load(matrix_fd)
+    cases = expand_matrix(matrix)
+    results = dict()
+    for idx, case in enumerate(cases):
+        LOG.info("benchmark {i}/{n}: {k}".format(i=idx + 1, n=len(cases), k=case.key))
+        try:
+            with ImportBenchmark(case, matrix.get('import_timeout', 1800), matrix.get('store_port', 8891),
+                                 args_ns.keep_tmpdir) as benchmark:
+                results[case.key] = benchmark.run()
+        except Exception as ex:
+            LOG.exception("benchmark failed: {k}".format(k=case.key))
+            results[case.key] = {'case': case.describe(), 'error': str(ex)}
+        # written after each case to keep the results of long running matrices
+        write_results(args_ns.output, results)
+
+    if args_ns.baseline:
+        with open(args_ns.baseline) as baseline_fd:
+            regressions = compare_results(json.load(baseline_fd), {'results': results}, args_ns.threshold)
+        for regression in regressions:
+            LOG.error("regression: " + regression)
+        return regressions and 1 or 0
+    return 0
+
+
+if __name__ == '__main__':
+    # run as 'python -m tests.import_benchmark' from the project dir, the tests package sets up logging
+    sys.exit(main())
@@ -0,0 +1,54 @@
+from tests.import_benchmark import expand_matrix, benchmark_config, compare_results, ContainerUsage, \
+    BENCHMARK_GRAPH
+
+
+def _stats(total_usage, pre_total_usage, memory_usage):
+    return {
+        'cpu_stats': {'cpu_usage': {'total_usage': total_usage}, 'system_cpu_usage': 4000000000,
+                      'online_cpus': 2},
+        'precpu_stats': {'cpu_usage': {'total_usage': pre_total_usage}, 'system_cpu_usage': 2000000000},
+        'memory_stats': {'usage': memory_usage},
+    }
+
+
+def test_matrix_combinations_and_component_overrides():
+    cases = expand_matrix({'configs': ['tests/simple-dld.yml'], 'dataset_triples': [10, 1000],
+                           'components': [{}, {'store': {'mem_limit': '4g'}}]})
+    len(cases).should.equal(4)
+    len(set(case.key for case in cases)).should.equal(4)
+
+    base_config = {'components': {'store': 'aksw/dld-store-virtuoso7', 'load': {'image': 'aksw/dld-load-virtuoso'}},
+                   'settings': {'default_graph': 'http://dld.aksw.org/'}}
+    config = benchmark_config(cases[3], base_config, ['/tmp/bench-000.nt'])
+    config['components']['store'].should.equal({'image': 'aksw/dld-store-virtuoso7', 'mem_limit': '4g'})
+    config['datasets'].should.equal({'bench0': {'file': '/tmp/bench-000.nt', 'graph_name': BENCHMARK_GRAPH}})
+
+
+def test_container_usage_from_stats_samples():
+    usage = ContainerUsage()
+    usage.add_sample(_stats(1000000000, 1000000000, 300))
+    usage.add_sample(_stats(3500000000, 3000000000, 200))
+    usage.as_dict().should.equal({'peak_memory_bytes': 300, 'peak_cpu_percent': 50.0, 'cpu_seconds': 2.5})
+
+
+def test_regressions_beyond_threshold_are_reported():
+    baseline = {'results': {
+        'a': {'triples_per_second': 1000.0, 'time_to_first_query_seconds': 10.0},
+        'b': {'triples_per_second': 1000.0, 'containers': {'store': {'peak_memory_bytes': 100}}},
+        'c': {'triples_per_second': 1000.0},
+    }}
+    current = {'results': {
+        'a': {'triples_per_second': 950.0, 'time_to_first_query_seconds': 10.5},
+        'b': {'triples_per_second': 800.0, 'containers': {'store': {'peak_memory_bytes': 150}}},
+        'c': {'error': 'import timed out'},
+        'd': {'triples_per_second': 1.0},
+    }}
+    regressions = compare_results(baseline, current, threshold=0.1)
+    len(regressions).should.equal(3)
+    [regression.split(':')[0] for regression in regressions].should.equal(['b', 'b', 'c'])
+
+
+for test in [test_matrix_combinations_and_component_overrides, test_container_usage_from_stats_samples,
+             test_regressions_beyond_threshold_are_reported]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
@@ -11,14 +11,22 @@ import logging
 from subprocess import Popen, PIPE
 
 from invoke import run
-from SPARQLWrapper import SPARQLWrapper, JSON
-
-if __name__ != '__main__':
-    import dld
 
 TEST_DIR = osp.dirname(osp.realpath(__file__))
 TEST_LOG = logging.getLogger('dld.test')
 TEST_TEMP_DIR = os.environ.get('DLD_TEST_TMP')
+# 'docker' (default) or 'hermetic' to run against the fake engine of tests/hermetic.py
+TEST_BACKEND = os.environ.get('DLD_TEST_BACKEND', 'docker')
+
+# the fake engine needs to be up before DLDConfig probes the engine version (when importing dld)
+HERMETIC_BACKEND = None
+if TEST_BACKEND == 'hermetic':
+    from tests.hermetic import HermeticBackend
+    HERMETIC_BACKEND = HermeticBackend().start()
+
+if __name__ != '__main__':
+    import dld
+
 VOS_IMPORT_COMPLETED_PATTERN = re.compile(r'done loading graphs \(start hanging around idle\)')
 
 def test_simple_config_with_import_file_from_cli_args():
@@ -247,7 +255,11 @@ class ImportIntegrationTest(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._containers_created and (self.keep_containers is not True):
+        if HERMETIC_BACKEND is not None and self.keep_containers is not True:
+            for container in list(HERMETIC_BACKEND.engine.containers.values()):
+                if container.project == self.compose_name:
+                    HERMETIC_BACKEND.engine.remove(container)
+        elif self._containers_created and (self.keep_containers is not True):
             os.chdir(self.tmpdir)
             self.log.debug('cleaning up containers')
             run("docker-compose -p {pn} kill".format(pn=self.compose_name), hide=False, warn=True)
@@ -268,6 +280,10 @@ class ImportIntegrationTest(object):
     def run_compose_up(self):
         self._ensure_context()
         os.chdir(self.tmpdir)
+        if HERMETIC_BACKEND is not None:
+            dld.run_compose("-p", self.compose_name, "up", "-d")
+            self._containers_created = True
+            return
         res = run("docker-compose -p {pn} up -d".format(pn=self.compose_name), hide=False)
         if res.ok:
             self._containers_created = True
@@ -285,10 +301,17 @@ class ImportIntegrationTest(object):
             return False
 
     def _endpooint_url(self):
+        if HERMETIC_BACKEND is not None:
+            return HERMETIC_BACKEND.engine.published_endpoint(self.compose_name)
         return "http://localhost:{port}/sparql".format(port=self.store_port)
 
     def wait_for_completed_import(self):
         self._ensure_context()
+        if HERMETIC_BACKEND is not None:
+            if not HERMETIC_BACKEND.engine.wait_for_log(self.compose_name, 'load', self._import_completed_pattern(),
+                                                        self.import_timeout):
+                raise RuntimeError("import timed out")
+            return
         timed_out = threading.Event()
 
         logtail = Popen(
@@ -322,25 +345,17 @@ class ImportIntegrationTest(object):
             raise RuntimeError("import timed out")
 
     def verify_imported_triple_counts(self):
-        def bindings_to_dict(bindings):
-            return dict((b['graph']['value'], int(b['count']['value'])) for b in bindings)
-
-        sparql = SPARQLWrapper(self._endpooint_url(), returnFormat=JSON)
-        sparql.setQuery('''
-          SELECT (SAMPLE(?g) AS ?graph) (count(*) AS ?count) {
-            GRAPH ?g { ?s ?p ?o }
-          } GROUP BY ?g
-        ''')
-        result = sparql.queryAndConvert()
-
-        actual_counts = bindings_to_dict(result['results']['bindings'])
-
-        self.log.debug(actual_counts)
-        for graph_name, expected_count in self.expected_triple_counts.items():
-            if isinstance(expected_count, tuple) and len(expected_count) is 2:
-                actual_counts.get(graph_name, 0).should.be.within(*expected_count)
-            elif isinstance(expected_count, int):
-                actual_counts.get(graph_name, 0).should.equal(expected_count)
+        from sparql.verify import CountVerifier, ExpectedCount
+
+        verifier = CountVerifier(self._endpooint_url())
+        expected_counts = dict((graph_name, ExpectedCount.parse(expected_count))
+                               for graph_name, expected_count in self.expected_triple_counts.items())
+        results = verifier.verify(expected_counts)
+
+        self.log.debug(dict((result.graph_name, result.count) for result in results))
+        for result in results:
+            if not result.ok:
+                raise AssertionError(result.format())
         self.log.debug('finished verifying counts')
 
     def run(self):
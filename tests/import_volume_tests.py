@@ -0,0 +1,122 @@
+import contextlib
+import io
+import tarfile
+import tempfile
+import shutil
+import threading
+import os
+from os import path as osp
+
+from docker.errors import APIError
+
+from orchestration.volumes import ImportVolumeUploader, tar_stream
+from tests.support import NotFoundResponse
+
+
+class FakeVolumeDockerClient(object):
+    """
+    extracts uploaded archives into a dict of file contents by name, records the commands of started helpers
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.volumes = set()
+        self.files = dict()
+        self.uploads = list()
+        self.commands = dict()
+        self.executed = list()
+
+    def inspect_volume(self, name):
+        if name not in self.volumes:
+            raise APIError('no such volume', NotFoundResponse())
+        return {'Name': name}
+
+    def create_volume(self, name):
+        self.volumes.add(name)
+
+    def create_host_config(self, **kwargs):
+        return kwargs
+
+    def create_container(self, image, entrypoint=None, command=None, **kwargs):
+        with self.lock:
+            container_id = 'helper{n}'.format(n=len(self.commands))
+            self.commands[container_id] = entrypoint + (command or [])
+            return {'Id': container_id}
+
+    def put_archive(self, container, path, data):
+        with tarfile.open(fileobj=io.BytesIO(b''.join(data)), mode='r') as archive:
+            members = archive.getmembers()
+            with self.lock:
+                self.uploads.append(sorted(member.name for member in members))
+                for member in members:
+                    self.files[member.name] = archive.extractfile(member).read()
+        return True
+
+    def start(self, container_id):
+        self.executed.append(self.commands[container_id])
+
+    def wait(self, container_id):
+        return 0
+
+    def remove_container(self, container_id, force=False):
+        pass
+
+
+def fake_client_factory(fake_client):
+    @contextlib.contextmanager
+    def client_context():
+        yield fake_client
+
+    return client_context
+
+
+def _write_file(filepath, content):
+    with open(filepath, 'w') as data_file:
+        data_file.write(content)
+
+
+def test_tar_stream_contains_files():
+    source_dir = tempfile.mkdtemp('_src', 'test_tar_stream')
+    try:
+        for name in ['a.nt', 'b.nt']:
+            _write_file(osp.join(source_dir, name), name * 100000)
+        chunks = list(tar_stream(source_dir, ['a.nt', 'b.nt'], chunk_size=4096))
+        with tarfile.open(fileobj=io.BytesIO(b''.join(chunks)), mode='r') as archive:
+            archive.getnames().should.equal(['a.nt', 'b.nt'])
+            archive.extractfile('b.nt').read().should.equal(b'b.nt' * 100000)
+        (len(chunks) > 1).should.be(True)
+    finally:
+        shutil.rmtree(source_dir, ignore_errors=True)
+
+
+def test_only_changed_files_are_uploaded_again():
+    working_dir = tempfile.mkdtemp('_wd', 'test_only_changed_files')
+    try:
+        models_dir = osp.join(working_dir, 'models')
+        os.makedirs(models_dir)
+        for name in ['a.nt', 'b.nt', 'c.nt', 'dld-preparation.done']:
+            _write_file(osp.join(models_dir, name), name)
+        docker_client = FakeVolumeDockerClient()
+        uploader = ImportVolumeUploader(models_dir, 'wdtest_load_import', 'aksw/dld-load-virtuoso', working_dir,
+                                        client_factory=fake_client_factory(docker_client), max_workers=2)
+
+        uploader.upload()
+        sorted(docker_client.files).should.equal(['a.nt', 'b.nt', 'c.nt', 'dld-preparation.done'])
+        docker_client.uploads[-1].should.equal(['dld-preparation.done'])  # markers come last
+
+        docker_client.uploads = list()
+        _write_file(osp.join(models_dir, 'b.nt'), 'changed')
+        os.remove(osp.join(models_dir, 'c.nt'))
+        changed, removed = uploader.upload()
+
+        changed.should.equal(['b.nt'])
+        removed.should.equal(['c.nt'])
+        docker_client.uploads.should.equal([['b.nt']])
+        docker_client.executed.should.equal([['rm', '-f', '/import/c.nt']])
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_tar_stream_contains_files, test_only_changed_files_are_uploaded_again]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
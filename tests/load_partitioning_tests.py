@@ -0,0 +1,55 @@
+import tempfile
+import shutil
+import os
+from os import path as osp
+
+from data.partitioning import LoadPartitioner
+from tests.support import DLDTestConfig
+
+
+def test_balance_by_byte_size():
+    """
+        the largest files are spread first, each onto the least loaded partition
+    """
+    sized_files = [('a.nt', 100), ('b.nt', 60), ('c.nt', 50), ('d.nt', 40), ('e.nt', 10)]
+    assignment = LoadPartitioner.balance(sized_files, ['load1', 'load2'])
+    assignment.should.equal({'load1': ['a.nt', 'd.nt'], 'load2': ['b.nt', 'c.nt', 'e.nt']})
+
+
+def test_partitions_are_disjoint_and_carry_graph_files():
+    """
+        every data file ends up in exactly one partition, together with its graph file,
+        the global graph file is available in every partition
+    """
+    working_dir = tempfile.mkdtemp('_wd', 'test_partitions_are_disjoint')
+    try:
+        config = DLDTestConfig(working_dir)
+        os.makedirs(config.models_dir)
+        for name, size in [('a.nt.gz', 30), ('b.ttl', 20), ('c.nt', 10)]:
+            with open(osp.join(config.models_dir, name), 'w') as data_file:
+                data_file.write('x' * size)
+        with open(osp.join(config.models_dir, 'a.nt.graph'), 'w') as graph_file:
+            graph_file.write('http://dld.aksw.org/testing#\n')
+        with open(osp.join(config.models_dir, 'global.graph'), 'w') as graph_file:
+            graph_file.write('http://dld.aksw.org/default#\n')
+
+        assignment = LoadPartitioner(config).partition(['load1', 'load2'])
+
+        assignment.should.equal({'load1': ['a.nt.gz'], 'load2': ['b.ttl', 'c.nt']})
+        sorted(os.listdir(osp.join(config.partitions_dir, 'load1'))).should.equal(
+            ['a.nt.graph', 'a.nt.gz', 'global.graph'])
+        sorted(os.listdir(osp.join(config.partitions_dir, 'load2'))).should.equal(
+            ['b.ttl', 'c.nt', 'global.graph'])
+
+        # the partition of a load service no longer configured is removed
+        LoadPartitioner(config).partition(['load1'])
+        os.listdir(config.partitions_dir).should.equal(['load1'])
+        sorted(os.listdir(osp.join(config.partitions_dir, 'load1'))).should.equal(
+            ['a.nt.graph', 'a.nt.gz', 'b.ttl', 'c.nt', 'global.graph'])
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_balance_by_byte_size, test_partitions_are_disjoint_and_carry_graph_files]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
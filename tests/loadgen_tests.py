@@ -0,0 +1,111 @@
+import random
+import shutil
+import tempfile
+import threading
+import time
+from os import path as osp
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, quote_plus
+
+from sparql.loadgen import LoadGenerator, QueryTemplate, Workload, percentile, read_query_log
+from tests.support import ThreadingHTTPServer
+
+
+class StandInEndpointHandler(BaseHTTPRequestHandler):
+    """
+    answers POSTed queries after server.delay seconds with a small JSON result, queries containing 'FAIL'
+    with 500
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        query = parse_qs(body)['query'][0]
+        with self.server.lock:
+            self.server.queries.append(query)
+        time.sleep(self.server.delay)
+        if 'FAIL' in query:
+            self.send_error(500)
+            return
+        result = b'{"head": {"vars": ["s"]}, "results": {"bindings": []}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(result)))
+        self.end_headers()
+        self.wfile.write(result)
+
+
+def start_endpoint(delay=0.01):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInEndpointHandler)
+    server.queries = list()
+    server.delay = delay
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{p}/sparql".format(p=server.server_address[1])
+
+
+def test_templates_query_logs_and_percentiles():
+    template = QueryTemplate('lookup', 'SELECT * { ?s ?p "{{label}}" } LIMIT {{ limit }}',
+                             {'label': ['a'], 'limit': [10]})
+    template.render(random.Random(0)).should.equal('SELECT * { ?s ?p "a" } LIMIT 10')
+    QueryTemplate.when.called_with('broken', 'SELECT * { ?s ?p "{{label}}" }').should.throw(RuntimeError)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        log_path = osp.join(tmpdir, 'queries.log')
+        with open(log_path, 'w') as log_fd:
+            log_fd.write("# comment\nASK { ?s ?p ?o }\n\n")
+            log_fd.write("127.0.0.1 GET /sparql?query={q}&format=json 200\n".format(
+                q=quote_plus('SELECT ?s { ?s a ?t }')))
+        read_query_log(log_path).should.equal(['ASK { ?s ?p ?o }', 'SELECT ?s { ?s a ?t }'])
+        workload = Workload.from_config({'query_log': 'queries.log', 'concurrency': 2}, tmpdir)
+        [workload.next_query(random.Random(0))[1] for _ in range(3)].should.equal(
+            ['ASK { ?s ?p ?o }', 'SELECT ?s { ?s a ?t }', 'ASK { ?s ?p ?o }'])
+        Workload.from_config.when.called_with({'query_log': 'queries.log', 'qps': 3}).should.throw(RuntimeError)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    values = [float(v) for v in range(1, 101)]
+    percentile(values, 0.5).should.equal(50.0)
+    percentile(values, 0.99).should.equal(99.0)
+    percentile([], 0.5).should.be(None)
+
+
+def test_closed_loop_reports_per_template_latencies_and_errors():
+    server, endpoint = start_endpoint()
+    try:
+        workload = Workload.from_config({'templates': {'ok': 'ASK { ?s ?p ?o }', 'broken': 'FAIL'},
+                                         'concurrency': 3, 'duration': 0.5})
+        report = LoadGenerator(endpoint, workload).run().as_dict()
+    finally:
+        server.shutdown()
+    ok, broken = report['templates']['ok'], report['templates']['broken']
+    (ok['queries'] > 10).should.be(True)
+    ok['errors'].should.equal(0)
+    ok['p50_seconds'].should.be.within(0.005, 0.5)
+    (ok['p50_seconds'] <= ok['p95_seconds'] <= ok['p99_seconds']).should.be(True)
+    broken['error_rate'].should.equal(1.0)
+    broken['error_kinds'].should.equal({'HTTP 500': broken['queries']})
+    report['total']['queries'].should.equal(ok['queries'] + broken['queries'])
+
+
+def test_open_loop_keeps_the_rate_and_excludes_the_warmup():
+    server, endpoint = start_endpoint()
+    try:
+        workload = Workload.from_config({'templates': {'ask': 'ASK { ?s ?p ?o }'}, 'rate': 40, 'duration': 0.5,
+                                         'warmup': 0.25})
+        report = LoadGenerator(endpoint, workload).run()
+    finally:
+        server.shutdown()
+    measured = report.as_dict()['templates']['ask']['queries']
+    measured.should.equal(20)
+    len(server.queries).should.equal(30)
+    report.format().should.contain('ask')
+
+
+for test in [test_templates_query_logs_and_percentiles, test_closed_loop_reports_per_template_latencies_and_errors,
+             test_open_loop_keeps_the_rate_and_excludes_the_warmup]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
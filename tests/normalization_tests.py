@@ -0,0 +1,66 @@
+import gzip
+import tempfile
+import shutil
+import os
+from os import path as osp
+from unittest import SkipTest
+
+from data import normalization
+from data.datasets import ImportsCollector
+from data.normalization import turtle_chunks
+from tests.support import DLDTestConfig
+
+TURTLE_HEADER = "@prefix ex: <http://dld.aksw.org/> .\n\n"
+
+
+def _turtle(count):
+    return TURTLE_HEADER + "".join('ex:s{i} ex:p "o{i}" ;\n    ex:q ex:o .\n'.format(i=i) for i in range(count))
+
+
+def test_turtle_chunks_are_self_contained():
+    lines = _turtle(5).encode('utf-8').splitlines(True)
+    chunks = list(turtle_chunks(lines, 2))
+
+    len(chunks).should.equal(3)
+    all(chunk.startswith(TURTLE_HEADER.encode('utf-8')) for chunk in chunks).should.be(True)
+    [chunk.count(b'ex:p') for chunk in chunks].should.equal([2, 2, 1])
+
+
+def test_normalized_shards_replace_the_turtle_source():
+    if normalization.rdflib is None:
+        raise SkipTest("rdflib is not available")
+    working_dir = tempfile.mkdtemp('_wd', 'test_normalized_shards')
+    try:
+        config = DLDTestConfig(working_dir, default_graph_name='http://dld.aksw.org/default#', ready_markers=True)
+        os.makedirs(config.models_dir)
+        source_path = osp.join(working_dir, 'data.ttl')
+        with open(source_path, 'w') as source_file:
+            source_file.write(_turtle(30))
+        normalized = {'data': {'file': source_path, 'graph_name': 'http://dld.aksw.org/data',
+                               'normalize': {'shards': 2, 'workers': 2, 'chunk_statements': 4}}}
+
+        ImportsCollector(config).prepare(normalized)
+        shards = ['data-000.nt.gz', 'data-001.nt.gz']
+        sorted(name for name in os.listdir(config.models_dir) if name.endswith('.nt.gz')).should.equal(shards)
+        triples = list()
+        for shard in shards:
+            with gzip.open(osp.join(config.models_dir, shard), 'rb') as shard_file:
+                triples.extend(line for line in shard_file if line.strip())
+            osp.isfile(osp.join(config.models_dir, shard[:-len('.gz')] + '.graph')).should.be(True)
+            osp.isfile(osp.join(config.models_dir, shard + '.ready')).should.be(True)
+        len(triples).should.equal(60)
+
+        collector = ImportsCollector(config)
+        collector.prepare(normalized)
+        collector.memory.was_retained('data-001').should.be(True)
+
+        ImportsCollector(config).prepare({'data': {'file': source_path}})
+        sorted(n for n in os.listdir(config.models_dir) if n.startswith('data')).should.equal(
+            ['data.ttl', 'data.ttl.ready'])
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_turtle_chunks_are_self_contained, test_normalized_shards_replace_the_turtle_source]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import tempfile
+from os import path as osp
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from data.peers import PeerShareServer, PeerSources, SegmentedDownloader, SourceIndex, announced_digest, \
+    is_trusted_offer, parse_range, sha256_digest
+from tests.support import PAYLOAD, StandInServer
+
+ORIGIN_URL = 'http://downloads.dbpedia.org/2016-04/core/labels_en.nt.bz2'
+CONTENT = b''.join("<http://dbpedia.org/resource/R{i}> <http://ex.org/p> \"{i}\" .\n".format(i=i).encode('utf-8')
+                   for i in range(2000))
+
+
+def _share(content=CONTENT, origin_url=ORIGIN_URL, validators=None):
+    """
+    :return: pair of a started PeerShareServer offering the content as download of the origin URL and its directory
+    """
+    working_dir = tempfile.mkdtemp('_wd', 'test_peers')
+    filepath = osp.join(working_dir, 'models', 'labels_en.nt.bz2')
+    os.makedirs(osp.dirname(filepath))
+    with open(filepath, 'wb') as data_fd:
+        data_fd.write(content)
+    SourceIndex(working_dir).record([origin_url], filepath, validators or {'etag': '"labels-1"'})
+    return PeerShareServer([working_dir], '127.0.0.1', 0).start(), working_dir
+
+
+def _get(url, range_header=None):
+    request = Request(url, headers=range_header and {'Range': range_header} or dict())
+    try:
+        with urlopen(request, timeout=10) as response:
+            return response.status, response.headers, response.read()
+    except HTTPError as ex:
+        return ex.code, ex.headers, b''
+
+
+def test_shared_sources_are_served_with_ranges():
+    parse_range('bytes=-5', 100).should.equal((95, 99))
+    parse_range('bytes=90-', 100).should.equal((90, 99))
+    parse_range(None, 100).should.be(None)
+    parse_range.when.called_with('bytes=100-', 100).should.throw(ValueError)
+
+    server, working_dir = _share()
+    try:
+        status, _, index = _get(server.url + '/index')
+        sources = json.loads(index.decode('utf-8'))['sources']
+        sources.should.equal([{'urls': [ORIGIN_URL], 'sha256': sha256_digest(osp.join(
+            working_dir, 'models', 'labels_en.nt.bz2')), 'size': len(CONTENT), 'etag': '"labels-1"',
+                                     'last_modified': None}])
+        file_url = server.url + '/files/' + sources[0]['sha256']
+        status, headers, body = _get(file_url, 'bytes=10-19')
+        content_range = 'bytes 10-19/{s}'.format(s=len(CONTENT))
+        (status, body, headers['Content-Range']).should.equal((206, CONTENT[10:20], content_range))
+        _get(file_url)[2].should.equal(CONTENT)
+        _get(file_url, 'bytes={s}-'.format(s=len(CONTENT)))[0].should.equal(416)
+        _get(server.url + '/files/' + '0' * 64)[0].should.equal(404)
+        _get(server.url + '/files/../../etc/passwd')[0].should.equal(404)
+    finally:
+        server.shutdown()
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_sources_are_downloaded_from_several_peers_at_once():
+    first, first_dir = _share()
+    second, second_dir = _share()
+    target_dir = tempfile.mkdtemp()
+    try:
+        # the unavailable peer is skipped
+        peers = PeerSources([first.url, second.url + '/', 'http://127.0.0.1:9'], segment_size=4096, timeout=2)
+        digest, size, urls = peers.offer(['http://mirror.example.org/labels_en.nt.bz2', ORIGIN_URL])
+        (digest, size, len(urls)).should.equal((sha256_digest(osp.join(first_dir, 'models', 'labels_en.nt.bz2')),
+                                                len(CONTENT), 2))
+
+        received = SegmentedDownloader(urls + [first.url + '/files/' + '0' * 64], size, digest, 4096,
+                                       connections=2, max_attempts=2).download(osp.join(target_dir, 'direct.nt.bz2'))
+        sorted(received.keys()).should.equal(sorted(urls))
+        sum(received.values()).should.equal(len(CONTENT))
+
+        target_path = osp.join(target_dir, 'labels_en.nt.bz2')
+        peers.fetch([ORIGIN_URL], target_path, digest).should.equal({'etag': None, 'last_modified': None})
+        with open(target_path, 'rb') as data_fd:
+            data_fd.read().should.equal(CONTENT)
+        len(os.listdir(target_dir)).should.equal(2)
+
+        # a newer version at the origin or a corrupted transfer leads to the origin
+        peers.fetch([ORIGIN_URL], osp.join(target_dir, 'newer.nt.bz2'), '1' * 64).should.be(None)
+        corrupt_path = osp.join(target_dir, 'corrupt.nt.bz2')
+        SegmentedDownloader(urls, size, '0' * 64, 4096).download.when.called_with(corrupt_path).should.throw(IOError)
+        peers.fetch(['http://elsewhere.example.org/other.nt'], osp.join(target_dir, 'other.nt'), digest).should.be(None)
+        len(os.listdir(target_dir)).should.equal(2)
+    finally:
+        first.shutdown()
+        second.shutdown()
+        for directory in (first_dir, second_dir, target_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    PeerSources.from_config(None).should.be(None)
+    PeerSources.from_config({'urls': 'http://dld-a:8900', 'segment_size': '1M'}).segment_size.should.equal(1048576)
+    PeerSources.from_config.when.called_with({'urls': ['http://dld-a:8900'], 'rate': 1}).should.throw(RuntimeError)
+
+
+def test_peers_are_only_used_for_the_version_at_the_origin():
+    announced_digest({'repr-digest': 'sha-512=:AA==:, sha-256=:AAEC:'}).should.equal('000102')
+    announced_digest({'digest': 'SHA-256=AAEC'}).should.equal('000102')
+    announced_digest({}).should.be(None)
+    source = {'sha256': '0' * 64, 'size': 10, 'etag': '"v1"', 'last_modified': 'Mon, 01 Jun 2026 00:00:00 GMT'}
+    is_trusted_offer(source, {'sha256': '0' * 64}).should.be(True)
+    is_trusted_offer(source, {'sha256': '1' * 64, 'etag': '"v1"'}).should.be(False)
+    is_trusted_offer(source, {'etag': '"v2"', 'last_modified': source['last_modified']}).should.be(False)
+    is_trusted_offer(source, {'etag': 'W/"v2"', 'last_modified': source['last_modified']}).should.be(True)
+    is_trusted_offer(source, {'etag': '"v1"', 'length': 11}).should.be(False)
+    is_trusted_offer(dict(source, etag=None, last_modified=None), {'etag': '"v1"'}).should.be(False)
+
+    target_dir = tempfile.mkdtemp()
+    with StandInServer() as origin:
+        current, current_dir = _share(PAYLOAD, origin.url, {'etag': '"payload-1"'})
+        outdated, outdated_dir = _share(PAYLOAD[:-1], origin.url, {'etag': '"payload-0"'})
+        try:
+            peers = PeerSources([current.url, outdated.url], timeout=2)
+            target_path = osp.join(target_dir, 'dump.nt')
+            peers.fetch([origin.url], target_path).should.equal({'etag': '"payload-1"',
+                                                                 'last_modified': 'Mon, 01 Jun 2026 00:00:00 GMT'})
+            with open(target_path, 'rb') as data_fd:
+                (data_fd.read() == PAYLOAD).should.be(True)
+
+            PeerSources([outdated.url], timeout=2).fetch([origin.url], target_path).should.be(None)
+        finally:
+            current.shutdown()
+            outdated.shutdown()
+            for directory in (current_dir, outdated_dir, target_dir):
+                shutil.rmtree(directory, ignore_errors=True)
+    PeerSources([current.url]).fetch(['http://127.0.0.1:9/dump.nt'], target_path).should.be(None)
+
+
+for test in [test_shared_sources_are_served_with_ranges, test_sources_are_downloaded_from_several_peers_at_once,
+             test_peers_are_only_used_for_the_version_at_the_origin]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import threading
+from os import path as osp
+
+import dld
+from data.datasets import ImportsCollector, PREPARATION_DONE_MARKER
+from dld import BackgroundCall, ComposeConfigGenerator, run_pipelined
+from tests.support import DLDTestConfig
+
+COMPONENTS = {'store': 'aksw/dld-store-virtuoso7', 'load': 'aksw/dld-load-virtuoso',
+              'present': {'ontowiki': 'aksw/dld-present-ontowiki'}}
+
+
+def test_early_services_include_the_loader_only_with_ready_markers():
+    configurator = ComposeConfigGenerator({'components': COMPONENTS}, DLDTestConfig('wd-pipelined'))
+    configurator.configure_compose()
+    configurator.early_service_names.should.equal(['presentontowiki', 'store'])
+    ('IMPORT_READY_MARKER_SUFFIX' in configurator.compose_config['load']['environment']).should.be(False)
+
+    marked = ComposeConfigGenerator({'components': COMPONENTS}, DLDTestConfig('wd-pipelined', ready_markers=True))
+    marked.configure_compose()
+    marked.early_service_names.should.equal(['load', 'presentontowiki', 'store'])
+    marked.compose_config['load']['environment']['IMPORT_READY_MARKER_SUFFIX'].should.equal('.ready')
+
+
+def test_ready_markers_follow_the_prepared_datasets():
+    working_dir = tempfile.mkdtemp('_wd', 'test_ready_markers')
+    try:
+        config = DLDTestConfig(working_dir, default_graph_name='http://dld.aksw.org/default#', ready_markers=True)
+        os.makedirs(config.models_dir)
+        datasets = dict()
+        for name in ['a', 'b']:
+            source_path = osp.join(working_dir, name + '.nt')
+            with open(source_path, 'w') as source_file:
+                source_file.write('<http://dld.aksw.org/{n}> <http://dld.aksw.org/p> "o" .\n'.format(n=name))
+            datasets[name] = {'file': source_path}
+
+        ImportsCollector(config).prepare(datasets)
+        sorted(os.listdir(config.models_dir)).should.equal(['a.nt', 'a.nt.ready', 'b.nt', 'b.nt.ready',
+                                                            PREPARATION_DONE_MARKER, 'global.graph'])
+
+        del datasets['b']
+        ImportsCollector(config).prepare(datasets)
+        sorted(os.listdir(config.models_dir)).should.equal(['a.nt', 'a.nt.ready', PREPARATION_DONE_MARKER,
+                                                            'global.graph'])
+
+        config.ready_markers = False
+        ImportsCollector(config).prepare(datasets)
+        sorted(os.listdir(config.models_dir)).should.equal(['a.nt', 'global.graph'])
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_background_call_hands_over_result_and_exception():
+    call = BackgroundCall(lambda value, factor=1: value * factor, 3, factor=2)
+    call.start()
+    call.join().should.equal(6)
+
+    def failing():
+        raise RuntimeError("preparation failed")
+
+    call = BackgroundCall(failing)
+    call.start()
+    call.join.when.called_with().should.throw(RuntimeError)
+
+
+def test_pipelined_run_starts_early_services_while_preparing():
+    early_services_started = threading.Event()
+
+    class RecordingConfigurator(object):
+        early_service_names = ['store']
+        store_service_names = ['store']
+        events = list()
+
+        def create_compose_config(self):
+            self.events.append('configured')
+
+        def run_preparation(self, pull_images=False):
+            # blocks until the early services were brought up, i.e. both happen concurrently
+            early_services_started.wait(5).should.be(True)
+            self.events.append(('prepared', pull_images))
+
+    def recording_bring_up(configurator, dld_config, backend, service_names=None, detach=False):
+        configurator.events.append(('up', service_names, detach))
+        early_services_started.set()
+
+    working_dir = tempfile.mkdtemp('_wd', 'test_pipelined')
+    original_bring_up = dld.bring_up
+    dld.bring_up = recording_bring_up
+    try:
+        configurator = RecordingConfigurator()
+        run_pipelined(configurator, DLDTestConfig(working_dir), 'engine')
+        configurator.events.should.equal(['configured', ('up', ['store'], True), ('prepared', True),
+                                          ('up', None, False)])
+        osp.isdir(osp.join(working_dir, 'models')).should.be(True)
+    finally:
+        dld.bring_up = original_bring_up
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_early_services_include_the_loader_only_with_ready_markers,
+             test_ready_markers_follow_the_prepared_datasets,
+             test_background_call_hands_over_result_and_exception,
+             test_pipelined_run_starts_early_services_while_preparing]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
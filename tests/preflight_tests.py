@@ -0,0 +1,71 @@
+import tempfile
+import shutil
+import os
+from os import path as osp
+
+from data.datasets import ImportsCollector
+from data.preflight import Preflight, PreflightError
+from tests.support import DLDTestConfig, StandInServer, PAYLOAD
+
+
+def _write_file(filepath, size):
+    with open(filepath, 'w') as data_file:
+        data_file.write('x' * size)
+
+
+def test_preflight_sums_transfers_and_reports_all_problems():
+    """
+        files already complete in the models dir are not counted, every unreachable source is reported
+    """
+    working_dir = tempfile.mkdtemp('_wd', 'test_preflight_sums_transfers')
+    try:
+        config = DLDTestConfig(working_dir, default_graph_name='http://dld.aksw.org/default#')
+        sources_dir = osp.join(working_dir, 'sources')
+        os.makedirs(config.models_dir)
+        os.makedirs(sources_dir)
+        for name, size in [('a.nt', 300), ('b.nt', 200)]:
+            _write_file(osp.join(sources_dir, name), size)
+        shutil.copy2(osp.join(sources_dir, 'b.nt'), osp.join(config.models_dir, 'b.nt'))
+        with StandInServer() as available, StandInServer(missing=True) as missing:
+            datasets = {
+                'a': {'file': osp.join(sources_dir, 'a.nt')},
+                'b': {'file': osp.join(sources_dir, 'b.nt')},
+                'gone': {'file': osp.join(sources_dir, 'gone.nt')},
+                'remote': {'location': available.url},
+                'missing': {'location': missing.url.replace('dump.nt', 'other.nt')},
+            }
+            report = Preflight(ImportsCollector(config)).run(datasets)
+
+        report.transfer_bytes.should.equal(300 + len(PAYLOAD))
+        sorted(entry.dataset_name for entry in report.entries if entry.retained).should.equal(['b'])
+        sorted(entry.dataset_name for entry in report.failed_entries).should.equal(['gone', 'missing'])
+        report.ok.should.be(False)
+        report.raise_on_failure.when.called_with().should.throw(PreflightError)
+        os.listdir(config.models_dir).should.equal(['b.nt'])
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_preflight_checks_files_of_lists():
+    working_dir = tempfile.mkdtemp('_wd', 'test_preflight_checks_files_of_lists')
+    try:
+        config = DLDTestConfig(working_dir, default_graph_name='http://dld.aksw.org/default#')
+        os.makedirs(config.models_dir)
+        list_path = osp.join(working_dir, 'sources.list')
+        with open(list_path, 'w') as list_file:
+            for name, size in [('a.nt', 10), ('b.nt', 20), ('c.nt', 30)]:
+                _write_file(osp.join(working_dir, name), size)
+                list_file.write(osp.join(working_dir, name) + '\n')
+
+        report = Preflight(ImportsCollector(config)).run({'listed': {'file_list': list_path}})
+
+        len(report.entries).should.equal(3)
+        report.transfer_bytes.should.equal(60)
+        report.ok.should.be(True)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_preflight_sums_transfers_and_reports_all_problems, test_preflight_checks_files_of_lists]:
+    test.test_kind = 'unit'
+    test.test_speed = 2
@@ -0,0 +1,130 @@
+import gzip
+import tempfile
+import shutil
+import os
+from os import path as osp
+
+from data.datasets import ImportsCollector
+from data.sampling import SampleSpec, SampleCache, write_sample, is_sample_file, source_signature, FULL_COPIES_DIR
+from data.transfer import SourceMetadataCache
+from tests.support import DLDTestConfig, PAYLOAD, LAST_MODIFIED, StandInServer
+
+
+def _triples(count):
+    return "".join('<http://dld.aksw.org/s{i}> <http://dld.aksw.org/p> "o" .\n'.format(i=i) for i in range(count))
+
+
+def test_head_sample_of_compressed_ntriples():
+    working_dir = tempfile.mkdtemp('_wd', 'test_head_sample')
+    try:
+        source_path = osp.join(working_dir, 'source.nt.gz')
+        with gzip.open(source_path, 'wt') as source_file:
+            source_file.write(_triples(100))
+        target_path = osp.join(working_dir, 'sample.nt.gz')
+
+        write_sample(source_path, target_path, SampleSpec(triples=10)).should.equal(10)
+        with gzip.open(target_path, 'rt') as sample_file:
+            sample_file.read().should.equal(_triples(10))
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_fraction_sample_of_turtle_keeps_directives():
+    working_dir = tempfile.mkdtemp('_wd', 'test_fraction_sample')
+    try:
+        source_path = osp.join(working_dir, 'source.ttl')
+        statements = ['ex:s{i} ex:p "a" ;\n    ex:q """multi\nline.\n""" .\n'.format(i=i) for i in range(200)]
+        with open(source_path, 'w') as source_file:
+            source_file.write("@prefix ex: <http://dld.aksw.org/> .\n\n" + "".join(statements))
+        sample_spec = SampleSpec(fraction=0.25, seed=7)
+
+        written = write_sample(source_path, osp.join(working_dir, 'a.ttl'), sample_spec)
+        write_sample(source_path, osp.join(working_dir, 'b.ttl'), sample_spec).should.equal(written)
+        written.should.be.within(20, 80)
+        with open(osp.join(working_dir, 'a.ttl')) as sample_file:
+            sample = sample_file.read()
+        sample.startswith("@prefix ex: <http://dld.aksw.org/> .\n").should.be(True)
+        sampled_statements = [block + '""" .\n' for block in sample.split("\n", 1)[1].split('""" .\n')[:-1]]
+        len(sampled_statements).should.equal(written)
+        set(sampled_statements).issubset(statements).should.be(True)
+        with open(osp.join(working_dir, 'b.ttl')) as other_sample_file:
+            (other_sample_file.read() == sample).should.be(True)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_switching_between_sample_and_full_copy():
+    working_dir = tempfile.mkdtemp('_wd', 'test_switching_sample')
+    try:
+        config = DLDTestConfig(working_dir, default_graph_name='http://dld.aksw.org/default#')
+        os.makedirs(config.models_dir)
+        source_path = osp.join(working_dir, 'data.nt')
+        with open(source_path, 'w') as source_file:
+            source_file.write(_triples(50))
+        target_path = osp.join(config.models_dir, 'data.nt')
+        sampled = {'data': {'file': source_path, 'sample': {'triples': 5}}}
+
+        ImportsCollector(config).prepare(sampled)
+        is_sample_file(working_dir, target_path).should.be(True)
+        osp.getsize(target_path).should.equal(len(_triples(5)))
+
+        ImportsCollector(config).prepare({'data': {'file': source_path}})
+        is_sample_file(working_dir, target_path).should.be(False)
+        osp.getsize(target_path).should.equal(len(_triples(50)))
+
+        collector = ImportsCollector(config)
+        collector.prepare(sampled)
+        collector.memory.was_added('data').should.be(True)
+        osp.isfile(osp.join(working_dir, FULL_COPIES_DIR, 'data.nt')).should.be(True)
+
+        collector = ImportsCollector(config)
+        collector.prepare({'data': {'file': source_path}})
+        collector.memory.was_retained('data').should.be(True)
+        osp.getsize(target_path).should.equal(len(_triples(50)))
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_remote_sample_is_read_through_the_chunk_filter():
+    working_dir = tempfile.mkdtemp('_wd', 'test_remote_sample')
+    try:
+        read_chunks = []
+        with StandInServer() as server:
+            written = write_sample(server.url, osp.join(working_dir, 'sample.nt'), SampleSpec(triples=10),
+                                   read_chunks.append)
+        written.should.equal(10)
+        (0 < sum(read_chunks) <= len(PAYLOAD)).should.be(True)
+        with open(osp.join(working_dir, 'sample.nt'), 'rb') as sample_file:
+            (sample_file.read() == b''.join(PAYLOAD.splitlines(True)[:10])).should.be(True)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_remote_sample_is_taken_again_for_new_source_version():
+    working_dir = tempfile.mkdtemp('_wd', 'test_remote_signature')
+    try:
+        now = [0]
+        metadata_cache = SourceMetadataCache(ttl=10, clock=lambda: now[0])
+        sample_cache = SampleCache(working_dir, SampleSpec(triples=10), metadata_cache)
+        with StandInServer() as server:
+            signature = source_signature(server.url)
+            signature.should.equal([server.url, '"payload-1"', LAST_MODIFIED, len(PAYLOAD)])
+            sample_cache.ensure_sample('dump.nt', server.url)
+            sample_cache.is_current('dump.nt', server.url).should.be(True)
+            metadata_cache.stats().should.equal({'entries': 1, 'hits': 1, 'misses': 1})
+
+            server.httpd.etag = '"payload-2"'
+            sample_cache.is_current('dump.nt', server.url).should.be(True)  # remembered validators
+            now[0] = 11
+            sample_cache.is_current('dump.nt', server.url).should.be(False)
+            sample_cache.ensure_sample('dump.nt', server.url)
+            sample_cache.is_current('dump.nt', server.url).should.be(True)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_head_sample_of_compressed_ntriples, test_fraction_sample_of_turtle_keeps_directives,
+             test_switching_between_sample_and_full_copy, test_remote_sample_is_read_through_the_chunk_filter,
+             test_remote_sample_is_taken_again_for_new_source_version]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
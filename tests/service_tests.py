@@ -0,0 +1,155 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path as osp
+
+from data.transfer import SourceMetadataCache
+from dld import BackgroundCall
+from service import DLDService, JobLogHandler, JobScheduler, ServiceClient, job_working_dir
+from tools import child_thread_name
+
+
+class RecordingRunner(object):
+    """
+    stands in for dld.py main(): records when the jobs for each working directory run and blocks them until
+    released
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = list()
+        self.max_running = 0
+        self.release = threading.Event()
+
+    def __call__(self, args):
+        working_dir = args[args.index('-w') + 1]
+        with self.lock:
+            self.running.append(working_dir)
+            self.max_running = max(self.max_running, len(self.running))
+            overlapping = self.running.count(working_dir) > 1
+        logging.getLogger('dld.test').info("preparing {wd}".format(wd=working_dir))
+        self.release.wait(5)
+        with self.lock:
+            self.running.remove(working_dir)
+        if 'fail' in args:
+            raise RuntimeError("preparation failed")
+        return overlapping and 1 or 0
+
+
+def _wait_for(jobs, timeout=5):
+    deadline = time.time() + timeout
+    while not all(job.done for job in jobs) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_jobs_on_the_same_working_dir_run_one_after_the_other():
+    runner = RecordingRunner()
+    scheduler = JobScheduler(runner, max_workers=3)
+    try:
+        first = scheduler.submit(['-w', 'wd-a'])
+        second = scheduler.submit(['-w', 'wd-a', 'fail'])
+        other = scheduler.submit(['-c', 'b-dld.yml', '-w', 'wd-b'])
+        time.sleep(0.2)
+        (first.state, second.state, other.state).should.equal(('running', 'queued', 'running'))
+        runner.release.set()
+        _wait_for([first, second, other])
+    finally:
+        scheduler.shutdown()
+    (first.exit_status, other.exit_status).should.equal((0, 0))
+    (second.state, second.exit_status, second.error).should.equal(('failed', 1, 'RuntimeError: preparation failed'))
+    runner.max_running.should.equal(2)
+    [event['state'] for event in second.events].should.equal(['queued', 'running', 'failed'])
+
+    job_working_dir(['-c', 'conf/x-dld.yml']).should.equal(osp.realpath('wd-x'))
+    job_working_dir(['-u', '--working-dir', 'setup']).should.equal(osp.realpath('setup'))
+
+
+def test_events_are_streamed_through_the_unix_socket():
+    tmpdir = tempfile.mkdtemp()
+    runner = RecordingRunner()
+    runner.release.set()
+
+    def validate(args):
+        if '--watch' in args:
+            raise ValueError("--watch cannot be run by the service")
+
+    logging.getLogger('dld').setLevel(logging.INFO)
+    service = DLDService(runner, validate=validate, cache_stats=lambda: {'source_metadata': {'hits': 0}})
+    try:
+        socket_path = osp.join(tmpdir, 'dld.sock')
+        service.bind(socket_path)
+        service.start()
+        (os.stat(socket_path).st_mode & 0o777).should.equal(0o600)
+        client = ServiceClient(socket_path)
+
+        job = client.submit(['-w', 'wd-streamed'])
+        job['working_dir'].should.equal(osp.realpath('wd-streamed'))
+        events = list(client.events(job['id']))
+        [event['type'] for event in events].should.equal(['state', 'state', 'log', 'state'])
+        events[2]['message'].should.equal('preparing wd-streamed')
+        client.job(job['id'])['exit_status'].should.equal(0)
+
+        client.submit.when.called_with(['--watch']).should.throw(RuntimeError)
+        client.status()['caches'].should.equal({'source_metadata': {'hits': 0}})
+        len(client.jobs()).should.equal(1)
+    finally:
+        service.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    osp.exists(socket_path).should.be(False)
+
+
+def test_source_metadata_cache_expires_entries():
+    now = [100.0]
+    fetched = list()
+    cache = SourceMetadataCache(ttl=10, clock=lambda: now[0])
+
+    def fetch(location):
+        fetched.append(location)
+        return 42
+
+    cache.content_length('http://example.org/a.nt', fetch).should.equal(42)
+    cache.content_length('http://example.org/a.nt', fetch).should.equal(42)
+    now[0] += 11
+    cache.content_length('http://example.org/a.nt', fetch).should.equal(42)
+    len(fetched).should.equal(2)
+    cache.stats().should.equal({'entries': 1, 'hits': 1, 'misses': 2})
+
+
+def test_log_records_of_the_threads_started_by_jobs_reach_the_jobs():
+    log = logging.getLogger('dld.test.threaded')
+
+    def threaded_runner(args):
+        log.info("job {a}".format(a=args[0]))
+        background = BackgroundCall(log.info, "background of {a}".format(a=args[0]))
+        background.start()
+        background.join()
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix=child_thread_name('test')) as executor:
+            executor.submit(log.info, "pooled of {a}".format(a=args[0])).result()
+        return 0
+
+    log_handler = JobLogHandler()
+    log.setLevel(logging.INFO)
+    log.addHandler(log_handler)
+    scheduler = JobScheduler(threaded_runner, max_workers=2, log_handler=log_handler)
+    try:
+        first, second = scheduler.submit(['a', '-w', 'wd-a']), scheduler.submit(['b', '-w', 'wd-b'])
+        _wait_for([first, second])
+    finally:
+        scheduler.shutdown()
+        log.removeHandler(log_handler)
+    for job, name in [(first, 'a'), (second, 'b')]:
+        messages = [event['message'] for event in job.events if event['type'] == 'log']
+        messages.should.equal(['job ' + name, 'background of ' + name, 'pooled of ' + name])
+    log.info("not part of a job")
+    len([event for event in first.events if event['type'] == 'log']).should.equal(3)
+
+
+for test in [test_jobs_on_the_same_working_dir_run_one_after_the_other,
+             test_events_are_streamed_through_the_unix_socket, test_source_metadata_cache_expires_entries,
+             test_log_records_of_the_threads_started_by_jobs_reach_the_jobs]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
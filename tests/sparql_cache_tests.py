@@ -0,0 +1,165 @@
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from dld import ComposeConfigGenerator
+from orchestration.engine import LOAD_COMPLETED_MESSAGE
+from sparql.cache import CachingProxyServer, LoadWatcher, QueryCache, cache_key, normalize_query
+from tests.support import DLDTestConfig
+
+QUERY = 'SELECT ?label # labels only\nWHERE  {\n  ?s <http://www.w3.org/2000/01/rdf-schema#label>  ?label .\n}'
+
+
+class CountingStore(BaseHTTPRequestHandler):
+    """
+    stands in for the store: answers each query with the number of queries received so far
+    """
+    received = list()
+
+    def log_message(self, msg_format, *args):
+        pass
+
+    def do_GET(self):
+        self._answer(b'')
+
+    def do_POST(self):
+        self._answer(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+
+    def _answer(self, body):
+        self.received.append((self.command, self.path, body))
+        content = json.dumps({'count': len(self.received), 'accept': self.headers.get('Accept')}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _query(url, query, accept='application/sparql-results+json', post=False):
+    data = post and urlencode({'query': query}).encode('utf-8') or None
+    request = Request(post and url or (url + '?' + urlencode({'query': query})), data=data,
+                      headers={'Accept': accept})
+    with urlopen(request, timeout=10) as response:
+        return response.headers['X-Cache'], json.loads(response.read().decode('utf-8'))['count']
+
+
+def test_query_cache_evicts_least_recently_used_and_expired_results():
+    normalized = 'SELECT ?label WHERE { ?s <http://www.w3.org/2000/01/rdf-schema#label> ?label . }'
+    normalize_query(QUERY).should.equal(normalized)
+    normalize_query('ASK { ?s ?p "a  # b" }').should.equal('ASK { ?s ?p "a  # b" }')
+    cache_key(QUERY, [('_', '1')], 'text/csv, */*').should.equal(cache_key(normalize_query(QUERY), [], 'text/csv,*/*'))
+
+    now = [100.0]
+    cache = QueryCache(ttl=10, max_entries=2, max_bytes=10, clock=lambda: now[0])
+    cache.put('a', {}, b'aaaa')
+    cache.put('b', {}, b'bbbb')
+    cache.get('a').should.equal(({}, b'aaaa'))
+    cache.put('c', {}, b'cccc')
+    cache.get('b').should.be(None)
+    cache.put('too large', {}, b'x' * 11)
+    cache.get('too large').should.be(None)
+    now[0] += 11
+    cache.get('a').should.be(None)
+    cache.put('d', {}, b'dddddddd')
+    cache.get('c').should.be(None)
+    stats = cache.stats()
+    (stats['hits'], stats['misses'], stats['evictions'], stats['entries'], stats['bytes']).should.equal((1, 4, 2, 1, 8))
+
+
+def test_proxy_serves_repeated_queries_from_the_cache_until_the_load_finished():
+    CountingStore.received = list()
+    store = HTTPServer(('127.0.0.1', 0), CountingStore)
+    threading.Thread(target=store.serve_forever, daemon=True).start()
+    cache = QueryCache(enabled=False)
+    proxy = CachingProxyServer('http://127.0.0.1:{p}'.format(p=store.server_address[1]), cache, '127.0.0.1', 0)
+    proxy.start()
+    try:
+        url = proxy.url + '/sparql'
+        # while loading, the queries are passed through
+        _query(url, QUERY).should.equal(('MISS', 1))
+        _query(url, QUERY).should.equal(('MISS', 2))
+        released = threading.Event()
+
+        class WaitingClient(object):
+            inspected = list()
+
+            def inspect_container(self, name):
+                self.inspected.append(name)
+                if len(self.inspected) == 1:
+                    not_found = IOError("no such container")
+                    not_found.response = type('Response', (object,), {'status_code': 404})
+                    raise not_found
+                return {'State': {'Running': True}}
+
+            def logs(self, name, **kwargs):
+                message = released.is_set() and LOAD_COMPLETED_MESSAGE or 'loading'
+                return '2016-05-01T10:00:00.1Z {m}\n'.format(m=message).encode('utf-8')
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+        watcher = LoadWatcher(cache, ['wdcache_load_1'], client_factory=WaitingClient, poll_interval=0.01)
+        watcher.start()
+        # the loader keeps running after the import, only its completion message ends the wait
+        watcher.join(0.1)
+        cache.enabled.should.be(False)
+        released.set()
+        watcher.join(5)
+        watcher.is_alive().should.be(False)
+        set(WaitingClient.inspected).should.equal(set(['wdcache_load_1']))
+
+        _query(url, QUERY).should.equal(('MISS', 3))
+        _query(url, ' ' + QUERY.replace('  ', ' ')).should.equal(('HIT', 3))
+        _query(url, QUERY, post=True).should.equal(('HIT', 3))
+        _query(url, QUERY, accept='text/csv').should.equal(('MISS', 4))
+
+        update = Request(url, data=urlencode({'update': 'CLEAR ALL'}).encode('utf-8'))
+        with urlopen(update, timeout=10) as response:
+            response.headers['X-Cache'].should.equal('PASS')
+        _query(url, QUERY).should.equal(('MISS', 6))
+
+        with urlopen(proxy.url + '/cache/metrics', timeout=10) as response:
+            metrics = json.loads(response.read().decode('utf-8'))
+        (metrics['hits'], metrics['misses'], metrics['bypassed'], metrics['enabled']).should.equal((2, 3, 2, True))
+        with urlopen(Request(proxy.url + '/cache/invalidate', data=b''), timeout=10) as response:
+            json.loads(response.read().decode('utf-8')).should.equal({'dropped': 1})
+    finally:
+        proxy.shutdown()
+        store.shutdown()
+        store.server_close()
+    set(path.split('?')[0] for _, path, _ in CountingStore.received).should.equal(set(['/sparql']))
+
+
+def test_present_components_are_linked_to_the_cache():
+    yaml_config = {'components': {
+        'store': 'aksw/dld-store-virtuoso7', 'load': 'aksw/dld-load-virtuoso',
+        'present': {'ontowiki': {'image': 'aksw/dld-present-ontowiki', 'links': ['other']}},
+        'cache': {'settings': {'ttl': 60}}}}
+    configurator = ComposeConfigGenerator(yaml_config, DLDTestConfig('wd-cache'))
+    configurator.configure_compose()
+    compose_config = configurator.compose_config
+    compose_config['presentontowiki']['links'].should.equal(['other', 'cache:store'])
+    cache_spec = compose_config['cache']
+    (cache_spec['image'], cache_spec['links']).should.equal(('aksw/dld', ['store']))
+    cache_spec['command'][cache_spec['command'].index('--ttl') + 1].should.equal('60')
+    cache_spec['command'][-2:].should.equal(['--await', 'wdcache_load_1'])
+    cache_spec['volumes'].should.equal(['/var/run/docker.sock:/var/run/docker.sock'])
+
+    restored = ComposeConfigGenerator(dict(yaml_config, components=dict(yaml_config['components'], cache='my/cache')),
+                                      DLDTestConfig('wd-cache'))
+    restored.skip_load = True
+    restored.configure_compose()
+    (restored.compose_config['cache']['image'], 'load' in restored.compose_config).should.equal(('my/cache', False))
+    ('--await' in restored.compose_config['cache']['command']).should.be(False)
+
+
+for test in [test_query_cache_evicts_least_recently_used_and_expired_results,
+             test_proxy_serves_repeated_queries_from_the_cache_until_the_load_finished,
+             test_present_components_are_linked_to_the_cache]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
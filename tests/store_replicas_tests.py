@@ -0,0 +1,99 @@
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from dld import ComposeConfigGenerator
+from sparql.cache import CachingProxyServer, QueryCache
+from tests.support import DLDTestConfig
+from tools import parse_cpuset, partition_cpuset
+
+
+class NamedStore(BaseHTTPRequestHandler):
+    """
+    stands in for a store replica: answers with the name of the replica
+    """
+
+    def log_message(self, msg_format, *args):
+        pass
+
+    def do_GET(self):
+        content = json.dumps({'store': self.server.name}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _components(store, **components):
+    components.update({'store': store, 'load': 'aksw/dld-load-virtuoso',
+                       'present': {'ontowiki': 'aksw/dld-present-ontowiki', 'sparqlify': 'aksw/dld-present-sparqlify',
+                                   'yasgui': 'aksw/dld-present-yasgui'}})
+    return {'components': components}
+
+
+def test_cpus_are_divided_among_the_replicas():
+    parse_cpuset('0-3, 8').should.equal([0, 1, 2, 3, 8])
+    parse_cpuset.when.called_with('0-a').should.throw(ValueError)
+    partition_cpuset(list(range(8)), 3).should.equal(['0,1', '2,3,4', '5,6,7'])
+    partition_cpuset([4, 5], 3).should.equal(['4', '5', '4'])
+
+
+def test_present_components_are_distributed_over_the_store_replicas():
+    store = {'image': 'aksw/dld-store-virtuoso7', 'replicas': 3, 'ports': ['8891:8890']}
+    configurator = ComposeConfigGenerator(_components(store), DLDTestConfig('wd-replicas'))
+    configurator.configure_compose()
+    compose_config = configurator.compose_config
+
+    configurator.store_service_names.should.equal(['store', 'store2', 'store3'])
+    [compose_config[name]['cpuset'] for name in ['store', 'store2', 'store3']].should.equal(['0,1', '2,3,4', '5,6,7'])
+    (compose_config['store']['ports'], 'ports' in compose_config['store3']).should.equal((['8891:8890'], False))
+    ('replicas' in compose_config['store2']).should.be(False)
+    [compose_config['present' + name]['links'] for name in ['ontowiki', 'sparqlify', 'yasgui']].should.equal(
+        [['store'], ['store2:store'], ['store3:store']])
+    (compose_config['load']['links'], compose_config['load']['volumes_from']).should.equal((['store'], ['store']))
+
+    store = dict(store, cpuset='0-3', replicas=2)
+    cached = ComposeConfigGenerator(_components(store, cache='aksw/dld'), DLDTestConfig('wd-replicas'))
+    cached.configure_compose()
+    [cached.compose_config[name]['cpuset'] for name in ['store', 'store2']].should.equal(['0,1', '2,3'])
+    cached.compose_config['presentyasgui']['links'].should.equal(['cache:store'])
+    command = cached.compose_config['cache']['command']
+    command[command.index('--upstream') + 1:command.index('--ttl')].should.equal(['http://store:8890',
+                                                                                  'http://store2:8890'])
+    command[command.index('--await-replicas') + 1:].should.equal(['wdreplicas_store2_1'])
+
+
+def test_cache_balances_queries_over_the_replicas_once_loaded():
+    stores = list()
+    for name in ['store', 'store2']:
+        store = HTTPServer(('127.0.0.1', 0), NamedStore)
+        store.name = name
+        threading.Thread(target=store.serve_forever, daemon=True).start()
+        stores.append(store)
+    cache = QueryCache(enabled=False)
+    upstreams = ['http://127.0.0.1:{p}'.format(p=store.server_address[1]) for store in stores]
+    # an unavailable replica is skipped
+    proxy = CachingProxyServer(upstreams + ['http://127.0.0.1:9'], cache, '127.0.0.1', 0).start()
+    try:
+        def answering_store(query):
+            with urlopen(Request(proxy.url + '/sparql?' + urlencode({'query': query})), timeout=10) as response:
+                return json.loads(response.read().decode('utf-8'))['store']
+
+        [answering_store('ASK {{ ?s ?p {i} }}'.format(i=i)) for i in range(3)].should.equal(['store'] * 3)
+        cache.invalidate()
+        answering = [answering_store('ASK {{ ?s ?p {i} }}'.format(i=i)) for i in range(6)]
+        sorted(set(answering)).should.equal(['store', 'store2'])
+    finally:
+        proxy.shutdown()
+        for store in stores:
+            store.shutdown()
+            store.server_close()
+
+
+for test in [test_cpus_are_divided_among_the_replicas, test_present_components_are_distributed_over_the_store_replicas,
+             test_cache_balances_queries_over_the_replicas_once_loaded]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
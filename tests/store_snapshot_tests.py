@@ -0,0 +1,198 @@
+import contextlib
+import io
+import tempfile
+import shutil
+import os
+from os import path as osp
+
+from orchestration.engine import LOAD_COMPLETED_MESSAGE
+from orchestration.snapshots import SnapshotCache, StoreSnapshots, DigestCache, import_fingerprint, SNAPSHOT_PATHS_LABEL
+
+IMAGES = {'store': 'sha256:store', 'load': 'sha256:load'}
+CLEAR_COMMAND = ['find', '/var/lib/virtuoso/db', '-mindepth', '1', '-delete']
+COMPLETED_LOG = '2016-05-01T10:00:00.000000000Z {m}\n'.format(m=LOAD_COMPLETED_MESSAGE).encode('utf-8')
+
+
+class FakeSnapshotDockerClient(object):
+    """
+    keeps the data paths of a single store container as bytes, records the calls made for export and restore;
+    load containers keep running with the given log
+    """
+
+    def __init__(self, data_by_path, load_log=COMPLETED_LOG, labels=None):
+        self.data_by_path = data_by_path
+        self.load_log = load_log
+        self.labels = labels
+        self.load_running = True
+        self.calls = list()
+        self.inspected = list()
+
+    def inspect_image(self, image):
+        self.inspected.append(image)
+        return {'Id': 'sha256:' + image, 'Config': {'Volumes': dict((p, {}) for p in self.data_by_path),
+                                                    'Labels': self.labels}}
+
+    def inspect_container(self, container):
+        running = '_load' not in container or self.load_running
+        return {'Config': {'Image': 'aksw/dld-store-virtuoso7'}, 'State': {'Running': running, 'ExitCode': 1}}
+
+    def logs(self, container, **kwargs):
+        self.calls.append(('logs', container))
+        return self.load_log
+
+    def create_host_config(self, **kwargs):
+        return kwargs
+
+    def create_container(self, image, entrypoint=None, command=None, host_config=None):
+        self.calls.append(('clear', host_config['volumes_from'][0], entrypoint + command))
+        return {'Id': 'helper'}
+
+    def wait(self, container):
+        return 0
+
+    def remove_container(self, container, force=False):
+        pass
+
+    def get_archive(self, container, path):
+        self.calls.append(('get_archive', container, path))
+        return io.BytesIO(self.data_by_path[path]), {'name': osp.basename(path)}
+
+    def put_archive(self, container, path, data):
+        self.calls.append(('put_archive', container, path, data.read()))
+        return True
+
+    def __getattr__(self, name):
+        if name in ('stop', 'start', 'pause', 'unpause'):
+            return lambda container: self.calls.append((name, container))
+        raise AttributeError(name)
+
+
+def fake_client_factory(fake_client):
+    @contextlib.contextmanager
+    def client_context():
+        yield fake_client
+
+    return client_context
+
+
+def test_fingerprint_covers_contents_graphs_and_images():
+    working_dir = tempfile.mkdtemp('_wd', 'test_fingerprint_covers')
+    try:
+        with open(osp.join(working_dir, 'a.nt'), 'w') as data_file:
+            data_file.write('<http://dld.aksw.org/s> <http://dld.aksw.org/p> "o" .\n')
+        digest_cache = DigestCache(osp.join(working_dir, '.dld', 'digests.json'))
+        graphs = {'a.nt': 'http://dld.aksw.org/a'}
+
+        fingerprint = import_fingerprint(working_dir, graphs, None, IMAGES, digest_cache)
+        digest_cache.save()
+
+        reloaded_cache = DigestCache(osp.join(working_dir, '.dld', 'digests.json'))
+        import_fingerprint(working_dir, graphs, None, IMAGES, reloaded_cache).should.equal(fingerprint)
+        other_graph = import_fingerprint(working_dir, {'a.nt': 'http://dld.aksw.org/b'}, None, IMAGES, digest_cache)
+        other_image = import_fingerprint(working_dir, graphs, None, dict(IMAGES, load='sha256:other'), digest_cache)
+        with open(osp.join(working_dir, 'a.nt'), 'a') as data_file:
+            data_file.write('<http://dld.aksw.org/s> <http://dld.aksw.org/p> "o2" .\n')
+        other_content = import_fingerprint(working_dir, graphs, None, IMAGES, reloaded_cache)
+        len(set([fingerprint, other_graph, other_image, other_content])).should.equal(4)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_snapshot_cache_evicts_least_recently_used():
+    cache_dir = tempfile.mkdtemp('_cache', 'test_snapshot_cache_evicts')
+    try:
+        cache = SnapshotCache(cache_dir, max_bytes=2500)
+        cache.add('first', [('/data', [b'x' * 1000])])
+        cache.add('second', [('/data', [b'x' * 1000])])
+        os.utime(osp.join(cache_dir, 'second', 'snapshot.json'), (1, 1))  # 'second' becomes the oldest one
+        cache.add('third', [('/data', [b'x' * 1000])])
+
+        [cache.has(fp) for fp in ['first', 'second', 'third']].should.equal([True, False, True])
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_export_after_load_and_restore():
+    cache_dir = tempfile.mkdtemp('_cache', 'test_export_after_load')
+    try:
+        docker_client = FakeSnapshotDockerClient({'/var/lib/virtuoso/db': b'tar-bytes', '/import': b''})
+        snapshots = StoreSnapshots(SnapshotCache(cache_dir), 'wdtest', '/import',
+                                   client_factory=fake_client_factory(docker_client), poll_interval=0.01)
+
+        snapshots.export('fp', 'aksw/dld-store-virtuoso7', ['load']).should.be(True)
+        docker_client.calls.should.equal([('logs', 'wdtest_load_1'), ('pause', 'wdtest_store_1'),
+                                          ('get_archive', 'wdtest_store_1', '/var/lib/virtuoso/db'),
+                                          ('unpause', 'wdtest_store_1')])
+
+        docker_client.calls = list()
+        snapshots.restore('fp')
+        docker_client.calls.should.equal([('stop', 'wdtest_store_1'),
+                                          ('clear', 'wdtest_store_1', CLEAR_COMMAND), ('start', 'helper'),
+                                          ('put_archive', 'wdtest_store_1', '/var/lib/virtuoso', b'tar-bytes'),
+                                          ('start', 'wdtest_store_1')])
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_export_waits_for_the_completion_message_of_the_loaders():
+    cache_dir = tempfile.mkdtemp('_cache', 'test_export_waits')
+    try:
+        docker_client = FakeSnapshotDockerClient({'/var/lib/virtuoso/db': b'tar-bytes'}, load_log=b'loading\n')
+        snapshots = StoreSnapshots(SnapshotCache(cache_dir), 'wdtest', '/import', load_timeout=0.05,
+                                   client_factory=fake_client_factory(docker_client), poll_interval=0.01)
+        snapshots.export('fp', 'aksw/dld-store-virtuoso7', ['load']).should.be(False)
+        (('pause', 'wdtest_store_1') in docker_client.calls).should.be(False)
+
+        docker_client.load_running = False
+        docker_client.calls = list()
+        snapshots.load_timeout = 60
+        snapshots.export('fp', 'aksw/dld-store-virtuoso7', ['load']).should.be(False)
+        docker_client.calls.should.equal([('logs', 'wdtest_load_1')])
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_data_paths_from_the_labels_of_inspected_images():
+    docker_client = FakeSnapshotDockerClient({'/var/lib/virtuoso/db': b'tar-bytes', '/var/log': b''},
+                                             labels={SNAPSHOT_PATHS_LABEL: '/var/lib/virtuoso/db', 'other': 'x'})
+    snapshots = StoreSnapshots(None, 'wdtest', '/import', client_factory=fake_client_factory(docker_client))
+    compose_config = {'store': {'image': 'aksw/dld-store-virtuoso7'}, 'load': {'image': 'aksw/dld-load-virtuoso'}}
+
+    snapshots.image_ids(compose_config, ['store', 'load']).should.equal({
+        'store': 'sha256:aksw/dld-store-virtuoso7', 'load': 'sha256:aksw/dld-load-virtuoso'})
+    snapshots.data_paths('aksw/dld-store-virtuoso7').should.equal(['/var/lib/virtuoso/db'])
+    docker_client.inspected.should.equal(['aksw/dld-store-virtuoso7', 'aksw/dld-load-virtuoso'])
+
+    docker_client.labels = None
+    snapshots = StoreSnapshots(None, 'wdtest', '/import', client_factory=fake_client_factory(docker_client))
+    snapshots.data_paths('aksw/dld-store-virtuoso7').should.equal(['/var/lib/virtuoso/db', '/var/log'])
+
+
+def test_replicas_receive_the_loaded_store_data():
+    docker_client = FakeSnapshotDockerClient({'/var/lib/virtuoso/db': b'tar-bytes'})
+    snapshots = StoreSnapshots(None, 'wdtest', '/import', client_factory=fake_client_factory(docker_client),
+                               poll_interval=0.01)
+
+    snapshots.replicate('aksw/dld-store-virtuoso7', ['load'], ['store2', 'store3']).should.be(True)
+    docker_client.calls.should.equal([('logs', 'wdtest_load_1'), ('pause', 'wdtest_store_1'),
+                                      ('get_archive', 'wdtest_store_1', '/var/lib/virtuoso/db'),
+                                      ('unpause', 'wdtest_store_1'), ('stop', 'wdtest_store2_1'),
+                                      ('clear', 'wdtest_store2_1', CLEAR_COMMAND), ('start', 'helper'),
+                                      ('put_archive', 'wdtest_store2_1', '/var/lib/virtuoso', b'tar-bytes'),
+                                      ('start', 'wdtest_store2_1'), ('stop', 'wdtest_store3_1'),
+                                      ('clear', 'wdtest_store3_1', CLEAR_COMMAND), ('start', 'helper'),
+                                      ('put_archive', 'wdtest_store3_1', '/var/lib/virtuoso', b'tar-bytes'),
+                                      ('start', 'wdtest_store3_1')])
+
+    docker_client.load_running = False
+    docker_client.load_log = b''
+    docker_client.calls = list()
+    snapshots.replicate('aksw/dld-store-virtuoso7', ['load'], ['store2']).should.be(False)
+    docker_client.calls.should.equal([('logs', 'wdtest_load_1')])
+
+
+for test in [test_fingerprint_covers_contents_graphs_and_images, test_snapshot_cache_evicts_least_recently_used,
+             test_export_after_load_and_restore, test_export_waits_for_the_completion_message_of_the_loaders,
+             test_data_paths_from_the_labels_of_inspected_images, test_replicas_receive_the_loaded_store_data]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
@@ -0,0 +1,158 @@
+"""
+Helpers shared by the unit tests: a stand-in for the DLD configuration, fakes for docker-py and a stand-in HTTP
+server for the transfer of dataset sources.
+"""
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from os import path as osp
+from socketserver import ThreadingMixIn
+
+
+class DLDTestConfig(object):
+    """
+    stands in for config.DLDConfig (whose creation requires a docker engine), with the same defaults and without
+    taking the environment into account; settings are overridden by keyword
+    """
+
+    def __init__(self, working_dir='wd-test', **settings):
+        self.working_dir = working_dir
+        self.models_dir = osp.join(working_dir, 'models')
+        self.partitions_dir = osp.join(working_dir, 'partitions')
+        self.default_graph_name = None
+        self.ready_markers = False
+        self.graph_index = False
+        self.download_settings = dict()
+        self.sample_settings = None
+        self.normalize_settings = None
+        self.changeset_settings = None
+        self.transfer_limits = None
+        self.source_metadata_cache = None
+        self.peer_sources = None
+        self.link_local_sources = False
+        self.snapshot_cache_dir = None
+        self.snapshot_cache_max_bytes = None
+        self.internal_import_volume = False
+        self.import_volume_destination = '/import'
+        self.selinux_volumes_tweaks_supported = False
+        self.additional_volumes_from = []
+        self.docker_host_cpus = 8
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+
+class NotFoundResponse(object):
+    """
+    the parts of a requests response docker-py (1.x) reads when raising an APIError for a missing object
+    """
+    status_code = 404
+    reason = 'Not Found'
+    content = b'{"message": "not found"}'
+    url = 'http+docker://localunixsocket/'
+
+    def json(self):
+        return {'message': 'not found'}
+
+
+LAST_MODIFIED = 'Mon, 01 Jun 2026 00:00:00 GMT'
+PAYLOAD = b''.join(b'<http://dld.aksw.org/s%d> <http://dld.aksw.org/p> "o" .\n' % i for i in range(20000))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    serves PAYLOAD with Range and If-Range support, behaviour is tuned by the server attributes:
+        * etag: the ETag of the served PAYLOAD version
+        * failing: answer every request with 500
+        * missing: answer every request with 404
+        * stall_after: stop sending (without closing) after that many bytes of a full transfer
+        * delay: seconds to wait before answering
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        server.if_range_headers.append(self.headers.get('If-Range'))
+        time.sleep(server.delay)
+        if server.failing or server.missing:
+            self.send_error(server.missing and 404 or 500)
+            return
+        start = 0
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and if_range is not None and if_range not in (server.etag, LAST_MODIFIED):
+            range_header = None  # the resource changed, send all of it
+        if range_header:
+            start_str, _, end_str = range_header[len('bytes='):].partition('-')
+            start = int(start_str)
+            end = end_str and int(end_str) + 1 or len(PAYLOAD)
+            if start >= len(PAYLOAD):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{t}'.format(t=len(PAYLOAD)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {s}-{e}/{t}'.format(s=start, e=end - 1, t=len(PAYLOAD)))
+        else:
+            end = len(PAYLOAD)
+            self.send_response(200)
+        body = PAYLOAD[start:end]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', server.etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        if not send_body:
+            return
+        if server.stall_after is not None and not range_header:
+            self.wfile.write(body[:server.stall_after])
+            self.wfile.flush()
+            server.release.wait(5)
+            return
+        self.wfile.write(body)
+
+
+class StandInServer(object):
+    def __init__(self, failing=False, missing=False, stall_after=None, delay=0.0, etag='"payload-1"'):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.httpd.etag = etag
+        self.httpd.failing = failing
+        self.httpd.missing = missing
+        self.httpd.stall_after = stall_after
+        self.httpd.delay = delay
+        self.httpd.requests = []
+        self.httpd.if_range_headers = []
+        self.httpd.release = threading.Event()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{p}/dump.nt'.format(p=self.httpd.server_address[1])
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def if_range_headers(self):
+        return self.httpd.if_range_headers
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.release.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,88 @@
+import tempfile
+import shutil
+from os import path as osp
+
+from data.throttling import TokenBucket, Throttle, LatencyProbe, TransferLimits, create_throttle, copy_file
+from dld import close_transfer_limits
+from tests.support import DLDTestConfig
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+def test_token_bucket_limits_rate_after_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(1000, burst=500, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        bucket.consume(250)
+
+    # 2000 bytes beyond the initial burst of 500 bytes at 1000 bytes/s
+    clock.slept.should.equal(2.0)
+
+
+    halved = TokenBucket(1000, burst=500, clock=clock, sleep=clock.sleep)
+    halved.rate_factor = 0.5
+    halved.consume(1000)
+    clock.slept.should.equal(3.0)
+
+
+def test_throttled_copy_and_dataset_limits():
+    working_dir = tempfile.mkdtemp('_wd', 'test_throttled_copy')
+    try:
+        source_path = osp.join(working_dir, 'source.nt')
+        with open(source_path, 'wb') as source_file:
+            source_file.write(b'x' * 3000)
+        limits = TransferLimits.from_config({'rate': '1M', 'idle_io': True})
+        throttle = create_throttle(limits, {'rate': 2048, 'burst': 1024})
+        [bucket.rate for bucket in throttle.buckets].should.equal([1024 * 1024, 2048])
+        throttle.idle_io.should.be(True)
+
+        clock = FakeClock()
+        copy_file(source_path, osp.join(working_dir, 'copy.nt'),
+                  Throttle([TokenBucket(2048, burst=1024, clock=clock, sleep=clock.sleep)]))
+        osp.getsize(osp.join(working_dir, 'copy.nt')).should.equal(3000)
+        # (3000 - 1024) / 2048 s, the global limit is not reached
+        clock.slept.should.be.within(0.96, 0.97)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_latency_probe_backs_off_and_recovers():
+    bucket = TokenBucket(1000)
+    probe = LatencyProbe('http://localhost:8890/sparql', [bucket], max_latency=1.0)
+    probe.adjust(0.1)
+    bucket.rate_factor.should.equal(1.0)
+    probe.adjust(0.5)  # more than three times the lowest latency seen
+    probe.adjust(None)
+    bucket.rate_factor.should.equal(0.25)
+    probe.adjust(0.1)
+    probe.adjust(0.2)
+    bucket.rate_factor.should.be.within(0.44, 0.46)
+
+
+def test_closing_the_transfer_limits_stops_the_latency_probe():
+    transfer_limits = TransferLimits.from_config({'rate': '1M', 'probe': {'url': 'http://127.0.0.1:9/sparql',
+                                                                          'interval': 0.01, 'timeout': 0.1}})
+    config = DLDTestConfig(transfer_limits=transfer_limits)
+    create_throttle(config.transfer_limits)
+    transfer_limits.probe._thread.is_alive().should.be(True)
+    close_transfer_limits(config)
+    transfer_limits.probe._thread.join(1)
+    transfer_limits.probe._thread.is_alive().should.be(False)
+    config.transfer_limits.should.be(None)
+
+
+for test in [test_token_bucket_limits_rate_after_burst, test_throttled_copy_and_dataset_limits,
+             test_latency_probe_backs_off_and_recovers, test_closing_the_transfer_limits_stops_the_latency_probe]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
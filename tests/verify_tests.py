@@ -0,0 +1,120 @@
+import json
+import shutil
+import tempfile
+import threading
+from os import path as osp
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from data.transfer import ExponentialBackoff
+from sparql.verify import CountCache, CountVerifier, ExpectedCount, endpoint_from_compose, \
+    format_verification, parse_expected_counts
+from tests.support import ThreadingHTTPServer
+
+COUNTS = {
+    'http://dld.aksw.org/a#': 10,
+    'http://dld.aksw.org/b#': 25,
+    'http://dld.aksw.org/c#': 0,
+}
+
+
+class CountEndpointHandler(BaseHTTPRequestHandler):
+    """
+    answers COUNT queries for the graphs in COUNTS, failing the first server.fail_first requests with 503
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)['query'][0]
+        graph_name = query[query.index('<') + 1:query.index('>')]
+        with server.lock:
+            server.queries.append(graph_name)
+            failing = len(server.queries) <= server.fail_first
+        if failing:
+            self.send_error(503)
+            return
+        body = json.dumps({'head': {'vars': ['count']}, 'results': {'bindings': [
+            {'count': {'type': 'literal', 'value': str(COUNTS.get(graph_name, 0))}}]}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_endpoint(fail_first=0):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountEndpointHandler)
+    server.queries = list()
+    server.fail_first = fail_first
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{p}/sparql".format(p=server.server_address[1])
+
+
+def test_expected_counts_and_endpoint_from_compose():
+    expected = parse_expected_counts({'http://dld.aksw.org/a#': 10, 'http://dld.aksw.org/b#': [20, 30]})
+    expected['http://dld.aksw.org/a#'].matches(10).should.be(True)
+    expected['http://dld.aksw.org/a#'].matches(11).should.be(False)
+    expected['http://dld.aksw.org/b#'].matches(30).should.be(True)
+    str(expected['http://dld.aksw.org/b#']).should.equal('20..30')
+    parse_expected_counts.when.called_with({'g': 'many'}).should.throw(RuntimeError)
+    endpoint_from_compose({'store': {'ports': ['8895:8890']}}).should.equal('http://localhost:8895/sparql')
+    endpoint_from_compose({'store': {'image': 'x'}}).should.be(None)
+
+
+def test_verifier_reports_diverging_counts_and_retries():
+    server, endpoint = start_endpoint(fail_first=1)
+    try:
+        verifier = CountVerifier(endpoint, concurrency=2, timeout=5, retries=1,
+                                 backoff=ExponentialBackoff(base_delay=0.01, max_delay=0.01))
+        results = verifier.verify({'http://dld.aksw.org/a#': ExpectedCount(10),
+                                   'http://dld.aksw.org/b#': ExpectedCount(20, 30),
+                                   'http://dld.aksw.org/c#': ExpectedCount(5)})
+    finally:
+        server.shutdown()
+    [result.ok for result in results].should.equal([True, True, False])
+    len(server.queries).should.equal(4)
+    report = format_verification(results)
+    report.should.contain('1 diverging')
+    report.should.contain('http://dld.aksw.org/c#: expected 5, found 0 (diff -5)')
+
+
+def test_counts_are_cached_per_store_container():
+    working_dir = tempfile.mkdtemp()
+    cache_path = osp.join(working_dir, '.dld', 'verify-cache.json')
+    server, endpoint = start_endpoint()
+    try:
+        expected = {'http://dld.aksw.org/a#': ExpectedCount(10), 'http://dld.aksw.org/b#': ExpectedCount(25)}
+        CountVerifier(endpoint, cache=CountCache(cache_path, 'c1')).verify(expected)
+        len(server.queries).should.equal(2)
+
+        results = CountVerifier(endpoint, cache=CountCache(cache_path, 'c1')).verify(expected)
+        len(server.queries).should.equal(2)
+        all(result.cached and result.ok for result in results).should.be(True)
+
+        CountVerifier(endpoint, cache=CountCache(cache_path, 'c1', refresh=True)).verify(expected)
+        len(server.queries).should.equal(4)
+
+        CountVerifier(endpoint, cache=CountCache(cache_path, 'c2')).verify(expected)
+        len(server.queries).should.equal(6)
+        with open(cache_path) as cache_fd:
+            list(json.load(cache_fd).keys()).should.equal(['c2'])
+
+        # a count differing from the expectation (e.g. of a partially loaded store) is queried again next time
+        expected['http://dld.aksw.org/c#'] = ExpectedCount(5)
+        CountVerifier(endpoint, cache=CountCache(cache_path, 'c2')).verify(expected)
+        results = CountVerifier(endpoint, cache=CountCache(cache_path, 'c2')).verify(expected)
+        len(server.queries).should.equal(8)
+        [result.cached for result in results].should.equal([True, True, False])
+    finally:
+        server.shutdown()
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+for test in [test_expected_counts_and_endpoint_from_compose, test_verifier_reports_diverging_counts_and_retries,
+             test_counts_are_cached_per_store_container]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
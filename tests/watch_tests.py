@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+from os import path as osp
+from unittest import SkipTest
+
+import watch
+from data.datasets import ImportsCollector
+from tests.support import DLDTestConfig
+from watch import InotifyPathWatcher, PollingPathWatcher, WatchSession, dataset_local_paths, \
+    settings_affected_datasets
+
+DEFAULT_GRAPH = 'http://dld.aksw.org/default#'
+
+
+def _write(file_path, content):
+    with open(file_path, 'w') as target:
+        target.write(content)
+
+
+class RecordingWatcher(object):
+    def __init__(self):
+        self.paths = []
+
+    def set_paths(self, paths):
+        self.paths = list(paths)
+
+
+class RecordingConfigurator(object):
+    """
+    stands in for the ComposeConfigGenerator: records the datasets prepared again and the reconfigurations
+    """
+
+    def __init__(self, yaml_config):
+        self.yaml_config = yaml_config
+        self.dld_config = DLDTestConfig(default_graph_name=DEFAULT_GRAPH)
+        self.updated = []
+        self.reconfigured = []
+
+    def update_import_data(self, dataset_names):
+        self.updated.append(dataset_names)
+
+    def reconfigure(self, yaml_config):
+        self.yaml_config = yaml_config
+        self.reconfigured.append(yaml_config)
+        return ['store']
+
+
+def test_dataset_local_paths_include_sources_and_list_files():
+    working_dir = tempfile.mkdtemp('_wd', 'test_local_paths')
+    try:
+        list_path = osp.join(working_dir, 'files.list')
+        _write(list_path, osp.join(working_dir, 'a.nt') + '\n\n' + osp.join(working_dir, 'b.nt') + '\n')
+        dataset_local_paths({'file': osp.join(working_dir, 'a.nt')}).should.equal(set([osp.join(working_dir, 'a.nt')]))
+        dataset_local_paths({'file_list': list_path}).should.equal(
+            set([list_path, osp.join(working_dir, 'a.nt'), osp.join(working_dir, 'b.nt')]))
+        dataset_local_paths({'location_list': list_path}).should.equal(set([list_path]))
+        dataset_local_paths({'location': 'http://dld.aksw.org/dump.nt'}).should.equal(set())
+        dataset_local_paths('not a dataset').should.equal(set())
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_polling_watcher_reports_changed_created_and_removed_files():
+    working_dir = tempfile.mkdtemp('_wd', 'test_polling_watcher')
+    try:
+        existing, created = osp.join(working_dir, 'existing.nt'), osp.join(working_dir, 'created.nt')
+        _write(existing, 'before\n')
+        watcher = PollingPathWatcher(interval=0.01)
+        watcher.set_paths([existing, created])
+        watcher.poll(0.05).should.equal(set())
+
+        _write(existing, 'after, longer\n')
+        _write(created, 'new\n')
+        watcher.poll(1).should.equal(set([existing, created]))
+        os.remove(created)
+        watcher.poll(1).should.equal(set([created]))
+
+        watcher.set_paths([existing])
+        _write(created, 'not watched anymore\n')
+        watcher.poll(0.05).should.equal(set())
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_inotify_watcher_reports_changed_files_only():
+    if watch.inotify_simple is None:
+        raise SkipTest("inotify_simple is not available")
+    working_dir = tempfile.mkdtemp('_wd', 'test_inotify_watcher')
+    try:
+        watched, other = osp.join(working_dir, 'watched.nt'), osp.join(working_dir, 'other.nt')
+        _write(watched, 'before\n')
+        watcher = InotifyPathWatcher()
+        watcher.set_paths([watched])
+        _write(other, 'unrelated\n')
+        watcher.poll(0.1).should.equal(set())
+        _write(watched, 'after\n')
+        watcher.poll(1).should.equal(set([watched]))
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_collector_update_prepares_only_the_named_datasets():
+    working_dir = tempfile.mkdtemp('_wd', 'test_collector_update')
+    try:
+        config = DLDTestConfig(working_dir, default_graph_name=DEFAULT_GRAPH)
+        os.makedirs(config.models_dir)
+        datasets = dict()
+        for name in ['a', 'b', 'c']:
+            source_path = osp.join(working_dir, name + '.nt')
+            _write(source_path, '<http://dld.aksw.org/{n}> <http://dld.aksw.org/p> "o" .\n'.format(n=name))
+            datasets[name] = {'file': source_path}
+        collector = ImportsCollector(config)
+        collector.prepare(datasets)
+        sorted(collector.dataset_files).should.equal(['a', 'b', 'c'])
+
+        _write(osp.join(working_dir, 'a.nt'), '<http://dld.aksw.org/a> <http://dld.aksw.org/p> "changed" .\n')
+        del datasets['b']
+        collector.update(datasets, ['a', 'b'])
+        sorted(collector.dataset_files).should.equal(['a', 'c'])
+        sorted(n for n in os.listdir(config.models_dir) if n.endswith('.nt')).should.equal(['a.nt', 'c.nt'])
+        with open(osp.join(config.models_dir, 'a.nt')) as updated:
+            ('"changed"' in updated.read()).should.be(True)
+
+        collector.forget_dataset('c')
+        collector.memory.was_added_or_retained('c').should.be(False)
+        collector.memory.was_added_or_retained('a').should.be(True)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_watch_session_prepares_affected_datasets_again():
+    working_dir = tempfile.mkdtemp('_wd', 'test_watch_session')
+    try:
+        config_file, source = osp.join(working_dir, 'dld.yml'), osp.join(working_dir, 'a.nt')
+        initial_config = {'datasets': {'a': {'file': source}, 'b': {'location': 'http://dld.aksw.org/b.nt'}},
+                          'components': {'store': 'aksw/dld-store-virtuoso7'}}
+        configurator = RecordingConfigurator(initial_config)
+        loaded_configs = []
+        watcher = RecordingWatcher()
+        session = WatchSession(configurator, config_file, lambda: loaded_configs.pop(0), watcher=watcher)
+        watcher.paths.should.equal([config_file, source])
+
+        session.handle_changes(set([source])).should.equal((['a'], []))
+
+        changed_datasets = {'b': {'location': 'http://dld.aksw.org/b2.nt'},
+                            'c': {'file': osp.join(working_dir, 'c.nt')}}
+        loaded_configs.append(dict(initial_config, datasets=changed_datasets))
+        session.handle_changes(set([config_file])).should.equal((['a', 'b', 'c'], []))
+        watcher.paths.should.equal([config_file, osp.join(working_dir, 'c.nt')])
+
+        loaded_configs.append(dict(initial_config, datasets=changed_datasets,
+                                   components={'store': 'aksw/dld-store-virtuoso7:other'}))
+        session.handle_changes(set([config_file])).should.equal(([], ['store']))
+        len(configurator.reconfigured).should.equal(1)
+        configurator.updated.should.equal([['a'], ['a', 'b', 'c'], []])
+
+        def broken_config():
+            raise RuntimeError("invalid YAML")
+
+        session.config_loader = broken_config
+        session.handle_changes(set([config_file])).should.equal(([], []))
+        len(configurator.updated).should.equal(3)
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def test_changed_global_settings_prepare_the_datasets_again():
+    datasets = {'a': {'location': 'http://dld.aksw.org/a.nt'},
+                'b': {'location': 'http://dld.aksw.org/b.nt', 'sample': {'triples': 5}}}
+    previous_config = {'datasets': datasets, 'settings': {'sample': {'triples': 10}}}
+    settings_affected_datasets(previous_config, dict(previous_config)).should.equal(set())
+    settings_affected_datasets(previous_config, {'datasets': datasets}).should.equal(set(['a']))
+    current_config = {'datasets': datasets, 'settings': {'sample': {'triples': 10}, 'changesets': True}}
+    settings_affected_datasets(previous_config, current_config).should.equal(set(['a', 'b']))
+
+    configurator = RecordingConfigurator(dict(previous_config, components={'store': 'aksw/dld-store-virtuoso7'}))
+    session = WatchSession(configurator, 'dld.yml', lambda: dict(configurator.yaml_config, settings={}),
+                           watcher=RecordingWatcher())
+    session.handle_changes(set([session.config_file])).should.equal((['a'], ['store']))
+
+
+for test in [test_dataset_local_paths_include_sources_and_list_files,
+             test_polling_watcher_reports_changed_created_and_removed_files,
+             test_inotify_watcher_reports_changed_files_only,
+             test_collector_update_prepares_only_the_named_datasets,
+             test_watch_session_prepares_affected_datasets_again,
+             test_changed_global_settings_prepare_the_datasets_again]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
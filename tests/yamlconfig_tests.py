@@ -0,0 +1,119 @@
+import os
+import tempfile
+import shutil
+import stat
+from os import path as osp
+
+from yamlconfig import load_dld_config, ParsedConfigCache
+
+BASE_CONFIG = """
+components:
+    store:
+        image: aksw/dld-store-virtuoso7
+        environment: {PWDDBA: dba}
+    load: aksw/dld-load-virtuoso
+datasets:
+    single_triple:
+        file: single_triple.ttl
+"""
+
+TEMPLATED_CONFIG = """
+include: base-dld.yml
+components:
+    store:
+        ports: ["8891:8890"]
+dataset_templates:
+    labels:
+        name: "labels-{lang}"
+        for_each: {lang: [en, de]}
+        dataset:
+            location: "http://downloads.dbpedia.org/2015-10/core-i18n/{lang}/labels_{lang}.ttl.bz2"
+            graph_name: "http://{lang}.dbpedia.org"
+datasets:
+    labels-de:
+        file: labels_de.ttl
+"""
+
+
+def test_includes_and_dataset_templates():
+    """
+        included files are merged in below the including file, templates expand into datasets
+        unless a dataset of the same name is declared explicitly
+    """
+    config_dir = tempfile.mkdtemp('_config', 'test_includes_and_dataset_templates')
+    try:
+        for name, content in [('base-dld.yml', BASE_CONFIG), ('dld.yml', TEMPLATED_CONFIG)]:
+            with open(osp.join(config_dir, name), 'w') as config_fd:
+                config_fd.write(content)
+        cache = ParsedConfigCache(osp.join(config_dir, 'cache'))
+        config = load_dld_config(osp.join(config_dir, 'dld.yml'), cache=cache)
+
+        config['components']['store'].should.equal({'image': 'aksw/dld-store-virtuoso7',
+                                                    'environment': {'PWDDBA': 'dba'}, 'ports': ['8891:8890']})
+        sorted(config['datasets'].keys()).should.equal(['labels-de', 'labels-en', 'single_triple'])
+        config['datasets']['labels-de'].should.equal({'file': 'labels_de.ttl'})
+        config['datasets']['labels-en'].should.equal(
+            {'location': 'http://downloads.dbpedia.org/2015-10/core-i18n/en/labels_en.ttl.bz2',
+             'graph_name': 'http://en.dbpedia.org'})
+
+        # the cached configuration is handed out as a copy
+        config['datasets']['cli'] = {'file': 'single_triple.ttl'}
+        ('cli' in load_dld_config(osp.join(config_dir, 'dld.yml'), cache=cache)['datasets']).should.be(False)
+    finally:
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+
+def test_parsed_configs_are_cached_as_json_in_a_private_directory():
+    config_dir = tempfile.mkdtemp('_config', 'test_parsed_configs_are_cached')
+    try:
+        config_path = osp.join(config_dir, 'dld.yml')
+        with open(config_path, 'w') as config_fd:
+            config_fd.write(BASE_CONFIG + "settings:\n    released: 2016-05-01\n")
+        cache_dir = osp.join(config_dir, 'cache')
+        ParsedConfigCache(cache_dir).load(config_path)['settings']['released'].year.should.equal(2016)
+        # dates have no JSON representation, such content is cached in memory only
+        osp.isdir(cache_dir).should.be(False)
+
+        with open(config_path, 'w') as config_fd:
+            config_fd.write(BASE_CONFIG)
+        ParsedConfigCache(cache_dir).load(config_path)['components']['load'].should.equal('aksw/dld-load-virtuoso')
+        stat.S_IMODE(os.stat(cache_dir).st_mode).should.equal(0o700)
+        cached_files = os.listdir(cache_dir)
+        [name.endswith('.json') for name in cached_files].should.equal([True])
+
+        with open(osp.join(cache_dir, cached_files[0]), 'w') as cache_fd:
+            cache_fd.write('{"components": {"load": "from the cache"}}')
+        ParsedConfigCache(cache_dir).load(config_path)['components']['load'].should.equal('from the cache')
+        # a cache directory others can write to is not trusted
+        os.chmod(cache_dir, 0o777)
+        ParsedConfigCache(cache_dir).load(config_path)['components']['load'].should.equal('aksw/dld-load-virtuoso')
+    finally:
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+
+def test_disk_cache_keeps_the_most_recently_used_entries():
+    config_dir = tempfile.mkdtemp('_config', 'test_disk_cache_keeps')
+    try:
+        cache_dir = osp.join(config_dir, 'cache')
+        cache_names = list()
+        for idx in range(3):
+            config_path = osp.join(config_dir, 'dld{i}.yml'.format(i=idx))
+            with open(config_path, 'w') as config_fd:
+                config_fd.write(BASE_CONFIG + "settings:\n    default_graph: http://example.org/{i}\n".format(i=idx))
+            if idx == 2:  # the first entry is used again and outlives the second one
+                ParsedConfigCache(cache_dir, max_entries=2).load(osp.join(config_dir, 'dld0.yml'))
+            ParsedConfigCache(cache_dir, max_entries=2).load(config_path)
+            new_names = sorted(set(os.listdir(cache_dir)) - set(cache_names))
+            len(new_names).should.equal(1)
+            cache_names.append(new_names[0])
+            if idx < 2:
+                os.utime(osp.join(cache_dir, new_names[0]), ns=(idx * 10 ** 9, idx * 10 ** 9))
+        sorted(os.listdir(cache_dir)).should.equal(sorted([cache_names[0], cache_names[2]]))
+    finally:
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+
+for test in [test_includes_and_dataset_templates, test_parsed_configs_are_cached_as_json_in_a_private_directory,
+             test_disk_cache_keeps_the_most_recently_used_entries]:
+    test.test_kind = 'unit'
+    test.test_speed = 1
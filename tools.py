@@ -1,7 +1,11 @@
 from collections import defaultdict
+import os
 from os import path as osp
 import re
 import socket
+import stat
+import tempfile
+import threading
 from urllib.request import Request
 from urllib.parse import urlparse
 
@@ -88,6 +92,48 @@ class FilenameOps(object):
         return match_attempt and match_attempt.group(1) or string
 
 
+def current_umask():
+    """
+    :return: the file mode creation mask of the process (os.umask can only be read by setting it)
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def write_if_changed(filepath, content, atomic=False):
+    """
+    Writes the given text to a file, unless the file already has exactly that content.
+
+    :param atomic: write to a temporary file first and move it into place (replaces the file's inode, but keeps
+                   its mode)
+    :return: True if the file was written
+    """
+    if osp.isfile(filepath):
+        with open(filepath) as existing_fd:
+            if existing_fd.read() == content:
+                return False
+    if atomic:
+        if osp.isfile(filepath):
+            mode = stat.S_IMODE(os.stat(filepath).st_mode)
+        else:
+            mode = 0o666 & ~current_umask()
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix='.' + osp.basename(filepath), dir=osp.dirname(filepath))
+        try:
+            with os.fdopen(tmp_fd, 'w') as tmp_file:
+                tmp_file.write(content)
+            # mkstemp creates the file readable for the owner only, keep the mode a plain write would leave
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, filepath)
+        except:
+            os.remove(tmp_path)
+            raise
+    else:
+        with open(filepath, 'w') as target_fd:
+            target_fd.write(content)
+    return True
+
+
 class HeadRequest(Request):
     def get_method(self):
         return "HEAD"
@@ -98,9 +144,9 @@ class ComposeConfigDefaultDict(dict):
 
     _dict_keys = frozenset(['environment'])
 
-    _recurse_keys = frozenset(['store', 'load'])
+    _recurse_keys = frozenset(['store', 'load', 'cache'])
 
-    _recurse_prefixes = frozenset(['present'])
+    _recurse_prefixes = frozenset(['present', 'load', 'store'])
 
     @classmethod
     def _should_recurse(cls, key):
@@ -131,6 +177,17 @@ def alpha_gen(start='A', end='Z'):
         yield mem
 
 
+THREAD_NAME_SEPARATOR = '/'
+
+
+def child_thread_name(name):
+    """
+    :return: name for a thread started by the current thread: the name of the current thread followed by the given
+             one, so that the work of the thread can be related to the work it is part of (e.g. a job of the service)
+    """
+    return threading.current_thread().name + THREAD_NAME_SEPARATOR + name
+
+
 def adjusted_socket_timeout(timeout=60):
     class SockerTimeoutAdjustment(object):
         def __enter__(self):
@@ -152,6 +209,47 @@ def http_url(location_str):
         raise LocationError(msg)
     return location_str
 
+BYTE_SIZE_PATTERN = re.compile('^(\d+)\s*([kKmMgGtT]?)i?[bB]?$')
+BYTE_SIZE_FACTORS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+def byte_size(size_str):
+    """
+    :param size_str: number of bytes, optionally with a binary unit suffix (e.g. '512M' or '20GiB')
+    :return: the number of bytes as int
+    """
+    match = BYTE_SIZE_PATTERN.match(size_str.strip())
+    if match is None:
+        raise ValueError("not a byte size: {s}".format(s=size_str))
+    return int(match.group(1)) * BYTE_SIZE_FACTORS[match.group(2).lower()]
+
+CPUSET_RANGE_PATTERN = re.compile('^(\d+)(?:-(\d+))?$')
+
+def parse_cpuset(cpuset):
+    """
+    :param cpuset: CPUs in the notation of docker (e.g. '0-3,8')
+    :return: sorted list of the CPU numbers
+    """
+    cpus = set()
+    for part in str(cpuset).split(','):
+        match = CPUSET_RANGE_PATTERN.match(part.strip())
+        if match is None:
+            raise ValueError("not a cpuset: {c}".format(c=cpuset))
+        first = int(match.group(1))
+        cpus.update(range(first, int(match.group(2) or first) + 1))
+    return sorted(cpus)
+
+def partition_cpuset(cpus, parts):
+    """
+    :param cpus: list of CPU numbers to divide
+    :param parts: number of partitions
+    :return: list of cpusets (in the notation of docker), contiguous slices of about equal size
+             (when there are fewer CPUs than partitions, the CPUs are shared round-robin)
+    """
+    if len(cpus) < parts:
+        return [str(cpus[idx % len(cpus)]) for idx in range(parts)]
+    bounds = [len(cpus) * idx // parts for idx in range(parts + 1)]
+    return [','.join(str(cpu) for cpu in cpus[bounds[idx]:bounds[idx + 1]]) for idx in range(parts)]
+
 DICT_LIKE_ATTRIBUTES = ('keys', 'get', 'update')
 LIST_LIKE_ATTRIBUTES = ('insert', 'reverse', 'sort', 'pop')
 
@@ -0,0 +1,233 @@
+import logging
+import os
+from os import path as osp
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from data.datasets import DATASET_SETTING_KEYS
+from tools import is_dict_like
+
+# global settings the preparation of the datasets depends on (the ones in DATASET_SETTING_KEYS can be overridden
+# by a dataset)
+DATASET_GLOBAL_SETTINGS = ('sample', 'normalize', 'throttle', 'changesets')
+
+
+def settings_affected_datasets(previous_config, current_config):
+    """
+    :return: set of the names of the datasets of the current configuration whose effective settings changed with the
+             global settings
+    """
+    previous_settings, current_settings = [is_dict_like(config.get('settings')) and config['settings'] or dict()
+                                           for config in (previous_config, current_config)]
+    changed = set(key for key in DATASET_GLOBAL_SETTINGS if previous_settings.get(key) != current_settings.get(key))
+    affected = set()
+    for dataset_name, dataset_config in current_config['datasets'].items():
+        overridden = set(key for key in DATASET_SETTING_KEYS if is_dict_like(dataset_config) and key in dataset_config)
+        if changed - overridden:
+            affected.add(dataset_name)
+    return affected
+
+
+def dataset_local_paths(dataset_config):
+    """
+    :return: set of absolute paths of the local files the preparation of a dataset reads (sources and list files)
+    """
+    paths = set()
+    if not is_dict_like(dataset_config):
+        return paths
+    if isinstance(dataset_config.get('file'), str):
+        paths.add(osp.abspath(dataset_config['file']))
+    for list_key in ('file_list', 'location_list'):
+        if isinstance(dataset_config.get(list_key), str):
+            list_path = osp.abspath(dataset_config[list_key])
+            paths.add(list_path)
+            if list_key == 'file_list' and osp.isfile(list_path):
+                with open(list_path) as list_fd:
+                    paths.update(osp.abspath(line.strip()) for line in list_fd if line.strip())
+    return paths
+
+
+class PollingPathWatcher(object):
+    """
+    Detects changes of a set of files by comparing their stat signatures in short intervals.
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self._signatures = dict()
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size, stat.st_ino
+        except OSError:
+            return None
+
+    def set_paths(self, paths):
+        previous = self._signatures
+        self._signatures = dict((p, previous[p] if p in previous else self._signature(p)) for p in paths)
+
+    def poll(self, timeout=None):
+        """
+        :param timeout: seconds to wait for changes at most (None to wait until a change is detected)
+        :return: set of the changed paths (empty when the timeout expired)
+        """
+        deadline = (timeout is not None) and (time.time() + timeout) or None
+        while True:
+            changed = set()
+            for path, signature in self._signatures.items():
+                current = self._signature(path)
+                if current != signature:
+                    self._signatures[path] = current
+                    changed.add(path)
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+            time.sleep(self.interval)
+
+
+class InotifyPathWatcher(object):
+    """
+    Detects changes of a set of files with inotify watches on their parent directories.
+    """
+
+    def __init__(self):
+        flags = inotify_simple.flags
+        self._mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.CREATE | flags.DELETE | \
+                     flags.MODIFY | flags.ATTRIB
+        self._inotify = inotify_simple.INotify()
+        self._dirs_by_watch = dict()
+        self._paths = frozenset()
+
+    def set_paths(self, paths):
+        self._paths = frozenset(paths)
+        wanted_dirs = set(osp.dirname(p) for p in self._paths if osp.isdir(osp.dirname(p)))
+        for watch_descriptor, directory in list(self._dirs_by_watch.items()):
+            if directory not in wanted_dirs:
+                self._inotify.rm_watch(watch_descriptor)
+                del self._dirs_by_watch[watch_descriptor]
+        for directory in wanted_dirs - set(self._dirs_by_watch.values()):
+            self._dirs_by_watch[self._inotify.add_watch(directory, self._mask)] = directory
+
+    def poll(self, timeout=None):
+        deadline = (timeout is not None) and (time.time() + timeout) or None
+        while True:
+            read_timeout = None
+            if deadline is not None:
+                read_timeout = int(max(0, deadline - time.time()) * 1000)
+            events = self._inotify.read(timeout=read_timeout)
+            changed = set()
+            for event in events:
+                directory = self._dirs_by_watch.get(event.wd)
+                path = directory and osp.join(directory, event.name)
+                if path in self._paths:
+                    changed.add(path)
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+
+def path_watcher():
+    """
+    :return: an inotify based path watcher where available, a polling one otherwise
+    """
+    if inotify_simple is not None:
+        try:
+            return InotifyPathWatcher()
+        except OSError:
+            pass
+    return PollingPathWatcher()
+
+
+class WatchSession(object):
+    """
+    Keeps the state of a prepared DLD setup in memory and prepares the datasets and compose services
+    affected by changes of the DLD configuration, of list files or of local sources again.
+    """
+    log = logging.getLogger('dld.WatchSession')
+
+    def __init__(self, configurator, config_file, config_loader, debounce=0.3, watcher=None):
+        """
+        :param configurator: the ComposeConfigGenerator that prepared the setup initially
+        :param config_file: path of the DLD configuration file
+        :param config_loader: callable returning the (re-)read DLD configuration, applying its settings to the DLDConfig
+        :param debounce: seconds without further changes to wait for before handling changes
+        :param watcher: path watcher to use (defaults to an inotify or polling based one)
+        """
+        self.configurator = configurator
+        self.config_file = osp.abspath(config_file)
+        self.config_loader = config_loader
+        self.debounce = debounce
+        self.watcher = watcher or path_watcher()
+        self._default_graph_name = configurator.dld_config.default_graph_name
+        self._datasets_by_path = dict()
+        self._update_watched_paths()
+
+    def _update_watched_paths(self):
+        datasets_by_path = dict()
+        for dataset_name, dataset_config in self.configurator.yaml_config['datasets'].items():
+            for path in dataset_local_paths(dataset_config):
+                datasets_by_path.setdefault(path, set()).add(dataset_name)
+        self._datasets_by_path = datasets_by_path
+        self.watcher.set_paths([self.config_file] + sorted(datasets_by_path.keys()))
+
+    def run(self):
+        self.log.info("watching {n} files for changes (interrupt to stop)".format(n=len(self._datasets_by_path) + 1))
+        try:
+            while True:
+                changed_paths = self.watcher.poll()
+                further_changes = self.watcher.poll(self.debounce)
+                while further_changes:
+                    changed_paths |= further_changes
+                    further_changes = self.watcher.poll(self.debounce)
+                self.handle_changes(changed_paths)
+        except KeyboardInterrupt:
+            self.log.info("stopped watching")
+
+    def handle_changes(self, changed_paths):
+        """
+        :param changed_paths: set of absolute paths of changed files
+        :return: pair of the sorted names of the datasets prepared again and of the changed compose services
+        """
+        start = time.time()
+        affected_datasets = set()
+        changed_services = list()
+        for path in changed_paths:
+            affected_datasets.update(self._datasets_by_path.get(path, ()))
+
+        if self.config_file in changed_paths:
+            previous_config = self.configurator.yaml_config
+            try:
+                current_config = self.config_loader()
+            except (Exception, SystemExit) as ex:
+                self.log.error("keeping previous configuration, unable to read changed {f}: {ex}"
+                               .format(f=self.config_file, ex=ex))
+                return [], []
+            previous_datasets, current_datasets = previous_config['datasets'], current_config['datasets']
+            if self.configurator.dld_config.default_graph_name != self._default_graph_name:
+                self._default_graph_name = self.configurator.dld_config.default_graph_name
+                affected_datasets.update(current_datasets.keys())
+            for dataset_name in set(previous_datasets.keys()) | set(current_datasets.keys()):
+                if previous_datasets.get(dataset_name) != current_datasets.get(dataset_name):
+                    affected_datasets.add(dataset_name)
+            affected_datasets.update(settings_affected_datasets(previous_config, current_config))
+            if any(previous_config.get(key) != current_config.get(key) for key in ('components', 'settings')):
+                changed_services = self.configurator.reconfigure(current_config)
+            else:
+                self.configurator.yaml_config = current_config
+
+        affected_datasets = sorted(affected_datasets)
+        if affected_datasets or changed_services:  # changed load services might require a new partitioning
+            try:
+                self.configurator.update_import_data(affected_datasets)
+            except Exception as ex:
+                self.log.error("preparing import data failed: {ex}".format(ex=ex))
+        self._update_watched_paths()
+
+        self.log.info("changed files: {f}; datasets prepared again: {d}; compose services changed: {s} ({t:.2f} s)"
+                      .format(f=", ".join(sorted(changed_paths)), d=", ".join(affected_datasets) or "none",
+                              s=", ".join(changed_services) or "none", t=time.time() - start))
+        return affected_datasets, changed_services
@@ -0,0 +1,304 @@
+import copy
+import hashlib
+import itertools
+import json
+import logging
+import os
+from os import path as osp
+import stat
+import tempfile
+import threading
+from collections.abc import MutableMapping
+
+import yaml
+
+from tools import is_dict_like, is_list_like
+
+# the libyaml based loader is an order of magnitude faster for large configurations, if PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+CONFIG_CACHE_DIR_ENV_VAR = 'DLD_CONFIG_CACHE_DIR'
+# number of parsed files kept in the disk cache, the least recently used ones are removed beyond that
+CONFIG_CACHE_MAX_ENTRIES = 256
+INCLUDE_KEY = 'include'
+TEMPLATES_KEY = 'dataset_templates'
+
+LOG = logging.getLogger('dld.yamlconfig')
+
+
+def default_config_cache_dir():
+    """
+    :return: the per-user cache directory for parsed configuration files ($XDG_CACHE_HOME/dld/config)
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or osp.join(osp.expanduser('~'), '.cache')
+    return osp.join(cache_home, 'dld', 'config')
+
+
+def _json_if_lossless(parsed):
+    """
+    :return: the parsed YAML content serialised as JSON, None if JSON cannot represent it exactly
+             (e.g. dates or non-string keys)
+    """
+    try:
+        serialised = json.dumps(parsed)
+    except (TypeError, ValueError):
+        return None
+    return json.loads(serialised) == parsed and serialised or None
+
+
+class ParsedConfigCache(object):
+    """
+    Caches parsed YAML files in memory (keyed by path, modification time and size) and as JSON on disk
+    (keyed by the content hash), so that unchanged configuration files are only parsed once. The disk cache
+    is only used when its directory belongs to the current user and is not accessible by others, it keeps the
+    most recently used entries only.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=CONFIG_CACHE_MAX_ENTRIES):
+        """
+        :param max_entries: number of entries kept in the disk cache, older ones are removed when writing new ones
+        """
+        self.cache_dir = cache_dir or os.environ.get(CONFIG_CACHE_DIR_ENV_VAR) or default_config_cache_dir()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._by_path = dict()
+
+    @staticmethod
+    def _copy(cached):
+        if isinstance(cached, str):
+            return json.loads(cached)
+        return copy.deepcopy(cached)
+
+    def load(self, filepath):
+        """
+        :return: a fresh copy of the parsed content of the YAML file (safe to alter by the caller)
+        """
+        filepath = osp.realpath(filepath)
+        file_stat = os.stat(filepath)
+        stat_key = (file_stat.st_mtime_ns, file_stat.st_size)
+        with self._lock:
+            cached = self._by_path.get(filepath)
+        if cached is not None and cached[0] == stat_key:
+            return self._copy(cached[1])
+
+        with open(filepath, 'rb') as config_fd:
+            content = config_fd.read()
+        content_hash = hashlib.sha1(content).hexdigest()
+        cached = self._read_disk_cache(content_hash)
+        if cached is None:
+            LOG.debug("parsing {f}".format(f=filepath))
+            parsed = yaml.load(content, Loader=YAML_LOADER)
+            serialised = _json_if_lossless(parsed)
+            if serialised is None:  # kept in memory only
+                cached = parsed
+            else:
+                self._write_disk_cache(content_hash, serialised)
+                cached = serialised
+        with self._lock:
+            self._by_path[filepath] = (stat_key, cached)
+        return self._copy(cached)
+
+    def _cache_path(self, content_hash):
+        return osp.join(self.cache_dir, content_hash + '.json')
+
+    def _ensure_private_cache_dir(self):
+        """
+        Creates the cache directory (accessible by the current user only), unless it exists.
+
+        :return: True if the directory is owned by the current user and not accessible by others
+        """
+        if not osp.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, mode=0o700)
+        dir_stat = os.lstat(self.cache_dir)
+        if stat.S_ISDIR(dir_stat.st_mode) and dir_stat.st_uid == os.getuid() and \
+                not stat.S_IMODE(dir_stat.st_mode) & 0o077:
+            return True
+        LOG.warning("not using the configuration cache {d}: it needs to be a directory owned by the current user "
+                    "and accessible by no one else".format(d=self.cache_dir))
+        return False
+
+    def _read_disk_cache(self, content_hash):
+        try:
+            if not osp.isdir(self.cache_dir) or not self._ensure_private_cache_dir():
+                return None
+            with open(self._cache_path(content_hash)) as cache_fd:
+                serialised = cache_fd.read()
+            os.utime(self._cache_path(content_hash))  # the modification time tells the last use for pruning
+            return serialised
+        except (IOError, OSError):
+            return None
+
+    def _write_disk_cache(self, content_hash, serialised):
+        try:
+            if not self._ensure_private_cache_dir():
+                return
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(tmp_fd, 'w') as tmp_file:
+                tmp_file.write(serialised)
+            os.replace(tmp_path, self._cache_path(content_hash))
+            self._prune_disk_cache()
+        except (IOError, OSError) as ex:
+            LOG.debug("unable to cache parsed configuration: {ex}".format(ex=ex))
+
+    def _prune_disk_cache(self):
+        """
+        Removes the least recently used entries beyond max_entries from the disk cache.
+        """
+        entries = list()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                try:
+                    entries.append((os.stat(osp.join(self.cache_dir, name)).st_mtime_ns, name))
+                except OSError:  # removed concurrently
+                    pass
+        for _, name in sorted(entries, reverse=True)[self.max_entries:]:
+            try:
+                os.remove(osp.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+
+PARSED_CONFIG_CACHE = ParsedConfigCache()
+
+
+def merge_configs(base, override):
+    """
+    :return: deep merge of two configuration dicts, values of override take precedence
+    """
+    merged = dict(base)
+    for key, value in override.items():
+        if is_dict_like(merged.get(key)) and is_dict_like(value):
+            merged[key] = merge_configs(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _format_recursively(value, variables):
+    if isinstance(value, str):
+        return value.format(**variables)
+    elif is_dict_like(value):
+        return dict((k, _format_recursively(v, variables)) for k, v in value.items())
+    elif is_list_like(value):
+        return [_format_recursively(v, variables) for v in value]
+    return value
+
+
+class DatasetTemplate(object):
+    """
+    A dataset configuration pattern expanded over all combinations of the values given for its variables,
+    e.g.:
+
+        dbpedia-labels:
+            name: "dbpedia-labels-{lang}"
+            for_each: {lang: [en, de, fr]}
+            dataset:
+                location: "http://downloads.dbpedia.org/2015-10/core-i18n/{lang}/labels_{lang}.ttl.bz2"
+                graph_name: "http://{lang}.dbpedia.org"
+    """
+
+    def __init__(self, template_name, template_config):
+        try:
+            self.name_pattern = template_config['name']
+            self.dataset_pattern = template_config['dataset']
+            for_each = template_config.get('for_each') or dict()
+        except (KeyError, TypeError):
+            raise RuntimeError("dataset template {t} needs 'name' and 'dataset' declarations".format(t=template_name))
+        self.variable_names = sorted(for_each.keys())
+        self.value_lists = [list(for_each[name]) for name in self.variable_names]
+
+    def variable_bindings(self):
+        """
+        :return: iterator over pairs of dataset name and the variable bindings it is expanded with
+        """
+        for values in itertools.product(*self.value_lists):
+            variables = dict(zip(self.variable_names, values))
+            yield self.name_pattern.format(**variables), variables
+
+    def expand(self, variables):
+        return _format_recursively(self.dataset_pattern, variables)
+
+
+class DatasetsFragment(MutableMapping):
+    """
+    The 'datasets' configuration fragment with datasets declared explicitly and by templates. Templated
+    datasets are only expanded when they are accessed, explicit declarations take precedence.
+    """
+
+    def __init__(self, explicit_datasets, templates=()):
+        self._explicit = dict(explicit_datasets or dict())
+        self._templates = list(templates)
+        self._template_bindings = None
+
+    def _bindings(self):
+        if self._template_bindings is None:
+            bindings = dict()
+            for template in self._templates:
+                for name, variables in template.variable_bindings():
+                    bindings.setdefault(name, (template, variables))
+            self._template_bindings = bindings
+        return self._template_bindings
+
+    def __getitem__(self, name):
+        if name in self._explicit:
+            return self._explicit[name]
+        if self._templates and name in self._bindings():
+            template, variables = self._bindings()[name]
+            return template.expand(variables)
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in self._explicit or (bool(self._templates) and name in self._bindings())
+
+    def __setitem__(self, name, dataset_config):
+        self._explicit[name] = dataset_config
+
+    def __delitem__(self, name):
+        if name in self._explicit:
+            del self._explicit[name]
+        else:
+            raise KeyError(name)
+
+    def __iter__(self):
+        for name in self._explicit:
+            yield name
+        if self._templates:
+            for name in self._bindings():
+                if name not in self._explicit:
+                    yield name
+
+    def __len__(self):
+        return len(set(self._explicit) | set(self._templates and self._bindings() or ()))
+
+    def __repr__(self):
+        return "DatasetsFragment({n} datasets)".format(n=len(self))
+
+
+def _load_with_includes(filepath, cache, including=()):
+    filepath = osp.realpath(filepath)
+    if filepath in including:
+        raise RuntimeError("circular inclusion of configuration file: {f}".format(f=filepath))
+    config = cache.load(filepath) or dict()
+    if not is_dict_like(config):
+        raise RuntimeError("configuration file does not contain a mapping: {f}".format(f=filepath))
+    includes = config.pop(INCLUDE_KEY, None) or []
+    if isinstance(includes, str):
+        includes = [includes]
+    merged = dict()
+    for include in includes:
+        include_path = osp.join(osp.dirname(filepath), include)
+        merged = merge_configs(merged, _load_with_includes(include_path, cache, including + (filepath,)))
+    return merge_configs(merged, config)
+
+
+def load_dld_config(filepath, cache=PARSED_CONFIG_CACHE):
+    """
+    Reads a DLD configuration file: files listed under 'include' (relative to the including file) are merged
+    in first, the including file takes precedence. The 'datasets' entry is provided as DatasetsFragment,
+    expanding the templates declared under 'dataset_templates' lazily.
+    """
+    config = _load_with_includes(filepath, cache)
+    templates = [DatasetTemplate(name, template_config) for name, template_config
+                 in sorted((config.pop(TEMPLATES_KEY, None) or dict()).items())]
+    if 'datasets' in config or templates:
+        config['datasets'] = DatasetsFragment(config.get('datasets'), templates)
+    return config